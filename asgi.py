@@ -0,0 +1,124 @@
+"""
+SAP 請購系統 - ASGI 入口
+
+/api/chat 直接在事件迴圈中以 ConversationalPurchaseAgent.achat 處理，
+等待 LLM 與 SAP API 時不佔用執行緒，單一行程即可同時服務大量對話；
+其餘路由仍交由 Flask 應用（透過 WSGI 轉接）處理。
+
+啟動方式：
+    uvicorn asgi:application --host 0.0.0.0 --port 7777
+"""
+
+import json
+from typing import Dict, Optional
+
+from asgiref.wsgi import WsgiToAsgi
+
+import tracing
+from app import _build_chat_payload, ai_agent, app, trace_exporter
+
+flask_application = WsgiToAsgi(app)
+
+
+async def _read_body(receive) -> bytes:
+    """讀取完整的 HTTP 請求內容"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+def _encode_json(payload: dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _header(scope, name: str) -> Optional[str]:
+    """取得請求標頭（不分大小寫）"""
+    key = name.lower().encode("latin-1")
+    for header, value in scope.get("headers", []):
+        if header == key:
+            return value.decode("latin-1")
+    return None
+
+
+async def _send_json(
+    send, status: int, payload, headers: Optional[Dict[str, str]] = None
+):
+    """送出 JSON 回應（與 Flask 端相同的 CORS 設定）；payload 可為已編碼的 bytes"""
+    body = payload if isinstance(payload, bytes) else _encode_json(payload)
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+                *(
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in (headers or {}).items()
+                ),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def chat_with_agent(scope, receive, send):
+    """與 AI Agent 對話（非同步版本的 /api/chat）"""
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict) or "message" not in data:
+        await _send_json(send, 400, {"status": "error", "message": "請提供對話訊息"})
+        return
+
+    try:
+        session_id = data.get("session_id", "default")
+        with tracing.start_trace(
+            _header(scope, tracing.TRACE_HEADER),
+            name="/api/chat",
+            exporter=trace_exporter,
+            session_id=session_id,
+        ) as trace:
+            response = await ai_agent.achat(data["message"], session_id)
+
+            with tracing.span("serialize"):
+                body = _encode_json(_build_chat_payload(response, session_id))
+
+        await _send_json(send, 200, body, trace.response_headers())
+
+    except Exception as e:
+        await _send_json(
+            send, 500, {"status": "error", "message": f"對話處理失敗: {str(e)}"}
+        )
+
+
+async def _lifespan(receive, send):
+    """處理 ASGI 生命週期事件"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await ai_agent.sap_transport.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI 應用程式進入點"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif (
+        scope["type"] == "http"
+        and scope["path"] == "/api/chat"
+        and scope["method"] == "POST"
+    ):
+        await chat_with_agent(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
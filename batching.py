@@ -0,0 +1,170 @@
+"""
+SAP 請購系統 AI Agent - 跨會話的 LLM 請求微批次
+
+高負載時，大量會話會在幾毫秒內同時呼叫意圖判斷與擷取鏈。MicroBatcher 在
+短暫的時間窗內收集同一條鏈的並行呼叫，再以鏈的 batch API 一次送出：
+1. 第一個請求開啟時間窗，時間窗結束或累積到批次上限時立即送出，
+   單一請求的排隊時間不會超過時間窗
+2. 同一批次內輸入完全相同的請求只呼叫一次，結果分送給所有等待者
+3. batch 以 max_concurrency 限制同時送往 LLM 服務的請求數
+
+同步呼叫端以 submit() 取得 concurrent.futures.Future，非同步呼叫端以
+ainvoke() 等待，兩者共用同一個批次。批次一律在背景執行緒中送出（時間窗結束時
+由計時器執行緒、達上限時另開執行緒），不會佔住呼叫端的執行緒或事件迴圈。
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """單一鏈的微批次分派器"""
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Dict]], List[Any]],
+        window_ms: float = 10.0,
+        max_batch_size: int = 16,
+    ):
+        """
+        Args:
+            batch_fn: 一次處理多筆輸入的函式，回傳與輸入等長的結果串列，
+                個別失敗的項目以例外物件表示（對應 batch(return_exceptions=True)）
+            window_ms: 時間窗長度（毫秒），也是單一請求的最長排隊時間
+            max_batch_size: 批次上限，累積到上限時不等時間窗結束即送出
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 必須大於 0")
+        self._batch_fn = batch_fn
+        self.window_seconds = max(window_ms, 0.0) / 1000
+        self.max_batch_size = max_batch_size
+
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[Dict, Future, float]] = []
+        # 統計另用一把鎖，送出批次時更新統計不會擋住 submit()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batched_requests": 0,
+            "batches": 0,
+            "llm_calls": 0,
+            "deduplicated": 0,
+            "max_batch_size": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "errors": 0,
+        }
+
+    def submit(self, inputs: Dict) -> Future:
+        """加入目前的批次，回傳該請求結果的 Future"""
+        future: Future = Future()
+        flush_now: Optional[List] = None
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        with self._lock:
+            self._pending.append((inputs, future, time.perf_counter()))
+            if len(self._pending) >= self.max_batch_size:
+                flush_now, self._pending = self._pending, []
+            elif len(self._pending) == 1:
+                # 第一個請求開啟時間窗
+                timer = threading.Timer(
+                    self.window_seconds, self._flush_window, args=(self._pending,)
+                )
+                timer.daemon = True
+                timer.start()
+
+        if flush_now is not None:
+            # 達上限的批次也在背景執行緒送出，呼叫端（可能是事件迴圈）不必等待
+            threading.Thread(
+                target=self._run_batch, args=(flush_now,), daemon=True
+            ).start()
+        return future
+
+    def invoke(self, inputs: Dict):
+        """同步等待批次結果"""
+        return self.submit(inputs).result()
+
+    async def ainvoke(self, inputs: Dict):
+        """在事件迴圈中等待批次結果（不佔住事件迴圈）"""
+        return await asyncio.wrap_future(self.submit(inputs))
+
+    def _flush_window(self, batch: List):
+        """時間窗結束：只送出開啟此時間窗的批次（已因達上限送出則略過）"""
+        with self._lock:
+            if self._pending is not batch:
+                return
+            self._pending = []
+        self._run_batch(batch)
+
+    def _run_batch(self, batch: List[Tuple[Dict, Future, float]]):
+        """以 batch_fn 處理一個批次，相同輸入只送出一次"""
+        started = time.perf_counter()
+        unique_inputs: List[Dict] = []
+        slots: Dict[str, int] = {}
+        assignments: List[int] = []
+        for inputs, _, _ in batch:
+            key = self._input_key(inputs)
+            if key not in slots:
+                slots[key] = len(unique_inputs)
+                unique_inputs.append(inputs)
+            assignments.append(slots[key])
+
+        waits = [(started - queued) * 1000 for _, _, queued in batch]
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["batched_requests"] += len(batch)
+            self._stats["llm_calls"] += len(unique_inputs)
+            self._stats["deduplicated"] += len(batch) - len(unique_inputs)
+            self._stats["max_batch_size"] = max(
+                self._stats["max_batch_size"], len(batch)
+            )
+            self._stats["total_wait_ms"] += sum(waits)
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], *waits)
+
+        try:
+            results = self._batch_fn(unique_inputs)
+            if len(results) != len(unique_inputs):
+                raise RuntimeError(
+                    f"批次結果數量不符: 預期 {len(unique_inputs)}，實際 {len(results)}"
+                )
+        except Exception as e:
+            logger.warning(f"微批次呼叫失敗: {e}")
+            results = [e] * len(unique_inputs)
+
+        errors = 0
+        for (_, future, _), index in zip(batch, assignments):
+            result = results[index]
+            if isinstance(result, BaseException):
+                errors += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        if errors:
+            with self._stats_lock:
+                self._stats["errors"] += errors
+
+    @staticmethod
+    def _input_key(inputs: Dict) -> str:
+        return json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+
+    def stats(self) -> Dict:
+        """取得批次統計"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._lock:
+            stats["pending"] = len(self._pending)
+        batches = stats["batches"]
+        requests = stats.pop("batched_requests")
+        stats["avg_batch_size"] = round(requests / batches, 2) if batches else 0.0
+        total_wait_ms = stats.pop("total_wait_ms")
+        stats["avg_wait_ms"] = round(total_wait_ms / requests, 2) if requests else 0.0
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 2)
+        stats["window_ms"] = self.window_seconds * 1000
+        return stats
@@ -0,0 +1,3 @@
+"""
+SAP 請購系統 AI Agent - 效能基準測試工具
+"""
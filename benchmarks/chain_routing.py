@@ -0,0 +1,227 @@
+"""
+各鏈模型路由基準測試
+
+以相同的範例輸入，在每個路由設定檔（routing profile）下逐一呼叫每條鏈，
+統計各鏈的延遲與 token 用量，用來評估把分類、擷取鏈改用小型快速模型的效果。
+
+使用方式（需要 OpenAI 相容的 API，可搭配 OPENAI_BASE_URL 指向其他服務）：
+    python -m benchmarks.chain_routing --profiles uniform tiered --repeat 3
+    python -m benchmarks.chain_routing --fast-model gpt-4.1-nano --json result.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date
+from typing import Dict, List
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_routing import CHAIN_NAMES, ROUTING_PROFILES  # noqa: E402
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig  # noqa: E402
+
+PURCHASE_HISTORY = """1. MacBook Pro 16吋 | 類別: 筆記型電腦 | 供應商: Apple Inc. | 單價: NT$ 75,000 | 日期: 2024-12-15 | 部門: IT部門
+2. MacBook Pro 14吋 | 類別: 筆記型電腦 | 供應商: Apple Inc. | 單價: NT$ 55,000 | 日期: 2024-12-20 | 部門: IT部門
+3. Surface Laptop 5 | 類別: 筆記型電腦 | 供應商: Microsoft | 單價: NT$ 42,000 | 日期: 2024-11-18 | 部門: 業務部門
+4. Dell Monitor 27吋 4K | 類別: 顯示器 | 供應商: Dell Technologies | 單價: NT$ 18,000 | 日期: 2024-11-02 | 部門: 設計部門"""
+
+RECOMMENDATION = """🎯 **推薦產品**：MacBook Pro 14吋
+💰 **建議價格**：NT$ 55,000 (基於歷史價格分析)
+🏢 **推薦供應商**：Apple Inc.
+📊 **推薦理由**：
+- 過去採購表現良好
+- 符合預算"""
+
+PRODUCT = {
+    "product_name": "MacBook Pro 14吋",
+    "category": "筆記型電腦",
+    "supplier": "Apple Inc.",
+    "unit_price": 55000,
+}
+USER_INFO = json.dumps(
+    {"requester": "系統使用者", "department": "IT部門"}, ensure_ascii=False
+)
+
+# 各鏈的範例輸入（取自典型的請購對話）
+SAMPLE_INPUTS: Dict[str, Dict] = {
+    "intent": {
+        "user_input": "我需要一台筆電，預算6萬左右",
+        "current_state": "initial",
+        "chat_history": "",
+    },
+    "analyze": {"user_request": "我需要一台筆電，預算6萬左右"},
+    "recommend": {
+        "user_request": "我需要一台筆電，預算6萬左右",
+        "purchase_history": PURCHASE_HISTORY,
+    },
+    "adjust": {
+        "current_recommendation": RECOMMENDATION,
+        "adjustment_request": "有沒有便宜一點的",
+        "purchase_history": PURCHASE_HISTORY,
+    },
+    "create_order": {
+        "recommendation": RECOMMENDATION,
+        "user_info": USER_INFO,
+        "today": date.today().isoformat(),
+    },
+    "guidance": {"current_state": "initial", "user_input": "今天天氣如何"},
+    "extract_requirement": {"user_request": "我需要一台筆電，預算6萬左右"},
+    "direct_order": {
+        "requirement": "幫我請購 2 台 MacBook Pro 14吋，下週五到貨",
+        "matching_product": json.dumps(PRODUCT, ensure_ascii=False),
+        "user_info": USER_INFO,
+        "today": date.today().isoformat(),
+    },
+    "custom_product": {"user_input": "我要買一台 Sony A7 IV 相機，大約 7 萬元"},
+    "smart_order_collection": {
+        "selected_product_info": json.dumps(PRODUCT, ensure_ascii=False),
+        "collected_info": json.dumps({"quantity": 2}, ensure_ascii=False),
+        "user_input": "請購人是張三，月底前要",
+        "today": date.today().isoformat(),
+    },
+    "extract_product_from_recommendation": {
+        "recommendation": RECOMMENDATION,
+        "purchase_history": PURCHASE_HISTORY,
+    },
+    "structured_recommend": {
+        "user_request": "我需要一台筆電，預算6萬左右",
+        "purchase_history": PURCHASE_HISTORY,
+    },
+    "structured_adjust": {
+        "current_recommendation": RECOMMENDATION,
+        "adjustment_request": "有沒有便宜一點的",
+        "purchase_history": PURCHASE_HISTORY,
+    },
+}
+
+
+class UsageRecorder(BaseCallbackHandler):
+    """從 LLM 回應記錄 token 用量"""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                self.prompt_tokens += usage.get("input_tokens", 0)
+                self.completion_tokens += usage.get("output_tokens", 0)
+
+
+def run_profile(
+    profile: str, chains: List[str], repeat: int, config_kwargs: Dict
+) -> List[Dict]:
+    """在單一路由設定檔下量測每條鏈"""
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            routing_profile=profile, llm_cache_enabled=False, **config_kwargs
+        )
+    )
+    routing = agent.get_chain_routing()["chains"]
+
+    rows = []
+    for name in chains:
+        latencies, errors = [], 0
+        recorder = UsageRecorder()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                getattr(agent, f"{name}_chain").invoke(
+                    SAMPLE_INPUTS[name], config={"callbacks": [recorder]}
+                )
+            except Exception as e:
+                errors += 1
+                print(f"[{profile}] {name} 失敗: {e}", file=sys.stderr)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        rows.append(
+            {
+                "profile": profile,
+                "chain": name,
+                "model": routing[name]["model"],
+                "max_tokens": routing[name]["max_tokens"],
+                "calls": repeat,
+                "errors": errors,
+                "avg_ms": round(statistics.fmean(latencies), 1),
+                "p50_ms": round(statistics.median(latencies), 1),
+                "max_ms": round(max(latencies), 1),
+                "prompt_tokens": round(recorder.prompt_tokens / repeat, 1),
+                "completion_tokens": round(recorder.completion_tokens / repeat, 1),
+            }
+        )
+    return rows
+
+
+def print_report(rows: List[Dict]):
+    """以表格輸出各設定檔、各鏈的結果與每個設定檔的合計"""
+    header = (
+        f"{'profile':<10} {'chain':<38} {'model':<16} {'max_tok':>7} "
+        f"{'avg_ms':>9} {'p50_ms':>9} {'in_tok':>8} {'out_tok':>8} {'err':>4}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['profile']:<10} {row['chain']:<38} {str(row['model']):<16} "
+            f"{str(row['max_tokens']):>7} {row['avg_ms']:>9.1f} {row['p50_ms']:>9.1f} "
+            f"{row['prompt_tokens']:>8.1f} {row['completion_tokens']:>8.1f} "
+            f"{row['errors']:>4}"
+        )
+
+    print()
+    for profile in dict.fromkeys(row["profile"] for row in rows):
+        selected = [row for row in rows if row["profile"] == profile]
+        print(
+            f"{profile}: 各鏈平均延遲合計 {sum(r['avg_ms'] for r in selected):.1f} ms，"
+            f"輸入 {sum(r['prompt_tokens'] for r in selected):.0f} tokens，"
+            f"輸出 {sum(r['completion_tokens'] for r in selected):.0f} tokens"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="各鏈模型路由基準測試")
+    parser.add_argument(
+        "--profiles", nargs="+", default=list(ROUTING_PROFILES), help="路由設定檔"
+    )
+    parser.add_argument(
+        "--chains", nargs="+", default=list(CHAIN_NAMES), help="要量測的鏈"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="每條鏈的呼叫次數")
+    parser.add_argument("--model", default=None, help="預設模型")
+    parser.add_argument("--fast-model", default="", help="tiered 設定檔使用的小型模型")
+    parser.add_argument(
+        "--base-url",
+        default=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        help="OpenAI 相容 API 位址",
+    )
+    parser.add_argument("--json", dest="json_path", help="將結果另存為 JSON 檔")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.chains) - set(CHAIN_NAMES)
+    if unknown:
+        parser.error(f"未知的鏈名稱: {', '.join(sorted(unknown))}")
+
+    config_kwargs = {"openai_base_url": args.base_url, "fast_model": args.fast_model}
+    if args.model:
+        config_kwargs["model"] = args.model
+
+    rows = []
+    for profile in args.profiles:
+        rows.extend(run_profile(profile, args.chains, args.repeat, config_kwargs))
+
+    print_report(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+"""
+本地 OpenAI 相容假 LLM 伺服器
+
+不需網路與真實 LLM 服務即可對 ConversationalPurchaseAgent 做負載與延遲測試：
+1. 實作 chat completions 協定（POST /v1/chat/completions），包含串流（SSE）與
+   stream_options.include_usage 的用量回報
+2. 依系統提示判斷是 PurchasePrompts 的哪一個提示（即哪一條鏈），回傳該鏈可解析的
+   JSON 或文字；也可用腳本檔指定各鏈的固定回應
+3. 可設定首個 token 延遲（TTFT）、每秒 token 數、延遲抖動與錯誤率，
+   讓每次量測的延遲條件一致
+
+使用方式：
+    python -m benchmarks.fake_llm_server --port 8001 --ttft-ms 300 --tokens-per-second 60
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python app.py
+
+腳本檔為 JSON，鍵為鏈名稱（例如 intent、structured_recommend），值為回應文字、
+JSON 物件，或依序循環使用的回應串列。GET /stats 提供各鏈的呼叫次數與錯誤次數。
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_retrieval import estimate_tokens  # noqa: E402
+from purchase_agent import ConversationalPurchaseAgent  # noqa: E402
+
+
+@dataclass
+class FakeLLMConfig:
+    """假伺服器的回應行為設定"""
+
+    ttft_ms: float = 200.0
+    tokens_per_second: float = 50.0
+    # 延遲抖動比例（0.1 表示 TTFT 與每個 token 的間隔各在 ±10% 內隨機變動）
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    model: str = "fake-gpt"
+    seed: Optional[int] = None
+    # 各鏈的固定回應（字串、JSON 物件或循環使用的串列）
+    scripted: Dict[str, Any] = field(default_factory=dict)
+
+
+def _prompt_fingerprints() -> Dict[str, str]:
+    """各鏈系統提示的第一行 → 鏈名稱"""
+    fingerprints = {}
+    for name, (prompt_factory, _) in ConversationalPurchaseAgent._CHAIN_SPECS.items():
+        template = prompt_factory().messages[0].prompt.template
+        fingerprints[template.strip().splitlines()[0].strip()] = name
+    return fingerprints
+
+
+# ---- 依鏈產生回應 ----
+
+_HISTORY_PATTERNS = (
+    # Agent 的採購歷史格式（產品: X / 類別: Y / 供應商: Z / 單價: NT$ n）
+    re.compile(
+        r"產品:\s*(?P<name>.+?)\s*\n\s*類別:\s*(?P<category>.+?)\s*\n"
+        r"\s*供應商:\s*(?P<supplier>.+?)\s*\n.*?單價:\s*NT\$\s*(?P<price>[\d,]+)",
+        re.S,
+    ),
+    # 基準測試範例格式（1. X | 類別: Y | 供應商: Z | 單價: NT$ n）
+    re.compile(
+        r"\d+\.\s*(?P<name>[^|\n]+?)\s*\|\s*類別:\s*(?P<category>[^|]+?)\s*\|"
+        r"\s*供應商:\s*(?P<supplier>[^|]+?)\s*\|\s*單價:\s*NT\$\s*(?P<price>[\d,]+)"
+    ),
+)
+_RECOMMENDED_PATTERN = re.compile(r"推薦產品\**[:：]\s*(?P<name>[^\n*]+)")
+_PRICE_PATTERN = re.compile(r"NT\$\s*(?P<price>[\d,]+)")
+_SUPPLIER_PATTERN = re.compile(r"供應商\**[:：]\s*(?P<supplier>[^\n*]+)")
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_QUANTITY_PATTERN = re.compile(r"(\d+)\s*(台|個|支|組|套|件)")
+_REQUESTER_PATTERN = re.compile(r"請購人(?:是|為|[:：])?\s*([一-鿿A-Za-z]{2,10})")
+_BUDGET_PATTERN = re.compile(r"預算\D{0,3}(\d+(?:\.\d+)?)\s*(萬|千)?")
+_FIELD_PATTERN = re.compile(r"^(?P<label>[^：:\n]+)[：:](?P<value>.*)$", re.M)
+
+_DEFAULT_PRODUCT = {
+    "product_name": "MacBook Pro 14吋",
+    "category": "筆記型電腦",
+    "supplier": "Apple Inc.",
+    "unit_price": 55000,
+}
+_PRODUCT_TYPES = (
+    (("筆電", "筆記型電腦", "laptop", "macbook"), "筆記型電腦"),
+    (("螢幕", "顯示器", "monitor"), "顯示器"),
+    (("手機", "iphone"), "手機"),
+    (("平板", "ipad"), "平板"),
+    (("印表機", "printer"), "印表機"),
+)
+_AGREE_WORDS = ("同意", "好", "確認", "可以", "沒問題", "ok", "yes")
+_DISAGREE_WORDS = ("不同意", "不要", "不行", "不好", "調整", "修改", "貴")
+_CHANGE_WORDS = ("換成", "改成", "我要", "我想要", "改買")
+_SUBMIT_WORDS = ("送出", "提交", "確認", "好", "ok")
+_OFF_TOPIC_WORDS = ("天氣", "笑話", "你好", "你是誰", "新聞", "電影")
+
+
+def _fields(text: str) -> Dict[str, str]:
+    """解析提示中「標籤：內容」形式的欄位"""
+    return {
+        match["label"].strip(): match["value"].strip()
+        for match in _FIELD_PATTERN.finditer(text)
+    }
+
+
+def _history_products(text: str) -> List[Dict]:
+    for pattern in _HISTORY_PATTERNS:
+        products = [
+            {
+                "product_name": match["name"].strip(),
+                "category": match["category"].strip(),
+                "supplier": match["supplier"].strip(),
+                "unit_price": int(match["price"].replace(",", "")),
+            }
+            for match in pattern.finditer(text)
+        ]
+        if products:
+            return products
+    return []
+
+
+def _recommended_product(text: str) -> Dict:
+    """從推薦文字或採購歷史找出產品資訊"""
+    match = _RECOMMENDED_PATTERN.search(text)
+    if match is None:
+        products = _history_products(text)
+        return dict(products[0]) if products else dict(_DEFAULT_PRODUCT)
+    product = dict(_DEFAULT_PRODUCT, product_name=match["name"].strip())
+    price = _PRICE_PATTERN.search(text)
+    if price:
+        product["unit_price"] = int(price["price"].replace(",", ""))
+    supplier = _SUPPLIER_PATTERN.search(text)
+    if supplier:
+        product["supplier"] = supplier["supplier"].strip()
+    return product
+
+
+def _budget(text: str) -> Optional[int]:
+    match = _BUDGET_PATTERN.search(text)
+    if not match:
+        return None
+    unit = {"萬": 10000, "千": 1000}.get(match.group(2) or "", 1)
+    return int(float(match.group(1)) * unit)
+
+
+def _pick_product(text: str) -> Dict:
+    """挑選符合預算的第一筆歷史產品"""
+    products = _history_products(text)
+    budget = _budget(text)
+    for product in products:
+        if budget is None or product["unit_price"] <= budget:
+            return product
+    return products[-1] if products else dict(_DEFAULT_PRODUCT)
+
+
+def _intent(system: str, human: str) -> Dict:
+    fields = _fields(human)
+    user_input = fields.get("使用者輸入", human).lower()
+    # 狀態可能以 "waiting_confirmation" 或 "ConversationState.WAITING_CONFIRMATION" 呈現
+    state = fields.get("當前對話狀態", "initial").lower()
+
+    def result(intent, next_state, related=True, change=False):
+        return {
+            "intent": intent,
+            "next_state": next_state,
+            "is_purchase_related": related,
+            "guidance_message": "" if related else "請告訴我您想要採購什麼產品？",
+            "is_product_change": change,
+        }
+
+    if any(word in user_input for word in _OFF_TOPIC_WORDS):
+        return result("off_topic", state, related=False)
+    if "waiting_confirmation" in state:
+        if any(word in user_input for word in _CHANGE_WORDS):
+            return result("product_change", "analyzing", change=True)
+        if any(word in user_input for word in _DISAGREE_WORDS):
+            return result("request_adjustment", "adjusting")
+        if any(word in user_input for word in _AGREE_WORDS):
+            return result("confirm_recommendation", "waiting_order_details")
+        return result("request_adjustment", "adjusting")
+    if "confirming_order" in state and any(w in user_input for w in _SUBMIT_WORDS):
+        return result("submit_order", "submitting")
+    return result("new_request", "analyzing")
+
+
+def _extract_requirement(system: str, human: str) -> Dict:
+    text = human.lower()
+    product_type = next(
+        (label for words, label in _PRODUCT_TYPES if any(w in text for w in words)),
+        "",
+    )
+    quantity = _QUANTITY_PATTERN.search(human)
+    return {
+        "product_name": "",
+        "product_type": product_type,
+        "budget": _budget(human),
+        "quantity": int(quantity.group(1)) if quantity else None,
+        "urgency": "緊急" if "急" in human else "一般",
+        "specifications": "",
+    }
+
+
+def _recommendation_text(product: Dict, adjusted: bool = False) -> str:
+    reason = "符合調整後的需求" if adjusted else "過去採購表現良好"
+    return (
+        f"🎯 **推薦產品**：{product['product_name']}\n"
+        f"💰 **建議價格**：NT$ {product['unit_price']:,} (基於歷史價格分析)\n"
+        f"🏢 **推薦供應商**：{product['supplier']}\n"
+        f"📊 **推薦理由**：\n- {reason}\n- 價格在合理範圍內\n- 供應商交貨穩定"
+    )
+
+
+def _structured(product: Dict, adjusted: bool = False) -> Dict:
+    return {
+        **product,
+        "quantity": 1,
+        "total_amount": product["unit_price"],
+        "reason": "符合調整後的需求\n價格在合理範圍內"
+        if adjusted
+        else "過去採購表現良好\n價格在合理範圍內",
+        "alternatives": [],
+    }
+
+
+def _order(product: Dict, human: str, quantity: Optional[int] = None) -> Dict:
+    user_info = {}
+    match = re.search(r"使用者資訊[:：]\s*(\{.*\})", human)
+    if match:
+        try:
+            user_info = json.loads(match.group(1))
+        except ValueError:
+            pass
+    found = _QUANTITY_PATTERN.search(human)
+    return {
+        "product_name": product["product_name"],
+        "category": product["category"],
+        "quantity": quantity or (int(found.group(1)) if found else 1),
+        "unit_price": product["unit_price"],
+        "requester": user_info.get("requester", "系統使用者"),
+        "department": user_info.get("department", "IT部門"),
+        "reason": "業務需求",
+        "urgent": False,
+        "expected_delivery_date": (date.today() + timedelta(days=14)).isoformat(),
+    }
+
+
+def _smart_order_collection(system: str, human: str) -> Dict:
+    collected: Dict = {}
+    match = re.search(r"目前已收集的資訊：\s*(\{.*?\})\s*\n", system, re.S)
+    if match:
+        try:
+            collected = dict(json.loads(match.group(1)) or {})
+        except ValueError:
+            pass
+    extracted = {}
+    quantity = _QUANTITY_PATTERN.search(human)
+    if quantity:
+        extracted["quantity"] = int(quantity.group(1))
+    requester = _REQUESTER_PATTERN.search(human)
+    if requester:
+        extracted["requester"] = requester.group(1)
+    delivery = _DATE_PATTERN.search(human)
+    if delivery:
+        extracted["expected_delivery_date"] = delivery.group(0)
+    elif any(word in human for word in ("月底", "下週", "下周", "明天")):
+        extracted["expected_delivery_date"] = (
+            date.today() + timedelta(days=7)
+        ).isoformat()
+
+    required = ("quantity", "requester", "expected_delivery_date")
+    updated = {key: extracted.get(key, collected.get(key)) for key in required}
+    missing = [key for key in required if not updated[key]]
+    return {
+        "extracted_info": {key: extracted.get(key) for key in required},
+        "updated_collected_info": updated,
+        "missing_required_fields": missing,
+        "is_complete": not missing,
+        "next_question": None if not missing else f"請提供：{'、'.join(missing)}",
+    }
+
+
+def _custom_product(system: str, human: str) -> Dict:
+    text = _fields(human).get("使用者輸入", human)
+    price = _budget(text) or 10000
+    return {
+        "product_name": re.sub(r"^(我要買|我要|我想買|請購)\s*", "", text)[:30],
+        "category": "其他",
+        "unit_price": price,
+        "quantity": 1,
+        "requester": "",
+        "reason": "",
+        "urgent": False,
+        "expected_delivery_date": "",
+    }
+
+
+# 各鏈的預設回應產生函式：（系統提示, 使用者訊息）→ 回應（dict 會編碼為 JSON）
+RESPONDERS: Dict[str, Callable[[str, str], Any]] = {
+    "intent": _intent,
+    "analyze": lambda system, human: (
+        "需求分析：\n1. 產品類型：依使用者描述\n2. 數量：1\n3. 預算：未指定\n"
+        "4. 用途：日常辦公\n5. 時間：一般"
+    ),
+    "recommend": lambda system, human: _recommendation_text(_pick_product(human)),
+    "adjust": lambda system, human: _recommendation_text(
+        _pick_product(human), adjusted=True
+    ),
+    "structured_recommend": lambda system, human: _structured(_pick_product(human)),
+    "structured_adjust": lambda system, human: _structured(
+        _pick_product(human), adjusted=True
+    ),
+    "create_order": lambda system, human: _order(_recommended_product(human), human),
+    "direct_order": lambda system, human: _order(_pick_product(human), human),
+    "guidance": lambda system, human: (
+        "我是採購助手，目前只能協助處理採購相關事務。"
+        "請告訴我您想採購的產品、數量或預算，我會為您推薦合適的選擇。"
+    ),
+    "extract_requirement": _extract_requirement,
+    "custom_product": _custom_product,
+    "smart_order_collection": _smart_order_collection,
+    "extract_product_from_recommendation": lambda system, human: {
+        "recommended_product": {
+            **_recommended_product(human.split("採購歷史資料")[0]),
+            "source": "recommendation",
+        },
+        "confidence_score": 0.9,
+        "extraction_notes": "由推薦文字擷取",
+    },
+}
+
+
+class FakeLLM:
+    """依鏈產生回應並計算延遲（與 HTTP 層分開，方便直接測試）"""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self._fingerprints = _prompt_fingerprints()
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._scripted = {
+            name: itertools.cycle(value if isinstance(value, list) else [value])
+            for name, value in config.scripted.items()
+        }
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def identify(self, messages: List[Dict]) -> str:
+        """依系統提示判斷鏈名稱（無法判斷時為 unknown）"""
+        system = next(
+            (m.get("content") or "" for m in messages if m.get("role") == "system"), ""
+        )
+        lines = system.strip().splitlines()
+        if lines and lines[0].strip() in self._fingerprints:
+            return self._fingerprints[lines[0].strip()]
+        for fingerprint, name in self._fingerprints.items():
+            if fingerprint in system:
+                return name
+        return "unknown"
+
+    def respond(self, messages: List[Dict]) -> Tuple[str, str]:
+        """回傳（鏈名稱, 回應內容）"""
+        chain = self.identify(messages)
+        system = next(
+            (m.get("content") or "" for m in messages if m.get("role") == "system"), ""
+        )
+        human = "\n".join(
+            m.get("content") or "" for m in messages if m.get("role") == "user"
+        )
+        with self._lock:
+            scripted = self._scripted.get(chain)
+            value = next(scripted) if scripted is not None else None
+        if value is None:
+            responder = RESPONDERS.get(chain)
+            value = responder(system, human) if responder else "好的，請繼續。"
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False)
+        return chain, value
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.error_rate
+
+    def _jittered(self, seconds: float) -> float:
+        if not self.config.jitter:
+            return seconds
+        with self._lock:
+            factor = self._random.uniform(
+                1 - self.config.jitter, 1 + self.config.jitter
+            )
+        return max(0.0, seconds * factor)
+
+    def first_token_delay(self) -> float:
+        return self._jittered(self.config.ttft_ms / 1000)
+
+    def token_interval(self) -> float:
+        if self.config.tokens_per_second <= 0:
+            return 0.0
+        return self._jittered(1 / self.config.tokens_per_second)
+
+    def record(self, chain: str, error: bool = False):
+        with self._lock:
+            stats = self._stats.setdefault(chain, {"requests": 0, "errors": 0})
+            stats["requests"] += 1
+            if error:
+                stats["errors"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
+
+
+def split_tokens(text: str) -> List[str]:
+    """把回應切成串流片段（中日韓文字每字一段，其他文字每 4 個字元一段）"""
+    pieces: List[str] = []
+    buffer = ""
+    for char in text:
+        if "一" <= char <= "鿿":
+            if buffer:
+                pieces.append(buffer)
+                buffer = ""
+            pieces.append(char)
+        else:
+            buffer += char
+            if len(buffer) >= 4:
+                pieces.append(buffer)
+                buffer = ""
+    if buffer:
+        pieces.append(buffer)
+    return pieces
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """chat completions 協定的 HTTP 處理器（keep-alive，串流以 chunked 編碼送出）"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+    fake: FakeLLM = None  # 由 make_server 設定
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/v1/models", "/models"):
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": self.fake.config.model, "object": "model"}],
+                },
+            )
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.fake.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        messages = request.get("messages") or []
+        chain, content = self.fake.respond(messages)
+        if self.fake.should_fail():
+            self.fake.record(chain, error=True)
+            time.sleep(self.fake.first_token_delay())
+            self._send_json(
+                self.fake.config.error_status,
+                {
+                    "error": {
+                        "message": "fake server injected error",
+                        "type": "server_error",
+                        "code": self.fake.config.error_status,
+                    }
+                },
+            )
+            return
+        self.fake.record(chain)
+
+        # 輸出上限：依 token 估計值截斷
+        pieces = split_tokens(content)
+        max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+        finish_reason = "stop"
+        if max_tokens and len(pieces) > max_tokens:
+            pieces = pieces[:max_tokens]
+            finish_reason = "length"
+        usage = {
+            "prompt_tokens": sum(
+                estimate_tokens(m.get("content") or "") for m in messages
+            ),
+            "completion_tokens": len(pieces),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model") or self.fake.config.model
+
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._stream(
+                completion_id, model, pieces, finish_reason, usage, include_usage
+            )
+            return
+
+        time.sleep(
+            self.fake.first_token_delay()
+            + sum(self.fake.token_interval() for _ in pieces[1:])
+        )
+        self._send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(pieces)},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+                "usage": usage,
+            },
+        )
+
+    def _write_chunk(self, payload: Optional[Dict]):
+        data = "[DONE]" if payload is None else json.dumps(payload, ensure_ascii=False)
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(
+        self,
+        completion_id: str,
+        model: str,
+        pieces: List[str],
+        finish_reason: str,
+        usage: Dict,
+        include_usage: bool,
+    ):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta: Dict, finish: Optional[str] = None) -> Dict:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+
+        try:
+            time.sleep(self.fake.first_token_delay())
+            self._write_chunk(chunk({"role": "assistant", "content": ""}))
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(self.fake.token_interval())
+                self._write_chunk(chunk({"content": piece}))
+            self._write_chunk(chunk({}, finish_reason))
+            if include_usage:
+                self._write_chunk(
+                    {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                )
+            self._write_chunk(None)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端中途斷線
+            self.close_connection = True
+
+
+def make_server(
+    config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """建立假伺服器（port 為 0 時自動選擇可用的連接埠）"""
+    handler = type("BoundFakeLLMHandler", (FakeLLMHandler,), {"fake": FakeLLM(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(
+    config: Optional[FakeLLMConfig] = None, host: str = "127.0.0.1", port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """在背景執行緒啟動假伺服器，回傳（伺服器, OpenAI base URL）"""
+    server = make_server(config or FakeLLMConfig(), host, port)
+    thread = threading.Thread(
+        target=server.serve_forever, daemon=True, name="fake-llm-server"
+    )
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 相容假 LLM 伺服器")
+    parser.add_argument("--host", default="127.0.0.1", help="監聽位址")
+    parser.add_argument("--port", type=int, default=8001, help="監聽連接埠")
+    parser.add_argument(
+        "--ttft-ms", type=float, default=200.0, help="首個 token 延遲（毫秒）"
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=50.0,
+        help="每秒輸出 token 數（0 表示不限制）",
+    )
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲抖動比例（0~1）")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="錯誤回應比例（0~1）"
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        help="錯誤回應的 HTTP 狀態碼（例如 429）",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="隨機種子（重現錯誤與抖動）"
+    )
+    parser.add_argument("--script", help="各鏈固定回應的 JSON 檔")
+    args = parser.parse_args(argv)
+
+    scripted = {}
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            scripted = json.load(f)
+        unknown = set(scripted) - set(RESPONDERS)
+        if unknown:
+            parser.error(f"未知的鏈名稱: {', '.join(sorted(unknown))}")
+
+    config = FakeLLMConfig(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+        scripted=scripted,
+    )
+    server = make_server(config, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"假 LLM 伺服器啟動於 http://{host}:{port}/v1")
+    print(
+        f"   OPENAI_BASE_URL=http://{host}:{port}/v1 OPENAI_API_KEY=fake python app.py"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+"""
+對話重播基準測試
+
+以 JSONL 腳本（每行一段多回合對話）驅動 ConversationalPurchaseAgent.chat，
+在 N 個並行會話下重播，統計：
+1. 每回合延遲的 p50 / p95 / p99，並依回合開始時的對話狀態（ConversationState）分組
+2. 每條鏈的 LLM 呼叫延遲（取自回合 trace 的 llm.<鏈名稱> span）
+3. 吞吐量（每秒回合數、每秒對話數）與每張完成的請購單所需的 LLM 呼叫次數
+
+結果以 JSON 輸出（含 git commit），可與前一次的結果比較，用來判斷各項優化是否有效。
+SAP 端使用 sap_data 的假 SAP 資料（程序內呼叫），LLM 可用 --fake-llm 改為本地假伺服器。
+
+對話腳本格式（回合可為字串，或含 expect_state 的物件，用來檢查重播是否走到預期狀態）：
+    {"id": "laptop_order", "turns": ["我想買筆電，預算6萬", {"user": "同意", "expect_state": "waiting_order_details"}]}
+
+使用方式：
+    python -m benchmarks.replay --fake-llm --sessions 40 --concurrency 8 --output before.json
+    python -m benchmarks.replay benchmarks/conversations/ --fake-llm --compare before.json
+    python -m benchmarks.replay my_conversations.jsonl --base-url http://localhost:8001/v1
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm_server import FakeLLMConfig, start_server  # noqa: E402
+from choose_state import ConversationState  # noqa: E402
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig  # noqa: E402
+from sap_data import in_process_transport  # noqa: E402
+from tracing import start_trace  # noqa: E402
+
+DEFAULT_CONVERSATIONS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "conversations"
+)
+# 比較結果時列出的延遲百分位數
+COMPARED_PERCENTILES = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def load_conversations(paths: List[str]) -> List[Dict]:
+    """讀取對話腳本（路徑可為 JSONL 檔或含 *.jsonl 的目錄）"""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))))
+        else:
+            files.append(path)
+
+    conversations = []
+    for file_path in files:
+        with open(file_path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                location = f"{file_path}:{line_number}"
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{location} 不是合法的 JSON: {e}") from e
+                turns = [
+                    turn if isinstance(turn, dict) else {"user": turn}
+                    for turn in record.get("turns") or []
+                ]
+                if not turns or not all(turn.get("user") for turn in turns):
+                    raise ValueError(f"{location} 缺少回合內容（turns）")
+                conversations.append(
+                    {
+                        "id": record.get("id") or location,
+                        "source": os.path.basename(file_path),
+                        "turns": turns,
+                    }
+                )
+    return conversations
+
+
+def percentiles(values: List[float]) -> Dict:
+    """延遲分布摘要（以最近排名法計算百分位數）"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[max(0, math.ceil(len(ordered) * q) - 1)], 1)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 1),
+        "p50_ms": rank(0.50),
+        "p95_ms": rank(0.95),
+        "p99_ms": rank(0.99),
+        "max_ms": round(ordered[-1], 1),
+    }
+
+
+def _state_label(state) -> str:
+    return getattr(state, "value", state) or ConversationState.INITIAL.value
+
+
+class ReplayRecorder:
+    """彙總各回合的延遲、對話狀態與 trace 中的 span"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turn_ms: List[float] = []
+        self.by_state: Dict[str, List[float]] = {}
+        self.by_chain: Dict[str, List[float]] = {}
+        self.llm_spans = 0
+        self.orders = 0
+        self.errors = 0
+        self.state_mismatches: List[Dict] = []
+        self.completed_conversations = 0
+
+    def record_turn(
+        self, state: str, duration_ms: float, spans: List[Dict], failed: bool
+    ):
+        with self._lock:
+            self.turn_ms.append(duration_ms)
+            self.by_state.setdefault(state, []).append(duration_ms)
+            self.errors += failed
+            for span in spans:
+                name = span["name"]
+                if name.startswith("llm."):
+                    self.llm_spans += 1
+                    self.by_chain.setdefault(name[len("llm.") :], []).append(
+                        span["duration_ms"]
+                    )
+                elif (
+                    name == "sap.purchase_request"
+                    and span["attributes"].get("status") == 201
+                ):
+                    self.orders += 1
+
+    def record_mismatch(self, conversation_id: str, turn: int, expected, actual):
+        with self._lock:
+            self.state_mismatches.append(
+                {
+                    "conversation": conversation_id,
+                    "turn": turn,
+                    "expected": expected,
+                    "actual": actual,
+                }
+            )
+
+    def record_conversation(self):
+        with self._lock:
+            self.completed_conversations += 1
+
+
+def replay_conversation(
+    agent: ConversationalPurchaseAgent,
+    conversation: Dict,
+    session_id: str,
+    recorder: ReplayRecorder,
+):
+    """依序重播一段對話的所有回合"""
+    for index, turn in enumerate(conversation["turns"], 1):
+        status = agent.get_session_status(session_id) or {}
+        state = _state_label(status.get("conversation_state"))
+        failed = False
+        with start_trace(name="replay", session_id=session_id) as trace:
+            started = time.perf_counter()
+            try:
+                agent.chat(turn["user"], session_id)
+            except Exception as e:
+                failed = True
+                print(f"[{conversation['id']}#{index}] 失敗: {e}", file=sys.stderr)
+            duration_ms = (time.perf_counter() - started) * 1000
+        recorder.record_turn(state, duration_ms, trace.to_dict()["spans"], failed)
+
+        expected = turn.get("expect_state")
+        if expected:
+            status = agent.get_session_status(session_id) or {}
+            actual = _state_label(status.get("conversation_state"))
+            if actual != expected:
+                recorder.record_mismatch(conversation["id"], index, expected, actual)
+    recorder.record_conversation()
+
+
+def run_replay(
+    agent: ConversationalPurchaseAgent,
+    conversations: List[Dict],
+    sessions: int,
+    concurrency: int,
+) -> Dict:
+    """以 concurrency 個並行工作重播 sessions 段對話（依序輪流使用腳本），回傳統計結果"""
+    recorder = ReplayRecorder()
+    run_id = uuid.uuid4().hex[:8]
+    usage_before = _llm_calls(agent)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                replay_conversation,
+                agent,
+                conversations[index % len(conversations)],
+                f"replay-{run_id}-{index}",
+                recorder,
+            )
+            for index in range(sessions)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    # 用量統計只計實際送出的 LLM 呼叫（不含快取命中）；關閉用量統計時改用 span 數
+    usage_after = _llm_calls(agent)
+    llm_calls = (
+        usage_after - usage_before
+        if usage_after is not None and usage_before is not None
+        else recorder.llm_spans
+    )
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "turns": len(recorder.turn_ms),
+        "errors": recorder.errors,
+        "throughput": {
+            "turns_per_second": round(len(recorder.turn_ms) / elapsed, 2),
+            "conversations_per_second": round(
+                recorder.completed_conversations / elapsed, 2
+            ),
+        },
+        "turn_latency": percentiles(recorder.turn_ms),
+        "by_state": {
+            state: percentiles(values)
+            for state, values in sorted(recorder.by_state.items())
+        },
+        "by_chain": {
+            chain: percentiles(values)
+            for chain, values in sorted(recorder.by_chain.items())
+        },
+        "llm_calls": llm_calls,
+        "completed_orders": recorder.orders,
+        "llm_calls_per_order": round(llm_calls / recorder.orders, 2)
+        if recorder.orders
+        else None,
+        "state_mismatches": recorder.state_mismatches,
+    }
+
+
+def _llm_calls(agent: ConversationalPurchaseAgent) -> Optional[int]:
+    if agent.usage is None:
+        return None
+    return agent.get_usage_stats()["totals"]["llm_calls"]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline: Dict, current: Dict) -> List[Dict]:
+    """比較兩次結果的延遲、吞吐量與每張請購單的 LLM 呼叫次數"""
+    rows = []
+
+    def add(metric: str, before, after, lower_is_better: bool = True):
+        if before is None or after is None:
+            return
+        change = (after - before) / before * 100 if before else 0.0
+        rows.append(
+            {
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "change_pct": round(change, 1),
+                "regression": change > 0 if lower_is_better else change < 0,
+            }
+        )
+
+    before, after = baseline["results"], current["results"]
+    for key in COMPARED_PERCENTILES:
+        add(
+            f"turn.{key}",
+            before["turn_latency"].get(key),
+            after["turn_latency"].get(key),
+        )
+    for group in ("by_state", "by_chain"):
+        for name in sorted(set(before[group]) & set(after[group])):
+            add(
+                f"{group[3:]}.{name}.p95_ms",
+                before[group][name].get("p95_ms"),
+                after[group][name].get("p95_ms"),
+            )
+    add(
+        "turns_per_second",
+        before["throughput"]["turns_per_second"],
+        after["throughput"]["turns_per_second"],
+        lower_is_better=False,
+    )
+    add(
+        "llm_calls_per_order",
+        before["llm_calls_per_order"],
+        after["llm_calls_per_order"],
+    )
+    return rows
+
+
+def print_report(results: Dict):
+    """以表格輸出延遲分布、吞吐量與 LLM 呼叫次數"""
+    header = (
+        f"{'':<36} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'max_ms':>9}"
+    )
+
+    def row(label: str, stats: Dict):
+        if not stats.get("count"):
+            return
+        print(
+            f"{label:<36} {stats['count']:>6} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}"
+        )
+
+    print(header)
+    print("-" * len(header))
+    row("turn", results["turn_latency"])
+    for state, stats in results["by_state"].items():
+        row(f"state:{state}", stats)
+    for chain, stats in results["by_chain"].items():
+        row(f"chain:{chain}", stats)
+
+    print()
+    throughput = results["throughput"]
+    print(
+        f"{results['sessions']} 段對話、{results['turns']} 個回合（並行 "
+        f"{results['concurrency']}），耗時 {results['elapsed_seconds']:.2f} 秒："
+        f"{throughput['turns_per_second']:.2f} 回合/秒，"
+        f"{throughput['conversations_per_second']:.2f} 對話/秒"
+    )
+    per_order = results["llm_calls_per_order"]
+    print(
+        f"LLM 呼叫 {results['llm_calls']} 次，完成請購單 {results['completed_orders']} 張"
+        + (f"（每張 {per_order:.2f} 次）" if per_order is not None else "")
+    )
+    if results["errors"]:
+        print(f"⚠️ 失敗的回合：{results['errors']}")
+    if results["state_mismatches"]:
+        print(f"⚠️ 未走到預期狀態的回合：{len(results['state_mismatches'])}")
+
+
+def print_comparison(rows: List[Dict]):
+    header = f"{'metric':<48} {'baseline':>10} {'current':>10} {'change':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        flag = " ⚠️" if row["regression"] and abs(row["change_pct"]) >= 5 else ""
+        print(
+            f"{row['metric']:<48} {row['baseline']:>10} {row['current']:>10} "
+            f"{row['change_pct']:>+7.1f}%{flag}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="對話重播基準測試")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=[DEFAULT_CONVERSATIONS],
+        help="對話腳本（JSONL 檔或目錄，預設為 benchmarks/conversations）",
+    )
+    parser.add_argument("--sessions", type=int, default=20, help="重播的對話數")
+    parser.add_argument("--concurrency", type=int, default=4, help="並行的會話數")
+    parser.add_argument(
+        "--base-url",
+        default=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        help="OpenAI 相容 API 位址",
+    )
+    parser.add_argument("--model", default=None, help="預設模型")
+    parser.add_argument("--no-cache", action="store_true", help="關閉 LLM 回應快取")
+    parser.add_argument(
+        "--fake-llm", action="store_true", help="改用本地假 LLM 伺服器（不需網路）"
+    )
+    parser.add_argument(
+        "--ttft-ms", type=float, default=200.0, help="假伺服器首個 token 延遲"
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=50.0,
+        help="假伺服器每秒輸出 token 數",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假伺服器錯誤率")
+    parser.add_argument("--seed", type=int, default=0, help="假伺服器隨機種子")
+    parser.add_argument("--output", help="將結果另存為 JSON 檔")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    parser.add_argument(
+        "--fail-over",
+        type=float,
+        default=None,
+        help="回合 p95 延遲比基準增加超過此百分比時以非零狀態結束",
+    )
+    args = parser.parse_args(argv)
+
+    conversations = load_conversations(args.paths)
+    if not conversations:
+        parser.error("沒有可重播的對話")
+
+    server = None
+    config_kwargs = {"openai_base_url": args.base_url}
+    if args.fake_llm:
+        server, config_kwargs["openai_base_url"] = start_server(
+            FakeLLMConfig(
+                ttft_ms=args.ttft_ms,
+                tokens_per_second=args.tokens_per_second,
+                error_rate=args.error_rate,
+                seed=args.seed,
+            )
+        )
+        config_kwargs["openai_api_key"] = os.getenv("OPENAI_API_KEY") or "fake"
+    if args.model:
+        config_kwargs["model"] = args.model
+    if args.no_cache:
+        config_kwargs["llm_cache_enabled"] = False
+
+    try:
+        agent = ConversationalPurchaseAgent(
+            PurchaseAgentConfig(**config_kwargs), sap_transport=in_process_transport()
+        )
+        results = run_replay(agent, conversations, args.sessions, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "settings": {
+            "paths": args.paths,
+            "conversations": len(conversations),
+            "base_url": "fake" if args.fake_llm else args.base_url,
+            "model": agent.config.model,
+            "llm_cache_enabled": agent.config.llm_cache_enabled,
+            "ttft_ms": args.ttft_ms if args.fake_llm else None,
+            "tokens_per_second": args.tokens_per_second if args.fake_llm else None,
+        },
+        "results": results,
+    }
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        print(f"與 {baseline.get('commit') or args.compare} 比較：")
+        rows = compare_results(baseline, report)
+        print_comparison(rows)
+        if args.fail_over is not None:
+            turn_p95 = next(r for r in rows if r["metric"] == "turn.p95_ms")
+            if turn_p95["change_pct"] > args.fail_over:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
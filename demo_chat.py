@@ -51,11 +51,11 @@ def main():
             if not user_input:
                 continue
 
-            # 與 AI Agent 對話
-            print("\n🤖 AI助手正在處理...")
-            response = agent.chat(user_input, session_id)
-
-            print(f"\n🤖 AI助手: {response}")
+            # 與 AI Agent 對話（逐字顯示串流回應）
+            print("\n🤖 AI助手: ", end="", flush=True)
+            for chunk in agent.chat_stream(user_input, session_id):
+                print(chunk, end="", flush=True)
+            print()
 
             # 顯示當前狀態
             status = agent.get_session_status(session_id)
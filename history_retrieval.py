@@ -0,0 +1,182 @@
+"""
+SAP 請購系統 AI Agent - 採購歷史檢索
+
+送進推薦、調整與產品擷取鏈的採購歷史只保留與需求最相關的前 k 筆：
+1. 斷詞：英數字以單字為單位，中日韓文字切成相鄰雙字（bigram）
+2. 排序：BM25 詞彙相關度，超出預算的產品降低權重
+3. 索引：同一份採購歷史只建立一次索引，後續回合直接重用（呼叫端標示來源時以來源、
+   筆數與首尾記錄辨識，否則以內容指紋辨識）
+"""
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# 英數字詞與連續的中日韓文字
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]+")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+def tokenize(text: str) -> List[str]:
+    """斷詞：英數字取整個單字，中日韓文字取相鄰雙字（單一字時保留單字）"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall((text or "").lower()):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 LLM token 數：中日韓文字約一字一個 token，其餘約四個字元一個 token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class BM25Index:
+    """BM25 詞彙相關度索引"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(tokens) for tokens in documents]
+        self._lengths = [len(tokens) for tokens in documents]
+        self._avg_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        )
+
+        doc_freqs = Counter()
+        for term_freq in self._term_freqs:
+            doc_freqs.update(term_freq.keys())
+        total = len(documents)
+        self._idf = {
+            term: math.log((total - df + 0.5) / (df + 0.5) + 1)
+            for term, df in doc_freqs.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._term_freqs)
+
+    def scores(self, query_tokens: List[str]) -> List[float]:
+        """計算每份文件對查詢的 BM25 分數"""
+        terms = [term for term in set(query_tokens) if term in self._idf]
+        results = []
+        for term_freq, length in zip(self._term_freqs, self._lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+            for term in terms:
+                tf = term_freq.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+
+class HistoryRetriever:
+    """依需求挑選最相關的採購歷史"""
+
+    # 產品名稱重複計入，使名稱相符的權重高於類別、供應商
+    _FIELDS = ("product_name", "product_name", "category", "supplier")
+    # 單價超出預算的產品分數折扣
+    OVER_BUDGET_FACTOR = 0.5
+
+    def __init__(self, max_cached_indexes: int = 64):
+        self.max_cached_indexes = max_cached_indexes
+        self._indexes: "OrderedDict[Hashable, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"index_builds": 0, "index_hits": 0}
+
+    @staticmethod
+    def _row_key(item: Dict) -> Tuple:
+        return (
+            item.get("product_name"),
+            item.get("supplier"),
+            item.get("purchase_date"),
+            item.get("quantity"),
+            item.get("unit_price"),
+        )
+
+    @classmethod
+    def _cache_key(cls, history: List[Dict], catalog: Optional[Hashable]) -> Hashable:
+        """索引的快取鍵
+
+        標示來源（例如 SAP 查詢條件）時只看來源、筆數與首尾兩筆記錄，不必逐筆計算；
+        未標示來源的歷史（例如會話中保留的少量記錄）才以全部內容計算指紋。
+        """
+        if catalog is not None:
+            return (
+                catalog,
+                len(history),
+                cls._row_key(history[0]),
+                cls._row_key(history[-1]),
+            )
+        return hash(tuple(cls._row_key(item) for item in history))
+
+    def _index_for(
+        self, history: List[Dict], catalog: Optional[Hashable] = None
+    ) -> BM25Index:
+        """取得（或建立）採購歷史的索引"""
+        key = self._cache_key(history, catalog)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self._stats["index_hits"] += 1
+                return index
+
+        index = BM25Index(
+            [
+                tokenize(" ".join(str(item.get(f) or "") for f in self._FIELDS))
+                for item in history
+            ]
+        )
+        with self._lock:
+            self._indexes[key] = index
+            self._stats["index_builds"] += 1
+            while len(self._indexes) > self.max_cached_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def rank(
+        self,
+        history: List[Dict],
+        query: str,
+        budget: Optional[float] = None,
+        catalog: Optional[Hashable] = None,
+    ) -> List[Tuple[float, Dict]]:
+        """依相關度由高到低排序；分數相同時維持原本順序（最近的在前）"""
+        if not history:
+            return []
+        scores = self._index_for(history, catalog).scores(tokenize(query))
+        if budget:
+            scores = [
+                score * self.OVER_BUDGET_FACTOR
+                if (item.get("unit_price") or 0) > budget
+                else score
+                for score, item in zip(scores, history)
+            ]
+        order = sorted(range(len(history)), key=lambda i: -scores[i])
+        return [(scores[i], history[i]) for i in order]
+
+    def select(
+        self,
+        history: List[Dict],
+        query: str,
+        top_k: int = 10,
+        budget: Optional[float] = None,
+        catalog: Optional[Hashable] = None,
+    ) -> List[Dict]:
+        """挑選最相關的前 k 筆採購歷史"""
+        return [item for _, item in self.rank(history, query, budget, catalog)[:top_k]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_indexes"] = len(self._indexes)
+        return stats
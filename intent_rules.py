@@ -0,0 +1,143 @@
+"""
+SAP 請購系統 AI Agent - 狀態感知的意圖規則引擎
+
+在「等待確認推薦」與「確認請購單」這類只需要是/否回覆的狀態中，
+以預先編譯的關鍵字自動機（每個狀態一個）直接判斷使用者意圖，
+只有在規則無法明確判斷時才交給 LLM 意圖分類。
+
+關鍵字以外出現否定詞（「不太好」、「先不要送出」）、問句（「可以便宜點嗎」）、
+同時命中多個意圖（「不要提交」），或剩下的中文內容（「確認一下價格」、「好貴」）
+都視為無法明確判斷。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from choose_state import ConversationState
+from keyword_automaton import KeywordAutomaton
+
+# 各狀態的意圖關鍵字，字典順序即為意圖優先順序
+STATE_INTENT_KEYWORDS: Dict[ConversationState, Dict[str, List[str]]] = {
+    ConversationState.WAITING_CONFIRMATION: {
+        "confirm_recommendation": ["同意", "確認", "好", "可以", "沒問題", "ok"],
+        "request_adjustment": [
+            "不同意",
+            "不要",
+            "不行",
+            "不好",
+            "不可以",
+            "不確認",
+            "調整",
+            "修改",
+            "改",
+        ],
+    },
+    ConversationState.CONFIRMING_ORDER: {
+        "submit_order": ["確認提交", "提交", "確認", "送出"],
+        "modify_order": ["修改", "調整", "更改"],
+        "cancel_order": [
+            "取消",
+            "不要",
+            "放棄",
+            "不提交",
+            "不送出",
+            "不要提交",
+            "不要送出",
+        ],
+    },
+}
+
+# 計算「剩餘文字」時忽略的標點、空白、語助詞與客套話
+_FILLER_PATTERN = re.compile(r"謝謝|感謝|麻煩了|[\s\W_的了吧啊呀喔哦嗯呢嘛囉唷啦]+")
+# 關鍵字以外的否定詞會反轉或削弱關鍵字的意思（「不太好」、「先不要送出」）
+_NEGATION_PATTERN = re.compile(r"[不沒没別别未]")
+# 問句不是明確的是/否回覆（「可以便宜點嗎」、「確認了嗎？」）
+_QUESTION_PATTERN = re.compile(
+    r"[嗎吗?？]|怎麼|怎么|如何|多少|什麼|什么|能不能|可不可以|是不是|要不要"
+)
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+
+
+@dataclass
+class RuleMatch:
+    """規則比對結果"""
+
+    intents: List[str] = field(default_factory=list)  # 依優先順序排列的命中意圖
+    keywords: List[str] = field(default_factory=list)  # 命中的關鍵字
+    residual: str = ""  # 移除關鍵字與語助詞後剩下的文字
+    negated: bool = False  # 關鍵字以外出現否定詞
+    question: bool = False  # 輸入為問句
+
+    @property
+    def intent(self) -> Optional[str]:
+        """優先順序最高的命中意圖"""
+        return self.intents[0] if self.intents else None
+
+
+class IntentRuleEngine:
+    """狀態感知的關鍵字意圖規則引擎"""
+
+    def __init__(
+        self,
+        state_keywords: Optional[Dict[ConversationState, Dict[str, List[str]]]] = None,
+        max_residual_chars: int = 4,
+        max_residual_cjk_chars: int = 0,
+    ):
+        self.max_residual_chars = max_residual_chars
+        # 中文剩餘內容幾乎都帶有意思（「一下價格」、「貴」），上限比英數字更嚴格
+        self.max_residual_cjk_chars = max_residual_cjk_chars
+        self._intent_order: Dict[ConversationState, List[str]] = {}
+        self._automata: Dict[ConversationState, KeywordAutomaton] = {}
+
+        for state, intent_keywords in (state_keywords or STATE_INTENT_KEYWORDS).items():
+            automaton = KeywordAutomaton()
+            for intent, keywords in intent_keywords.items():
+                for keyword in keywords:
+                    automaton.add(keyword, intent)
+            automaton.build()
+            self._automata[state] = automaton
+            self._intent_order[state] = list(intent_keywords)
+
+    def handles(self, state: ConversationState) -> bool:
+        """此狀態是否有對應規則"""
+        return state in self._automata
+
+    def match(self, state: ConversationState, user_input: str) -> RuleMatch:
+        """以最長比對找出使用者輸入命中的意圖"""
+        automaton = self._automata.get(state)
+        if automaton is None:
+            return RuleMatch(residual=user_input)
+
+        text = user_input.strip()
+        matches = automaton.longest_matches(text)
+
+        hit_intents = {match[3] for match in matches}
+        intents = [i for i in self._intent_order[state] if i in hit_intents]
+
+        residual_parts = []
+        position = 0
+        for start, end, _, _ in matches:
+            residual_parts.append(text[position:start])
+            position = end
+        residual_parts.append(text[position:])
+        unmatched = "".join(residual_parts)
+
+        return RuleMatch(
+            intents=intents,
+            keywords=[match[2] for match in matches],
+            residual=_FILLER_PATTERN.sub("", unmatched),
+            negated=bool(_NEGATION_PATTERN.search(unmatched)),
+            question=bool(_QUESTION_PATTERN.search(text)),
+        )
+
+    def classify(self, state: ConversationState, user_input: str) -> Optional[str]:
+        """規則能明確判斷時回傳意圖，否則回傳 None（交由 LLM 判斷或再次詢問）"""
+        result = self.match(state, user_input)
+        if len(result.intents) != 1 or result.negated or result.question:
+            return None
+        if len(result.residual) > self.max_residual_chars:
+            return None
+        if len(_CJK_PATTERN.findall(result.residual)) > self.max_residual_cjk_chars:
+            return None
+        return result.intent
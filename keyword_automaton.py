@@ -0,0 +1,116 @@
+"""
+SAP 請購系統 AI Agent - 關鍵字自動機
+
+Aho-Corasick 多模式字串比對：一次線性掃描即可找出文字中所有關鍵字，
+並支援「最左最長」不重疊比對（例如「不同意」優先於「同意」）。
+"""
+
+from collections import deque
+from typing import Any, Dict, Iterator, List, Tuple
+
+# (起始位置, 結束位置, 關鍵字, 關鍵字對應值)
+Match = Tuple[int, int, str, Any]
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 關鍵字自動機"""
+
+    def __init__(self, case_insensitive: bool = True):
+        self.case_insensitive = case_insensitive
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self._patterns: List[str] = []
+        self._values: List[Any] = []
+        self._built = True
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _normalize(self, text: str) -> str:
+        return text.lower() if self.case_insensitive else text
+
+    def add(self, pattern: str, value: Any = None):
+        """加入關鍵字；加入後需重新 build 才會生效"""
+        pattern = self._normalize(pattern)
+        if not pattern:
+            return
+
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+
+        self._output[node].append(len(self._patterns))
+        self._patterns.append(pattern)
+        self._values.append(value)
+        self._built = False
+
+    def build(self):
+        """以 BFS 建立失敗連結；已存在的 trie 節點會沿用，只重算連結"""
+        if self._built:
+            return
+
+        # 重新計算前先清掉舊的繼承輸出，只保留節點本身結尾的關鍵字
+        own_output = [[] for _ in self._goto]
+        for pattern_id, pattern in enumerate(self._patterns):
+            node = 0
+            for char in pattern:
+                node = self._goto[node][char]
+            own_output[node].append(pattern_id)
+        self._output = own_output
+
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = (
+                    self._output[child] + self._output[self._fail[child]]
+                )
+
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Match]:
+        """列出文字中所有（可重疊的）關鍵字出現位置"""
+        self.build()
+        text = self._normalize(text)
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for pattern_id in self._output[node]:
+                pattern = self._patterns[pattern_id]
+                yield (
+                    index + 1 - len(pattern),
+                    index + 1,
+                    pattern,
+                    self._values[pattern_id],
+                )
+
+    def longest_matches(self, text: str) -> List[Match]:
+        """最左最長、不重疊的關鍵字比對結果"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        covered_until = 0
+        for match in matches:
+            if match[0] >= covered_until:
+                selected.append(match)
+                covered_until = match[1]
+        return selected
@@ -0,0 +1,218 @@
+"""
+SAP 請購系統 AI Agent - LLM 回應快取
+
+以「完整渲染後的 prompt + 模型參數（模型名稱、temperature 等）」作為鍵值，
+提供兩層快取：
+1. 記憶體 LRU 層：最近使用的回應，查詢不需 I/O
+2. SQLite 磁碟層：跨行程、重啟後仍可命中
+
+兩層皆支援 TTL 與容量上限淘汰，並提供命中 / 未命中統計。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, Generation
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache(BaseCache):
+    """兩層式（記憶體 LRU + SQLite）LLM 回應快取"""
+
+    # 每寫入多少筆才檢查一次磁碟層容量，避免每次寫入都 COUNT(*)
+    _DISK_EVICT_INTERVAL = 64
+
+    def __init__(
+        self,
+        db_path: str = "",
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 50000,
+        ttl_seconds: float = 3600,
+    ):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._init_db()
+
+    def _init_db(self):
+        """初始化 SQLite 磁碟層"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _make_key(prompt: str, llm_string: str) -> str:
+        """產生快取鍵值（prompt 與模型參數的雜湊）"""
+        digest = hashlib.sha256()
+        digest.update(llm_string.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(prompt.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _to_generations(texts: List[str]) -> List[Generation]:
+        """將快取的文字還原為 ChatGeneration"""
+        return [ChatGeneration(message=AIMessage(content=text)) for text in texts]
+
+    def _remember(self, key: str, expires_at: float, texts: List[str]):
+        """寫入記憶體層並依容量淘汰最舊項目（呼叫端需持有鎖）"""
+        self._memory[key] = (expires_at, texts)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        """查詢快取"""
+        key = self._make_key(prompt, llm_string)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, texts = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return self._to_generations(texts)
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        value, expires_at = row
+                        if expires_at > now:
+                            self._conn.execute(
+                                "UPDATE llm_cache SET last_access = ? WHERE key = ?",
+                                (now, key),
+                            )
+                            self._conn.commit()
+                            texts = json.loads(value)
+                            self._remember(key, expires_at, texts)
+                            self._stats["disk_hits"] += 1
+                            return self._to_generations(texts)
+                        self._conn.execute(
+                            "DELETE FROM llm_cache WHERE key = ?", (key,)
+                        )
+                        self._conn.commit()
+                        self._stats["expired"] += 1
+                except sqlite3.Error as e:
+                    logger.error(f"讀取 LLM 磁碟快取失敗: {e}")
+
+            self._stats["misses"] += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]):
+        """寫入快取"""
+        texts = [generation.text for generation in return_val]
+        if not any(texts):
+            # 空回應通常代表呼叫異常，不快取
+            return
+
+        key = self._make_key(prompt, llm_string)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+
+        with self._lock:
+            self._remember(key, expires_at, texts)
+
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(texts, ensure_ascii=False), expires_at, now),
+                    )
+                    self._conn.commit()
+                    self._writes_since_evict += 1
+                    if self._writes_since_evict >= self._DISK_EVICT_INTERVAL:
+                        self._writes_since_evict = 0
+                        self._evict_disk(now)
+                except sqlite3.Error as e:
+                    logger.error(f"寫入 LLM 磁碟快取失敗: {e}")
+
+    def _evict_disk(self, now: float):
+        """淘汰磁碟層中過期與超出容量的項目（呼叫端需持有鎖）"""
+        cursor = self._conn.execute(
+            "DELETE FROM llm_cache WHERE expires_at <= ?", (now,)
+        )
+        self._stats["expired"] += cursor.rowcount
+
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self._stats["disk_evictions"] += overflow
+        self._conn.commit()
+
+    def clear(self, **kwargs):
+        """清除所有快取"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        """取得快取統計資訊"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return stats
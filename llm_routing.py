@@ -0,0 +1,150 @@
+"""
+SAP 請購系統 AI Agent - 各鏈的模型路由與生成設定
+
+每條 LangChain 鏈可以有自己的模型、max_tokens、temperature、逾時與停止序列：
+1. 預設值來自 PurchaseAgentConfig 的 model / max_tokens / temperature
+2. 路由設定檔（routing profile）為一組鏈套用預先定義的設定
+3. PurchaseAgentConfig.chain_settings 可再覆寫個別鏈
+
+解析後設定相同的鏈共用同一個 ChatOpenAI 用戶端（停止序列以 bind 套用，不影響共用）。
+"""
+
+import threading
+from dataclasses import dataclass, fields, replace
+from typing import Callable, Dict, Optional, Tuple
+
+# 所有鏈的名稱（與 ConversationalPurchaseAgent 的 <name>_chain 屬性對應）
+CHAIN_NAMES = (
+    "intent",
+    "analyze",
+    "recommend",
+    "adjust",
+    "create_order",
+    "guidance",
+    "extract_requirement",
+    "direct_order",
+    "custom_product",
+    "smart_order_collection",
+    "extract_product_from_recommendation",
+    "structured_recommend",
+    "structured_adjust",
+)
+
+# 只輸出小型 JSON 的分類與擷取鏈
+CLASSIFICATION_CHAINS = (
+    "intent",
+    "extract_requirement",
+    "smart_order_collection",
+    "extract_product_from_recommendation",
+    "direct_order",
+    "custom_product",
+    "create_order",
+)
+
+
+@dataclass(frozen=True)
+class ChainSettings:
+    """單一鏈的生成設定（None 表示沿用上一層設定）"""
+
+    model: Optional[str] = None
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    timeout: Optional[float] = None
+    stop: Optional[Tuple[str, ...]] = None
+
+    def over(self, base: "ChainSettings") -> "ChainSettings":
+        """以本設定覆寫 base 中對應的欄位"""
+        updates = {
+            item.name: getattr(self, item.name)
+            for item in fields(self)
+            if getattr(self, item.name) is not None
+        }
+        return replace(base, **updates)
+
+    def client_key(self) -> Tuple:
+        """決定是否共用用戶端的設定（停止序列不影響）"""
+        return (self.model, self.max_tokens, self.temperature, self.timeout)
+
+
+def _tiered_profile(fast_model: Optional[str]) -> Dict[str, ChainSettings]:
+    """分類與擷取鏈改用小型快速模型、低輸出上限與 temperature 0"""
+    output_limits = {
+        "intent": 128,
+        "extract_requirement": 256,
+        "smart_order_collection": 256,
+        "extract_product_from_recommendation": 256,
+        "custom_product": 256,
+        "direct_order": 384,
+        "create_order": 384,
+    }
+    profile = {
+        name: ChainSettings(model=fast_model, max_tokens=limit, temperature=0.0)
+        for name, limit in output_limits.items()
+    }
+    profile["guidance"] = ChainSettings(max_tokens=256)
+    profile["structured_recommend"] = ChainSettings(max_tokens=512)
+    profile["structured_adjust"] = ChainSettings(max_tokens=512)
+    return profile
+
+
+# 路由設定檔：uniform 為所有鏈共用預設設定（原本的行為）
+ROUTING_PROFILES: Dict[str, Callable[[Optional[str]], Dict[str, ChainSettings]]] = {
+    "uniform": lambda fast_model: {},
+    "tiered": _tiered_profile,
+}
+
+
+def resolve_chain_settings(
+    default: ChainSettings,
+    profile: str = "uniform",
+    overrides: Optional[Dict[str, ChainSettings]] = None,
+    fast_model: Optional[str] = None,
+) -> Dict[str, ChainSettings]:
+    """解析每條鏈最終的設定：預設值 → 路由設定檔 → 個別覆寫"""
+    if profile not in ROUTING_PROFILES:
+        raise ValueError(
+            f"未知的路由設定檔: {profile}（可用：{', '.join(ROUTING_PROFILES)}）"
+        )
+    profile_settings = ROUTING_PROFILES[profile](fast_model or None)
+    overrides = overrides or {}
+    unknown = set(overrides) - set(CHAIN_NAMES)
+    if unknown:
+        raise ValueError(f"未知的鏈名稱: {', '.join(sorted(unknown))}")
+
+    resolved = {}
+    for name in CHAIN_NAMES:
+        settings = default
+        if name in profile_settings:
+            settings = profile_settings[name].over(settings)
+        if name in overrides:
+            settings = overrides[name].over(settings)
+        resolved[name] = settings
+    return resolved
+
+
+class LLMClientPool:
+    """依設定共用 LLM 用戶端：設定相同（不含停止序列）的鏈取得同一個實例"""
+
+    def __init__(self, factory: Callable[[ChainSettings], object]):
+        self._factory = factory
+        self._clients: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, settings: ChainSettings, client: object):
+        """登記既有的用戶端（例如預設設定的用戶端）"""
+        with self._lock:
+            self._clients[settings.client_key()] = client
+
+    def get(self, settings: ChainSettings):
+        """取得（或建立）符合設定的用戶端"""
+        key = settings.client_key()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._factory(settings)
+                self._clients[key] = client
+            return client
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
@@ -0,0 +1,254 @@
+"""
+SAP 請購系統 AI Agent - 對外 LLM 呼叫排程
+
+所有鏈的呼叫都先向 LLMScheduler 取得執行名額：
+1. 全域並行上限：同時送往 LLM 服務的請求數不超過 max_concurrency
+2. token 速率預算（token bucket）：每分鐘預估消耗的 token 數不超過
+   tokens_per_minute，預估值為輸入文字的粗估 token 數加上輸出上限
+3. 優先通道：名額釋出時依通道優先順序（送出 / 確認請購單 > 推薦 > 離題引導）
+   分配給等待中的請求，同一通道內先到先得
+
+同步呼叫端以 slot()、非同步呼叫端以 aslot() 取得名額，兩者共用同一個佇列；
+一次送出多個請求的批次以 calls 取得對應數量的名額。stats() 提供各通道的佇列
+深度與等待時間。
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# 通道名稱依優先順序排列（越前面越優先）；speculative 為推測性預先計算，
+# 只使用其他通道沒有用到的名額
+LANES = ("order", "recommend", "guidance", "speculative")
+
+# 各鏈所屬的通道（未列出的鏈歸入 recommend）
+CHAIN_LANES = {
+    "create_order": "order",
+    "direct_order": "order",
+    "smart_order_collection": "order",
+    "extract_product_from_recommendation": "order",
+    "intent": "recommend",
+    "analyze": "recommend",
+    "extract_requirement": "recommend",
+    "custom_product": "recommend",
+    "recommend": "recommend",
+    "adjust": "recommend",
+    "structured_recommend": "recommend",
+    "structured_adjust": "recommend",
+    "guidance": "guidance",
+}
+
+
+def lane_for_chain(chain_name: str) -> str:
+    """取得鏈所屬的優先通道"""
+    return CHAIN_LANES.get(chain_name, "recommend")
+
+
+class _Waiter:
+    """等待名額的請求（同步以 Event、非同步以事件迴圈的 Future 通知）"""
+
+    __slots__ = ("lane", "tokens", "calls", "queued_at", "event", "loop", "future")
+
+    def __init__(self, lane: str, tokens: int, calls: int = 1, loop=None):
+        self.lane = lane
+        self.tokens = tokens
+        self.calls = calls
+        self.queued_at = time.perf_counter()
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class LLMScheduler:
+    """具優先通道、並行上限與 token 速率預算的 LLM 呼叫排程器"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        tokens_per_minute: Optional[int] = None,
+        lanes: Tuple[str, ...] = LANES,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 必須大於 0")
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute or None
+        self._priorities = {lane: index for index, lane in enumerate(lanes)}
+
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._tokens = float(self.tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._refill_timer: Optional[threading.Timer] = None
+        self._stats = {
+            lane: {
+                "submitted": 0,
+                "completed": 0,
+                "queued": 0,
+                "max_queued": 0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0,
+            }
+            for lane in lanes
+        }
+
+    # ---- 取得與釋放名額 ----
+
+    @contextmanager
+    def slot(self, lane: str, tokens: int = 0, calls: int = 1):
+        """在同步程式中持有執行名額（批次同時送出 calls 個請求時佔用 calls 個）"""
+        waiter = self._enqueue(lane, tokens, calls, loop=None)
+        waiter.event.wait()
+        self._record_wait(waiter)
+        try:
+            yield
+        finally:
+            self._release(lane, waiter.calls)
+
+    @asynccontextmanager
+    async def aslot(self, lane: str, tokens: int = 0, calls: int = 1):
+        """在事件迴圈中持有執行名額（等待時不佔住事件迴圈）"""
+        waiter = self._enqueue(lane, tokens, calls, loop=asyncio.get_running_loop())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._cancel(waiter)
+            raise
+        self._record_wait(waiter)
+        try:
+            yield
+        finally:
+            self._release(lane, waiter.calls)
+
+    def _enqueue(self, lane: str, tokens: int, calls: int, loop) -> _Waiter:
+        if lane not in self._priorities:
+            raise ValueError(f"未知的優先通道: {lane}")
+        if self.tokens_per_minute:
+            # 超過整個預算的請求以預算上限計算，避免永遠無法執行
+            tokens = min(tokens, self.tokens_per_minute)
+        # 超過並行上限的批次以上限計算，同樣避免永遠無法執行
+        calls = min(max(calls, 1), self.max_concurrency)
+        waiter = _Waiter(lane, tokens, calls, loop)
+        with self._lock:
+            lane_stats = self._stats[lane]
+            lane_stats["submitted"] += 1
+            lane_stats["queued"] += 1
+            lane_stats["max_queued"] = max(
+                lane_stats["max_queued"], lane_stats["queued"]
+            )
+            heapq.heappush(
+                self._queue, (self._priorities[lane], next(self._sequence), waiter)
+            )
+            self._dispatch_locked()
+        return waiter
+
+    def _cancel(self, waiter: _Waiter):
+        """非同步等待被取消：移出佇列，或歸還已分配的名額"""
+        with self._lock:
+            for index, (_, _, queued) in enumerate(self._queue):
+                if queued is waiter:
+                    self._queue.pop(index)
+                    heapq.heapify(self._queue)
+                    self._stats[waiter.lane]["queued"] -= 1
+                    return
+        # 已分配名額但呼叫端已取消
+        self._release(waiter.lane, waiter.calls, completed=False)
+
+    def _release(self, lane: str, calls: int = 1, completed: bool = True):
+        with self._lock:
+            self._in_flight -= calls
+            if completed:
+                self._stats[lane]["completed"] += 1
+            self._dispatch_locked()
+
+    def _refill_locked(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+        )
+        self._refilled_at = now
+
+    def _dispatch_locked(self):
+        """依優先順序把可用的名額分配給等待中的請求（需持有 self._lock）"""
+        self._refill_locked()
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if self._in_flight + waiter.calls > self.max_concurrency:
+                # 名額不足以執行優先順序最高的請求（或批次）：等名額釋出，不讓插隊
+                return
+            if self.tokens_per_minute and waiter.tokens > self._tokens:
+                # 優先順序最高的請求預算不足：等 token 補充後再分配，
+                # 不讓較低優先的請求插隊
+                self._schedule_refill_locked(waiter.tokens - self._tokens)
+                return
+            heapq.heappop(self._queue)
+            self._stats[waiter.lane]["queued"] -= 1
+            self._in_flight += waiter.calls
+            if self.tokens_per_minute:
+                self._tokens -= waiter.tokens
+            waiter.grant()
+
+    def _schedule_refill_locked(self, missing_tokens: float):
+        if self._refill_timer is not None and self._refill_timer.is_alive():
+            return
+        delay = missing_tokens * 60 / self.tokens_per_minute
+        self._refill_timer = threading.Timer(delay, self._on_refill)
+        self._refill_timer.daemon = True
+        self._refill_timer.start()
+
+    def _on_refill(self):
+        with self._lock:
+            self._refill_timer = None
+            self._dispatch_locked()
+
+    def _record_wait(self, waiter: _Waiter):
+        wait_ms = (time.perf_counter() - waiter.queued_at) * 1000
+        with self._lock:
+            lane_stats = self._stats[waiter.lane]
+            lane_stats["total_wait_ms"] += wait_ms
+            lane_stats["max_wait_ms"] = max(lane_stats["max_wait_ms"], wait_ms)
+
+    # ---- 統計 ----
+
+    def stats(self) -> Dict:
+        """取得排程統計（各通道的佇列深度與等待時間）"""
+        with self._lock:
+            self._refill_locked()
+            lanes = {lane: dict(values) for lane, values in self._stats.items()}
+            stats = {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_available": (
+                    int(self._tokens) if self.tokens_per_minute else None
+                ),
+            }
+
+        for values in lanes.values():
+            started = values["submitted"] - values["queued"]
+            total_wait_ms = values.pop("total_wait_ms")
+            values["avg_wait_ms"] = (
+                round(total_wait_ms / started, 2) if started else 0.0
+            )
+            values["max_wait_ms"] = round(values["max_wait_ms"], 2)
+        stats["lanes"] = lanes
+        return stats
@@ -0,0 +1,393 @@
+"""
+SAP 請購系統 AI Agent - Prometheus 格式指標
+
+提供計數器（Counter）、可增減的量測值（Gauge）、直方圖（Histogram）與
+抓取時才計算的量測值（回呼函式），並以 Prometheus 文字格式輸出（/metrics）。
+
+為了能在正式環境常駐開啟，記錄指標時不取得鎖、不建立新的指標物件：
+1. 每個執行緒各自累加自己的計數格（thread-local cell），只有擁有者會寫入，
+   抓取指標時才把所有執行緒的計數格加總
+2. 只有第一次使用某組標籤，或某個執行緒第一次記錄某個指標時才需要取鎖建立
+   計數格；呼叫端可先以 labels() 取得子指標並重複使用
+"""
+
+import bisect
+import math
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 預設的延遲直方圖區間（秒）：涵蓋本地規則（毫秒內）到 LLM 呼叫（數十秒）
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class _ThreadCells:
+    """每個執行緒一份的計數格（固定長度的 list），抓取時加總
+
+    已結束執行緒的計數格會併入 retired，避免每個請求一個執行緒的伺服器
+    （例如 Flask 開發伺服器）讓計數格無限增加。
+    """
+
+    __slots__ = ("_size", "_local", "_cells", "_retired", "_lock")
+
+    # 計數格超過此數量時，登錄新計數格前先回收已結束執行緒的計數格
+    _COMPACT_THRESHOLD = 64
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: List[Tuple[threading.Thread, List[float]]] = []
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self) -> List[float]:
+        """取得目前執行緒的計數格（只有第一次需要取鎖）"""
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self._size
+            with self._lock:
+                if len(self._cells) >= self._COMPACT_THRESHOLD:
+                    self._compact_locked()
+                self._cells.append((threading.current_thread(), cell))
+            self._local.cell = cell
+            return cell
+
+    def _compact_locked(self):
+        alive = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                for index, value in enumerate(cell):
+                    self._retired[index] += value
+        self._cells = alive
+
+    def totals(self) -> List[float]:
+        """加總所有執行緒的計數格"""
+        with self._lock:
+            self._compact_locked()
+            totals = list(self._retired)
+            cells = [cell for _, cell in self._cells]
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class _CounterChild:
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount: float = 1):
+        self._cells.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        self._cells.cell()[0] -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_cells")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # 各區間計數 + 超過最大區間的計數 + 總和
+        self._cells = _ThreadCells(len(bounds) + 2)
+
+    def observe(self, value: float):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self) -> Tuple[List[float], float]:
+        """回傳（各區間計數（含 +Inf）, 總和）"""
+        totals = self._cells.totals()
+        return totals[:-1], totals[-1]
+
+
+class _Metric:
+    """具標籤的指標；labels() 回傳對應標籤值的子指標"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        self._default = None if self.labelnames else self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """取得標籤值對應的子指標（第一次使用時建立）"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f"指標 {self.name} 需要 {len(self.labelnames)} 個標籤值，"
+                f"收到 {len(values)} 個"
+            )
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        if self._default is not None:
+            return [((), self._default)]
+        with self._lock:
+            return sorted(self._children.items())
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._items():
+            yield f"{self.name}{self._label_text(values)} {_number(child.value())}"
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    """可增減的量測值（例如進行中的回合數）"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+
+class Histogram(_Metric):
+    """累積區間直方圖"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._items():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                labels = self._label_text(values, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {_number(cumulative)}"
+            labels = self._label_text(values)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {_number(cumulative)}"
+
+
+class CallbackGauge(_Metric):
+    """抓取指標時才呼叫函式計算的量測值
+
+    可直接設定 callback，或以 track() 為每個擁有者（例如每個 Agent）登錄回呼，
+    抓取時加總所有仍存在的擁有者；擁有者只以弱參照保存，被回收後自動移除。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.callback: Optional[Callable[[], float]] = None
+        # 擁有者 -> 以擁有者為參數的回呼
+        self._tracked = weakref.WeakKeyDictionary()
+
+    def _new_child(self):
+        return None
+
+    def track(self, owner: object, func: Callable[[object], float]):
+        """登錄 owner 的回呼；func 以 owner 為參數（不可在閉包中持有 owner）"""
+        with self._lock:
+            self._tracked[owner] = func
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            tracked = list(self._tracked.items())
+        if self.callback is not None:
+            tracked.append((None, lambda _: self.callback()))
+        if not tracked:
+            return
+        total = 0
+        for owner, func in tracked:
+            try:
+                total += func(owner)
+            except Exception:
+                continue
+        yield f"{self.name} {_number(total)}"
+
+
+class MetricsRegistry:
+    """指標登錄處（同名指標只會建立一次）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_type, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_type(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f"指標 {name} 已以其他類型登錄")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def callback_gauge(self, name: str, documentation: str) -> CallbackGauge:
+        return self._register(CallbackGauge, name, documentation)
+
+    def render(self) -> str:
+        """以 Prometheus 文字格式輸出所有指標"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# 全域指標登錄處與各模組共用的指標
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+CHAIN_LATENCY = REGISTRY.histogram(
+    "sap_agent_llm_chain_seconds",
+    "LLM 鏈呼叫延遲（秒，含排程與批次等待）",
+    ("chain",),
+)
+LLM_ERRORS = REGISTRY.counter(
+    "sap_agent_llm_errors_total", "LLM 鏈呼叫失敗次數", ("chain", "error")
+)
+LLM_RETRIES = REGISTRY.counter(
+    "sap_agent_llm_retries_total",
+    "LLM 輸出無法使用而改以其他鏈重新呼叫的次數",
+    ("chain",),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "sap_agent_llm_tokens_total",
+    "LLM 回應回報的 token 用量（kind 為 input / output）",
+    ("chain", "kind"),
+)
+SAP_LATENCY = REGISTRY.histogram(
+    "sap_agent_sap_request_seconds",
+    "SAP API 呼叫延遲（秒，每次嘗試各記一筆）",
+    ("endpoint", "outcome"),
+)
+SAP_RETRIES = REGISTRY.counter(
+    "sap_agent_sap_retries_total", "SAP API 重試次數", ("endpoint",)
+)
+TURN_LATENCY = REGISTRY.histogram(
+    "sap_agent_turn_seconds", "對話回合延遲（秒，依處理路由）", ("route",)
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "sap_agent_stage_seconds", "對話回合中各階段的延遲（秒）", ("stage",)
+)
+STATE_TRANSITIONS = REGISTRY.counter(
+    "sap_agent_state_transitions_total",
+    "對話狀態轉換次數",
+    ("from_state", "to_state"),
+)
+TURNS_IN_PROGRESS = REGISTRY.gauge("sap_agent_turns_in_progress", "處理中的對話回合數")
+ACTIVE_SESSIONS = REGISTRY.callback_gauge("sap_agent_active_sessions", "保存中的會話數")
+LLM_IN_FLIGHT = REGISTRY.callback_gauge(
+    "sap_agent_llm_in_flight", "排程器中執行中的 LLM 呼叫數"
+)
+LLM_QUEUE_DEPTH = REGISTRY.callback_gauge(
+    "sap_agent_llm_queue_depth", "排程器中等待名額的 LLM 呼叫數"
+)
@@ -0,0 +1,313 @@
+"""
+SAP 請購系統 AI Agent - 請購單資料解析
+
+在「等待請購單詳細資訊」狀態中，以規則直接從使用者輸入擷取三個必要欄位：
+1. 數量：阿拉伯數字或中文數字，可搭配量詞（台、個、支…）或「數量：」標籤
+2. 請購人：「請購人：」、「申請人」、「我是」等標籤後的姓名
+3. 交貨日期：2025-07-15、7/15、7月15日、明天、後天、下週五、月底、3天後等
+
+無法由規則擷取的欄位才交給 LLM；擷取後剩下的文字（residual）可用來判斷
+使用者是否還提供了規則看不懂的資訊。
+"""
+
+import calendar
+import re
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+ORDER_FIELDS = ("quantity", "requester", "expected_delivery_date")
+
+_CHINESE_DIGITS = {
+    "零": 0,
+    "〇": 0,
+    "一": 1,
+    "二": 2,
+    "兩": 2,
+    "两": 2,
+    "三": 3,
+    "四": 4,
+    "五": 5,
+    "六": 6,
+    "七": 7,
+    "八": 8,
+    "九": 9,
+}
+_CHINESE_UNITS = {"十": 10, "百": 100, "千": 1000}
+_WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+
+_NUMBER = r"(\d+|[零〇一二兩两三四五六七八九十百千]+)"
+_MEASURE_WORDS = r"(?:台|臺|個|个|支|部|件|套|組|隻|份|張)"
+_WEEK = r"(?:週|周|星期|禮拜)"
+
+_QUANTITY_PATTERNS = [
+    re.compile(
+        rf"(?:數量|数量|quantity)\s*(?:是|為|[:：])?\s*{_NUMBER}\s*{_MEASURE_WORDS}?",
+        re.I,
+    ),
+    re.compile(rf"{_NUMBER}\s*{_MEASURE_WORDS}"),
+]
+
+_REQUESTER_PATTERNS = [
+    re.compile(
+        r"(?:請購人|申請人|請購者|使用者|requester)\s*(?:姓名)?\s*(?:是|為|[:：])?\s*"
+        r"([\u4e00-\u9fff]{2,8}|[A-Za-z][A-Za-z .'-]{0,30}[A-Za-z])",
+        re.I,
+    ),
+    re.compile(
+        r"我(?:是|叫)\s*([\u4e00-\u9fff]{2,8}|[A-Za-z][A-Za-z .'-]{0,30}[A-Za-z])"
+    ),
+]
+# 中文姓名後常接的欄位關鍵字（例如「請購人張三交貨日期…」）
+_NAME_STOP_WORDS = ("交貨", "日期", "數量", "需要", "希望", "預計", "要", "在", "於")
+# 「我是IT部門的」之類的部門或單位名稱不是請購人
+_DEPARTMENT_PATTERN = re.compile(
+    r"部門|部|處|課|組|中心|團隊|單位|公司|\b(?:department|dept|team)\b", re.I
+)
+
+_DATE_PATTERNS: List[Tuple[str, re.Pattern]] = [
+    (
+        "ymd",
+        re.compile(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*[日號]?"),
+    ),
+    ("md_cn", re.compile(rf"{_NUMBER}\s*月\s*{_NUMBER}\s*[日號]")),
+    ("md", re.compile(r"(?<![\d/.-])(\d{1,2})\s*[/-]\s*(\d{1,2})(?![\d/.-])")),
+    ("week", re.compile(rf"(下下|下|這|这|本)?\s*{_WEEK}\s*([一二三四五六日天])")),
+    ("month_end", re.compile(r"(下個?|下一個)?\s*月底")),
+    ("month_start", re.compile(r"下個?月初|下一個月初")),
+    (
+        "after",
+        re.compile(rf"{_NUMBER}\s*(天|日|週|周|星期|禮拜|個月)\s*(?:後|之後|以後|內)"),
+    ),
+    ("relative", re.compile(r"大後天|後天|明天|今天")),
+]
+_RELATIVE_DAYS = {"今天": 0, "明天": 1, "後天": 2, "大後天": 3}
+
+# 計算剩餘文字時移除的欄位標籤、標點與語助詞
+_LABEL_PATTERN = re.compile(
+    r"請購人|申請人|請購者|使用者|姓名|數量|数量|交貨日期|交貨|到貨|日期|預期|預計|"
+    r"希望|需要|我要|我是|我叫|是|為|共|在|於|前|之前|左右|請|幫我|麻煩"
+)
+_FILLER_PATTERN = re.compile(r"[\s\W_的了吧啊呀喔哦嗯呢嘛囉唷啦和跟及]+")
+
+
+def parse_number(text: str) -> Optional[int]:
+    """解析阿拉伯數字或中文數字（一、兩、十二、二十五、一百零五…）"""
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+
+    total, current = 0, 0
+    for char in text:
+        if char in _CHINESE_DIGITS:
+            current = _CHINESE_DIGITS[char]
+        elif char in _CHINESE_UNITS:
+            total += (current or 1) * _CHINESE_UNITS[char]
+            current = 0
+        else:
+            return None
+    return total + current
+
+
+def _month_end(year: int, month: int) -> date:
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def roll_forward(day: date, today: date) -> date:
+    """早於今天的日期順延到下一個相同月日（交貨日期不會在過去）"""
+    while day < today:
+        try:
+            day = day.replace(year=day.year + 1)
+        except ValueError:  # 2 月 29 日
+            day = day.replace(year=day.year + 1, day=28)
+    return day
+
+
+@dataclass
+class OrderDetailsParse:
+    """請購單資料解析結果"""
+
+    fields: Dict[str, object] = field(default_factory=dict)  # 規則擷取到的欄位
+    residual: str = ""  # 移除已擷取內容、標籤與語助詞後剩下的文字
+
+    def missing(self, collected: Optional[Dict] = None) -> List[str]:
+        """合併已收集資訊後仍缺少的欄位"""
+        merged = {**(collected or {}), **self.fields}
+        return [name for name in ORDER_FIELDS if merged.get(name) is None]
+
+
+class OrderDetailsParser:
+    """數量、請購人與交貨日期的規則解析器"""
+
+    def parse(self, text: str, today: Optional[date] = None) -> OrderDetailsParse:
+        """從使用者輸入擷取請購單欄位"""
+        today = today or date.today()
+        text = text or ""
+        result = OrderDetailsParse()
+        spans: List[Tuple[int, int]] = []
+
+        # 日期先解析，避免「7月15日」之類的數字被當成數量
+        delivery = self._parse_date(text, today)
+        if delivery is not None:
+            result.fields["expected_delivery_date"] = roll_forward(
+                delivery[0], today
+            ).isoformat()
+            spans.append(delivery[1])
+
+        for pattern in _QUANTITY_PATTERNS:
+            match = self._first_free_match(pattern, text, spans)
+            if match is not None:
+                quantity = parse_number(match.group(1))
+                if quantity:
+                    result.fields["quantity"] = quantity
+                    spans.append(match.span())
+                    break
+
+        requester = self._parse_requester(text, spans)
+        if requester is not None:
+            result.fields["requester"] = requester[0]
+            spans.append(requester[1])
+
+        result.residual = self._residual(text, spans)
+        return result
+
+    def normalize_date(self, value: str, today: Optional[date] = None) -> Optional[str]:
+        """將日期字串正規化為 YYYY-MM-DD，早於今天的日期順延到下一個相同月日"""
+        today = today or date.today()
+        parsed = self._parse_date(value or "", today)
+        if parsed is None:
+            return None
+        return roll_forward(parsed[0], today).isoformat()
+
+    @staticmethod
+    def _first_free_match(
+        pattern: re.Pattern, text: str, spans: List[Tuple[int, int]]
+    ) -> Optional[re.Match]:
+        """第一個不與已擷取內容重疊的比對結果"""
+        for match in pattern.finditer(text):
+            if all(
+                match.end() <= start or match.start() >= end for start, end in spans
+            ):
+                return match
+        return None
+
+    @classmethod
+    def _parse_requester(
+        cls, text: str, spans: List[Tuple[int, int]]
+    ) -> Optional[Tuple[str, Tuple[int, int]]]:
+        """擷取請購人，回傳（姓名, 文字位置）
+
+        姓名先截斷到下一個欄位標籤前，再檢查是否與已擷取的內容重疊，
+        避免「請購人：張三豐交貨日期明天」因姓名吃到日期而整個被捨棄。
+        """
+        for pattern in _REQUESTER_PATTERNS:
+            for match in pattern.finditer(text):
+                name = cls._trim_name(match.group(1))
+                if not name or cls._is_department(name, text[match.start(1) :]):
+                    continue
+                span = (match.start(), match.start(1) + len(name))
+                if all(span[1] <= start or span[0] >= end for start, end in spans):
+                    return name, span
+        return None
+
+    @staticmethod
+    def _is_department(name: str, text: str) -> bool:
+        """姓名本身或緊接在後的文字是部門名稱（例如「IT部門」、「業務部」）"""
+        return bool(
+            _DEPARTMENT_PATTERN.search(name)
+            or _DEPARTMENT_PATTERN.match(text[len(name) :].lstrip())
+        )
+
+    @staticmethod
+    def _trim_name(name: str) -> str:
+        name = name.strip()
+        if re.match(r"[\u4e00-\u9fff]", name):
+            for stop_word in _NAME_STOP_WORDS:
+                index = name.find(stop_word, 1)
+                if index > 0:
+                    name = name[:index]
+            # 中文姓名最多取四個字
+            name = name[:4]
+            if len(name) < 2:
+                return ""
+        return name
+
+    def _parse_date(
+        self, text: str, today: date
+    ) -> Optional[Tuple[date, Tuple[int, int]]]:
+        """解析第一個可辨識的日期，回傳（日期, 文字位置）"""
+        candidates = []
+        for kind, pattern in _DATE_PATTERNS:
+            for match in pattern.finditer(text):
+                day = self._resolve_date(kind, match, today)
+                if day is not None:
+                    candidates.append(
+                        (match.start(), -len(match.group(0)), day, match.span())
+                    )
+                    break
+        if not candidates:
+            return None
+        _, _, day, span = min(candidates)
+        return day, span
+
+    @staticmethod
+    def _resolve_date(kind: str, match: re.Match, today: date) -> Optional[date]:
+        try:
+            if kind == "ymd":
+                year, month, day = (int(value) for value in match.groups())
+                return date(year, month, day)
+            if kind in ("md", "md_cn"):
+                month = parse_number(match.group(1))
+                day = parse_number(match.group(2))
+                return roll_forward(date(today.year, month, day), today)
+            if kind == "week":
+                prefix, weekday = match.group(1) or "", _WEEKDAYS[match.group(2)]
+                monday = today - timedelta(days=today.weekday())
+                if prefix == "下下":
+                    return monday + timedelta(weeks=2, days=weekday)
+                if prefix == "下":
+                    return monday + timedelta(weeks=1, days=weekday)
+                if prefix:
+                    return monday + timedelta(days=weekday)
+                # 只說「週五」時取今天之後最近的一天
+                return today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+            if kind == "month_end":
+                if match.group(1):
+                    next_month = _add_months(today.replace(day=1), 1)
+                    return _month_end(next_month.year, next_month.month)
+                end = _month_end(today.year, today.month)
+                if end == today:
+                    next_month = _add_months(today.replace(day=1), 1)
+                    return _month_end(next_month.year, next_month.month)
+                return end
+            if kind == "month_start":
+                return _add_months(today.replace(day=1), 1)
+            if kind == "after":
+                amount = parse_number(match.group(1))
+                unit = match.group(2)
+                if amount is None:
+                    return None
+                if unit in ("天", "日"):
+                    return today + timedelta(days=amount)
+                if unit == "個月":
+                    return _add_months(today, amount)
+                return today + timedelta(weeks=amount)
+            if kind == "relative":
+                return today + timedelta(days=_RELATIVE_DAYS[match.group(0)])
+        except (TypeError, ValueError):
+            return None
+        return None
+
+    @staticmethod
+    def _residual(text: str, spans: List[Tuple[int, int]]) -> str:
+        for start, end in sorted(spans, reverse=True):
+            text = text[:start] + " " + text[end:]
+        text = _LABEL_PATTERN.sub(" ", text)
+        return _FILLER_PATTERN.sub("", text)
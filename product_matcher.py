@@ -0,0 +1,150 @@
+"""
+SAP 請購系統 AI Agent - 產品比對
+
+以 Aho-Corasick 自動機一次線性掃描推薦文字，找出其中提到的產品名稱關鍵字、
+供應商、類別與價格，並為採購歷史中的產品計分排序。
+
+產品目錄為所有看過的採購歷史產品（以名稱、供應商、類別、單價識別）；
+出現新產品時只把新的關鍵字加入自動機並重建失敗連結，不需重新建立整個目錄。
+完整產品名稱也登記在自動機中，可直接找出使用者輸入裡指名的已知產品。
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from keyword_automaton import KeywordAutomaton
+
+# 各類關鍵字命中時的加分（與原本逐筆比對的計分規則相同）
+MATCH_WEIGHTS = {"name": 2, "supplier": 1, "category": 1, "price": 3}
+
+# 產品名稱關鍵字的最短長度（忽略太短的關鍵字）
+MIN_NAME_KEYWORD_LENGTH = 3
+
+ProductKey = Tuple[str, str, str, float]
+
+
+class ProductMatcher:
+    """推薦文字與採購歷史產品的比對器"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._automaton = KeywordAutomaton(case_insensitive=True)
+        self._products: Dict[ProductKey, int] = {}
+        self._catalog: List[Dict] = []
+        # (關鍵字類型, 關鍵字) -> 含有此關鍵字的產品編號
+        self._keyword_products: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        self.catalog_version = 0
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    @staticmethod
+    def product_key(product: Dict) -> ProductKey:
+        """產品識別鍵（名稱、供應商、類別、單價）"""
+        return (
+            (product.get("product_name") or "").lower(),
+            (product.get("supplier") or "").lower(),
+            (product.get("category") or "").lower(),
+            product.get("unit_price") or 0,
+        )
+
+    def _add_keyword(self, kind: str, keyword: str, product_id: int, patterns=None):
+        """登記關鍵字；第一次出現的關鍵字才加入自動機"""
+        key = (kind, keyword)
+        if key not in self._keyword_products:
+            for pattern in patterns or (keyword,):
+                self._automaton.add(pattern, key)
+        self._keyword_products[key].append(product_id)
+
+    def add_products(self, products: Iterable[Dict]) -> int:
+        """將新產品加入目錄，回傳新增的產品數"""
+        with self._lock:
+            added = 0
+            for product in products:
+                key = self.product_key(product)
+                if key in self._products:
+                    continue
+
+                product_id = len(self._products)
+                self._products[key] = product_id
+                self._catalog.append(product)
+                name, supplier, category, unit_price = key
+
+                # 完整名稱只用於找出指名的產品，不參與計分
+                if len(name) >= MIN_NAME_KEYWORD_LENGTH:
+                    self._automaton.add(name, ("full", product_id))
+
+                for keyword in set(name.split()):
+                    if len(keyword) >= MIN_NAME_KEYWORD_LENGTH:
+                        self._add_keyword("name", keyword, product_id)
+                if supplier:
+                    self._add_keyword("supplier", supplier, product_id)
+                if category:
+                    self._add_keyword("category", category, product_id)
+                if unit_price:
+                    price = str(unit_price)
+                    # 同時比對「75000」與「75,000」兩種寫法
+                    self._add_keyword(
+                        "price",
+                        price,
+                        product_id,
+                        patterns=(price, f"{unit_price:,}"),
+                    )
+                added += 1
+
+            if added:
+                self._automaton.build()
+                self.catalog_version += 1
+            return added
+
+    def _scores(self, text: str) -> Dict[int, int]:
+        """一次掃描文字，計算各產品的比對分數"""
+        matched = {
+            value
+            for _, _, _, value in self._automaton.iter_matches(text)
+            if value[0] != "full"
+        }
+        scores: Dict[int, int] = defaultdict(int)
+        for key in matched:
+            weight = MATCH_WEIGHTS[key[0]]
+            for product_id in self._keyword_products[key]:
+                scores[product_id] += weight
+        return scores
+
+    def rank(self, text: str, products: List[Dict]) -> List[Tuple[int, Dict]]:
+        """依比對分數排序 products 中的產品（同分時維持原本順序）"""
+        with self._lock:
+            self.add_products(products)
+            scores = self._scores(text)
+
+            candidates = []
+            seen = set()
+            for position, product in enumerate(products):
+                product_id = self._products[self.product_key(product)]
+                score = scores.get(product_id, 0)
+                if score and product_id not in seen:
+                    seen.add(product_id)
+                    candidates.append((score, position, product))
+
+        candidates.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, product) for score, _, product in candidates]
+
+    def best_match(
+        self, text: str, products: List[Dict], min_score: int = 3
+    ) -> Optional[Dict]:
+        """分數最高且達門檻的產品"""
+        ranked = self.rank(text, products)
+        if ranked and ranked[0][0] >= min_score:
+            return ranked[0][1]
+        return None
+
+    def mentioned_products(self, text: str) -> List[Dict]:
+        """文字中以完整名稱提到的目錄產品（名稱較長者優先，同名產品依加入順序）"""
+        with self._lock:
+            hits = {}
+            for start, end, _, value in self._automaton.iter_matches(text):
+                if value[0] == "full":
+                    hits.setdefault(value[1], end - start)
+            order = sorted(hits, key=lambda product_id: (-hits[product_id], product_id))
+            return [self._catalog[product_id] for product_id in order]
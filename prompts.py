@@ -26,6 +26,8 @@ class PurchasePrompts:
 - product_change: 要求更換產品（在確認階段想要選擇不同的產品）
 - confirm_order: 確認請購單
 - submit_order: 提交請購單
+- modify_order: 修改請購單
+- cancel_order: 取消請購
 - off_topic: 與採購無關的話題
 - unclear: 不清楚的輸入
 
@@ -199,11 +201,11 @@ class PurchasePrompts:
 6. department - 部門
 7. reason - 請購理由
 8. urgent - 是否緊急（布林值）
-9. expected_delivery_date - 預期交貨日期（格式：YYYY-MM-DD，使用2025年的日期）
+9. expected_delivery_date - 預期交貨日期（格式：YYYY-MM-DD，不早於今天 {today}）
 
 重要注意事項：
 - 欄位名稱必須完全匹配API要求
-- 日期必須是2025年的有效日期
+- 日期必須是今天（{today}）之後的有效日期
 - urgent欄位必須是布林值（true/false）
 - unit_price必須是整數
 
@@ -215,7 +217,7 @@ class PurchasePrompts:
 確認的產品推薦：{recommendation}
 使用者資訊：{user_info}
 
-請創建請購單，使用正確的欄位名稱和2025年的日期。
+請創建請購單，使用正確的欄位名稱和今天之後的日期。
                 """,
                 ),
             ]
@@ -286,12 +288,12 @@ class PurchasePrompts:
 6. department - 部門
 7. reason - 請購理由
 8. urgent - 是否緊急（布林值）
-9. expected_delivery_date - 預期交貨日期（格式：YYYY-MM-DD，使用2025年的日期）
+9. expected_delivery_date - 預期交貨日期（格式：YYYY-MM-DD，不早於今天 {today}）
 
 重要注意事項：
 - 基於匹配的歷史產品資訊
 - 根據使用者需求調整數量
-- 日期必須是2025年的有效日期
+- 日期必須是今天（{today}）之後的有效日期
 - urgent欄位必須是布林值（true/false）
 - unit_price必須是整數
 
@@ -304,7 +306,7 @@ class PurchasePrompts:
 匹配的歷史產品：{matching_product}
 使用者資訊：{user_info}
 
-請創建請購單，使用正確的欄位名稱和2025年的日期。
+請創建請購單，使用正確的欄位名稱和今天之後的日期。
                 """,
                 ),
             ]
@@ -385,7 +387,7 @@ class PurchasePrompts:
 - 智能識別各種日期格式：7/18、7-18、2025-07-18、7月18日等
 - 智能識別數量：1台、兩個、3、五台等
 - 智能識別人名：中文姓名、英文姓名等
-- 如果用戶沒有提供完整的年份，預設使用2025年
+- 今天是 {today}，相對日期（明天、下週五、月底）請以今天推算；沒有提供年份時使用今天之後最近的日期
 - 不要詢問請購理由或是否緊急，只收集必要的3項資訊
 - 自然地詢問缺少的資訊，不要太正式""",
                 ),
@@ -446,3 +448,89 @@ class PurchasePrompts:
                 ),
             ]
         )
+
+    @staticmethod
+    def get_structured_recommend_prompt():
+        """結構化產品推薦提示（回傳 JSON，顯示文字由程式依範本產生）"""
+        return ChatPromptTemplate.from_messages(
+            [
+                (
+                    "system",
+                    """你是一個專業的採購顧問和數據分析師。請根據使用者需求和採購歷史資料，推薦最合適的一項產品。
+
+推薦要求：
+- 優先從採購歷史中找出最符合需求的產品，產品名稱、類別、供應商請與歷史記錄完全相同
+- 使用者有提出預算時，絕對不要推薦單價超過預算的產品
+- 如果採購歷史中沒有完全匹配的產品，請基於類似產品的資料進行合理推論
+
+回覆格式：
+```json
+{{
+    "product_name": "具體產品名稱",
+    "category": "產品類別",
+    "supplier": "供應商名稱",
+    "quantity": 建議數量（整數，使用者未指定時為 1）,
+    "unit_price": 建議單價（整數）,
+    "total_amount": 總金額（整數，數量乘以單價）,
+    "reason": "推薦理由，2 到 4 點，每點一行，每點不超過 40 字",
+    "alternatives": ["替代產品名稱"]
+}}
+```
+
+只回覆 JSON，推薦理由請用繁體中文。""",
+                ),
+                (
+                    "human",
+                    """
+使用者需求：{user_request}
+
+採購歷史資料：
+{purchase_history}
+
+請提供產品推薦。
+                """,
+                ),
+            ]
+        )
+
+    @staticmethod
+    def get_structured_adjustment_prompt():
+        """結構化調整推薦提示（回傳 JSON，顯示文字由程式依範本產生）"""
+        return ChatPromptTemplate.from_messages(
+            [
+                (
+                    "system",
+                    """你是一個專業的採購顧問和數據分析師。使用者對當前推薦有調整需求，請根據使用者的反饋和採購歷史資料推薦調整後的一項產品。
+
+調整要求：
+- 優先從採購歷史中找出符合調整要求的產品，產品名稱、類別、供應商請與歷史記錄完全相同
+- 使用者有提出預算時，絕對不要推薦單價超過預算的產品
+
+回覆格式：
+```json
+{{
+    "product_name": "具體產品名稱",
+    "category": "產品類別",
+    "supplier": "供應商名稱",
+    "quantity": 建議數量（整數，使用者未指定時為 1）,
+    "unit_price": 建議單價（整數）,
+    "total_amount": 總金額（整數，數量乘以單價）,
+    "reason": "調整理由，2 到 4 點，每點一行，每點不超過 40 字，說明為何更符合使用者需求",
+    "alternatives": ["替代產品名稱"]
+}}
+```
+
+只回覆 JSON，調整理由請用繁體中文。""",
+                ),
+                (
+                    "human",
+                    """
+當前推薦：{current_recommendation}
+使用者調整要求：{adjustment_request}
+採購歷史資料：{purchase_history}
+
+請提供調整後的產品推薦。
+                """,
+                ),
+            ]
+        )
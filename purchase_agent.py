@@ -8,23 +8,106 @@ SAP 請購系統 AI Agent
 4. 防止偏離採購主題的對話
 """
 
+import asyncio
 import json
+import queue
+import re
+import time
+import httpx
 import requests
 import logging
-from typing import Dict, List, Optional
-from dataclasses import dataclass
-
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar, Token, copy_context
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain_openai import ChatOpenAI
 
 # 導入自定義模組
-from choose_state import ConversationState
+from batching import MicroBatcher
+from choose_state import ConversationState, PurchaseRecommendation
+from history_retrieval import HistoryRetriever, estimate_tokens
+from intent_rules import IntentRuleEngine
+from llm_cache import LLMResponseCache
+from llm_routing import (
+    CHAIN_NAMES,
+    ChainSettings,
+    LLMClientPool,
+    resolve_chain_settings,
+)
+from llm_scheduler import LLMScheduler, lane_for_chain
+from metrics import (
+    ACTIVE_SESSIONS,
+    CHAIN_LATENCY,
+    LLM_ERRORS,
+    LLM_IN_FLIGHT,
+    LLM_QUEUE_DEPTH,
+    LLM_RETRIES,
+    LLM_TOKENS,
+    STAGE_LATENCY,
+    STATE_TRANSITIONS,
+    TURN_LATENCY,
+    TURNS_IN_PROGRESS,
+)
+from order_parser import ORDER_FIELDS, OrderDetailsParse, OrderDetailsParser
+from product_matcher import ProductMatcher
 from prompts import PurchasePrompts
+from sap_client import CircuitOpenError, SAPClient, SAPTransport
+from session_locks import SessionLocks, SingleFlight
+from session_store import SessionStore, create_session_store
+from speculation import SpeculativeExecutor
+from tracing import span
+from usage import DEFAULT_PRICING, UsageCollector, UsageTracker
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 串流模式下接收回應片段的回呼（由 chat_stream 在處理執行緒中設定）
+_stream_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar(
+    "stream_sink", default=None
+)
+
+# 目前回合的用量歸屬（會話、部門、回合開始時的對話狀態、是否已超出 token 預算）
+_usage_scope: ContextVar[Optional[Dict]] = ContextVar("usage_scope", default=None)
+
+# 目前回合的會話狀態工作副本（會話 ID, 狀態）：回合中的狀態變更只寫入副本，
+# 回合結束時才一次寫回會話儲存，其他讀取者不會看到處理到一半的狀態
+_turn_state: ContextVar[Optional[Tuple[str, Dict]]] = ContextVar(
+    "turn_state", default=None
+)
+
+# 目前回合由意圖分類（規則或 LLM）判斷出的意圖，供規則無法明確判斷的處理步驟參考
+_turn_intent: ContextVar[Optional[str]] = ContextVar("turn_intent", default=None)
+
+# 直接下單省去的回合數（確認推薦、填寫請購資料）
+DIRECT_ORDER_TURNS_SAVED = 2
+
+# 使用者提到預算時交由 LLM 解析需求（本地快速推薦不處理預算條件）
+_BUDGET_PATTERN = re.compile(r"預算|budget|NT\$|\d\s*(萬|千|元)", re.IGNORECASE)
+
+
+class _TokenSinkHandler(BaseCallbackHandler):
+    """將 LLM 逐字產生的 token 轉送給串流接收端"""
+
+    def __init__(self, sink: Callable[[str], None]):
+        self.sink = sink
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.sink(token)
+
+
+def _state_label(state) -> str:
+    """對話狀態的指標標籤值"""
+    if state is None:
+        return "none"
+    return getattr(state, "value", str(state))
+
 
 @dataclass
 class PurchaseAgentConfig:
@@ -38,6 +121,114 @@ class PurchaseAgentConfig:
     openai_base_url: str = "https://api.openai.com/v1"
     default_requester: str = "系統使用者"
     default_department: str = "IT部門"
+    # LLM 回應快取設定（llm_cache_path 為空字串時只使用記憶體層）
+    llm_cache_enabled: bool = True
+    llm_cache_path: str = ".cache/llm_cache.sqlite"
+    llm_cache_max_entries: int = 1024
+    llm_cache_disk_max_entries: int = 50000
+    llm_cache_ttl_seconds: int = 3600
+    # 確認類狀態的關鍵字規則快速判斷（規則無法明確判斷時才呼叫 LLM）
+    intent_rules_enabled: bool = True
+    intent_rule_max_residual_chars: int = 4
+    intent_rule_max_residual_cjk_chars: int = 0
+    # 會話儲存設定（session_backend 可為 "memory" 或 "sqlite"）
+    session_backend: str = "memory"
+    session_max_entries: int = 10000
+    session_idle_ttl_seconds: int = 3600
+    session_db_path: str = ".cache/sessions.sqlite"
+    # 會話鎖分段數（同一會話的回合依序執行，不同會話平行處理）
+    session_lock_stripes: int = 256
+    # 採購歷史查詢：只取推薦所需欄位，依購買日期取最近的記錄
+    purchase_history_fields: str = (
+        "product_name,category,supplier,quantity,unit_price,purchase_date,department"
+    )
+    # 未啟用歷史檢索時查詢的筆數（最近的記錄）
+    purchase_history_limit: int = 50
+    # 非同步流程在解析出產品類別前預取的筆數（取回後再於本地依類別篩選）
+    purchase_history_prefetch_limit: int = 500
+    # 採購歷史檢索：每次只送與需求最相關的前 k 筆，並以各鏈的 token 預算限制長度
+    history_retrieval_enabled: bool = True
+    history_top_k: int = 10
+    # 啟用檢索時查詢的採購歷史筆數（SAP 單頁上限 1000）：BM25 在整段範圍內排序後
+    # 才取前 history_top_k 筆，較舊但相關的記錄也會被考慮。整段範圍只用於排序，
+    # 會話中只保留排序後的前 history_top_k 筆
+    history_retrieval_window: int = 1000
+    history_token_budgets: Dict[str, int] = field(
+        default_factory=lambda: {
+            "recommend": 1200,
+            "adjust": 900,
+            "extract_product_from_recommendation": 600,
+        }
+    )
+    # SAP API 用戶端設定（逾時以秒為單位，未列出的端點使用預設值）
+    sap_timeouts: Dict[str, float] = field(
+        default_factory=lambda: {"purchase_history": 5.0, "purchase_request": 10.0}
+    )
+    sap_default_timeout: float = 10.0
+    sap_max_retries: int = 2
+    sap_retry_backoff_seconds: float = 0.2
+    sap_pool_size: int = 20
+    sap_circuit_failure_threshold: int = 5
+    sap_circuit_reset_seconds: float = 30.0
+    # 各鏈的模型路由：routing_profile 為 "uniform"（全部使用預設設定）或 "tiered"
+    # （分類與擷取鏈改用 fast_model、較小的輸出上限與 temperature 0）；
+    # chain_settings 可再覆寫個別鏈的 model / max_tokens / temperature / timeout / stop
+    routing_profile: str = "uniform"
+    fast_model: str = ""
+    llm_timeout_seconds: Optional[float] = None
+    chain_settings: Dict[str, ChainSettings] = field(default_factory=dict)
+    # 跨會話微批次：在 llm_batch_window_ms 時間窗內收集各會話對下列鏈的並行呼叫，
+    # 以鏈的 batch API 一次送出（相同輸入只呼叫一次），單一請求排隊不超過時間窗
+    llm_batching_enabled: bool = False
+    llm_batch_chains: Tuple[str, ...] = (
+        "intent",
+        "extract_requirement",
+        "smart_order_collection",
+        "extract_product_from_recommendation",
+    )
+    llm_batch_window_ms: float = 10.0
+    llm_batch_max_size: int = 16
+    llm_batch_max_concurrency: int = 8
+    # 對外 LLM 呼叫排程：全域並行上限與每分鐘 token 預算（0 表示不限制），
+    # 名額依優先通道分配（送出 / 確認請購單 > 推薦 > 離題引導）
+    llm_scheduler_enabled: bool = True
+    llm_max_concurrency: int = 16
+    llm_tokens_per_minute: int = 0
+    # 推測性預先計算：推薦送出後在背景擷取確認產品並查詢庫存與供應商，使用者「同意」
+    # 時直接取用（最多等待 speculation_wait_seconds）；改為調整推薦時丟棄
+    speculation_enabled: bool = True
+    speculation_workers: int = 4
+    speculation_max_pending: int = 64
+    speculation_wait_seconds: float = 5.0
+    # token 用量統計：依鏈、會話、部門與對話狀態彙總，每 usage_rollup_seconds 結算一次；
+    # 成本依 llm_pricing（美元 / 每百萬 token：輸入, 輸出）以模型名稱前綴比對計算
+    usage_tracking_enabled: bool = True
+    usage_rollup_seconds: float = 60.0
+    usage_max_rollups: int = 60
+    llm_pricing: Dict[str, Tuple[float, float]] = field(
+        default_factory=lambda: dict(DEFAULT_PRICING)
+    )
+    # 每會話 token 預算（0 表示不限制）：會話累計用量達預算後，之後的回合改走較省的
+    # 路徑——所有鏈改用 budget_model（未設定時為 fast_model）並把輸出上限降到
+    # budget_max_tokens，不串流、不經微批次，也不做推測性預先計算
+    session_token_budget: int = 0
+    budget_model: str = ""
+    budget_max_tokens: int = 384
+    # 快速推薦：需求明確對應到歷史產品（比對分數達門檻）時以本地範本產生推薦，
+    # 不呼叫推薦鏈；使用者直接指名已知產品時連需求解析也略過
+    fast_recommend_enabled: bool = True
+    fast_recommend_min_score: int = 30
+    # 結構化推薦：推薦與調整鏈回傳產品 JSON，顯示文字由本地範本產生，確認時不需再
+    # 呼叫 LLM 擷取產品；代價是推薦內容在 LLM 完成後才一次送出（無法逐字串流）。
+    # 串流回合（chat_stream）預設仍用可逐字送出的文字推薦，首字延遲較短，但使用者
+    # 同意時要再由 LLM 擷取產品（推測性預先計算會在背景先做）；
+    # structured_recommend_when_streaming=True 時串流回合也改用結構化推薦
+    structured_recommend_enabled: bool = True
+    structured_recommend_when_streaming: bool = False
+    # 直接下單：一句話已包含產品、數量、請購人與交貨日期時，直接建立請購單並進入
+    # 確認請購單狀態（產品需以快速推薦相同的計分規則對應到採購歷史）
+    direct_order_enabled: bool = True
+    direct_order_min_score: int = 30
 
     def __post_init__(self):
         # 如果沒有設定 openai_api_key，從環境變量獲取
@@ -50,93 +241,632 @@ class PurchaseAgentConfig:
 class ConversationalPurchaseAgent:
     """對話式請購系統 AI Agent"""
 
-    def __init__(self, config: PurchaseAgentConfig):
+    def __init__(
+        self,
+        config: PurchaseAgentConfig,
+        session_store: Optional[SessionStore] = None,
+        sap_transport: Optional[SAPTransport] = None,
+    ):
         self.config = config
-        self.llm = ChatOpenAI(
-            model_name=config.model,
-            api_key=config.openai_api_key,
-            base_url=config.openai_base_url,
+        self.llm_cache = (
+            LLMResponseCache(
+                db_path=config.llm_cache_path,
+                max_memory_entries=config.llm_cache_max_entries,
+                max_disk_entries=config.llm_cache_disk_max_entries,
+                ttl_seconds=config.llm_cache_ttl_seconds,
+            )
+            if config.llm_cache_enabled
+            else None
+        )
+        # 各鏈的生成設定（預設值 → 路由設定檔 → 個別覆寫）
+        self._default_chain_settings = ChainSettings(
+            model=config.model,
             max_tokens=config.max_tokens,
             temperature=config.temperature,
+            timeout=config.llm_timeout_seconds,
+        )
+        self.chain_settings = resolve_chain_settings(
+            self._default_chain_settings,
+            profile=config.routing_profile,
+            overrides=config.chain_settings,
+            fast_model=config.fast_model,
         )
+        # 超出會話 token 預算後使用的較省設定
+        budget_model = config.budget_model or config.fast_model or None
+        self.budget_chain_settings = {
+            name: ChainSettings(
+                model=budget_model,
+                max_tokens=min(
+                    settings.max_tokens or config.budget_max_tokens,
+                    config.budget_max_tokens,
+                ),
+            ).over(settings)
+            for name, settings in self.chain_settings.items()
+        }
+        self.usage = (
+            UsageTracker(
+                pricing=config.llm_pricing,
+                rollup_seconds=config.usage_rollup_seconds,
+                max_rollups=config.usage_max_rollups,
+                max_sessions=config.session_max_entries,
+            )
+            if config.usage_tracking_enabled
+            else None
+        )
+        self._budget_stats = {"downgraded_turns": 0}
+        self.llm = self._create_llm(self._default_chain_settings)
         self._setup_chains()
-        self._session_states: Dict[str, Dict] = {}  # 儲存會話狀態
-
-    def _setup_chains(self):
-        """設定 LangChain 鏈"""
-        self.intent_chain = (
-            PurchasePrompts.get_intent_classification_prompt()
-            | self.llm
-            | JsonOutputParser()
+        self.llm_scheduler = (
+            LLMScheduler(
+                max_concurrency=config.llm_max_concurrency,
+                tokens_per_minute=config.llm_tokens_per_minute,
+            )
+            if config.llm_scheduler_enabled
+            else None
+        )
+        self._batchers = (
+            {name: self._create_batcher(name) for name in config.llm_batch_chains}
+            if config.llm_batching_enabled
+            else {}
+        )
+        self._speculation = (
+            SpeculativeExecutor(
+                max_workers=config.speculation_workers,
+                max_pending=config.speculation_max_pending,
+            )
+            if config.speculation_enabled
+            else None
         )
-        self.analyze_chain = (
-            PurchasePrompts.get_analyze_request_prompt() | self.llm | StrOutputParser()
+        self.history_retriever = HistoryRetriever()
+        self.product_matcher = ProductMatcher()
+        # 儲存會話狀態（可由外部注入其他後端）
+        # 空的會話儲存 len() 為 0，不能以 or 判斷是否有注入
+        if session_store is None:
+            session_store = create_session_store(
+                backend=config.session_backend,
+                max_sessions=config.session_max_entries,
+                idle_ttl_seconds=config.session_idle_ttl_seconds,
+                db_path=config.session_db_path,
+            )
+        self.session_store = session_store
+        self._session_locks = SessionLocks(config.session_lock_stripes)
+        self._inflight_turns = SingleFlight()
+        self.intent_rules = IntentRuleEngine(
+            max_residual_chars=config.intent_rule_max_residual_chars,
+            max_residual_cjk_chars=config.intent_rule_max_residual_cjk_chars,
+        )
+        # 各項統計計數器由多個回合並行更新，共用一把鎖
+        self._stats_lock = threading.Lock()
+        self._intent_stats = {"turns": 0, "rule_resolved": 0}
+        self._recommend_stats = {
+            path: {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            for path in ("fast", "llm")
+        }
+        self._confirmation_stats = {"structured": 0, "llm_extracted": 0}
+        self.order_parser = OrderDetailsParser()
+        self._order_detail_stats = {
+            "turns": 0,
+            "llm_calls": 0,
+            "rule_fields": {key: 0 for key in ORDER_FIELDS},
+            "llm_fields": {key: 0 for key in ORDER_FIELDS},
+        }
+        self._direct_order_stats = {"orders": 0, "llm_completed": 0, "total_ms": 0.0}
+        # SAP API 存取（未注入時經由 HTTP 呼叫 config.api_base_url）
+        self.sap_transport = sap_transport or SAPClient(
+            base_url=config.api_base_url,
+            timeouts=config.sap_timeouts,
+            default_timeout=config.sap_default_timeout,
+            max_retries=config.sap_max_retries,
+            backoff_seconds=config.sap_retry_backoff_seconds,
+            pool_size=config.sap_pool_size,
+            failure_threshold=config.sap_circuit_failure_threshold,
+            reset_timeout=config.sap_circuit_reset_seconds,
+        )
+        # /metrics 抓取時才計算的量測值（加總同一行程中所有仍存在的 Agent）
+        ACTIVE_SESSIONS.track(self, lambda agent: len(agent.session_store))
+        if self.llm_scheduler is not None:
+            LLM_IN_FLIGHT.track(
+                self, lambda agent: agent.llm_scheduler.stats()["in_flight"]
+            )
+            LLM_QUEUE_DEPTH.track(
+                self, lambda agent: agent.llm_scheduler.stats()["queue_depth"]
+            )
+
+    # 各鏈的提示模板與輸出解析器
+    _CHAIN_SPECS = {
+        "intent": (
+            PurchasePrompts.get_intent_classification_prompt,
+            JsonOutputParser,
+        ),
+        "analyze": (PurchasePrompts.get_analyze_request_prompt, StrOutputParser),
+        "recommend": (PurchasePrompts.get_recommend_product_prompt, StrOutputParser),
+        "adjust": (PurchasePrompts.get_adjustment_prompt, StrOutputParser),
+        "create_order": (PurchasePrompts.get_create_order_prompt, JsonOutputParser),
+        "guidance": (PurchasePrompts.get_guidance_prompt, StrOutputParser),
+        "extract_requirement": (
+            PurchasePrompts.get_extract_requirement_prompt,
+            JsonOutputParser,
+        ),
+        "direct_order": (PurchasePrompts.get_direct_order_prompt, JsonOutputParser),
+        "custom_product": (PurchasePrompts.get_custom_product_prompt, JsonOutputParser),
+        "smart_order_collection": (
+            PurchasePrompts.get_smart_order_collection_prompt,
+            JsonOutputParser,
+        ),
+        "extract_product_from_recommendation": (
+            PurchasePrompts.get_extract_product_from_recommendation_prompt,
+            JsonOutputParser,
+        ),
+        "structured_recommend": (
+            PurchasePrompts.get_structured_recommend_prompt,
+            lambda: JsonOutputParser(pydantic_object=PurchaseRecommendation),
+        ),
+        "structured_adjust": (
+            PurchasePrompts.get_structured_adjustment_prompt,
+            lambda: JsonOutputParser(pydantic_object=PurchaseRecommendation),
+        ),
+    }
+    # 可串流的文字鏈
+    _STREAMING_CHAINS = ("recommend", "adjust", "guidance")
+
+    def _create_llm(self, settings: ChainSettings) -> ChatOpenAI:
+        """依鏈設定建立 LLM 用戶端（所有用戶端共用回應快取）"""
+        return ChatOpenAI(
+            model_name=settings.model,
+            api_key=self.config.openai_api_key,
+            base_url=self.config.openai_base_url,
+            max_tokens=settings.max_tokens,
+            temperature=settings.temperature,
+            timeout=settings.timeout,
+            cache=self.llm_cache,
+            # 串流回應也回傳 token 用量
+            stream_usage=True,
         )
-        self.recommend_chain = (
-            PurchasePrompts.get_recommend_product_prompt()
-            | self.llm
+
+    def _chain_llm(
+        self, chain_name: str, settings: Optional[ChainSettings] = None, **bind_kwargs
+    ):
+        """取得鏈使用的 LLM（設定相同的鏈共用用戶端，停止序列以 bind 套用）"""
+        settings = settings or self.chain_settings[chain_name]
+        client = self._llm_clients.get(settings)
+        if settings.stop:
+            bind_kwargs["stop"] = list(settings.stop)
+        return client.bind(**bind_kwargs) if bind_kwargs else client
+
+    def _setup_chains(self):
+        """設定 LangChain 鏈（預設設定的鏈使用 self.llm）"""
+        self._llm_clients = LLMClientPool(self._create_llm)
+        self._llm_clients.register(self._default_chain_settings, self.llm)
+        for name in CHAIN_NAMES:
+            prompt_factory, parser_factory = self._CHAIN_SPECS[name]
+            setattr(
+                self,
+                f"{name}_chain",
+                prompt_factory() | self._chain_llm(name) | parser_factory(),
+            )
+
+        # 可串流的文字鏈：以串流 API 呼叫 LLM，仍會經過回應快取
+        self._streaming_chains = {
+            name: self._CHAIN_SPECS[name][0]()
+            | self._chain_llm(name, stream=True)
             | StrOutputParser()
+            for name in self._STREAMING_CHAINS
+        }
+
+        # 超出會話 token 預算時使用的鏈（未設定預算時不建立）
+        self._budget_chains = {}
+        if self.config.session_token_budget > 0:
+            for name in CHAIN_NAMES:
+                prompt_factory, parser_factory = self._CHAIN_SPECS[name]
+                self._budget_chains[name] = (
+                    prompt_factory()
+                    | self._chain_llm(name, self.budget_chain_settings[name])
+                    | parser_factory()
+                )
+
+    def _create_batcher(self, chain_name: str) -> MicroBatcher:
+        """建立鏈的微批次分派器（每批以 batch API 送出，個別失敗不影響其他請求）"""
+        if chain_name not in CHAIN_NAMES:
+            raise ValueError(f"未知的鏈名稱: {chain_name}")
+
+        def run_batch(batch_inputs: List[Dict]) -> List:
+            # 每筆輸入各自收集用量，結果以（輸出, 用量收集器）回傳給等待者
+            # batch 最多同時送出 llm_batch_max_concurrency 個請求，依此佔用排程名額
+            collectors = [self._usage_collector() for _ in batch_inputs]
+            calls = min(len(batch_inputs), self.config.llm_batch_max_concurrency)
+            with self._llm_slot(chain_name, *batch_inputs, calls=calls):
+                results = getattr(self, f"{chain_name}_chain").batch(
+                    batch_inputs,
+                    config=[
+                        {
+                            "max_concurrency": self.config.llm_batch_max_concurrency,
+                            **self._callbacks_config(collector),
+                        }
+                        for collector in collectors
+                    ],
+                    return_exceptions=True,
+                )
+            return [
+                result if isinstance(result, BaseException) else (result, collector)
+                for result, collector in zip(results, collectors)
+            ]
+
+        return MicroBatcher(
+            run_batch,
+            window_ms=self.config.llm_batch_window_ms,
+            max_batch_size=self.config.llm_batch_max_size,
         )
-        self.adjust_chain = (
-            PurchasePrompts.get_adjustment_prompt() | self.llm | StrOutputParser()
+
+    def _estimate_llm_tokens(self, chain_name: str, *inputs: Dict) -> int:
+        """粗估呼叫消耗的 token 數（輸入文字加上每次呼叫的輸出上限）"""
+        max_tokens = self.chain_settings[chain_name].max_tokens or 0
+        return sum(
+            estimate_tokens(json.dumps(item, ensure_ascii=False, default=str))
+            + max_tokens
+            for item in inputs
         )
-        self.create_order_chain = (
-            PurchasePrompts.get_create_order_prompt() | self.llm | JsonOutputParser()
+
+    def _llm_slot(
+        self,
+        chain_name: str,
+        *inputs: Dict,
+        lane: Optional[str] = None,
+        calls: int = 1,
+    ):
+        """向排程器取得 LLM 呼叫名額（未啟用排程時不限制）"""
+        if self.llm_scheduler is None:
+            return nullcontext()
+        return self.llm_scheduler.slot(
+            lane or lane_for_chain(chain_name),
+            self._estimate_llm_tokens(chain_name, *inputs),
+            calls,
         )
-        self.guidance_chain = (
-            PurchasePrompts.get_guidance_prompt() | self.llm | StrOutputParser()
+
+    # ---- token 用量與預算 ----
+
+    def _usage_collector(self) -> Optional[UsageCollector]:
+        return UsageCollector() if self.usage is not None else None
+
+    @staticmethod
+    def _callbacks_config(*handlers) -> Dict:
+        """鏈呼叫的 config（只包含有效的回呼）"""
+        handlers = [handler for handler in handlers if handler is not None]
+        return {"callbacks": handlers} if handlers else {}
+
+    def _record_usage(
+        self,
+        chain_name: str,
+        collector: Optional[UsageCollector],
+        settings: Optional[ChainSettings] = None,
+    ):
+        """記錄一次鏈呼叫的用量，歸屬於目前回合的會話、部門與對話狀態"""
+        if collector is None or self.usage is None:
+            return
+        usage = collector.claim()
+        if usage is None:
+            # 微批次中共用同一次呼叫結果的重複請求
+            usage = {
+                "llm_calls": 0,
+                "cached_calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "model": None,
+            }
+        settings = settings or self.chain_settings[chain_name]
+        scope = _usage_scope.get() or {}
+        self.usage.record(
+            chain_name,
+            usage,
+            model=settings.model,
+            session_id=scope.get("session_id"),
+            department=scope.get("department"),
+            state=scope.get("state"),
         )
-        self.extract_requirement_chain = (
-            PurchasePrompts.get_extract_requirement_prompt()
-            | self.llm
-            | JsonOutputParser()
+        LLM_TOKENS.labels(chain_name, "input").inc(usage["input_tokens"])
+        LLM_TOKENS.labels(chain_name, "output").inc(usage["output_tokens"])
+
+    def _begin_usage_scope(self, session_id: str):
+        """設定本回合的用量歸屬，回傳還原用的 token"""
+        state = self._get_session_state(session_id)
+        budget = self.config.session_token_budget
+        over_budget = bool(
+            budget
+            and self.usage is not None
+            and self.usage.session_tokens(session_id) >= budget
         )
-        self.direct_order_chain = (
-            PurchasePrompts.get_direct_order_prompt() | self.llm | JsonOutputParser()
+        if over_budget:
+            self._count(self._budget_stats, "downgraded_turns")
+        return _usage_scope.set(
+            {
+                "session_id": session_id,
+                "department": state.get("user_context", {}).get("department"),
+                "state": _state_label(state.get("conversation_state")),
+                "over_budget": over_budget,
+            }
         )
-        self.custom_product_chain = (
-            PurchasePrompts.get_custom_product_prompt() | self.llm | JsonOutputParser()
+
+    @staticmethod
+    def _over_budget() -> bool:
+        """目前回合的會話是否已超出 token 預算"""
+        scope = _usage_scope.get()
+        return bool(scope and scope["over_budget"])
+
+    def _select_chain(self, chain_name: str):
+        """取得本回合使用的鏈與設定（超出預算時改用較省的鏈）"""
+        if self._budget_chains and self._over_budget():
+            return (
+                self._budget_chains[chain_name],
+                self.budget_chain_settings[chain_name],
+            )
+        return getattr(self, f"{chain_name}_chain"), self.chain_settings[chain_name]
+
+    def _invoke_chain(self, chain_name: str, inputs: Dict, lane: Optional[str] = None):
+        """呼叫指定名稱的 LangChain 鏈（啟用微批次的鏈經由批次分派器）
+
+        lane 可覆寫排程的優先通道（例如推測性預先計算使用最低優先的 speculative）。
+        """
+        started = time.perf_counter()
+        try:
+            batcher = self._batchers.get(chain_name)
+            if batcher is not None and lane is None and not self._over_budget():
+                with span(f"llm.{chain_name}", batched=True):
+                    result, collector = batcher.invoke(inputs)
+                self._record_usage(chain_name, collector)
+                return result
+            chain, settings = self._select_chain(chain_name)
+            collector = self._usage_collector()
+            with span(f"llm.{chain_name}"):
+                with self._llm_slot(chain_name, inputs, lane=lane):
+                    try:
+                        return chain.invoke(
+                            inputs, config=self._callbacks_config(collector)
+                        )
+                    finally:
+                        self._record_usage(chain_name, collector, settings)
+        except Exception as e:
+            LLM_ERRORS.labels(chain_name, type(e).__name__).inc()
+            raise
+        finally:
+            CHAIN_LATENCY.labels(chain_name).observe(time.perf_counter() - started)
+
+    def _generate_text(self, chain_name: str, inputs: Dict, prefix: str = "") -> str:
+        """呼叫文字鏈；串流模式下先送出 prefix，再逐字送出 LLM 產生的內容"""
+        sink = _stream_sink.get()
+        if (
+            sink is None
+            or chain_name not in self._streaming_chains
+            or self._over_budget()
+        ):
+            return self._invoke_chain(chain_name, inputs)
+
+        if prefix:
+            sink(prefix)
+
+        streamed: List[str] = []
+
+        def forward(token: str):
+            streamed.append(token)
+            sink(token)
+
+        started = time.perf_counter()
+        collector = self._usage_collector()
+        try:
+            with span(f"llm.{chain_name}", streaming=True):
+                with self._llm_slot(chain_name, inputs):
+                    try:
+                        text = self._streaming_chains[chain_name].invoke(
+                            inputs,
+                            config=self._callbacks_config(
+                                _TokenSinkHandler(forward), collector
+                            ),
+                        )
+                    finally:
+                        self._record_usage(chain_name, collector)
+        except Exception as e:
+            LLM_ERRORS.labels(chain_name, type(e).__name__).inc()
+            raise
+        finally:
+            CHAIN_LATENCY.labels(chain_name).observe(time.perf_counter() - started)
+
+        # 快取命中或模型不支援串流時沒有 token 回呼，直接補送剩餘內容
+        emitted = "".join(streamed)
+        if text.startswith(emitted) and len(text) > len(emitted):
+            sink(text[len(emitted) :])
+        return text
+
+    def _generate_recommendation(
+        self,
+        chain_name: str,
+        inputs: Dict,
+        purchase_history: List[Dict],
+        prefix: str = "",
+    ) -> Tuple[str, Optional[Dict]]:
+        """產生推薦（或調整後推薦），回傳（顯示文字, 推薦產品）
+
+        啟用結構化推薦時由 LLM 回傳產品 JSON 並以本地範本產生文字；結構化輸出無法
+        解析或串流回合不使用結構化推薦時改用自由文字推薦，此時推薦產品為 None
+        （確認時再由 LLM 擷取）。
+        """
+        if self._structured_recommend_active():
+            try:
+                recommendation = self._validate_recommendation(
+                    self._invoke_chain(f"structured_{chain_name}", inputs)
+                )
+                return self._structured_result(
+                    chain_name, recommendation, purchase_history
+                )
+            except Exception as e:
+                logger.warning(f"結構化推薦解析失敗，改用文字推薦: {e}")
+                LLM_RETRIES.labels(f"structured_{chain_name}").inc()
+        return self._generate_text(chain_name, inputs, prefix=prefix), None
+
+    def _structured_recommend_active(self) -> bool:
+        """本回合是否使用結構化推薦（串流回合依設定改用可逐字送出的文字推薦）"""
+        if not self.config.structured_recommend_enabled:
+            return False
+        return (
+            _stream_sink.get() is None
+            or self.config.structured_recommend_when_streaming
         )
-        self.smart_order_collection_chain = (
-            PurchasePrompts.get_smart_order_collection_prompt()
-            | self.llm
-            | JsonOutputParser()
+
+    @staticmethod
+    def _validate_recommendation(data: Dict) -> Dict:
+        """以 PurchaseRecommendation 驗證結構化推薦，補上總金額"""
+        recommendation = PurchaseRecommendation.model_validate(data).model_dump()
+        if not recommendation["total_amount"]:
+            recommendation["total_amount"] = (
+                recommendation["quantity"] * recommendation["unit_price"]
+            )
+        return recommendation
+
+    def _structured_result(
+        self, chain_name: str, recommendation: Dict, purchase_history: List[Dict]
+    ) -> Tuple[str, Dict]:
+        """結構化推薦的顯示文字與推薦產品（優先對應到採購歷史中的同一產品）"""
+        name = recommendation["product_name"].lower()
+        supplier = recommendation["supplier"].lower()
+        product = next(
+            (
+                item
+                for item in purchase_history
+                if (item.get("product_name") or "").lower() == name
+                and (item.get("supplier") or "").lower() == supplier
+            ),
+            None,
         )
-        self.extract_product_from_recommendation_chain = (
-            PurchasePrompts.get_extract_product_from_recommendation_prompt()
-            | self.llm
-            | JsonOutputParser()
+        if product is None:
+            product = {
+                "product_name": recommendation["product_name"],
+                "category": recommendation["category"],
+                "unit_price": recommendation["unit_price"],
+                "supplier": recommendation["supplier"],
+                "source": "recommendation",
+            }
+        text = self._render_recommendation(
+            recommendation, adjusted=chain_name == "adjust"
         )
+        return text, product
+
+    @staticmethod
+    def _render_recommendation(recommendation: Dict, adjusted: bool = False) -> str:
+        """以本地範本產生推薦文字（格式與推薦、調整鏈的文字輸出相同）"""
+        reasons = [
+            line.strip().lstrip("-•*").strip()
+            for line in (recommendation.get("reason") or "").splitlines()
+        ]
+        lines = [
+            f"🎯 **{'調整後推薦產品' if adjusted else '推薦產品'}**："
+            f"{recommendation['product_name']}",
+            f"💰 **建議價格**：NT$ {recommendation['unit_price']:,} (基於歷史價格分析)",
+            f"🏢 **推薦供應商**：{recommendation['supplier']}",
+        ]
+        quantity = recommendation.get("quantity") or 0
+        if quantity > 1 and recommendation.get("total_amount"):
+            lines.append(
+                f"📦 **建議數量**：{quantity}，總金額 NT$ "
+                f"{recommendation['total_amount']:,}"
+            )
+        lines.append(f"📊 **{'調整理由' if adjusted else '推薦理由'}**：")
+        lines.extend(f"- {reason}" for reason in reasons if reason)
+        if recommendation.get("alternatives"):
+            lines.append(
+                f"🔀 **替代方案**：{'、'.join(recommendation['alternatives'])}"
+            )
+        return "\n".join(lines)
+
+    def _new_session_state(self) -> Dict:
+        """建立新會話的初始狀態"""
+        return {
+            "conversation_state": ConversationState.INITIAL,
+            "user_request": "",
+            "purchase_history": [],
+            "current_recommendation": None,
+            "recommended_product": None,
+            "confirmed_order": None,
+            "chat_history": [],
+            "user_context": {
+                "requester": self.config.default_requester,
+                "department": self.config.default_department,
+            },
+        }
 
     def _get_session_state(self, session_id: str) -> Dict:
-        """獲取會話狀態"""
-        if session_id not in self._session_states:
-            self._session_states[session_id] = {
-                "conversation_state": ConversationState.INITIAL,
-                "user_request": "",
-                "purchase_history": [],
-                "current_recommendation": None,
-                "confirmed_order": None,
-                "chat_history": [],
-                "user_context": {
-                    "requester": self.config.default_requester,
-                    "department": self.config.default_department,
-                },
-            }
-        return self._session_states[session_id]
+        """獲取會話狀態（不存在時建立新會話，僅供對話流程使用）
+
+        回合進行中取得的是該回合的工作副本。
+        """
+        buffered = self._buffered_state(session_id)
+        if buffered is not None:
+            return buffered
+        state = self.session_store.get(session_id)
+        if state is None:
+            state = self._new_session_state()
+            self.session_store.put(session_id, state)
+        return state
 
     def _update_session_state(self, session_id: str, updates: Dict):
-        """更新會話狀態"""
-        state = self._get_session_state(session_id)
-        state.update(updates)
-        self._session_states[session_id] = state
+        """更新會話狀態（回合進行中只更新工作副本）"""
+        with span("state.update"):
+            state = self._get_session_state(session_id)
+            new_state = updates.get("conversation_state")
+            if new_state is not None and new_state != state.get("conversation_state"):
+                STATE_TRANSITIONS.labels(
+                    _state_label(state.get("conversation_state")),
+                    _state_label(new_state),
+                ).inc()
+            state.update(updates)
+            if self._buffered_state(session_id) is None:
+                self.session_store.put(session_id, state)
 
     def _add_to_chat_history(self, session_id: str, role: str, content: str):
-        """添加到對話歷史"""
+        """添加到對話歷史（回合進行中只更新工作副本）"""
         state = self._get_session_state(session_id)
         state["chat_history"].append({"role": role, "content": content})
         if len(state["chat_history"]) > 20:  # 保持最近20條對話
             state["chat_history"] = state["chat_history"][-20:]
+        if self._buffered_state(session_id) is None:
+            self.session_store.put(session_id, state)
+
+    @staticmethod
+    def _buffered_state(session_id: str) -> Optional[Dict]:
+        """目前回合的會話狀態工作副本（不在該會話的回合中時為 None）"""
+        buffered = _turn_state.get()
+        if buffered is None or buffered[0] != session_id:
+            return None
+        return buffered[1]
+
+    def _begin_state_buffer(self, session_id: str, stored: Optional[Dict]) -> Token:
+        """開始回合：以會話儲存讀出的狀態建立工作副本（對話歷史另外複製，因為會原地附加）"""
+        if stored is None:
+            state = self._new_session_state()
+        else:
+            state = {**stored, "chat_history": list(stored.get("chat_history") or [])}
+        return _turn_state.set((session_id, state))
+
+    @staticmethod
+    def _end_state_buffer(token: Token) -> Tuple[str, Dict]:
+        """結束回合：還原工作副本，回傳（會話 ID, 要寫回的狀態）"""
+        session_id, state = _turn_state.get()
+        _turn_state.reset(token)
+        return session_id, state
+
+    def _commit_state_buffer(self, token: Token):
+        """結束回合：把工作副本一次寫回會話儲存"""
+        session_id, state = self._end_state_buffer(token)
+        with span("state.commit"):
+            self.session_store.put(session_id, state)
+
+    async def _acommit_state_buffer(self, token: Token):
+        """結束回合：把工作副本一次寫回會話儲存（非同步版本）"""
+        session_id, state = self._end_state_buffer(token)
+        with span("state.commit"):
+            await self._astore_call(self.session_store.put, session_id, state)
+
+    async def _astore_call(self, fn: Callable, *args):
+        """呼叫會話儲存；會阻塞的後端（例如 SQLite）交由執行緒池執行，不佔用事件迴圈"""
+        if self.session_store.blocking_io:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
 
     def _classify_intent(self, user_input: str, session_id: str) -> Dict:
         """分類使用者意圖"""
@@ -150,12 +880,13 @@ class ConversationalPurchaseAgent:
                 ]
             )
 
-            intent_result = self.intent_chain.invoke(
+            intent_result = self._invoke_chain(
+                "intent",
                 {
                     "current_state": state["conversation_state"],
                     "user_input": user_input,
                     "chat_history": chat_history_str,
-                }
+                },
             )
 
             return intent_result
@@ -168,18 +899,78 @@ class ConversationalPurchaseAgent:
                 "guidance_message": "抱歉，我無法理解您的需求。請告訴我您想要採購什麼產品？",
             }
 
-    def _fetch_purchase_history(self, product_type: str = None) -> List[Dict]:
+    def _resolve_intent(self, user_input: str, session_id: str) -> Dict:
+        """判斷使用者意圖 - 規則可明確判斷時略過 LLM 意圖分類"""
+        started = time.perf_counter()
+        try:
+            with span("intent") as attributes:
+                intent = self._rule_intent(user_input, session_id)
+                if attributes is not None:
+                    attributes["source"] = "rules" if intent else "llm"
+                return intent or self._classify_intent(user_input, session_id)
+        finally:
+            STAGE_LATENCY.labels("intent").observe(time.perf_counter() - started)
+
+    def _count(self, stats: Dict, key: str, amount: float = 1):
+        """在統計鎖內累加計數器"""
+        with self._stats_lock:
+            stats[key] += amount
+
+    def _rule_intent(self, user_input: str, session_id: str) -> Optional[Dict]:
+        """以關鍵字規則判斷意圖，無法明確判斷時回傳 None"""
+        self._count(self._intent_stats, "turns")
+
+        if not self.config.intent_rules_enabled:
+            return None
+
+        current_state = self._get_session_state(session_id)["conversation_state"]
+        intent = self.intent_rules.classify(current_state, user_input)
+        if not intent:
+            return None
+
+        self._count(self._intent_stats, "rule_resolved")
+        return {
+            "intent": intent,
+            "next_state": current_state,
+            "is_purchase_related": True,
+            "guidance_message": "",
+            "is_product_change": False,
+            "source": "rules",
+        }
+
+    def _history_limit(self) -> int:
+        """每次取用的採購歷史筆數（啟用檢索時取較大範圍，排序後才限制筆數）"""
+        if self.config.history_retrieval_enabled:
+            return self.config.history_retrieval_window
+        return self.config.purchase_history_limit
+
+    def _history_query_params(
+        self, product_type: str = None, limit: int = None
+    ) -> Dict:
+        """採購歷史查詢參數（欄位投影、最近日期優先、不計算總筆數）"""
+        params = {
+            "fields": self.config.purchase_history_fields,
+            "sort": "-purchase_date",
+            "limit": limit or self._history_limit(),
+            "include_total": "false",
+        }
+        if product_type:
+            params["category"] = product_type
+        return params
+
+    def _history_catalog(self, product_type: str = None) -> Tuple:
+        """採購歷史的來源（SAP 查詢條件），作為檢索索引的快取鍵"""
+        return tuple(sorted(self._history_query_params(product_type).items()))
+
+    def _fetch_purchase_history(
+        self, product_type: str = None, limit: int = None
+    ) -> List[Dict]:
         """獲取採購歷史資料"""
+        started = time.perf_counter()
         try:
-            params = {}
-            if product_type:
-                params["category"] = product_type
+            params = self._history_query_params(product_type, limit)
 
-            response = requests.get(
-                f"{self.config.api_base_url}/api/purchase-history",
-                params=params,
-                timeout=10,
-            )
+            response = self.sap_transport.get_purchase_history(params)
 
             if response.status_code == 200:
                 data = response.json()
@@ -190,11 +981,21 @@ class ConversationalPurchaseAgent:
         except requests.RequestException as e:
             logger.error(f"獲取採購歷史失敗: {e}")
             return []
+        finally:
+            STAGE_LATENCY.labels("purchase_history").observe(
+                time.perf_counter() - started
+            )
 
     def _find_matching_product(
         self, requirement: Dict, purchase_history: List[Dict]
     ) -> Optional[Dict]:
         """從採購歷史中找到符合需求的產品"""
+        return self._best_matching_product(requirement, purchase_history)[0]
+
+    def _best_matching_product(
+        self, requirement: Dict, purchase_history: List[Dict]
+    ) -> Tuple[Optional[Dict], int]:
+        """從採購歷史中找到符合需求的產品，並回傳其比對分數"""
         try:
             product_name = requirement.get("product_name", "") or ""
             product_type = requirement.get("product_type", "") or ""
@@ -241,162 +1042,757 @@ class ConversationalPurchaseAgent:
                     best_match = product
                     best_score = score
 
-            return best_match
+            return best_match, best_score
 
         except Exception as e:
             logger.error(f"尋找符合產品失敗: {e}")
+            return None, 0
+
+    def _local_requirement(self, user_input: str) -> Optional[Dict]:
+        """使用者直接指名目錄中的已知產品（且未提及預算）時，於本地產生需求資訊"""
+        if _BUDGET_PATTERN.search(user_input):
+            return None
+        mentioned = self.product_matcher.mentioned_products(user_input)
+        if not mentioned:
+            return None
+        product = mentioned[0]
+        return {
+            "product_name": product.get("product_name", ""),
+            "product_type": product.get("category", ""),
+            "budget": None,
+        }
+
+    def _fast_recommendation(
+        self,
+        requirement: Dict,
+        purchase_history: List[Dict],
+        quantity: Optional[int] = None,
+    ) -> Optional[Tuple[Dict, str]]:
+        """比對分數達門檻時，回傳（推薦產品, 以本地範本產生的推薦內容）"""
+        if not self.config.fast_recommend_enabled or not purchase_history:
             return None
+        product, score = self._best_matching_product(requirement, purchase_history)
+        if product is None or score < self.config.fast_recommend_min_score:
+            return None
+        return product, self._render_history_recommendation(
+            product, purchase_history, requirement, quantity
+        )
+
+    @classmethod
+    def _render_history_recommendation(
+        cls,
+        product: Dict,
+        purchase_history: List[Dict],
+        requirement: Dict,
+        quantity: Optional[int] = None,
+    ) -> str:
+        """依同一產品的採購歷史統計產生推薦內容（格式與推薦鏈的輸出相同）
+
+        需求中提到數量（例如「兩台」）時一併列出建議數量與總金額。
+        """
+        name = product.get("product_name", "")
+        supplier = product.get("supplier", "")
+        records = [
+            item
+            for item in purchase_history
+            if item.get("product_name") == name and item.get("supplier") == supplier
+        ] or [product]
+        prices = [item.get("unit_price") or 0 for item in records]
+        unit_price = product.get("unit_price") or 0
+        purchased = sum(item.get("quantity") or 0 for item in records)
+        last_date = max((item.get("purchase_date") or "" for item in records))
+        departments = "、".join(
+            dict.fromkeys(
+                item["department"] for item in records if item.get("department")
+            )
+        )
+
+        reasons = [
+            f"過去已採購 {len(records)} 次"
+            + (f"，累計 {purchased} 件" if purchased else "")
+            + (f"，最近一次為 {last_date}" if last_date else ""),
+            f"歷史單價介於 NT$ {min(prices):,} ～ NT$ {max(prices):,}，"
+            f"平均 NT$ {round(sum(prices) / len(prices)):,}",
+        ]
+        budget = requirement.get("budget") or 0
+        if budget and unit_price <= budget:
+            reasons.append(f"單價在您的預算 NT$ {budget:,} 以內")
+        if departments:
+            reasons.append(f"曾採購部門：{departments}")
+        reasons.append(f"{supplier} 為既有合作供應商，規格與交期已經驗證")
+
+        return cls._render_recommendation(
+            {
+                "product_name": name,
+                "unit_price": unit_price,
+                "supplier": supplier,
+                "quantity": quantity,
+                "total_amount": unit_price * (quantity or 0),
+                "reason": "\n".join(reasons),
+            }
+        )
+
+    def _local_requirement_enabled(self) -> bool:
+        """快速推薦或直接下單啟用時，先嘗試於本地解析需求（必要時先建立產品目錄）"""
+        return self.config.fast_recommend_enabled or self.config.direct_order_enabled
+
+    def _direct_order_candidate(
+        self, user_input: str, requirement: Dict, purchase_history: List[Dict]
+    ) -> Optional[Tuple[Dict, OrderDetailsParse]]:
+        """判斷是否可直接下單，回傳（對應的歷史產品, 請購欄位解析結果）
+
+        規則至少要擷取到兩個請購欄位（看起來是一句話下單），且產品比對分數達門檻。
+        """
+        if not self.config.direct_order_enabled or not purchase_history:
+            return None
+        parsed = self.order_parser.parse(user_input)
+        if len(parsed.fields) < 2:
+            return None
+        product, score = self._best_matching_product(requirement, purchase_history)
+        if product is None or score < self.config.direct_order_min_score:
+            return None
+        return product, parsed
+
+    def _direct_order_inputs(
+        self, user_input: str, product: Dict, session_id: str
+    ) -> Dict:
+        """直接下單鏈的輸入（只有規則擷取不到請購欄位時才呼叫）
+
+        不提供預設請購人，避免 LLM 以「系統使用者」之類的預設值填入請購人。
+        """
+        state = self._get_session_state(session_id)
+        user_info = {"department": state["user_context"]["department"]}
+        return {
+            "requirement": user_input,
+            "matching_product": json.dumps(product, ensure_ascii=False),
+            "user_info": json.dumps(user_info, ensure_ascii=False),
+            "today": date.today().isoformat(),
+        }
+
+    def _complete_direct_order(
+        self,
+        user_input: str,
+        session_id: str,
+        requirement: Dict,
+        purchase_history: List[Dict],
+        product: Dict,
+        parsed: OrderDetailsParse,
+        order_fields: Optional[Dict],
+        started: float,
+        catalog: Optional[Tuple] = None,
+    ) -> str:
+        """以規則擷取的欄位（不足時由直接下單鏈補齊）建立請購單並進入確認狀態
+
+        仍缺少必要欄位（例如沒有提到請購人）時記下已取得的欄位，改為詢問缺少的欄位。
+        """
+        collected_info = dict(parsed.fields)
+        if order_fields:
+            if isinstance(order_fields.get("purchase_order"), dict):
+                order_fields = order_fields["purchase_order"]
+            for key in parsed.missing():
+                value = order_fields.get(key)
+                if key == "expected_delivery_date" and value is not None:
+                    value = self.order_parser.normalize_date(str(value))
+                if key == "requester" and value == self.config.default_requester:
+                    value = None
+                if value:
+                    collected_info[key] = value
+
+        session_updates = {
+            "user_request": user_input,
+            "purchase_history": self._session_history(
+                purchase_history, user_input, requirement, catalog
+            ),
+            "requirement": requirement,
+            "recommended_product": product,
+            "selected_product": product,
+            "has_matching_history": True,
+        }
+        if any(collected_info.get(key) is None for key in ORDER_FIELDS):
+            collected_info = {key: collected_info.get(key) for key in ORDER_FIELDS}
+            self._update_session_state(
+                session_id,
+                {
+                    **session_updates,
+                    "conversation_state": ConversationState.WAITING_ORDER_DETAILS,
+                    "collected_order_info": collected_info,
+                },
+            )
+            return (
+                f"✅ 產品確認：{product.get('product_name', '未指定產品')}\n\n"
+                f"{self._order_details_question(collected_info)}"
+            )
+
+        state = self._get_session_state(session_id)
+        order_data = {
+            "product_name": product.get("product_name", "未指定產品"),
+            "category": product.get("category", "其他"),
+            "quantity": collected_info["quantity"],
+            "unit_price": product.get("unit_price", 0),
+            "requester": collected_info["requester"],
+            "department": state["user_context"]["department"],
+            "reason": "工作需求",
+            "urgent": False,
+            "expected_delivery_date": collected_info["expected_delivery_date"],
+        }
+        self._update_session_state(
+            session_id,
+            {
+                **session_updates,
+                "conversation_state": ConversationState.CONFIRMING_ORDER,
+                "collected_order_info": collected_info,
+                "confirmed_order": order_data,
+            },
+        )
+
+        stats = self._direct_order_stats
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            stats["orders"] += 1
+            stats["llm_completed"] += 1 if order_fields else 0
+            stats["total_ms"] += elapsed_ms
+
+        order_display = self._format_order_display(order_data)
+        return f"⚡ 已依您的描述直接建立請購單\n\n{order_display}\n\n請確認請購單資訊是否正確？\n- 輸入「確認提交」來提交請購單\n- 輸入「修改」來調整請購單\n- 輸入「取消」來取消請購"
+
+    def _record_recommend_path(self, path: str, started: float):
+        """記錄新請購需求走快速或 LLM 推薦路徑的次數與延遲"""
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = self._recommend_stats[path]
+        with self._stats_lock:
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
 
     def _handle_new_request(self, user_input: str, session_id: str) -> str:
         """處理新的請購需求"""
+        started = time.perf_counter()
         try:
-            # 1. 解析需求資訊
-            requirement = self.extract_requirement_chain.invoke(
-                {"user_request": user_input}
-            )
+            # 1. 解析需求資訊（指名已知產品時於本地解析）
+            requirement = None
+            if self._local_requirement_enabled():
+                if not len(self.product_matcher):
+                    self.product_matcher.add_products(
+                        self._fetch_purchase_history(
+                            limit=self.config.purchase_history_prefetch_limit
+                        )
+                    )
+                requirement = self._local_requirement(user_input)
+            if requirement is None:
+                requirement = self._invoke_chain(
+                    "extract_requirement", {"user_request": user_input}
+                )
 
             # 2. 根據需求類型決定是否查詢產品歷史
             product_type = requirement.get("product_type", "")
 
             # 3. 獲取採購歷史
             purchase_history = self._fetch_purchase_history(product_type)
-            print(f"獲取到的採購歷史資料: {len(purchase_history)} 筆")
-
-            # 4. 格式化採購歷史資料供 LLM 分析
-            history_text = self._format_purchase_history(purchase_history)
+            catalog = self._history_catalog(product_type)
+            logger.info(f"獲取到的採購歷史資料: {len(purchase_history)} 筆")
 
-            # 5. 讓 LLM 分析採購歷史並提供智能推薦
-            recommendation = self.recommend_chain.invoke(
-                {"user_request": user_input, "purchase_history": history_text}
+            # 4. 一句話已包含完整請購資訊時直接建立請購單
+            candidate = self._direct_order_candidate(
+                user_input, requirement, purchase_history
             )
+            if candidate is not None:
+                product, parsed = candidate
+                order_fields = None
+                if parsed.missing():
+                    try:
+                        order_fields = self._invoke_chain(
+                            "direct_order",
+                            self._direct_order_inputs(user_input, product, session_id),
+                        )
+                    except Exception as e:
+                        logger.warning(f"直接下單鏈調用失敗，改為詢問缺少的欄位: {e}")
+                return self._complete_direct_order(
+                    user_input,
+                    session_id,
+                    requirement,
+                    purchase_history,
+                    product,
+                    parsed,
+                    order_fields,
+                    started,
+                    catalog=catalog,
+                )
 
-            # 6. 檢查是否能從推薦中解析出特定產品資訊
-            selected_product = None
-            if purchase_history:
-                # 嘗試從 LLM 推薦中找出對應的歷史產品
-                selected_product = self._extract_product_from_recommendation(
-                    recommendation, purchase_history
+            # 5. 需求明確對應到歷史產品時直接以範本推薦
+            header = self._recommendation_header(purchase_history)
+            fast = self._fast_recommendation(
+                requirement, purchase_history, self._requested_quantity(user_input)
+            )
+            if fast is not None:
+                selected_product, recommendation = fast
+                response = self._complete_new_request(
+                    user_input,
+                    session_id,
+                    requirement,
+                    purchase_history,
+                    recommendation,
+                    header,
+                    recommended_product=selected_product,
+                    catalog=catalog,
                 )
+                self._record_recommend_path("fast", started)
+                return response
+
+            # 6. 挑選最相關的採購歷史供 LLM 分析
+            history_text = self._history_prompt(
+                "recommend",
+                purchase_history,
+                self._requirement_query(user_input, requirement),
+                requirement,
+                catalog=catalog,
+            )
 
-            # 7. 更新會話狀態
-            self._update_session_state(
-                session_id,
-                {
-                    "conversation_state": ConversationState.WAITING_CONFIRMATION,
-                    "user_request": user_input,
-                    "purchase_history": purchase_history,
-                    "current_recommendation": recommendation,
-                    "selected_product": selected_product,
-                    "requirement": requirement,
-                    "has_matching_history": bool(selected_product),
-                },
+            # 7. 讓 LLM 分析採購歷史並提供智能推薦
+            recommendation, recommended_product = self._generate_recommendation(
+                "recommend",
+                {"user_request": user_input, "purchase_history": history_text},
+                purchase_history,
+                prefix=header,
             )
 
-            # 8. 根據是否有採購歷史提供不同的回應格式
-            if purchase_history:
-                return f"📋 需求分析完成\n\n🎯 智能推薦 (基於採購歷史分析)\n\n{recommendation}\n\n請確認是否同意此推薦？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來調整推薦"
-            else:
-                return f"📋 需求分析完成\n\n🎯 推薦產品\n\n{recommendation}\n\n請確認是否同意此推薦？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來調整推薦"
+            response = self._complete_new_request(
+                user_input,
+                session_id,
+                requirement,
+                purchase_history,
+                recommendation,
+                header,
+                recommended_product=recommended_product,
+                catalog=catalog,
+            )
+            self._record_recommend_path("llm", started)
+            return response
 
         except Exception as e:
             logger.error(f"處理新請求失敗: {e}")
             return f"抱歉，處理您的請求時發生錯誤：{str(e)}\n請重新描述您的採購需求。"
 
+    def _complete_new_request(
+        self,
+        user_input: str,
+        session_id: str,
+        requirement: Dict,
+        purchase_history: List[Dict],
+        recommendation: str,
+        header: str,
+        recommended_product: Optional[Dict] = None,
+        catalog: Optional[Tuple] = None,
+    ) -> str:
+        """完成新請購需求的推薦：解析推薦產品、更新會話狀態並組合回應"""
+        # 8. 檢查是否能從推薦中解析出特定產品資訊（結構化或快速推薦已指定產品）
+        selected_product = recommended_product
+        if selected_product is None and purchase_history:
+            # 嘗試從 LLM 推薦中找出對應的歷史產品
+            selected_product = self._extract_product_from_recommendation(
+                recommendation, purchase_history
+            )
+
+        # 9. 更新會話狀態（需求中已提到的數量先記入請購單資訊，之後不必再問）
+        quantity = self._requested_quantity(user_input)
+        self._update_session_state(
+            session_id,
+            {
+                "conversation_state": ConversationState.WAITING_CONFIRMATION,
+                "user_request": user_input,
+                "purchase_history": self._session_history(
+                    purchase_history, user_input, requirement, catalog
+                ),
+                "current_recommendation": recommendation,
+                "recommended_product": recommended_product,
+                "selected_product": selected_product,
+                "requirement": requirement,
+                "has_matching_history": bool(selected_product),
+                "collected_order_info": (
+                    {
+                        "quantity": quantity,
+                        "requester": None,
+                        "expected_delivery_date": None,
+                    }
+                    if quantity
+                    else None
+                ),
+            },
+        )
+
+        self._start_confirmation_speculation(session_id)
+
+        # 10. 根據是否有採購歷史提供不同的回應格式
+        return f"{header}{recommendation}\n\n請確認是否同意此推薦？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來調整推薦"
+
+    def _requested_quantity(self, user_input: str) -> Optional[int]:
+        """需求中提到的數量（例如「兩台」、「2 台」），沒有提到時為 None"""
+        return self.order_parser.parse(user_input).fields.get("quantity")
+
+    @staticmethod
+    def _recommendation_header(purchase_history: List[Dict]) -> str:
+        """推薦回應的標題（依是否有採購歷史而不同）"""
+        if purchase_history:
+            return "📋 需求分析完成\n\n🎯 智能推薦 (基於採購歷史分析)\n\n"
+        return "📋 需求分析完成\n\n🎯 推薦產品\n\n"
+
+    @staticmethod
+    def _filter_history_by_category(
+        purchase_history: List[Dict], product_type: str
+    ) -> List[Dict]:
+        """依產品類別篩選採購歷史（與 SAP API 的 category 篩選規則相同）"""
+        if not product_type:
+            return purchase_history
+        product_type = product_type.lower()
+        return [
+            item
+            for item in purchase_history
+            if product_type in (item.get("category", "") or "").lower()
+        ]
+
+    _ADJUSTMENT_PROMPT = "我理解您想要調整推薦。請告訴我您的具體需求：\n\n1. 如果您想要歷史記錄中的特定產品，請說明產品名稱\n2. 如果您想要全新的產品，請提供：\n   - 產品名稱\n   - 預期價格\n\n請詳細描述您的需求。"
+    _CONFIRMATION_PROMPT = "請明確回答是否同意此推薦？\n- 輸入「同意」或「確認」來接受推薦\n- 輸入「不同意」或「調整」來修改推薦"
+
     def _handle_confirmation(self, user_input: str, session_id: str) -> str:
         """處理確認推薦"""
-        user_input_lower = user_input.lower().strip()
+        intent = self._confirmation_intent(user_input)
 
-        # 判斷使用者是否確認
-        if any(
-            keyword in user_input_lower
-            for keyword in ["同意", "確認", "好", "可以", "沒問題", "ok"]
-        ):
-            # 用戶確認了產品推薦，現在使用 LLM 智能提取確切的產品資訊
+        if intent == "confirm_recommendation":
+            # 用戶確認了產品推薦：優先取用推薦送出後預先計算的結果
             state = self._get_session_state(session_id)
-            current_recommendation = state.get("current_recommendation", "")
+            prepared = self._take_speculative_confirmation(session_id, state)
+            if prepared is None:
+                prepared = self._prepare_confirmation(state)
+            return self._confirm_recommendation(session_id, state, prepared)
+        elif intent == "request_adjustment":
+            if self._enter_adjustment(user_input, session_id):
+                return self._handle_adjustment(user_input, session_id)
+            return self._ADJUSTMENT_PROMPT
+        else:
+            return self._CONFIRMATION_PROMPT
+
+    def _confirmation_intent(self, user_input: str) -> Optional[str]:
+        """判斷使用者是否同意推薦
+
+        以最長比對判斷（「不同意」不會被誤判為「同意」）；否定、問句或多重意圖等
+        規則無法明確判斷的回覆改用本回合 LLM 判斷的意圖，仍無法判斷時回傳 None。
+        """
+        return (
+            self.intent_rules.classify(
+                ConversationState.WAITING_CONFIRMATION, user_input
+            )
+            or _turn_intent.get()
+        )
+
+    def _confirm_recommendation(
+        self, session_id: str, state: Dict, prepared: Dict
+    ) -> str:
+        """記錄確認的產品並進入收集請購資訊狀態，回傳詢問請購資訊的訊息"""
+        self._count(self._confirmation_stats, prepared["source"])
+
+        # 更新會話狀態
+        self._update_session_state(
+            session_id,
+            {
+                "selected_product": prepared["product"],
+                "conversation_state": ConversationState.WAITING_ORDER_DETAILS,
+            },
+        )
+
+        availability = self._render_availability(prepared["availability"])
+        quantity = (state.get("collected_order_info") or {}).get("quantity")
+        quantity_prompt = (
+            f"已依您的需求記錄為 {quantity}（如需更改請一併告知）"
+            if quantity
+            else "您需要多少台/個？"
+        )
+        return f"✅ 產品確認：{prepared['product_name']}\n\n{availability}現在請提供以下資訊以完成請購單：\n\n1. **數量**：{quantity_prompt}\n2. **請購人姓名**：請購人的完整姓名\n3. **預期交貨日期**：希望什麼時候交貨？（格式：YYYY-MM-DD）\n\n請一次提供所有資訊，例如：\n「數量：2台，請購人：張三，交貨日期：{self._example_delivery_date()}」"
+
+    def _enter_adjustment(self, user_input: str, session_id: str) -> bool:
+        """進入調整狀態，回傳回覆是否已附上調整需求（例如「不同意，預算降到3萬以內」）"""
+        # 預先計算的確認結果不再需要
+        if self._speculation is not None:
+            self._speculation.discard(session_id)
+        self._update_session_state(
+            session_id, {"conversation_state": ConversationState.ADJUSTING}
+        )
+        residual = self.intent_rules.match(
+            ConversationState.WAITING_CONFIRMATION, user_input
+        ).residual
+        return len(residual) > self.intent_rules.max_residual_chars
+
+    def _start_confirmation_speculation(self, session_id: str):
+        """推薦送出後，在背景預先計算使用者「同意」時需要的產品與供應資訊"""
+        if self._speculation is None or self._over_budget():
+            return
+        state = self._get_session_state(session_id)
+        snapshot = {
+            key: state.get(key)
+            for key in (
+                "current_recommendation",
+                "recommended_product",
+                "purchase_history",
+                "requirement",
+            )
+        }
+        scope = _usage_scope.get()
 
+        def prepare():
+            # 推測工作的用量仍歸屬於觸發它的會話
+            token = _usage_scope.set(scope)
             try:
-                purchase_history = state.get("purchase_history", [])
-                history_text = self._format_purchase_history(purchase_history)
+                return self._prepare_confirmation(snapshot, lane="speculative")
+            finally:
+                _usage_scope.reset(token)
 
-                # 使用 LLM 智能提取推薦中的具體產品資訊
-                product_extraction_result = (
-                    self.extract_product_from_recommendation_chain.invoke(
-                        {
-                            "recommendation": current_recommendation,
-                            "purchase_history": history_text,
-                        }
-                    )
-                )
+        self._speculation.start(session_id, prepare)
 
-                logger.info(f"產品提取結果: {product_extraction_result}")
+    def _take_speculative_confirmation(
+        self, session_id: str, state: Dict
+    ) -> Optional[Dict]:
+        """取出預先計算的確認結果（推薦內容已改變時視為未命中）"""
+        if self._speculation is None:
+            return None
+        recommendation = state.get("current_recommendation")
+        return self._speculation.take(
+            session_id,
+            timeout=self.config.speculation_wait_seconds,
+            accept=lambda prepared: prepared["recommendation"] == recommendation,
+        )
 
-                # 從提取結果中獲取產品名稱和完整資訊
-                if (
-                    product_extraction_result
-                    and "recommended_product" in product_extraction_result
-                ):
-                    recommended_product = product_extraction_result[
-                        "recommended_product"
-                    ]
-                    product_name = recommended_product.get("product_name", "推薦產品")
-
-                    # 確保產品資訊完整
-                    if "category" not in recommended_product:
-                        recommended_product["category"] = "電腦設備"
-                    if "supplier" not in recommended_product:
-                        recommended_product["supplier"] = "未指定供應商"
-
-                    # 更新 selected_product 以便後續使用
-                    self._update_session_state(
-                        session_id, {"selected_product": recommended_product}
-                    )
-                else:
-                    # 如果 LLM 提取失敗，使用通用名稱
-                    product_name = "推薦產品"
-                    recommended_product = {
-                        "product_name": product_name,
-                        "category": "電腦設備",
-                        "unit_price": 0,
-                        "supplier": "未指定供應商",
-                    }
-                    self._update_session_state(
-                        session_id, {"selected_product": recommended_product}
-                    )
+    async def _atake_speculative_confirmation(
+        self, session_id: str, state: Dict
+    ) -> Optional[Dict]:
+        """取出預先計算的確認結果（非同步版本）"""
+        if self._speculation is None:
+            return None
+        recommendation = state.get("current_recommendation")
+        return await self._speculation.atake(
+            session_id,
+            timeout=self.config.speculation_wait_seconds,
+            accept=lambda prepared: prepared["recommendation"] == recommendation,
+        )
 
-            except Exception as e:
-                logger.error(f"LLM 產品提取失敗: {e}")
-                # 如果完全失敗，使用通用名稱
-                product_name = "推薦產品"
-                recommended_product = {
-                    "product_name": product_name,
-                    "category": "電腦設備",
-                    "unit_price": 0,
-                    "supplier": "未指定供應商",
-                }
-                self._update_session_state(
-                    session_id, {"selected_product": recommended_product}
-                )
+    def _prepare_confirmation(self, state: Dict, lane: Optional[str] = None) -> Dict:
+        """計算確認推薦所需的資訊：確認的產品、庫存與供應商
 
-            # 更新會話狀態
-            self._update_session_state(
-                session_id,
-                {"conversation_state": ConversationState.WAITING_ORDER_DETAILS},
+        結構化或快速推薦已有確切的產品資訊，不需呼叫 LLM；文字推薦時以 LLM 擷取。
+        不修改會話狀態，可在背景執行緒中執行。
+        """
+        recommended_product = state.get("recommended_product")
+        if recommended_product:
+            product_name = recommended_product.get("product_name", "推薦產品")
+            product, source = recommended_product, "structured"
+        else:
+            product_name, product = self._llm_confirmed_product(state, lane=lane)
+            source = "llm_extracted"
+
+        return {
+            "recommendation": state.get("current_recommendation"),
+            "product_name": product_name,
+            "product": product,
+            "source": source,
+            "availability": self._product_availability(product),
+        }
+
+    async def _aprepare_confirmation(self, state: Dict) -> Dict:
+        """計算確認推薦所需的資訊（非同步版本）"""
+        recommended_product = state.get("recommended_product")
+        if recommended_product:
+            product_name = recommended_product.get("product_name", "推薦產品")
+            product, source = recommended_product, "structured"
+        else:
+            product_name, product = await self._allm_confirmed_product(state)
+            source = "llm_extracted"
+
+        return {
+            "recommendation": state.get("current_recommendation"),
+            "product_name": product_name,
+            "product": product,
+            "source": source,
+            "availability": await self._aproduct_availability(product),
+        }
+
+    def _llm_confirmed_product(
+        self, state: Dict, lane: Optional[str] = None
+    ) -> Tuple[str, Dict]:
+        """以 LLM 從文字推薦中擷取確認的產品，回傳（產品名稱, 產品資訊）"""
+        try:
+            # 使用 LLM 智能提取推薦中的具體產品資訊
+            product_extraction_result = self._invoke_chain(
+                "extract_product_from_recommendation",
+                self._product_extraction_inputs(state),
+                lane=lane,
             )
+        except Exception as e:
+            logger.error(f"LLM 產品提取失敗: {e}")
+            product_extraction_result = None
+        return self._extracted_product(product_extraction_result)
 
-            return f"✅ 產品確認：{product_name}\n\n現在請提供以下資訊以完成請購單：\n\n1. **數量**：您需要多少台/個？\n2. **請購人姓名**：請購人的完整姓名\n3. **預期交貨日期**：希望什麼時候交貨？（格式：YYYY-MM-DD）\n\n請一次提供所有資訊，例如：\n「數量：2台，請購人：張三，交貨日期：2025-07-15」"
-
-        elif any(
-            keyword in user_input_lower
-            for keyword in ["不同意", "不要", "不行", "調整", "修改", "改"]
+    async def _allm_confirmed_product(self, state: Dict) -> Tuple[str, Dict]:
+        """以 LLM 從文字推薦中擷取確認的產品（非同步版本）"""
+        try:
+            product_extraction_result = await self._ainvoke_chain(
+                "extract_product_from_recommendation",
+                self._product_extraction_inputs(state),
+            )
+        except Exception as e:
+            logger.error(f"LLM 產品提取失敗: {e}")
+            product_extraction_result = None
+        return self._extracted_product(product_extraction_result)
+
+    def _product_extraction_inputs(self, state: Dict) -> Dict:
+        """產品擷取鏈的輸入（推薦內容與最相關的採購歷史）"""
+        current_recommendation = state.get("current_recommendation", "")
+        history_text = self._history_prompt(
+            "extract_product_from_recommendation",
+            state.get("purchase_history", []),
+            current_recommendation,
+            state.get("requirement"),
+        )
+        return {
+            "recommendation": current_recommendation,
+            "purchase_history": history_text,
+        }
+
+    @staticmethod
+    def _extracted_product(
+        product_extraction_result: Optional[Dict],
+    ) -> Tuple[str, Dict]:
+        """從產品擷取結果取得（產品名稱, 產品資訊）；擷取失敗時使用通用產品"""
+        logger.info(f"產品提取結果: {product_extraction_result}")
+
+        # 從提取結果中獲取產品名稱和完整資訊
+        if isinstance(product_extraction_result, dict) and isinstance(
+            product_extraction_result.get("recommended_product"), dict
         ):
-            # 進入調整狀態
-            self._update_session_state(
-                session_id, {"conversation_state": ConversationState.ADJUSTING}
+            recommended_product = product_extraction_result["recommended_product"]
+
+            # 確保產品資訊完整
+            if "category" not in recommended_product:
+                recommended_product["category"] = "電腦設備"
+            if "supplier" not in recommended_product:
+                recommended_product["supplier"] = "未指定供應商"
+            return (
+                recommended_product.get("product_name", "推薦產品"),
+                recommended_product,
             )
-            return "我理解您想要調整推薦。請告訴我您的具體需求：\n\n1. 如果您想要歷史記錄中的特定產品，請說明產品名稱\n2. 如果您想要全新的產品，請提供：\n   - 產品名稱\n   - 預期價格\n\n請詳細描述您的需求。"
-        else:
-            return "請明確回答是否同意此推薦？\n- 輸入「同意」或「確認」來接受推薦\n- 輸入「不同意」或「調整」來修改推薦"
+
+        # 如果 LLM 提取失敗，使用通用名稱
+        return "推薦產品", {
+            "product_name": "推薦產品",
+            "category": "電腦設備",
+            "unit_price": 0,
+            "supplier": "未指定供應商",
+        }
+
+    def _product_availability(self, product: Optional[Dict]) -> Dict:
+        """查詢產品的庫存與供應商資訊（查詢失敗時該項為 None）"""
+        availability = {"inventory": None, "supplier": None}
+        if not product:
+            return availability
+
+        try:
+            availability["inventory"] = self._matching_inventory(
+                product,
+                self.sap_transport.get_inventory(self._inventory_params(product)),
+            )
+        except Exception as e:
+            logger.warning(f"查詢庫存失敗: {e}")
+
+        try:
+            availability["supplier"] = self._matching_supplier(
+                product, self.sap_transport.get_suppliers()
+            )
+        except Exception as e:
+            logger.warning(f"查詢供應商失敗: {e}")
+        return availability
+
+    async def _aproduct_availability(self, product: Optional[Dict]) -> Dict:
+        """查詢產品的庫存與供應商資訊（非同步版本，兩項查詢同時送出）"""
+        availability = {"inventory": None, "supplier": None}
+        if not product:
+            return availability
+
+        inventory, suppliers = await asyncio.gather(
+            self.sap_transport.aget_inventory(self._inventory_params(product)),
+            self.sap_transport.aget_suppliers(),
+            return_exceptions=True,
+        )
+        try:
+            if isinstance(inventory, BaseException):
+                raise inventory
+            availability["inventory"] = self._matching_inventory(product, inventory)
+        except Exception as e:
+            logger.warning(f"查詢庫存失敗: {e}")
+
+        try:
+            if isinstance(suppliers, BaseException):
+                raise suppliers
+            availability["supplier"] = self._matching_supplier(product, suppliers)
+        except Exception as e:
+            logger.warning(f"查詢供應商失敗: {e}")
+        return availability
+
+    @staticmethod
+    def _inventory_params(product: Dict) -> Dict:
+        return {"category": product.get("category") or ""}
+
+    @staticmethod
+    def _matching_inventory(product: Dict, response) -> Optional[Dict]:
+        """庫存查詢結果中與產品同名的項目"""
+        if response.status_code != 200:
+            return None
+        product_name = (product.get("product_name") or "").lower()
+        return next(
+            (
+                item
+                for item in response.json().get("data", [])
+                if (item.get("product_name") or "").lower() == product_name
+            ),
+            None,
+        )
+
+    @staticmethod
+    def _matching_supplier(product: Dict, response) -> Optional[Dict]:
+        """供應商查詢結果中與產品供應商相同的項目"""
+        supplier_name = product.get("supplier")
+        if not supplier_name or response.status_code != 200:
+            return None
+        return next(
+            (
+                supplier
+                for supplier in response.json().get("data", [])
+                if supplier.get("supplier_name") == supplier_name
+            ),
+            None,
+        )
+
+    @staticmethod
+    def _render_availability(availability: Dict) -> str:
+        """確認訊息中的庫存與供應商資訊"""
+        lines = []
+        inventory = availability.get("inventory")
+        if inventory:
+            lines.append(
+                f"📦 **目前庫存**：可用 {inventory.get('available_stock', 0)} 件"
+                f"（{inventory.get('location', '未指定倉庫')}）"
+            )
+        supplier = availability.get("supplier")
+        if supplier:
+            contact = " ".join(
+                value
+                for value in (
+                    supplier.get("contact_person"),
+                    supplier.get("contact_phone"),
+                )
+                if value
+            )
+            lines.append(
+                f"🚚 **供應商**：{supplier.get('supplier_name')}，"
+                f"交期 {supplier.get('delivery_time', '未提供')}"
+                + (f"，聯絡人 {contact}" if contact else "")
+            )
+        return "\n".join(lines) + "\n\n" if lines else ""
 
     def _handle_adjustment(self, user_input: str, session_id: str) -> str:
         """處理調整推薦"""
@@ -404,53 +1800,82 @@ class ConversationalPurchaseAgent:
             state = self._get_session_state(session_id)
             purchase_history = state.get("purchase_history", [])
 
-            # 格式化採購歷史資料供 LLM 分析
-            history_text = self._format_purchase_history(purchase_history)
-
-            # 讓 LLM 基於用戶的調整需求和採購歷史進行智能調整
-            adjusted_recommendation = self.adjust_chain.invoke(
-                {
-                    "current_recommendation": state["current_recommendation"],
-                    "adjustment_request": user_input,
-                    "purchase_history": history_text,
-                }
+            # 挑選與調整需求最相關的採購歷史供 LLM 分析
+            history_text = self._adjustment_history_prompt(
+                user_input, state, purchase_history
             )
 
-            # 檢查是否能從調整後的推薦中解析出特定產品資訊
-            selected_product = None
-            if purchase_history:
-                # 嘗試從 LLM 調整後的推薦中找出對應的歷史產品
-                selected_product = self._extract_product_from_recommendation(
-                    adjusted_recommendation, purchase_history
+            # 讓 LLM 基於用戶的調整需求和採購歷史進行智能調整
+            header = "🔄 推薦已調整 (基於採購歷史智能分析)\n\n"
+            adjusted_recommendation, recommended_product = (
+                self._generate_recommendation(
+                    "adjust",
+                    {
+                        "current_recommendation": state["current_recommendation"],
+                        "adjustment_request": user_input,
+                        "purchase_history": history_text,
+                    },
+                    purchase_history,
+                    prefix=header,
                 )
+            )
 
-            # 更新狀態
-            self._update_session_state(
+            return self._complete_adjustment(
                 session_id,
-                {
-                    "conversation_state": ConversationState.WAITING_CONFIRMATION,
-                    "current_recommendation": adjusted_recommendation,
-                    "selected_product": selected_product,
-                },
+                purchase_history,
+                adjusted_recommendation,
+                header,
+                recommended_product=recommended_product,
             )
 
-            return f"🔄 推薦已調整 (基於採購歷史智能分析)\n\n{adjusted_recommendation}\n\n請確認是否同意此調整後的推薦？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來進一步調整"
-
         except Exception as e:
             logger.error(f"調整推薦失敗: {e}")
             return f"抱歉，調整推薦時發生錯誤：{str(e)}\n請重新描述您的調整需求。"
 
+    def _complete_adjustment(
+        self,
+        session_id: str,
+        purchase_history: List[Dict],
+        adjusted_recommendation: str,
+        header: str,
+        recommended_product: Optional[Dict] = None,
+    ) -> str:
+        """完成推薦調整：解析調整後的產品、更新會話狀態並組合回應"""
+        # 檢查是否能從調整後的推薦中解析出特定產品資訊（結構化推薦已指定產品）
+        selected_product = recommended_product
+        if selected_product is None and purchase_history:
+            # 嘗試從 LLM 調整後的推薦中找出對應的歷史產品
+            selected_product = self._extract_product_from_recommendation(
+                adjusted_recommendation, purchase_history
+            )
+
+        # 更新狀態
+        self._update_session_state(
+            session_id,
+            {
+                "conversation_state": ConversationState.WAITING_CONFIRMATION,
+                "current_recommendation": adjusted_recommendation,
+                "recommended_product": recommended_product,
+                "selected_product": selected_product,
+            },
+        )
+        self._start_confirmation_speculation(session_id)
+
+        return f"{header}{adjusted_recommendation}\n\n請確認是否同意此調整後的推薦？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來進一步調整"
+
     def _create_and_show_order(self, session_id: str) -> str:
         """創建並顯示請購單"""
         try:
             state = self._get_session_state(session_id)
 
             # 創建請購單
-            order_data = self.create_order_chain.invoke(
+            order_data = self._invoke_chain(
+                "create_order",
                 {
                     "recommendation": state["current_recommendation"],
                     "user_info": json.dumps(state["user_context"], ensure_ascii=False),
-                }
+                    "today": date.today().isoformat(),
+                },
             )
 
             # 處理可能的嵌套結構
@@ -460,13 +1885,14 @@ class ConversationalPurchaseAgent:
                 else:
                     order_data = order_data["purchase_order"]
 
-            # 確保日期格式正確
-            if "expected_delivery_date" in order_data:
-                delivery_date = order_data["expected_delivery_date"]
-                if delivery_date.startswith("2023"):
-                    order_data["expected_delivery_date"] = delivery_date.replace(
-                        "2023", "2025"
+            # 確保日期格式正確（早於今天的日期順延到下一個相同月日）
+            if order_data.get("expected_delivery_date"):
+                order_data["expected_delivery_date"] = (
+                    self.order_parser.normalize_date(
+                        str(order_data["expected_delivery_date"])
                     )
+                    or order_data["expected_delivery_date"]
+                )
 
             # 更新狀態
             self._update_session_state(
@@ -486,22 +1912,28 @@ class ConversationalPurchaseAgent:
             logger.error(f"創建請購單失敗: {e}")
             return f"抱歉，創建請購單時發生錯誤：{str(e)}\n請重新確認推薦。"
 
+    # 請購單確認階段：LLM 判斷的意圖對應的處理分支
+    _ORDER_CONFIRMATION_INTENTS = {
+        "submit_order": "submit_order",
+        "confirm_order": "submit_order",
+        "modify_order": "modify_order",
+        "request_adjustment": "modify_order",
+        "cancel_order": "cancel_order",
+    }
+
     def _handle_order_confirmation(self, user_input: str, session_id: str) -> str:
         """處理請購單確認"""
-        user_input_lower = user_input.lower().strip()
+        intent = self._order_confirmation_intent(user_input)
 
-        if any(
-            keyword in user_input_lower
-            for keyword in ["確認提交", "提交", "確認", "送出"]
-        ):
+        if intent == "submit_order":
             return self._submit_order(session_id)
-        elif any(keyword in user_input_lower for keyword in ["修改", "調整", "更改"]):
+        elif intent == "modify_order":
             self._update_session_state(
                 session_id,
                 {"conversation_state": ConversationState.WAITING_CONFIRMATION},
             )
             return "請告訴我您要修改請購單的哪個部分？我會重新為您調整推薦。"
-        elif any(keyword in user_input_lower for keyword in ["取消", "不要", "放棄"]):
+        elif intent == "cancel_order":
             self._update_session_state(
                 session_id,
                 {
@@ -514,39 +1946,57 @@ class ConversationalPurchaseAgent:
         else:
             return "請明確回答：\n- 輸入「確認提交」來提交請購單\n- 輸入「修改」來調整請購單\n- 輸入「取消」來取消請購"
 
-    def _submit_order(self, session_id: str) -> str:
-        """提交請購單"""
+    def _order_confirmation_intent(self, user_input: str) -> Optional[str]:
+        """判斷使用者對請購單的回覆
+
+        規則能明確判斷時直接採用；否定、問句或多重意圖等規則無法判斷的回覆改用本回合
+        LLM 判斷的意圖，兩者都無法判斷時回傳 None，再次詢問而不會提交請購單。
+        """
+        intent = self.intent_rules.classify(
+            ConversationState.CONFIRMING_ORDER, user_input
+        )
+        if intent is None:
+            intent = self._ORDER_CONFIRMATION_INTENTS.get(_turn_intent.get())
+        return intent
+
+    def _submit_order(self, session_id: str) -> str:
+        """提交請購單"""
         try:
             state = self._get_session_state(session_id)
             order_data = state["confirmed_order"]
 
             # 呼叫請購單 API
-            response = requests.post(
-                f"{self.config.api_base_url}/api/purchase-request",
-                json=order_data,
-                headers={"Content-Type": "application/json"},
-                timeout=10,
+            response = self.sap_transport.create_purchase_request(order_data)
+
+            return self._complete_submit(session_id, order_data, response)
+
+        except requests.RequestException as e:
+            logger.error(f"提交請購單失敗: {e}")
+            return (
+                f"❌ 請購單提交失敗\n\n網路錯誤：{str(e)}\n請檢查網路連線或稍後重試。"
             )
 
-            if response.status_code == 201:
-                api_response = response.json()
-                request_id = api_response.get("request_id")
+    def _complete_submit(self, session_id: str, order_data: Dict, response) -> str:
+        """處理請購單 API 回應（requests 與 httpx 的回應物件皆可）"""
+        if response.status_code == 201:
+            api_response = response.json()
+            request_id = api_response.get("request_id")
 
-                # 更新狀態
-                self._update_session_state(
-                    session_id,
-                    {
-                        "conversation_state": ConversationState.COMPLETED,
-                        "api_response": api_response,
-                    },
-                )
+            # 更新狀態
+            self._update_session_state(
+                session_id,
+                {
+                    "conversation_state": ConversationState.COMPLETED,
+                    "api_response": api_response,
+                },
+            )
 
-                # 計算總金額
-                total_amount = order_data.get("unit_price", 0) * order_data.get(
-                    "quantity", 0
-                )
+            # 計算總金額
+            total_amount = order_data.get("unit_price", 0) * order_data.get(
+                "quantity", 0
+            )
 
-                success_msg = f"""✅ 請購單提交成功！
+            success_msg = f"""✅ 請購單提交成功！
                 
                 📄 請購單詳情：
                 - 請購單號：{request_id}
@@ -559,37 +2009,126 @@ class ConversationalPurchaseAgent:
 
                 如果您還有其他採購需求，請隨時告訴我。"""
 
-                return success_msg
-            else:
-                logger.error(f"API 提交失敗: {response.status_code}")
-                return f"❌ 請購單提交失敗\n\nAPI 錯誤：{response.status_code}\n請稍後重試或聯絡系統管理員。"
-
-        except requests.RequestException as e:
-            logger.error(f"提交請購單失敗: {e}")
-            return (
-                f"❌ 請購單提交失敗\n\n網路錯誤：{str(e)}\n請檢查網路連線或稍後重試。"
-            )
+            return success_msg
+        else:
+            logger.error(f"API 提交失敗: {response.status_code}")
+            return f"❌ 請購單提交失敗\n\nAPI 錯誤：{response.status_code}\n請稍後重試或聯絡系統管理員。"
 
     def _handle_off_topic(self, user_input: str, session_id: str) -> str:
         """處理偏離主題的對話"""
         try:
             state = self._get_session_state(session_id)
-            guidance = self.guidance_chain.invoke(
-                {"user_input": user_input, "current_state": state["conversation_state"]}
+            guidance = self._generate_text(
+                "guidance",
+                {
+                    "user_input": user_input,
+                    "current_state": state["conversation_state"],
+                },
             )
             return guidance
         except Exception as e:
             logger.error(f"生成引導訊息失敗: {e}")
             return "我是專門協助您處理採購相關事務的助手。請告訴我您想要採購什麼產品，我會為您提供最合適的推薦。"
 
-    def _format_purchase_history(self, history: List[Dict]) -> str:
-        """格式化採購歷史資料"""
+    @staticmethod
+    def _requirement_query(user_input: str, requirement: Optional[Dict]) -> str:
+        """組合檢索採購歷史用的查詢文字（使用者輸入 + 解析出的產品名稱與類別）"""
+        requirement = requirement or {}
+        return " ".join(
+            str(part)
+            for part in (
+                user_input,
+                requirement.get("product_name"),
+                requirement.get("product_type"),
+            )
+            if part
+        )
+
+    def _adjustment_history_prompt(
+        self, user_input: str, state: Dict, purchase_history: List[Dict]
+    ) -> str:
+        """調整推薦時的採購歷史：以調整需求與原始需求檢索"""
+        return self._history_prompt(
+            "adjust",
+            purchase_history,
+            f"{user_input} {state.get('user_request', '')}",
+            state.get("requirement"),
+        )
+
+    @staticmethod
+    def _requirement_budget(requirement: Optional[Dict]) -> Optional[float]:
+        """取得需求中的預算（無法解析時回傳 None）"""
+        try:
+            return float((requirement or {}).get("budget") or 0) or None
+        except (TypeError, ValueError):
+            return None
+
+    def _history_prompt(
+        self,
+        chain_name: str,
+        history: List[Dict],
+        query: str,
+        requirement: Optional[Dict] = None,
+        catalog: Optional[Tuple] = None,
+    ) -> str:
+        """挑選與需求最相關的採購歷史，並依該鏈的 token 預算格式化為 prompt 內容
+
+        catalog 為採購歷史的來源（見 _history_catalog），同一來源的索引跨回合重用。
+        """
+        if self.config.history_retrieval_enabled:
+            history = self._relevant_history(history, query, requirement, catalog)
+        return self._format_purchase_history(
+            history, token_budget=self.config.history_token_budgets.get(chain_name)
+        )
+
+    def _relevant_history(
+        self,
+        history: List[Dict],
+        query: str,
+        requirement: Optional[Dict] = None,
+        catalog: Optional[Tuple] = None,
+    ) -> List[Dict]:
+        """與需求最相關的前 history_top_k 筆採購歷史"""
+        return self.history_retriever.select(
+            history,
+            query,
+            top_k=self.config.history_top_k,
+            budget=self._requirement_budget(requirement),
+            catalog=catalog,
+        )
+
+    def _session_history(
+        self,
+        history: List[Dict],
+        user_input: str,
+        requirement: Optional[Dict] = None,
+        catalog: Optional[Tuple] = None,
+    ) -> List[Dict]:
+        """存入會話的採購歷史
+
+        啟用檢索時只保留與需求最相關的前 k 筆（即送進推薦鏈的記錄），查詢的整段範圍
+        不寫入會話，避免每次寫回會話儲存與預先計算時複製上千筆記錄。
+        """
+        if not self.config.history_retrieval_enabled:
+            return history
+        return self._relevant_history(
+            history,
+            self._requirement_query(user_input, requirement),
+            requirement,
+            catalog,
+        )
+
+    def _format_purchase_history(
+        self, history: List[Dict], token_budget: Optional[int] = None
+    ) -> str:
+        """格式化採購歷史資料（指定 token 預算時，超出預算的記錄不列出，至少保留一筆）"""
         if not history:
             return "沒有相關的採購歷史資料。"
 
         history_text = ""
+        used_tokens = 0
         for item in history:
-            history_text += f"""
+            item_text = f"""
             產品: {item.get("product_name", "N/A")}
             類別: {item.get("category", "N/A")}
             供應商: {item.get("supplier", "N/A")}
@@ -599,6 +2138,11 @@ class ConversationalPurchaseAgent:
             部門: {item.get("department", "N/A")}
             ---
             """
+            if token_budget is not None:
+                used_tokens += estimate_tokens(item_text)
+                if history_text and used_tokens > token_budget:
+                    break
+            history_text += item_text
         return history_text
 
     def _format_order_display(self, order_data: Dict) -> str:
@@ -616,80 +2160,243 @@ class ConversationalPurchaseAgent:
             是否緊急：{"是" if order_data.get("urgent", False) else "否"}
             預期交貨日期：{order_data.get("expected_delivery_date", "N/A")}"""
 
+    # 對話路由對應的處理方法（同步 / 非同步）
+    _ROUTE_HANDLERS = {
+        "off_topic": "_handle_off_topic",
+        "order_details": "_handle_order_details",
+        "product_change": "_handle_product_change_request",
+        "new_request": "_handle_new_request",
+        "confirmation": "_handle_confirmation",
+        "adjustment": "_handle_adjustment",
+        "order_confirmation": "_handle_order_confirmation",
+    }
+    _ASYNC_ROUTE_HANDLERS = {
+        "off_topic": "_ahandle_off_topic",
+        "order_details": "_ahandle_order_details",
+        "product_change": "_ahandle_product_change_request",
+        "new_request": "_ahandle_new_request",
+        "confirmation": "_ahandle_confirmation",
+        "adjustment": "_ahandle_adjustment",
+        "order_confirmation": "_ahandle_order_confirmation",
+    }
+
+    def _route_turn(
+        self, intent_result: Dict, user_input: str, session_id: str
+    ) -> Optional[str]:
+        """根據意圖和對話狀態決定本回合的處理路由（同步與非同步流程共用）"""
+        if not intent_result.get("is_purchase_related", True):
+            return "off_topic"
+
+        state = self._get_session_state(session_id)
+        current_state = state["conversation_state"]
+
+        # 優先處理資料收集狀態 - 避免意圖分類錯誤干擾
+        if current_state == ConversationState.WAITING_ORDER_DETAILS:
+            # 在資料收集階段，優先檢查是否為產品變更或修改請求
+            user_input_lower = user_input.lower().strip()
+            if any(
+                keyword in user_input_lower
+                for keyword in [
+                    "我要",
+                    "我想要",
+                    "換成",
+                    "改成",
+                    "不要這個",
+                    "重新選擇",
+                ]
+            ):
+                # 用戶想要變更產品，回到初始狀態
+                self._update_session_state(
+                    session_id,
+                    {
+                        "conversation_state": ConversationState.INITIAL,
+                        "current_recommendation": None,
+                        "confirmed_order": None,
+                        "collected_order_info": None,
+                    },
+                )
+                return "new_request"
+            # 正常的資料收集
+            return "order_details"
+        # 檢查是否為產品變更請求
+        elif intent_result.get("is_product_change", False):
+            return "product_change"
+        elif (
+            intent_result.get("intent") == "new_request"
+            or current_state == ConversationState.INITIAL
+        ):
+            return "new_request"
+        elif current_state == ConversationState.WAITING_CONFIRMATION:
+            return "confirmation"
+        elif current_state == ConversationState.ADJUSTING:
+            return "adjustment"
+        elif current_state == ConversationState.CONFIRMING_ORDER:
+            return "order_confirmation"
+        elif current_state == ConversationState.COMPLETED:
+            # 重新開始新的請購流程
+            self._update_session_state(
+                session_id,
+                {
+                    "conversation_state": ConversationState.INITIAL,
+                    "current_recommendation": None,
+                    "confirmed_order": None,
+                },
+            )
+            return "new_request"
+        return None
+
     def chat(self, user_input: str, session_id: str = "default") -> str:
-        """主要的對話處理方法"""
+        """主要的對話處理方法
+
+        同一會話的回合依序執行；相同會話的相同訊息正在處理、且之後沒有其他訊息
+        到達時，直接共用該次結果。
+        """
+        key = (session_id, user_input)
+        future, is_leader = self._inflight_turns.claim(key, group=session_id)
+        if not is_leader:
+            return future.result()
+
+        try:
+            with self._session_locks.hold(session_id):
+                response = self._chat_turn(user_input, session_id)
+        except BaseException as e:
+            self._inflight_turns.resolve(future, error=e)
+            raise
+        self._inflight_turns.resolve(future, result=response)
+        return response
+
+    def _chat_turn(self, user_input: str, session_id: str) -> str:
+        """處理單一對話回合（呼叫端需持有會話鎖）"""
+        started = time.perf_counter()
+        route = "error"
+        state_token = self._begin_state_buffer(
+            session_id, self.session_store.get(session_id)
+        )
+        usage_token = self._begin_usage_scope(session_id)
+        intent_token = _turn_intent.set(None)
+        TURNS_IN_PROGRESS.inc()
         try:
             # 記錄使用者輸入
             self._add_to_chat_history(session_id, "user", user_input)
 
             # 分類使用者意圖
-            intent_result = self._classify_intent(user_input, session_id)
+            intent_result = self._resolve_intent(user_input, session_id)
+            _turn_intent.set(intent_result.get("intent"))
 
             # 根據意圖和狀態處理
-            if not intent_result.get("is_purchase_related", True):
-                response = self._handle_off_topic(user_input, session_id)
+            route = self._route_turn(intent_result, user_input, session_id)
+            handler = self._ROUTE_HANDLERS.get(route)
+            if handler:
+                response = getattr(self, handler)(user_input, session_id)
             else:
-                state = self._get_session_state(session_id)
-                current_state = state["conversation_state"]
-
-                # 優先處理資料收集狀態 - 避免意圖分類錯誤干擾
-                if current_state == ConversationState.WAITING_ORDER_DETAILS:
-                    # 在資料收集階段，優先檢查是否為產品變更或修改請求
-                    user_input_lower = user_input.lower().strip()
-                    if any(
-                        keyword in user_input_lower
-                        for keyword in [
-                            "我要",
-                            "我想要",
-                            "換成",
-                            "改成",
-                            "不要這個",
-                            "重新選擇",
-                        ]
-                    ):
-                        # 用戶想要變更產品，回到初始狀態
-                        self._update_session_state(
-                            session_id,
-                            {
-                                "conversation_state": ConversationState.INITIAL,
-                                "current_recommendation": None,
-                                "confirmed_order": None,
-                                "collected_order_info": None,
-                            },
-                        )
-                        response = self._handle_new_request(user_input, session_id)
-                    else:
-                        # 正常的資料收集
-                        response = self._handle_order_details(user_input, session_id)
-                # 檢查是否為產品變更請求
-                elif intent_result.get("is_product_change", False):
-                    response = self._handle_product_change_request(
-                        user_input, session_id
-                    )
-                elif (
-                    intent_result.get("intent") == "new_request"
-                    or current_state == ConversationState.INITIAL
-                ):
-                    response = self._handle_new_request(user_input, session_id)
-                elif current_state == ConversationState.WAITING_CONFIRMATION:
-                    response = self._handle_confirmation(user_input, session_id)
-                elif current_state == ConversationState.ADJUSTING:
-                    response = self._handle_adjustment(user_input, session_id)
-                elif current_state == ConversationState.CONFIRMING_ORDER:
-                    response = self._handle_order_confirmation(user_input, session_id)
-                elif current_state == ConversationState.COMPLETED:
-                    # 重新開始新的請購流程
-                    self._update_session_state(
-                        session_id,
-                        {
-                            "conversation_state": ConversationState.INITIAL,
-                            "current_recommendation": None,
-                            "confirmed_order": None,
-                        },
-                    )
-                    response = self._handle_new_request(user_input, session_id)
-                else:
-                    response = "請告訴我您想要採購什麼產品？"
+                response = "請告訴我您想要採購什麼產品？"
+
+            # 記錄系統回應
+            self._add_to_chat_history(session_id, "assistant", response)
+
+            return response
+
+        except Exception as e:
+            logger.error(f"對話處理失敗: {e}")
+            return (
+                f"抱歉，處理您的訊息時發生錯誤：{str(e)}\n請重新輸入或聯絡系統管理員。"
+            )
+        finally:
+            self._commit_state_buffer(state_token)
+            _usage_scope.reset(usage_token)
+            _turn_intent.reset(intent_token)
+            TURNS_IN_PROGRESS.dec()
+            TURN_LATENCY.labels(route or "none").observe(time.perf_counter() - started)
+
+    def chat_stream(
+        self, user_input: str, session_id: str = "default"
+    ) -> Iterator[str]:
+        """串流版本的對話處理方法
+
+        逐段產生回應文字（推薦、調整與引導訊息會逐字送出），所有片段串接後即為
+        chat() 的完整回應。回合中的狀態變更只寫入工作副本，由 chat() 在回合結束時
+        一次寫回會話儲存；呼叫端中途停止讀取（例如 SSE 連線中斷）時，本回合仍在
+        背景處理完畢並寫回，其他讀取者不會看到處理到一半的狀態。
+        """
+        chunks: "queue.Queue" = queue.Queue()
+        finished = object()
+        result: Dict[str, str] = {}
+
+        def run():
+            _stream_sink.set(chunks.put)
+            try:
+                result["response"] = self.chat(user_input, session_id)
+            finally:
+                chunks.put(finished)
+
+        # 在處理執行緒中沿用呼叫端的 context（例如目前請求的 trace）
+        context = copy_context()
+        threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+        streamed: List[str] = []
+        while True:
+            chunk = chunks.get()
+            if chunk is finished:
+                break
+            streamed.append(chunk)
+            yield chunk
+
+        # 送出未經串流的剩餘內容（例如固定的確認提示或錯誤訊息）
+        response = result.get("response", "")
+        emitted = "".join(streamed)
+        if response.startswith(emitted):
+            remainder = response[len(emitted) :]
+        else:
+            remainder = f"\n\n{response}" if emitted else response
+        if remainder:
+            yield remainder
+
+    async def achat(self, user_input: str, session_id: str = "default") -> str:
+        """非同步版本的對話處理方法
+
+        LLM 呼叫使用 ainvoke、SAP API 使用非同步 HTTP 用戶端，等待期間不佔用執行緒；
+        會阻塞的會話儲存（例如 SQLite）讀寫交由執行緒池執行。
+        與 chat() 共用會話鎖與重複請求合併。
+        """
+        key = (session_id, user_input)
+        future, is_leader = self._inflight_turns.claim(key, group=session_id)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            async with self._session_locks.ahold(session_id):
+                response = await self._achat_turn(user_input, session_id)
+        except BaseException as e:
+            self._inflight_turns.resolve(future, error=e)
+            raise
+        self._inflight_turns.resolve(future, result=response)
+        return response
+
+    async def _achat_turn(self, user_input: str, session_id: str) -> str:
+        """非同步處理單一對話回合（呼叫端需持有會話鎖）"""
+        started = time.perf_counter()
+        route = "error"
+        state_token = self._begin_state_buffer(
+            session_id, await self._astore_call(self.session_store.get, session_id)
+        )
+        usage_token = self._begin_usage_scope(session_id)
+        intent_token = _turn_intent.set(None)
+        TURNS_IN_PROGRESS.inc()
+        try:
+            # 記錄使用者輸入
+            self._add_to_chat_history(session_id, "user", user_input)
+
+            # 分類使用者意圖
+            intent_result = await self._aresolve_intent(user_input, session_id)
+            _turn_intent.set(intent_result.get("intent"))
+
+            # 根據意圖和狀態處理
+            route = self._route_turn(intent_result, user_input, session_id)
+            handler = self._ASYNC_ROUTE_HANDLERS.get(route)
+            if handler:
+                response = await getattr(self, handler)(user_input, session_id)
+            else:
+                response = "請告訴我您想要採購什麼產品？"
 
             # 記錄系統回應
             self._add_to_chat_history(session_id, "assistant", response)
@@ -701,22 +2408,546 @@ class ConversationalPurchaseAgent:
             return (
                 f"抱歉，處理您的訊息時發生錯誤：{str(e)}\n請重新輸入或聯絡系統管理員。"
             )
+        finally:
+            await self._acommit_state_buffer(state_token)
+            _usage_scope.reset(usage_token)
+            _turn_intent.reset(intent_token)
+            TURNS_IN_PROGRESS.dec()
+            TURN_LATENCY.labels(route or "none").observe(time.perf_counter() - started)
+
+    async def _ainvoke_chain(self, chain_name: str, inputs: Dict):
+        """非同步呼叫指定名稱的 LangChain 鏈（啟用微批次的鏈經由批次分派器）"""
+        started = time.perf_counter()
+        try:
+            batcher = self._batchers.get(chain_name)
+            if batcher is not None and not self._over_budget():
+                with span(f"llm.{chain_name}", batched=True):
+                    result, collector = await batcher.ainvoke(inputs)
+                self._record_usage(chain_name, collector)
+                return result
+            chain, settings = self._select_chain(chain_name)
+            collector = self._usage_collector()
+            config = self._callbacks_config(collector)
+            with span(f"llm.{chain_name}"):
+                try:
+                    if self.llm_scheduler is None:
+                        return await chain.ainvoke(inputs, config=config)
+                    async with self.llm_scheduler.aslot(
+                        lane_for_chain(chain_name),
+                        self._estimate_llm_tokens(chain_name, inputs),
+                    ):
+                        return await chain.ainvoke(inputs, config=config)
+                finally:
+                    self._record_usage(chain_name, collector, settings)
+        except Exception as e:
+            LLM_ERRORS.labels(chain_name, type(e).__name__).inc()
+            raise
+        finally:
+            CHAIN_LATENCY.labels(chain_name).observe(time.perf_counter() - started)
+
+    async def _agenerate_recommendation(
+        self, chain_name: str, inputs: Dict, purchase_history: List[Dict]
+    ) -> Tuple[str, Optional[Dict]]:
+        """產生推薦（或調整後推薦），回傳（顯示文字, 推薦產品）（非同步版本）"""
+        if self._structured_recommend_active():
+            try:
+                recommendation = self._validate_recommendation(
+                    await self._ainvoke_chain(f"structured_{chain_name}", inputs)
+                )
+                return self._structured_result(
+                    chain_name, recommendation, purchase_history
+                )
+            except Exception as e:
+                logger.warning(f"結構化推薦解析失敗，改用文字推薦: {e}")
+                LLM_RETRIES.labels(f"structured_{chain_name}").inc()
+        return await self._ainvoke_chain(chain_name, inputs), None
+
+    async def _aclassify_intent(self, user_input: str, session_id: str) -> Dict:
+        """分類使用者意圖（非同步版本）"""
+        state = self._get_session_state(session_id)
+
+        try:
+            chat_history_str = "\n".join(
+                [
+                    f"{msg['role']}: {msg['content']}"
+                    for msg in state["chat_history"][-5:]  # 最近5條對話
+                ]
+            )
+
+            return await self._ainvoke_chain(
+                "intent",
+                {
+                    "current_state": state["conversation_state"],
+                    "user_input": user_input,
+                    "chat_history": chat_history_str,
+                },
+            )
+        except Exception as e:
+            logger.error(f"意圖分類失敗: {e}")
+            return {
+                "intent": "unclear",
+                "next_state": "initial",
+                "is_purchase_related": False,
+                "guidance_message": "抱歉，我無法理解您的需求。請告訴我您想要採購什麼產品？",
+            }
+
+    async def _aresolve_intent(self, user_input: str, session_id: str) -> Dict:
+        """判斷使用者意圖（非同步版本）"""
+        started = time.perf_counter()
+        try:
+            with span("intent") as attributes:
+                intent = self._rule_intent(user_input, session_id)
+                if attributes is not None:
+                    attributes["source"] = "rules" if intent else "llm"
+                return intent or await self._aclassify_intent(user_input, session_id)
+        finally:
+            STAGE_LATENCY.labels("intent").observe(time.perf_counter() - started)
+
+    async def _afetch_purchase_history(
+        self, product_type: str = None, limit: int = None
+    ) -> List[Dict]:
+        """獲取採購歷史資料（非同步版本）"""
+        started = time.perf_counter()
+        try:
+            params = self._history_query_params(product_type, limit)
+
+            response = await self.sap_transport.aget_purchase_history(params)
+
+            if response.status_code == 200:
+                data = response.json()
+                return data.get("data", [])
+            else:
+                logger.error(f"獲取採購歷史失敗: {response.status_code}")
+                return []
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.error(f"獲取採購歷史失敗: {e}")
+            return []
+        finally:
+            STAGE_LATENCY.labels("purchase_history").observe(
+                time.perf_counter() - started
+            )
+
+    async def _ahandle_new_request(self, user_input: str, session_id: str) -> str:
+        """處理新的請購需求（非同步版本）
+
+        需求解析與採購歷史預取同時進行：先預取最近的採購歷史，待需求解析出產品類別後
+        再於本地篩選，省去一次串接等待的 API 往返；預取範圍內該類別的記錄不足時才
+        補查該類別，結果與同步流程相同。
+        """
+        started = time.perf_counter()
+        try:
+            # 1. 指名已知產品時於本地解析需求，只查詢該類別的採購歷史
+            requirement = None
+            if self._local_requirement_enabled():
+                if not len(self.product_matcher):
+                    self.product_matcher.add_products(
+                        await self._afetch_purchase_history(
+                            limit=self.config.purchase_history_prefetch_limit
+                        )
+                    )
+                requirement = self._local_requirement(user_input)
+
+            catalog = None
+            if requirement is not None:
+                product_type = requirement.get("product_type", "")
+                purchase_history = await self._afetch_purchase_history(product_type)
+                catalog = self._history_catalog(product_type)
+            else:
+                # 2. 解析需求資訊，同時預取採購歷史，再依需求類型於本地篩選
+                prefetch_limit = max(
+                    self.config.purchase_history_prefetch_limit,
+                    self._history_limit(),
+                )
+                requirement, all_history = await asyncio.gather(
+                    self._ainvoke_chain(
+                        "extract_requirement", {"user_request": user_input}
+                    ),
+                    self._afetch_purchase_history(limit=prefetch_limit),
+                )
+                product_type = requirement.get("product_type", "")
+                purchase_history = self._filter_history_by_category(
+                    all_history, product_type
+                )[: self._history_limit()]
+                # 預取的是所有類別最近的記錄：預取已達上限而該類別的記錄不足時，較舊的
+                # 記錄可能不在預取範圍內，改以類別查詢取得與同步流程相同的採購歷史
+                if (
+                    len(purchase_history) < self._history_limit()
+                    and len(all_history) >= prefetch_limit
+                ):
+                    purchase_history = await self._afetch_purchase_history(product_type)
+                catalog = self._history_catalog(product_type)
+            logger.info(f"獲取到的採購歷史資料: {len(purchase_history)} 筆")
+
+            # 3. 一句話已包含完整請購資訊時直接建立請購單
+            candidate = self._direct_order_candidate(
+                user_input, requirement, purchase_history
+            )
+            if candidate is not None:
+                product, parsed = candidate
+                order_fields = None
+                if parsed.missing():
+                    try:
+                        order_fields = await self._ainvoke_chain(
+                            "direct_order",
+                            self._direct_order_inputs(user_input, product, session_id),
+                        )
+                    except Exception as e:
+                        logger.warning(f"直接下單鏈調用失敗，改為詢問缺少的欄位: {e}")
+                return self._complete_direct_order(
+                    user_input,
+                    session_id,
+                    requirement,
+                    purchase_history,
+                    product,
+                    parsed,
+                    order_fields,
+                    started,
+                    catalog=catalog,
+                )
+
+            # 4. 需求明確對應到歷史產品時直接以範本推薦
+            header = self._recommendation_header(purchase_history)
+            fast = self._fast_recommendation(
+                requirement, purchase_history, self._requested_quantity(user_input)
+            )
+            if fast is not None:
+                selected_product, recommendation = fast
+                response = self._complete_new_request(
+                    user_input,
+                    session_id,
+                    requirement,
+                    purchase_history,
+                    recommendation,
+                    header,
+                    recommended_product=selected_product,
+                    catalog=catalog,
+                )
+                self._record_recommend_path("fast", started)
+                return response
+
+            # 5. 讓 LLM 分析最相關的採購歷史並提供智能推薦
+            history_text = self._history_prompt(
+                "recommend",
+                purchase_history,
+                self._requirement_query(user_input, requirement),
+                requirement,
+                catalog=catalog,
+            )
+            recommendation, recommended_product = await self._agenerate_recommendation(
+                "recommend",
+                {"user_request": user_input, "purchase_history": history_text},
+                purchase_history,
+            )
+
+            response = self._complete_new_request(
+                user_input,
+                session_id,
+                requirement,
+                purchase_history,
+                recommendation,
+                header,
+                recommended_product=recommended_product,
+                catalog=catalog,
+            )
+            self._record_recommend_path("llm", started)
+            return response
+
+        except Exception as e:
+            logger.error(f"處理新請求失敗: {e}")
+            return f"抱歉，處理您的請求時發生錯誤：{str(e)}\n請重新描述您的採購需求。"
+
+    async def _ahandle_adjustment(self, user_input: str, session_id: str) -> str:
+        """處理調整推薦（非同步版本）"""
+        try:
+            state = self._get_session_state(session_id)
+            purchase_history = state.get("purchase_history", [])
+            history_text = self._adjustment_history_prompt(
+                user_input, state, purchase_history
+            )
+
+            (
+                adjusted_recommendation,
+                recommended_product,
+            ) = await self._agenerate_recommendation(
+                "adjust",
+                {
+                    "current_recommendation": state["current_recommendation"],
+                    "adjustment_request": user_input,
+                    "purchase_history": history_text,
+                },
+                purchase_history,
+            )
+
+            return self._complete_adjustment(
+                session_id,
+                purchase_history,
+                adjusted_recommendation,
+                "🔄 推薦已調整 (基於採購歷史智能分析)\n\n",
+                recommended_product=recommended_product,
+            )
+
+        except Exception as e:
+            logger.error(f"調整推薦失敗: {e}")
+            return f"抱歉，調整推薦時發生錯誤：{str(e)}\n請重新描述您的調整需求。"
+
+    async def _ahandle_product_change_request(
+        self, user_input: str, session_id: str
+    ) -> str:
+        """處理產品變更請求（非同步版本）"""
+        try:
+            state = self._get_session_state(session_id)
+            purchase_history = state.get("purchase_history", [])
+
+            # 如果沒有歷史記錄，重新獲取（會話中只保留最相關的記錄）
+            if not purchase_history:
+                purchase_history = self._session_history(
+                    await self._afetch_purchase_history(),
+                    user_input,
+                    state.get("requirement"),
+                    self._history_catalog(),
+                )
+
+            history_text = self._history_prompt(
+                "recommend", purchase_history, user_input, state.get("requirement")
+            )
+            (
+                product_change_recommendation,
+                recommended_product,
+            ) = await self._agenerate_recommendation(
+                "recommend",
+                {"user_request": user_input, "purchase_history": history_text},
+                purchase_history,
+            )
+
+            return self._complete_product_change(
+                session_id,
+                purchase_history,
+                product_change_recommendation,
+                "🔄 產品變更推薦 (基於採購歷史智能分析)\n\n",
+                recommended_product=recommended_product,
+            )
+
+        except Exception as e:
+            logger.error(f"處理產品變更請求失敗: {e}")
+            return (
+                f"抱歉，處理您的產品變更請求時發生錯誤：{str(e)}\n請重新描述您的需求。"
+            )
+
+    async def _ahandle_confirmation(self, user_input: str, session_id: str) -> str:
+        """處理確認推薦（非同步版本，產品擷取與庫存、供應商查詢不佔用執行緒）"""
+        intent = self._confirmation_intent(user_input)
+
+        if intent == "confirm_recommendation":
+            state = self._get_session_state(session_id)
+            prepared = await self._atake_speculative_confirmation(session_id, state)
+            if prepared is None:
+                prepared = await self._aprepare_confirmation(state)
+            return self._confirm_recommendation(session_id, state, prepared)
+        elif intent == "request_adjustment":
+            if self._enter_adjustment(user_input, session_id):
+                return await self._ahandle_adjustment(user_input, session_id)
+            return self._ADJUSTMENT_PROMPT
+        else:
+            return self._CONFIRMATION_PROMPT
+
+    async def _ahandle_order_confirmation(
+        self, user_input: str, session_id: str
+    ) -> str:
+        """處理請購單確認（非同步版本，只有提交需要呼叫 API）"""
+        intent = self._order_confirmation_intent(user_input)
+        if intent == "submit_order":
+            return await self._asubmit_order(session_id)
+        return self._handle_order_confirmation(user_input, session_id)
+
+    async def _asubmit_order(self, session_id: str) -> str:
+        """提交請購單（非同步版本）"""
+        try:
+            state = self._get_session_state(session_id)
+            order_data = state["confirmed_order"]
 
-    def get_session_status(self, session_id: str = "default") -> Dict:
-        """獲取會話狀態資訊"""
-        return self._get_session_state(session_id)
+            response = await self.sap_transport.acreate_purchase_request(order_data)
+
+            return self._complete_submit(session_id, order_data, response)
+
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.error(f"提交請購單失敗: {e}")
+            return (
+                f"❌ 請購單提交失敗\n\n網路錯誤：{str(e)}\n請檢查網路連線或稍後重試。"
+            )
+
+    async def _ahandle_off_topic(self, user_input: str, session_id: str) -> str:
+        """處理偏離主題的對話（非同步版本）"""
+        try:
+            state = self._get_session_state(session_id)
+            return await self._ainvoke_chain(
+                "guidance",
+                {
+                    "user_input": user_input,
+                    "current_state": state["conversation_state"],
+                },
+            )
+        except Exception as e:
+            logger.error(f"生成引導訊息失敗: {e}")
+            return "我是專門協助您處理採購相關事務的助手。請告訴我您想要採購什麼產品，我會為您提供最合適的推薦。"
+
+    def get_session_status(self, session_id: str = "default") -> Optional[Dict]:
+        """獲取會話狀態資訊（會話不存在或已過期時回傳 None，不會建立新會話）"""
+        return self.session_store.get(session_id)
+
+    def list_sessions(self) -> List[str]:
+        """列出所有有效的會話 ID"""
+        return self.session_store.session_ids()
+
+    def get_session_store_stats(self) -> Dict:
+        """獲取會話儲存統計（數量、淘汰次數與並行控制）"""
+        return {
+            **self.session_store.metrics(),
+            "locks": self._session_locks.stats(),
+            "deduplication": self._inflight_turns.stats(),
+        }
+
+    def get_cache_stats(self) -> Dict:
+        """獲取 LLM 回應快取統計"""
+        if self.llm_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.llm_cache.stats()}
+
+    def get_chain_routing(self) -> Dict:
+        """獲取各鏈解析後的生成設定與共用的 LLM 用戶端數"""
+        return {
+            "profile": self.config.routing_profile,
+            "clients": len(self._llm_clients),
+            "chains": {
+                name: {
+                    "model": settings.model,
+                    "max_tokens": settings.max_tokens,
+                    "temperature": settings.temperature,
+                    "timeout": settings.timeout,
+                    "stop": list(settings.stop) if settings.stop else None,
+                }
+                for name, settings in self.chain_settings.items()
+            },
+        }
+
+    def get_usage_stats(self, session_id: Optional[str] = None) -> Dict:
+        """獲取 token 用量與成本統計（指定 session_id 時只回傳該會話）"""
+        if self.usage is None:
+            return {"enabled": False}
+        budget = {
+            "session_token_budget": self.config.session_token_budget or None,
+            "downgraded_turns": self._budget_stats["downgraded_turns"],
+        }
+        if session_id is not None:
+            usage = self.usage.session_usage(session_id)
+            tokens = usage["total_tokens"] if usage else 0
+            return {
+                "enabled": True,
+                "session_id": session_id,
+                "usage": usage,
+                "session_token_budget": budget["session_token_budget"],
+                "over_budget": bool(
+                    budget["session_token_budget"]
+                    and tokens >= budget["session_token_budget"]
+                ),
+            }
+        return {"enabled": True, "budget": budget, **self.usage.snapshot()}
+
+    def get_speculation_stats(self) -> Dict:
+        """獲取推測性預先計算統計（命中率、丟棄與拒絕次數）"""
+        if self._speculation is None:
+            return {"enabled": False}
+        return {"enabled": True, **self._speculation.stats()}
+
+    def get_scheduler_stats(self) -> Dict:
+        """獲取 LLM 呼叫排程統計（並行數、各優先通道的佇列深度與等待時間）"""
+        if self.llm_scheduler is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.llm_scheduler.stats()}
+
+    def get_batching_stats(self) -> Dict:
+        """獲取跨會話微批次統計（各鏈的批次數、平均批次大小與排隊時間）"""
+        if not self._batchers:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "chains": {
+                name: batcher.stats() for name, batcher in self._batchers.items()
+            },
+        }
+
+    def get_sap_client_stats(self) -> Dict:
+        """獲取 SAP API 呼叫統計（熔斷狀態與各端點延遲）"""
+        return self.sap_transport.stats()
+
+    def get_intent_stats(self) -> Dict:
+        """獲取意圖判斷統計（規則略過 LLM 的比例）"""
+        with self._stats_lock:
+            turns = self._intent_stats["turns"]
+            rule_resolved = self._intent_stats["rule_resolved"]
+        return {
+            "turns": turns,
+            "rule_resolved": rule_resolved,
+            "llm_classified": turns - rule_resolved,
+            "llm_skip_ratio": round(rule_resolved / turns, 4) if turns else 0.0,
+        }
+
+    def get_recommend_stats(self) -> Dict:
+        """獲取新請購需求的推薦路徑統計（快速範本推薦與 LLM 推薦的次數與延遲）"""
+        with self._stats_lock:
+            paths = {path: dict(data) for path, data in self._recommend_stats.items()}
+            confirmations = dict(self._confirmation_stats)
+        stats = {}
+        for path, data in paths.items():
+            count = data["count"]
+            stats[path] = {
+                "count": count,
+                "avg_ms": round(data["total_ms"] / count, 2) if count else 0.0,
+                "max_ms": round(data["max_ms"], 2),
+            }
+        total = stats["fast"]["count"] + stats["llm"]["count"]
+        stats["fast_ratio"] = round(stats["fast"]["count"] / total, 4) if total else 0.0
+        # 確認推薦時直接使用結構化產品（不呼叫 LLM）或由 LLM 擷取的次數
+        stats["confirmations"] = confirmations
+        return stats
+
+    def get_order_detail_stats(self) -> Dict:
+        """獲取請購單資料收集統計（規則擷取的欄位數與仍需呼叫 LLM 的回合數）"""
+        with self._stats_lock:
+            turns = self._order_detail_stats["turns"]
+            llm_calls = self._order_detail_stats["llm_calls"]
+            rule_fields = dict(self._order_detail_stats["rule_fields"])
+            llm_fields = dict(self._order_detail_stats["llm_fields"])
+        return {
+            "turns": turns,
+            "llm_calls": llm_calls,
+            "llm_skip_ratio": round((turns - llm_calls) / turns, 4) if turns else 0.0,
+            "rule_fields": rule_fields,
+            "llm_fields": llm_fields,
+            "direct_orders": self.get_direct_order_stats(),
+        }
+
+    def get_direct_order_stats(self) -> Dict:
+        """獲取直接下單統計（每張直接建立的請購單省去確認推薦與填寫資料兩個回合）"""
+        with self._stats_lock:
+            stats = dict(self._direct_order_stats)
+        orders = stats["orders"]
+        return {
+            "orders": orders,
+            "llm_completed": stats["llm_completed"],
+            "turns_saved": orders * DIRECT_ORDER_TURNS_SAVED,
+            "avg_ms": round(stats["total_ms"] / orders, 2) if orders else 0.0,
+        }
 
     def reset_session(self, session_id: str = "default"):
         """重置會話狀態"""
-        if session_id in self._session_states:
-            del self._session_states[session_id]
+        self.session_store.delete(session_id)
 
     def _handle_custom_product_request(self, user_input: str, session_id: str) -> str:
         """處理自定義產品請求"""
         try:
             # 解析自定義產品資訊
-            custom_product = self.custom_product_chain.invoke(
-                {"user_input": user_input}
+            custom_product = self._invoke_chain(
+                "custom_product", {"user_input": user_input}
             )
 
             # 檢查是否有必要的資訊
@@ -748,6 +2979,12 @@ class ConversationalPurchaseAgent:
             logger.error(f"處理自定義產品請求失敗: {e}")
             return f"抱歉，處理您的自定義產品請求時發生錯誤：{str(e)}\n請重新提供產品資訊。"
 
+    _ORDER_COLLECTION_ERROR_RESULT = {
+        "updated_collected_info": {},
+        "is_complete": False,
+        "next_question": "抱歉，系統處理時發生錯誤，請重新提供資訊。",
+    }
+
     def _handle_order_details(self, user_input: str, session_id: str) -> str:
         """處理請購單詳細資訊 - 使用智能資料收集"""
         try:
@@ -756,195 +2993,296 @@ class ConversationalPurchaseAgent:
 
             # 如果沒有特定選定的產品，使用 LLM 從推薦中提取產品資訊
             if not selected_product:
-                recommendation = state.get("current_recommendation", "")
-                purchase_history = state.get("purchase_history", [])
+                try:
+                    product_extraction_result = self._invoke_chain(
+                        "extract_product_from_recommendation",
+                        self._product_extraction_inputs(state),
+                    )
+                except Exception as e:
+                    logger.error(f"LLM 產品提取失敗: {e}")
+                    product_extraction_result = None
+                selected_product = self._order_product(product_extraction_result)
+
+            parsed, collected_info, missing_fields, llm_inputs = (
+                self._prepare_order_details(
+                    state, selected_product, user_input, session_id
+                )
+            )
 
-                # 使用 LLM 智能提取產品資訊（替換硬編碼邏輯）
+            collection_result = {"updated_collected_info": {}}
+            if llm_inputs is not None:
+                # 使用智能資料收集鏈分析規則看不懂的部分
                 try:
-                    history_text = self._format_purchase_history(purchase_history)
-                    product_extraction_result = (
-                        self.extract_product_from_recommendation_chain.invoke(
-                            {
-                                "recommendation": recommendation,
-                                "purchase_history": history_text,
-                            }
-                        )
+                    collection_result = self._invoke_chain(
+                        "smart_order_collection", llm_inputs
                     )
+                    logger.info(f"智能資料收集結果: {collection_result}")
+                except Exception as e:
+                    logger.error(f"智能資料收集鏈調用失敗: {e}")
+                    # 使用預設結果
+                    collection_result = dict(self._ORDER_COLLECTION_ERROR_RESULT)
 
-                    logger.info(f"LLM 產品提取結果: {product_extraction_result}")
+            return self._finish_order_details(
+                session_id,
+                state,
+                selected_product,
+                parsed,
+                collected_info,
+                missing_fields,
+                collection_result,
+            )
 
-                    # 從提取結果中獲取產品資訊
-                    if (
-                        product_extraction_result
-                        and "recommended_product" in product_extraction_result
-                    ):
-                        selected_product = product_extraction_result[
-                            "recommended_product"
-                        ]
-
-                        # 確保產品資訊格式正確
-                        if isinstance(selected_product, dict):
-                            # 補充可能缺少的欄位
-                            if "category" not in selected_product:
-                                selected_product["category"] = "其他"
-                            if "supplier" not in selected_product:
-                                selected_product["supplier"] = "未指定供應商"
+        except Exception as e:
+            logger.error(f"處理請購單詳細資訊失敗: {e}")
+            return f"抱歉，處理請購單資訊時發生錯誤：{str(e)}\n請重新提供相關資訊。"
+
+    async def _ahandle_order_details(self, user_input: str, session_id: str) -> str:
+        """處理請購單詳細資訊（非同步版本）"""
+        try:
+            state = self._get_session_state(session_id)
+            selected_product = state.get("selected_product")
 
+            if not selected_product:
+                try:
+                    product_extraction_result = await self._ainvoke_chain(
+                        "extract_product_from_recommendation",
+                        self._product_extraction_inputs(state),
+                    )
                 except Exception as e:
                     logger.error(f"LLM 產品提取失敗: {e}")
-                    # 作為備用方案，使用通用產品資訊
-                    selected_product = {
-                        "product_name": "推薦產品",
-                        "category": "其他",
-                        "unit_price": 0,
-                        "supplier": "未指定供應商",
-                    }
+                    product_extraction_result = None
+                selected_product = self._order_product(product_extraction_result)
 
-            # 格式化產品資訊
-            selected_product_info = f"""產品名稱：{selected_product.get("product_name", "N/A")}
-類別：{selected_product.get("category", "N/A")}
-單價：NT$ {selected_product.get("unit_price", 0):,}
-供應商：{selected_product.get("supplier", "N/A")}"""
-
-            # 獲取已收集的資訊（如果有的話）- 修复 NoneType 错誤
-            collected_info = state.get("collected_order_info")
-            if collected_info is None or not isinstance(collected_info, dict):
-                # 初始化收集資訊 - 只收集必要欄位
-                collected_info = {
-                    "quantity": None,
-                    "requester": None,
-                    "expected_delivery_date": None,
-                }
-                # 更新會話狀態
-                self._update_session_state(
-                    session_id, {"collected_order_info": collected_info}
+            parsed, collected_info, missing_fields, llm_inputs = (
+                self._prepare_order_details(
+                    state, selected_product, user_input, session_id
                 )
+            )
 
-            # 使用智能資料收集鏈分析用戶輸入
-            try:
-                collection_result = self.smart_order_collection_chain.invoke(
-                    {
-                        "selected_product_info": selected_product_info,
-                        "collected_info": json.dumps(
-                            collected_info, ensure_ascii=False
-                        ),
-                        "user_input": user_input,
-                    }
-                )
-                logger.info(f"智能資料收集結果: {collection_result}")
-            except Exception as e:
-                logger.error(f"智能資料收集鏈調用失敗: {e}")
-                # 使用預設結果
-                collection_result = {
-                    "updated_collected_info": {},
-                    "is_complete": False,
-                    "next_question": "抱歉，系統處理時發生錯誤，請重新提供資訊。",
-                }
+            collection_result = {"updated_collected_info": {}}
+            if llm_inputs is not None:
+                try:
+                    collection_result = await self._ainvoke_chain(
+                        "smart_order_collection", llm_inputs
+                    )
+                    logger.info(f"智能資料收集結果: {collection_result}")
+                except Exception as e:
+                    logger.error(f"智能資料收集鏈調用失敗: {e}")
+                    collection_result = dict(self._ORDER_COLLECTION_ERROR_RESULT)
 
-            # 更新已收集的資訊
-            updated_collected_info = collection_result.get("updated_collected_info", {})
+            return self._finish_order_details(
+                session_id,
+                state,
+                selected_product,
+                parsed,
+                collected_info,
+                missing_fields,
+                collection_result,
+            )
 
-            # 確保 updated_collected_info 不是 None
-            if updated_collected_info is None:
-                updated_collected_info = {}
+        except Exception as e:
+            logger.error(f"處理請購單詳細資訊失敗: {e}")
+            return f"抱歉，處理請購單資訊時發生錯誤：{str(e)}\n請重新提供相關資訊。"
 
-            # 確保不會丟失已收集的資訊 - 合併舊資訊和新資訊
-            # 修复：确保 collected_info 是字典对象
-            if not isinstance(collected_info, dict):
-                collected_info = {
-                    "quantity": None,
-                    "requester": None,
-                    "expected_delivery_date": None,
-                }
+    @staticmethod
+    def _order_product(product_extraction_result: Optional[Dict]) -> Dict:
+        """從產品擷取結果取得請購的產品；擷取失敗時使用通用產品資訊"""
+        logger.info(f"LLM 產品提取結果: {product_extraction_result}")
+        selected_product = (
+            product_extraction_result.get("recommended_product")
+            if isinstance(product_extraction_result, dict)
+            else None
+        )
+        if not isinstance(selected_product, dict):
+            # 作為備用方案，使用通用產品資訊
+            return {
+                "product_name": "推薦產品",
+                "category": "其他",
+                "unit_price": 0,
+                "supplier": "未指定供應商",
+            }
 
-            final_collected_info = collected_info.copy()
-            for key, value in updated_collected_info.items():
-                if value is not None:  # 只有在新值不為 None 時才更新
-                    final_collected_info[key] = value
+        # 補充可能缺少的欄位
+        if "category" not in selected_product:
+            selected_product["category"] = "其他"
+        if "supplier" not in selected_product:
+            selected_product["supplier"] = "未指定供應商"
+        return selected_product
+
+    def _prepare_order_details(
+        self, state: Dict, selected_product: Dict, user_input: str, session_id: str
+    ) -> Tuple[OrderDetailsParse, Dict, List[str], Optional[Dict]]:
+        """以規則擷取本回合的請購資訊，回傳（擷取結果, 已收集資訊, 缺少的欄位, 智能資料收集鏈的輸入）
+
+        只有規則擷取不到的欄位才交給 LLM；不需呼叫 LLM 時鏈的輸入為 None。
+        """
+        # 格式化產品資訊
+        selected_product_info = f"""產品名稱：{selected_product.get("product_name", "N/A")}
+類別：{selected_product.get("category", "N/A")}
+單價：NT$ {selected_product.get("unit_price", 0):,}
+供應商：{selected_product.get("supplier", "N/A")}"""
 
-            # 儲存更新後的資訊
+        # 獲取已收集的資訊（如果有的話）- 修复 NoneType 错誤
+        collected_info = state.get("collected_order_info")
+        if collected_info is None or not isinstance(collected_info, dict):
+            # 初始化收集資訊 - 只收集必要欄位
+            collected_info = {
+                "quantity": None,
+                "requester": None,
+                "expected_delivery_date": None,
+            }
+            # 更新會話狀態
             self._update_session_state(
-                session_id, {"collected_order_info": final_collected_info}
-            )
-
-            # 檢查完成狀態：只有3個必要欄位都有值時才算完成
-            required_fields = ["quantity", "requester", "expected_delivery_date"]
-            all_required_present = all(
-                final_collected_info.get(field) is not None for field in required_fields
-            )
-
-            logger.info(f"完成狀態檢查: final_collected_info={final_collected_info}")
-            logger.info(f"必要欄位檢查: all_required_present={all_required_present}")
-            logger.info(
-                f"LLM回報狀態: is_complete={collection_result.get('is_complete', False)}"
+                session_id, {"collected_order_info": collected_info}
             )
 
-            # 使用我們自己的邏輯判斷是否完成，不完全依賴LLM的判斷
-            if all_required_present:
-                # 建立完整的請購單
-                order_data = {
-                    "product_name": selected_product.get("product_name", "未指定產品"),
-                    "category": selected_product.get("category", "其他"),
-                    "quantity": final_collected_info.get("quantity", 1),
-                    "unit_price": selected_product.get("unit_price", 0),
-                    "requester": final_collected_info.get(
-                        "requester", state["user_context"]["requester"]
-                    ),
-                    "department": state["user_context"]["department"],
-                    "reason": "工作需求",  # 簡化為預設值
-                    "urgent": False,  # 簡化為預設值
-                    "expected_delivery_date": final_collected_info.get(
-                        "expected_delivery_date", ""
-                    ),
-                }
-
-                # 更新狀態
-                self._update_session_state(
-                    session_id,
-                    {
-                        "conversation_state": ConversationState.CONFIRMING_ORDER,
-                        "confirmed_order": order_data,
-                    },
-                )
+        # 先以規則擷取數量、請購人與交貨日期，只有規則擷取不到的欄位才交給 LLM
+        parsed = self.order_parser.parse(user_input)
+        missing_fields = parsed.missing(collected_info)
+        with self._stats_lock:
+            self._order_detail_stats["turns"] += 1
+            for key in parsed.fields:
+                self._order_detail_stats["rule_fields"][key] += 1
+
+        if not (missing_fields and parsed.residual):
+            return parsed, collected_info, missing_fields, None
+
+        self._count(self._order_detail_stats, "llm_calls")
+        llm_inputs = {
+            "selected_product_info": selected_product_info,
+            "collected_info": json.dumps(
+                {**collected_info, **parsed.fields}, ensure_ascii=False
+            ),
+            "user_input": user_input,
+            "today": date.today().isoformat(),
+        }
+        return parsed, collected_info, missing_fields, llm_inputs
+
+    def _finish_order_details(
+        self,
+        session_id: str,
+        state: Dict,
+        selected_product: Dict,
+        parsed: OrderDetailsParse,
+        collected_info: Dict,
+        missing_fields: List[str],
+        collection_result: Dict,
+    ) -> str:
+        """合併規則與 LLM 擷取的請購資訊；資訊齊全時建立請購單，否則繼續詢問"""
+        # LLM 只補規則擷取不到的欄位
+        llm_collected_info = collection_result.get("updated_collected_info") or {}
+        updated_collected_info = dict(parsed.fields)
+        for key in missing_fields:
+            value = llm_collected_info.get(key)
+            if key == "expected_delivery_date" and value is not None:
+                value = self.order_parser.normalize_date(str(value))
+            if value is not None:
+                updated_collected_info[key] = value
+                self._count(self._order_detail_stats["llm_fields"], key)
+
+        # 確保不會丟失已收集的資訊 - 合併舊資訊和新資訊
+        final_collected_info = collected_info.copy()
+        for key, value in updated_collected_info.items():
+            if value is not None:  # 只有在新值不為 None 時才更新
+                final_collected_info[key] = value
+
+        # 儲存更新後的資訊
+        self._update_session_state(
+            session_id, {"collected_order_info": final_collected_info}
+        )
 
-                # 格式化顯示請購單
-                order_display = self._format_order_display(order_data)
+        # 檢查完成狀態：只有3個必要欄位都有值時才算完成
+        required_fields = ["quantity", "requester", "expected_delivery_date"]
+        all_required_present = all(
+            final_collected_info.get(field) is not None for field in required_fields
+        )
 
-                return f"✅ 資料收集完成！請購單已創建\n\n{order_display}\n\n請確認請購單資訊是否正確？\n- 輸入「確認提交」來提交請購單\n- 輸入「修改」來調整請購單\n- 輸入「取消」來取消請購"
-            else:
-                # 資訊不完整，繼續收集
-                next_question = collection_result.get(
-                    "next_question", "請提供更多資訊。"
-                )
+        logger.info(f"完成狀態檢查: final_collected_info={final_collected_info}")
+        logger.info(f"必要欄位檢查: all_required_present={all_required_present}")
+        logger.info(
+            f"LLM回報狀態: is_complete={collection_result.get('is_complete', False)}"
+        )
 
-                # 顯示目前已收集的資訊
-                progress_info = []
-                if final_collected_info.get("quantity"):
-                    progress_info.append(f"✅ 數量：{final_collected_info['quantity']}")
-                else:
-                    progress_info.append("❌ 數量：尚未提供")
+        # 使用我們自己的邏輯判斷是否完成，不完全依賴LLM的判斷
+        if all_required_present:
+            # 建立完整的請購單
+            order_data = {
+                "product_name": selected_product.get("product_name", "未指定產品"),
+                "category": selected_product.get("category", "其他"),
+                "quantity": final_collected_info.get("quantity", 1),
+                "unit_price": selected_product.get("unit_price", 0),
+                "requester": final_collected_info.get(
+                    "requester", state["user_context"]["requester"]
+                ),
+                "department": state["user_context"]["department"],
+                "reason": "工作需求",  # 簡化為預設值
+                "urgent": False,  # 簡化為預設值
+                "expected_delivery_date": final_collected_info.get(
+                    "expected_delivery_date", ""
+                ),
+            }
 
-                if final_collected_info.get("requester"):
-                    progress_info.append(
-                        f"✅ 請購人：{final_collected_info['requester']}"
-                    )
-                else:
-                    progress_info.append("❌ 請購人：尚未提供")
+            # 更新狀態
+            self._update_session_state(
+                session_id,
+                {
+                    "conversation_state": ConversationState.CONFIRMING_ORDER,
+                    "confirmed_order": order_data,
+                },
+            )
 
-                if final_collected_info.get("expected_delivery_date"):
-                    progress_info.append(
-                        f"✅ 交貨日期：{final_collected_info['expected_delivery_date']}"
-                    )
-                else:
-                    progress_info.append("❌ 交貨日期：尚未提供")
+            # 格式化顯示請購單
+            order_display = self._format_order_display(order_data)
 
-                progress_text = "\n".join(progress_info)
+            return f"✅ 資料收集完成！請購單已創建\n\n{order_display}\n\n請確認請購單資訊是否正確？\n- 輸入「確認提交」來提交請購單\n- 輸入「修改」來調整請購單\n- 輸入「取消」來取消請購"
+        else:
+            # 資訊不完整，繼續收集
+            next_question = collection_result.get(
+                "next_question"
+            ) or self._order_details_question(final_collected_info)
+
+            # 顯示目前已收集的資訊
+            progress_info = []
+            if final_collected_info.get("quantity"):
+                progress_info.append(f"✅ 數量：{final_collected_info['quantity']}")
+            else:
+                progress_info.append("❌ 數量：尚未提供")
 
-                return f"📋 資料收集進度\n\n{progress_text}\n\n{next_question}"
+            if final_collected_info.get("requester"):
+                progress_info.append(f"✅ 請購人：{final_collected_info['requester']}")
+            else:
+                progress_info.append("❌ 請購人：尚未提供")
 
-        except Exception as e:
-            logger.error(f"處理請購單詳細資訊失敗: {e}")
-            return f"抱歉，處理請購單資訊時發生錯誤：{str(e)}\n請重新提供相關資訊。"
+            if final_collected_info.get("expected_delivery_date"):
+                progress_info.append(
+                    f"✅ 交貨日期：{final_collected_info['expected_delivery_date']}"
+                )
+            else:
+                progress_info.append("❌ 交貨日期：尚未提供")
+
+            progress_text = "\n".join(progress_info)
+
+            return f"📋 資料收集進度\n\n{progress_text}\n\n{next_question}"
+
+    @staticmethod
+    def _example_delivery_date() -> str:
+        """提示中的交貨日期範例（兩週後，不會是過去的日期）"""
+        return (date.today() + timedelta(days=14)).isoformat()
+
+    @classmethod
+    def _order_details_question(cls, collected_info: Dict) -> str:
+        """詢問尚未提供的請購單欄位（規則已擷取完輸入時不需呼叫 LLM）"""
+        prompts = {
+            "quantity": "需要的數量（例如：2台）",
+            "requester": "請購人姓名（例如：請購人：張三）",
+            "expected_delivery_date": (
+                f"預期交貨日期（例如：{cls._example_delivery_date()}、下週五）"
+            ),
+        }
+        missing = [
+            text for key, text in prompts.items() if collected_info.get(key) is None
+        ]
+        return "還需要您提供：" + "、".join(missing)
 
     def _handle_product_change_request(self, user_input: str, session_id: str) -> str:
         """處理產品變更請求"""
@@ -953,96 +3291,90 @@ class ConversationalPurchaseAgent:
             state = self._get_session_state(session_id)
             purchase_history = state.get("purchase_history", [])
 
-            # 如果沒有歷史記錄，重新獲取
+            # 如果沒有歷史記錄，重新獲取（會話中只保留最相關的記錄）
             if not purchase_history:
-                purchase_history = self._fetch_purchase_history()
-
-            # 格式化採購歷史資料供 LLM 分析
-            history_text = self._format_purchase_history(purchase_history)
+                purchase_history = self._session_history(
+                    self._fetch_purchase_history(),
+                    user_input,
+                    state.get("requirement"),
+                    self._history_catalog(),
+                )
 
-            # 讓 LLM 基於用戶的產品變更需求和採購歷史進行智能推薦
-            product_change_recommendation = self.recommend_chain.invoke(
-                {
-                    "user_request": user_input,
-                    "purchase_history": history_text,
-                }
+            # 挑選與變更需求最相關的採購歷史供 LLM 分析
+            history_text = self._history_prompt(
+                "recommend", purchase_history, user_input, state.get("requirement")
             )
 
-            # 檢查是否能從推薦中解析出特定產品資訊
-            selected_product = None
-            if purchase_history:
-                # 嘗試從 LLM 推薦中找出對應的歷史產品
-                selected_product = self._extract_product_from_recommendation(
-                    product_change_recommendation, purchase_history
+            # 讓 LLM 基於用戶的產品變更需求和採購歷史進行智能推薦
+            header = "🔄 產品變更推薦 (基於採購歷史智能分析)\n\n"
+            product_change_recommendation, recommended_product = (
+                self._generate_recommendation(
+                    "recommend",
+                    {
+                        "user_request": user_input,
+                        "purchase_history": history_text,
+                    },
+                    purchase_history,
+                    prefix=header,
                 )
+            )
 
-            # 更新選定產品和會話狀態
-            self._update_session_state(
+            return self._complete_product_change(
                 session_id,
-                {
-                    "selected_product": selected_product,
-                    "current_recommendation": product_change_recommendation,
-                    "conversation_state": ConversationState.WAITING_CONFIRMATION,
-                    "purchase_history": purchase_history,
-                },
+                purchase_history,
+                product_change_recommendation,
+                header,
+                recommended_product=recommended_product,
             )
 
-            return f"🔄 產品變更推薦 (基於採購歷史智能分析)\n\n{product_change_recommendation}\n\n請確認是否選擇此產品？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來進一步調整"
-
         except Exception as e:
             logger.error(f"處理產品變更請求失敗: {e}")
             return (
                 f"抱歉，處理您的產品變更請求時發生錯誤：{str(e)}\n請重新描述您的需求。"
             )
 
-    def _extract_product_from_recommendation(
-        self, recommendation: str, purchase_history: List[Dict]
-    ) -> Optional[Dict]:
-        """從 LLM 推薦中提取對應的歷史產品資訊"""
-        try:
-            # 將推薦文字轉換為小寫以便比較
-            recommendation_lower = recommendation.lower()
-
-            # 嘗試匹配歷史產品
-            best_match = None
-            max_matches = 0
-
-            for product in purchase_history:
-                product_name = product.get("product_name", "").lower()
-                supplier = product.get("supplier", "").lower()
-                category = product.get("category", "").lower()
-
-                matches = 0
-
-                # 檢查產品名稱關鍵字
-                if product_name:
-                    # 分割產品名稱為關鍵字
-                    product_keywords = product_name.split()
-                    for keyword in product_keywords:
-                        if (
-                            len(keyword) > 2 and keyword in recommendation_lower
-                        ):  # 忽略太短的關鍵字
-                            matches += 2
-
-                # 檢查供應商
-                if supplier and supplier in recommendation_lower:
-                    matches += 1
+    def _complete_product_change(
+        self,
+        session_id: str,
+        purchase_history: List[Dict],
+        product_change_recommendation: str,
+        header: str,
+        recommended_product: Optional[Dict] = None,
+    ) -> str:
+        """完成產品變更推薦：解析推薦產品、更新會話狀態並組合回應"""
+        # 檢查是否能從推薦中解析出特定產品資訊（結構化推薦已指定產品）
+        selected_product = recommended_product
+        if selected_product is None and purchase_history:
+            # 嘗試從 LLM 推薦中找出對應的歷史產品
+            selected_product = self._extract_product_from_recommendation(
+                product_change_recommendation, purchase_history
+            )
 
-                # 檢查類別
-                if category and category in recommendation_lower:
-                    matches += 1
+        # 更新選定產品和會話狀態
+        self._update_session_state(
+            session_id,
+            {
+                "selected_product": selected_product,
+                "recommended_product": recommended_product,
+                "current_recommendation": product_change_recommendation,
+                "conversation_state": ConversationState.WAITING_CONFIRMATION,
+                "purchase_history": purchase_history,
+            },
+        )
+        self._start_confirmation_speculation(session_id)
 
-                # 檢查價格是否在推薦中提到
-                unit_price = product.get("unit_price", 0)
-                if unit_price and str(unit_price) in recommendation:
-                    matches += 3
+        return f"{header}{product_change_recommendation}\n\n請確認是否選擇此產品？\n- 輸入「同意」來接受推薦\n- 輸入「不同意」來進一步調整"
 
-                # 更新最佳匹配
-                if matches > max_matches and matches >= 3:  # 至少要有3個匹配點
-                    best_match = product
-                    max_matches = matches
+    def _extract_product_from_recommendation(
+        self, recommendation: str, purchase_history: List[Dict]
+    ) -> Optional[Dict]:
+        """從 LLM 推薦中提取對應的歷史產品資訊
 
-            return best_match
+        以產品比對自動機一次掃描推薦文字，找出提到的產品名稱、供應商、類別與價格，
+        回傳分數最高（至少 3 分）的歷史產品。
+        """
+        try:
+            return self.product_matcher.best_match(recommendation, purchase_history)
 
         except Exception as e:
             logger.error(f"從推薦中提取產品資訊失敗: {e}")
@@ -0,0 +1,350 @@
+"""
+SAP 請購系統 - 記憶體查詢引擎
+
+IndexedTable 為假 SAP API 的資料表提供索引查詢，避免每次請求都複製整份資料並逐條篩選：
+1. 主鍵雜湊索引：詳細資料查詢為 O(1)
+2. 文字欄位索引：預先計算小寫鍵值，依「不同值」分組；子字串篩選只需掃描不同值
+   （例如類別、供應商只有數十種），語意與原本的 `query.lower() in value.lower()` 相同
+3. 排序索引：日期等欄位以 bisect 做範圍查詢
+4. 單次掃描：以選擇性最高的條件產生候選列，其餘條件逐列判斷，不複製整份資料
+5. 分頁查詢：穩定游標（排序值 + 列位置）、欄位投影，排序以 heap 取前 k 筆
+"""
+
+import base64
+import heapq
+import json
+import threading
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+
+def encode_cursor(sort: Optional[str], key: Sequence) -> str:
+    """將排序條件與最後一筆的排序鍵編碼為分頁游標"""
+    payload = json.dumps({"sort": sort or "", "key": list(key)}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: Optional[str]) -> Tuple:
+    """解析分頁游標；游標格式錯誤或與排序條件不符時拋出 ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        key = tuple(payload["key"])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("無效的分頁游標")
+    if payload.get("sort", "") != (sort or ""):
+        raise ValueError("分頁游標與排序條件不符")
+    return key
+
+
+def project(row: Dict, fields: Optional[Sequence[str]]) -> Dict:
+    """只保留指定欄位"""
+    if not fields:
+        return row
+    return {field: row[field] for field in fields if field in row}
+
+
+class IndexedTable:
+    """具主鍵、文字與範圍索引的記憶體資料表"""
+
+    def __init__(
+        self,
+        key_field: str,
+        text_fields: Iterable[str] = (),
+        range_fields: Iterable[str] = (),
+        rows: Iterable[Dict] = (),
+    ):
+        self.key_field = key_field
+        self._lock = threading.RLock()
+        self._rows: List[Dict] = []
+        self._positions: Dict[Any, int] = {}
+        # 欄位 -> 小寫值 -> 列位置
+        self._text_index: Dict[str, Dict[str, set]] = {f: {} for f in text_fields}
+        # 欄位 -> 每列預先計算的小寫值
+        self._lower_keys: Dict[str, List[str]] = {f: [] for f in self._text_index}
+        # 欄位 -> 依值排序的 (值, 列位置)
+        self._range_index: Dict[str, List[Tuple[Any, int]]] = {
+            f: [] for f in range_fields
+        }
+
+        self.extend(rows)
+
+    @staticmethod
+    def _lower(value: Any) -> str:
+        return str(value).lower() if value is not None else ""
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._positions
+
+    def __getitem__(self, key: Any) -> Dict:
+        return self._rows[self._positions[key]]
+
+    def get(self, key: Any, default: Optional[Dict] = None) -> Optional[Dict]:
+        """依主鍵取得資料列"""
+        position = self._positions.get(key)
+        return self._rows[position] if position is not None else default
+
+    def values(self) -> Iterator[Dict]:
+        """依新增順序列出所有資料列"""
+        return iter(self._rows)
+
+    def _index_field(
+        self, field: str, position: int, value: Any, keep_sorted: bool = True
+    ):
+        if field in self._text_index:
+            lowered = self._lower(value)
+            self._lower_keys[field][position] = lowered
+            self._text_index[field].setdefault(lowered, set()).add(position)
+        if field in self._range_index and value is not None:
+            if keep_sorted:
+                insort(self._range_index[field], (value, position))
+            else:
+                self._range_index[field].append((value, position))
+
+    def _unindex_field(self, field: str, position: int, value: Any):
+        if field in self._text_index:
+            lowered = self._lower_keys[field][position]
+            bucket = self._text_index[field][lowered]
+            bucket.discard(position)
+            if not bucket:
+                del self._text_index[field][lowered]
+        if field in self._range_index and value is not None:
+            entries = self._range_index[field]
+            del entries[bisect_left(entries, (value, position))]
+
+    def _append(self, row: Dict, keep_sorted: bool) -> Dict:
+        """新增資料列（呼叫端需持有鎖）"""
+        key = row[self.key_field]
+        if key in self._positions:
+            return self.update(key, row)
+
+        position = len(self._rows)
+        self._rows.append(row)
+        self._positions[key] = position
+        for field in self._lower_keys:
+            self._lower_keys[field].append("")
+        for field in set(self._text_index) | set(self._range_index):
+            self._index_field(field, position, row.get(field), keep_sorted)
+        return row
+
+    def insert(self, row: Dict) -> Dict:
+        """新增資料列；主鍵已存在時取代原本的資料"""
+        with self._lock:
+            return self._append(row, keep_sorted=True)
+
+    def extend(self, rows: Iterable[Dict]):
+        """批次新增資料列，排序索引在全部加入後一次排序"""
+        with self._lock:
+            for row in rows:
+                self._append(row, keep_sorted=False)
+            for entries in self._range_index.values():
+                entries.sort()
+
+    def update(self, key: Any, changes: Dict) -> Dict:
+        """更新資料列欄位並同步索引（原地修改，已取得的參照會看到新值）"""
+        with self._lock:
+            position = self._positions[key]
+            row = self._rows[position]
+            for field, value in changes.items():
+                if field in self._text_index or field in self._range_index:
+                    self._unindex_field(field, position, row.get(field))
+                    self._index_field(field, position, value)
+                row[field] = value
+            return row
+
+    def _text_candidates(self, field: str, needle: str) -> Tuple[set, int]:
+        """找出包含子字串的不同值，回傳 (符合的小寫值, 預估列數)"""
+        needle = needle.lower()
+        index = self._text_index[field]
+        matched = {value for value in index if needle in value}
+        return matched, sum(len(index[value]) for value in matched)
+
+    def _range_bounds(self, field: str, low: Any, high: Any) -> Tuple[int, int]:
+        """以 bisect 找出範圍在排序索引中的起訖位置"""
+        entries = self._range_index[field]
+        start = bisect_left(entries, (low,)) if low is not None else 0
+        end = (
+            bisect_right(entries, (high, len(self._rows)))
+            if high is not None
+            else len(entries)
+        )
+        return start, max(start, end)
+
+    def select(
+        self,
+        contains: Optional[Dict[str, Optional[str]]] = None,
+        ranges: Optional[Dict[str, Tuple[Any, Any]]] = None,
+        where: Optional[Callable[[Dict], bool]] = None,
+        after_position: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """查詢資料列
+
+        Args:
+            contains: {文字欄位: 子字串}，不分大小寫；值為空時忽略該條件
+            ranges: {範圍欄位: (下限, 上限)}，包含上下限；None 表示不限
+            where: 其他逐列判斷條件
+            after_position: 只回傳位置在此之後的資料列（依新增順序分頁用）
+            limit: 找到指定筆數後即停止掃描
+
+        Returns:
+            依新增順序排列的符合資料列（回傳原始資料列參照，不複製）
+        """
+        with self._lock:
+            text_conditions = []
+            for field, needle in (contains or {}).items():
+                if needle:
+                    matched, estimate = self._text_candidates(field, needle)
+                    text_conditions.append((estimate, field, matched))
+
+            range_conditions = []
+            for field, (low, high) in (ranges or {}).items():
+                if low is None and high is None:
+                    continue
+                start, end = self._range_bounds(field, low, high)
+                range_conditions.append((end - start, field, low, high, start, end))
+
+            # 以預估列數最少的條件產生候選列
+            driver = min(
+                [(c[0], "text", c) for c in text_conditions]
+                + [(c[0], "range", c) for c in range_conditions],
+                key=lambda item: item[0],
+                default=None,
+            )
+            if driver is None:
+                start = after_position + 1 if after_position is not None else 0
+                positions: Iterable[int] = range(start, len(self._rows))
+            elif driver[1] == "text":
+                _, field, matched = driver[2]
+                index = self._text_index[field]
+                positions = sorted(p for value in matched for p in index[value])
+                text_conditions.remove(driver[2])
+            else:
+                _, field, _, _, start, end = driver[2]
+                entries = self._range_index[field]
+                positions = sorted(entries[i][1] for i in range(start, end))
+                range_conditions.remove(driver[2])
+
+            results = []
+            for position in positions:
+                if after_position is not None and position <= after_position:
+                    continue
+                if any(
+                    self._lower_keys[field][position] not in matched
+                    for _, field, matched in text_conditions
+                ):
+                    continue
+                row = self._rows[position]
+                if any(
+                    row.get(field) is None
+                    or (low is not None and row[field] < low)
+                    or (high is not None and row[field] > high)
+                    for _, field, low, high, _, _ in range_conditions
+                ):
+                    continue
+                if where is not None and not where(row):
+                    continue
+                results.append(row)
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def _sort_key(self, row: Dict, field: Optional[str], descending: bool) -> Tuple:
+        """排序鍵：(是否有值, 欄位值, 列位置)；缺值的資料列一律排在最後"""
+        position = self._positions[row[self.key_field]]
+        if field is None:
+            return (position,)
+        value = row.get(field)
+        has_value = value is not None
+        return (has_value if descending else not has_value, value, position)
+
+    def query(
+        self,
+        contains: Optional[Dict[str, Optional[str]]] = None,
+        ranges: Optional[Dict[str, Tuple[Any, Any]]] = None,
+        where: Optional[Callable[[Dict], bool]] = None,
+        sort: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+        with_total: bool = True,
+    ) -> Dict:
+        """分頁查詢
+
+        Args:
+            contains / ranges / where: 同 select
+            sort: 排序欄位，前綴 "-" 表示遞減；未指定時依新增順序
+            limit: 每頁筆數；未指定時回傳全部符合的資料列
+            cursor: 上一頁回傳的 next_cursor
+            fields: 只回傳的欄位
+            with_total: 是否計算符合條件的總筆數（不需要時可提早結束掃描）
+
+        Returns:
+            {"data": 本頁資料, "next_cursor": 下一頁游標或 None, "total": 總筆數或 None}
+        """
+        descending = bool(sort) and sort.startswith("-")
+        sort_field = sort.lstrip("-") if sort else None
+        after = decode_cursor(cursor, sort) if cursor else None
+
+        if sort_field is None and not with_total and limit is not None:
+            # 依新增順序且不需總數：掃描到 limit + 1 筆即可停止
+            page = self.select(
+                contains,
+                ranges,
+                where,
+                after_position=after[0] if after else None,
+                limit=limit + 1,
+            )
+            total = None
+        else:
+            matched = self.select(contains, ranges, where)
+            total = len(matched) if with_total else None
+
+            def key(row):
+                return self._sort_key(row, sort_field, descending)
+
+            candidates: Iterable[Dict] = matched
+            if after is not None:
+                after_key = tuple(after)
+                candidates = (
+                    row
+                    for row in matched
+                    if (key(row) < after_key if descending else key(row) > after_key)
+                )
+
+            if sort_field is None:
+                page = list(
+                    islice(candidates, limit + 1 if limit is not None else None)
+                )
+            elif limit is None:
+                page = sorted(candidates, key=key, reverse=descending)
+            elif descending:
+                page = heapq.nlargest(limit + 1, candidates, key=key)
+            else:
+                page = heapq.nsmallest(limit + 1, candidates, key=key)
+
+        next_cursor = None
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(
+                sort, self._sort_key(page[-1], sort_field, descending)
+            )
+
+        return {
+            "data": [project(row, fields) for row in page],
+            "next_cursor": next_cursor,
+            "total": total,
+        }
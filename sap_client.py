@@ -0,0 +1,603 @@
+"""
+SAP 請購系統 AI Agent - SAP API 用戶端
+
+Agent 透過 SAPTransport 介面存取 SAP API，提供兩種實作：
+- SAPClient：經由 HTTP 呼叫遠端 SAP API
+- InProcessTransport：Agent 與假 SAP API 在同一行程時，直接呼叫查詢函式，
+  省去回送（loopback）HTTP 往返與 JSON 編解碼
+
+SAPClient 的功能：
+1. 連線池：同步使用 requests.Session（keep-alive），非同步使用 httpx.AsyncClient
+2. 逾時：各端點可分別設定
+3. 重試：僅對冪等（GET）請求在連線錯誤、逾時或 5xx 時以指數退避 + 隨機抖動重試
+4. 熔斷：連續失敗達門檻後短時間內直接失敗，不再等待逾時
+5. 延遲統計：各端點的延遲分佈（histogram）與錯誤次數
+6. 追蹤：每次嘗試記錄為一個 span，並以 X-Trace-Id 標頭傳遞 trace id
+"""
+
+import asyncio
+import copy
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import SAP_LATENCY, SAP_RETRIES
+from tracing import span, trace_headers
+
+logger = logging.getLogger(__name__)
+
+# 視為 SAP 端暫時性故障、可重試的 HTTP 狀態碼
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """SAP API 熔斷中，請求直接失敗"""
+
+
+class LatencyHistogram:
+    """固定區間的延遲分佈統計（毫秒）"""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self._total_ms = 0.0
+        self._errors = 0
+
+    def observe(self, elapsed_ms: float, error: bool = False):
+        """記錄一次請求的延遲"""
+        index = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if elapsed_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._total_ms += elapsed_ms
+            if error:
+                self._errors += 1
+
+    def _percentile(self, counts: List[int], total: int, ratio: float) -> float:
+        """以區間上限估計百分位數"""
+        threshold = total * ratio
+        cumulative = 0
+        for i, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return (
+                    float(self.BUCKETS_MS[i])
+                    if i < len(self.BUCKETS_MS)
+                    else float("inf")
+                )
+        return 0.0
+
+    def snapshot(self) -> Dict:
+        """取得統計快照"""
+        with self._lock:
+            counts = list(self._counts)
+            total_ms = self._total_ms
+            errors = self._errors
+
+        total = sum(counts)
+        labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [
+            f">{self.BUCKETS_MS[-1]}ms"
+        ]
+        return {
+            "count": total,
+            "errors": errors,
+            "avg_ms": round(total_ms / total, 2) if total else 0.0,
+            "p50_ms": self._percentile(counts, total, 0.50) if total else 0.0,
+            "p95_ms": self._percentile(counts, total, 0.95) if total else 0.0,
+            "p99_ms": self._percentile(counts, total, 0.99) if total else 0.0,
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+class CircuitBreaker:
+    """熔斷器：closed（正常）→ open（直接失敗）→ half_open（放行一個試探請求）"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_inflight = False
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """是否允許送出請求"""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if (
+                self._state == "open"
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                self._state = "half_open"
+            if self._state == "half_open" and not self._probe_inflight:
+                self._probe_inflight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probe_inflight = False
+
+    def release_probe(self):
+        """放行的請求未記錄成功或失敗就結束（例如被取消）時，釋放試探名額"""
+        with self._lock:
+            self._probe_inflight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_inflight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    logger.warning("SAP API 連續失敗，啟動熔斷")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+            }
+
+
+class SAPTransport(ABC):
+    """SAP API 存取介面；回應物件需提供 status_code 與 json()"""
+
+    @abstractmethod
+    def get_purchase_history(self, params: Dict):
+        """查詢採購歷史"""
+
+    @abstractmethod
+    def create_purchase_request(self, order_data: Dict):
+        """建立請購單"""
+
+    @abstractmethod
+    def get_inventory(self, params: Dict):
+        """查詢庫存"""
+
+    @abstractmethod
+    def get_suppliers(self):
+        """查詢供應商"""
+
+    @abstractmethod
+    async def aget_purchase_history(self, params: Dict):
+        """查詢採購歷史（非同步版本）"""
+
+    @abstractmethod
+    async def acreate_purchase_request(self, order_data: Dict):
+        """建立請購單（非同步版本）"""
+
+    @abstractmethod
+    async def aget_inventory(self, params: Dict):
+        """查詢庫存（非同步版本）"""
+
+    @abstractmethod
+    async def aget_suppliers(self):
+        """查詢供應商（非同步版本）"""
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """取得呼叫統計"""
+
+    async def aclose(self):
+        """釋放非同步連線資源（預設不需處理）"""
+
+
+class SAPClient(SAPTransport):
+    """具連線池、重試、熔斷與延遲統計的 SAP API 用戶端"""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeouts: Optional[Dict[str, float]] = None,
+        default_timeout: float = 10.0,
+        max_retries: int = 2,
+        backoff_seconds: float = 0.2,
+        max_backoff_seconds: float = 2.0,
+        pool_size: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._histograms_lock = threading.Lock()
+        # 事件迴圈 → (httpx.AsyncClient, 綁定事件迴圈壽命的 async generator)
+        self._async_clients: Dict[asyncio.AbstractEventLoop, Tuple] = {}
+        self._async_clients_lock = threading.Lock()
+
+    # ---- 共用工具 ----
+
+    def _timeout(self, endpoint: str) -> float:
+        return self.timeouts.get(endpoint, self.default_timeout)
+
+    def _histogram(self, endpoint: str) -> LatencyHistogram:
+        histogram = self._histograms.get(endpoint)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self._histograms.setdefault(endpoint, LatencyHistogram())
+        return histogram
+
+    def _observe(self, endpoint: str, started: float, error: bool):
+        """記錄一次嘗試的延遲（端點統計與 Prometheus 指標）"""
+        elapsed = time.perf_counter() - started
+        self._histogram(endpoint).observe(elapsed * 1000, error=error)
+        SAP_LATENCY.labels(endpoint, "error" if error else "success").observe(elapsed)
+
+    @staticmethod
+    def _add_trace_headers(kwargs: Dict):
+        """把目前 trace 的 id 加入請求標頭（保留呼叫端自訂的標頭）"""
+        headers = trace_headers()
+        if headers:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **headers}
+
+    def _backoff(self, attempt: int) -> float:
+        """指數退避 + 完整隨機抖動（避免大量請求同時重試）"""
+        return random.uniform(
+            0, min(self.max_backoff_seconds, self.backoff_seconds * (2**attempt))
+        )
+
+    def _settle(self, settled: bool, error: BaseException):
+        """請求以例外結束但尚未記錄結果時補記：一般錯誤記為失敗，取消只釋放試探名額
+
+        否則半開狀態的試探請求會一直視為進行中，熔斷器將永久拒絕所有請求。
+        """
+        if settled:
+            return
+        if isinstance(error, Exception):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
+
+    def _check_circuit(self, endpoint: str):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"SAP API 暫時無法使用（熔斷中）: {endpoint}")
+
+    # ---- 同步請求 ----
+
+    def _request(
+        self, method: str, endpoint: str, path: str, idempotent: bool, **kwargs
+    ) -> requests.Response:
+        """送出請求；冪等請求在暫時性錯誤時重試"""
+        attempts = self.max_retries + 1 if idempotent else 1
+        self._add_trace_headers(kwargs)
+        for attempt in range(attempts):
+            self._check_circuit(endpoint)
+            settled = False
+            try:
+                with span(f"sap.{endpoint}", attempt=attempt + 1) as attributes:
+                    started = time.perf_counter()
+                    try:
+                        response = self.session.request(
+                            method,
+                            f"{self.base_url}{path}",
+                            timeout=self._timeout(endpoint),
+                            **kwargs,
+                        )
+                    except (requests.ConnectionError, requests.Timeout):
+                        self._observe(endpoint, started, error=True)
+                        self.breaker.record_failure()
+                        settled = True
+                        if attempt + 1 >= attempts:
+                            raise
+                    else:
+                        if attributes is not None:
+                            attributes["status"] = response.status_code
+                        failed = response.status_code in RETRYABLE_STATUS_CODES
+                        self._observe(endpoint, started, error=failed)
+                        if not failed:
+                            self.breaker.record_success()
+                            return response
+                        self.breaker.record_failure()
+                        settled = True
+                        if attempt + 1 >= attempts:
+                            return response
+            except BaseException as e:
+                self._settle(settled, e)
+                raise
+
+            delay = self._backoff(attempt)
+            SAP_RETRIES.labels(endpoint).inc()
+            logger.warning(f"SAP API {endpoint} 暫時失敗，{delay:.2f} 秒後重試")
+            time.sleep(delay)
+
+    def get_purchase_history(self, params: Dict) -> requests.Response:
+        """查詢採購歷史"""
+        return self._request(
+            "GET",
+            "purchase_history",
+            "/api/purchase-history",
+            idempotent=True,
+            params=params,
+        )
+
+    def create_purchase_request(self, order_data: Dict) -> requests.Response:
+        """建立請購單（非冪等，不重試）"""
+        return self._request(
+            "POST",
+            "purchase_request",
+            "/api/purchase-request",
+            idempotent=False,
+            json=order_data,
+        )
+
+    def get_inventory(self, params: Dict) -> requests.Response:
+        """查詢庫存"""
+        return self._request(
+            "GET", "inventory", "/api/inventory", idempotent=True, params=params
+        )
+
+    def get_suppliers(self) -> requests.Response:
+        """查詢供應商"""
+        return self._request("GET", "suppliers", "/api/suppliers", idempotent=True)
+
+    # ---- 非同步請求 ----
+
+    async def _get_async_http_client(self) -> httpx.AsyncClient:
+        """取得目前事件迴圈使用的非同步 HTTP 用戶端（每個事件迴圈各一個）"""
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            entry = self._async_clients.get(loop)
+            if entry is not None:
+                return entry[0]
+            # 已關閉的事件迴圈無法再執行 aclose()，只移除參照
+            for closed in [other for other in self._async_clients if other.is_closed()]:
+                del self._async_clients[closed]
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            lifetime = self._async_client_lifetime(loop, client)
+            self._async_clients[loop] = (client, lifetime)
+        await lifetime.__anext__()
+        return client
+
+    async def _async_client_lifetime(
+        self, loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient
+    ):
+        """讓用戶端隨事件迴圈結束而關閉
+
+        asyncio.run 與 uvicorn 在關閉事件迴圈前會呼叫 loop.shutdown_asyncgens()，
+        結束所有暫停中的 async generator，此時在同一個事件迴圈上關閉用戶端的連線池。
+        """
+        try:
+            yield
+        finally:
+            with self._async_clients_lock:
+                if self._async_clients.get(loop, (None,))[0] is client:
+                    del self._async_clients[loop]
+            await client.aclose()
+
+    async def aclose(self):
+        """關閉目前事件迴圈的非同步 HTTP 用戶端（應用程式結束時呼叫）"""
+        with self._async_clients_lock:
+            entry = self._async_clients.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[1].aclose()
+
+    async def _arequest(
+        self, method: str, endpoint: str, path: str, idempotent: bool, **kwargs
+    ) -> httpx.Response:
+        """送出非同步請求；重試與熔斷規則與同步版本相同"""
+        attempts = self.max_retries + 1 if idempotent else 1
+        client = await self._get_async_http_client()
+        self._add_trace_headers(kwargs)
+        for attempt in range(attempts):
+            self._check_circuit(endpoint)
+            settled = False
+            try:
+                with span(f"sap.{endpoint}", attempt=attempt + 1) as attributes:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.request(
+                            method, path, timeout=self._timeout(endpoint), **kwargs
+                        )
+                    except httpx.TransportError:
+                        self._observe(endpoint, started, error=True)
+                        self.breaker.record_failure()
+                        settled = True
+                        if attempt + 1 >= attempts:
+                            raise
+                    else:
+                        if attributes is not None:
+                            attributes["status"] = response.status_code
+                        failed = response.status_code in RETRYABLE_STATUS_CODES
+                        self._observe(endpoint, started, error=failed)
+                        if not failed:
+                            self.breaker.record_success()
+                            return response
+                        self.breaker.record_failure()
+                        settled = True
+                        if attempt + 1 >= attempts:
+                            return response
+            except BaseException as e:
+                self._settle(settled, e)
+                raise
+
+            delay = self._backoff(attempt)
+            SAP_RETRIES.labels(endpoint).inc()
+            logger.warning(f"SAP API {endpoint} 暫時失敗，{delay:.2f} 秒後重試")
+            await asyncio.sleep(delay)
+
+    async def aget_purchase_history(self, params: Dict) -> httpx.Response:
+        """查詢採購歷史（非同步版本）"""
+        return await self._arequest(
+            "GET",
+            "purchase_history",
+            "/api/purchase-history",
+            idempotent=True,
+            params=params,
+        )
+
+    async def acreate_purchase_request(self, order_data: Dict) -> httpx.Response:
+        """建立請購單（非同步版本，不重試）"""
+        return await self._arequest(
+            "POST",
+            "purchase_request",
+            "/api/purchase-request",
+            idempotent=False,
+            json=order_data,
+        )
+
+    async def aget_inventory(self, params: Dict) -> httpx.Response:
+        """查詢庫存（非同步版本）"""
+        return await self._arequest(
+            "GET", "inventory", "/api/inventory", idempotent=True, params=params
+        )
+
+    async def aget_suppliers(self) -> httpx.Response:
+        """查詢供應商（非同步版本）"""
+        return await self._arequest(
+            "GET", "suppliers", "/api/suppliers", idempotent=True
+        )
+
+    def stats(self) -> Dict:
+        """取得熔斷狀態與各端點延遲統計"""
+        with self._histograms_lock:
+            histograms = dict(self._histograms)
+        return {
+            "transport": "http",
+            "circuit": self.breaker.snapshot(),
+            "endpoints": {
+                endpoint: histogram.snapshot()
+                for endpoint, histogram in histograms.items()
+            },
+        }
+
+
+class InProcessResponse:
+    """程序內呼叫的回應（介面與 HTTP 回應物件相同）"""
+
+    def __init__(self, status_code: int, payload: Dict):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self) -> Dict:
+        return self._payload
+
+
+class InProcessTransport(SAPTransport):
+    """直接呼叫同一行程內 SAP API 查詢函式的傳輸層
+
+    查詢函式與 API 路由共用，回傳內容與 HTTP 回應相同；回傳前會複製一份，
+    避免 Agent 修改會話中的資料時改到 SAP 端的原始資料。
+    """
+
+    def __init__(
+        self,
+        query_purchase_history: Callable[[Dict], Dict],
+        create_purchase_request: Callable[[Dict], Tuple[Dict, int]],
+        query_inventory: Optional[Callable[[Dict], Dict]] = None,
+        query_suppliers: Optional[Callable[[], Dict]] = None,
+    ):
+        self._query_purchase_history = query_purchase_history
+        self._create_purchase_request = create_purchase_request
+        self._query_inventory = query_inventory
+        self._query_suppliers = query_suppliers
+        self._histograms = {
+            "purchase_history": LatencyHistogram(),
+            "purchase_request": LatencyHistogram(),
+            "inventory": LatencyHistogram(),
+            "suppliers": LatencyHistogram(),
+        }
+
+    def _call(self, endpoint: str, func: Callable[[], Tuple[Dict, int]]):
+        with span(f"sap.{endpoint}", transport="in_process") as attributes:
+            started = time.perf_counter()
+            try:
+                payload, status_code = func()
+            except ValueError as e:
+                payload, status_code = {"status": "error", "message": str(e)}, 400
+            if attributes is not None:
+                attributes["status"] = status_code
+        elapsed = time.perf_counter() - started
+        self._histograms[endpoint].observe(elapsed * 1000, error=status_code >= 500)
+        SAP_LATENCY.labels(
+            endpoint, "error" if status_code >= 500 else "success"
+        ).observe(elapsed)
+        return InProcessResponse(status_code, copy.deepcopy(payload))
+
+    def get_purchase_history(self, params: Dict) -> InProcessResponse:
+        return self._call(
+            "purchase_history", lambda: (self._query_purchase_history(params), 200)
+        )
+
+    def create_purchase_request(self, order_data: Dict) -> InProcessResponse:
+        return self._call(
+            "purchase_request", lambda: self._create_purchase_request(order_data)
+        )
+
+    def get_inventory(self, params: Dict) -> InProcessResponse:
+        if self._query_inventory is None:
+            return InProcessResponse(
+                404, {"status": "error", "message": "未提供庫存查詢"}
+            )
+        return self._call("inventory", lambda: (self._query_inventory(params), 200))
+
+    def get_suppliers(self) -> InProcessResponse:
+        if self._query_suppliers is None:
+            return InProcessResponse(
+                404, {"status": "error", "message": "未提供供應商查詢"}
+            )
+        return self._call("suppliers", lambda: (self._query_suppliers(), 200))
+
+    async def aget_purchase_history(self, params: Dict) -> InProcessResponse:
+        # 記憶體查詢不涉及 I/O，直接在事件迴圈中執行
+        return self.get_purchase_history(params)
+
+    async def acreate_purchase_request(self, order_data: Dict) -> InProcessResponse:
+        return self.create_purchase_request(order_data)
+
+    async def aget_inventory(self, params: Dict) -> InProcessResponse:
+        return self.get_inventory(params)
+
+    async def aget_suppliers(self) -> InProcessResponse:
+        return self.get_suppliers()
+
+    def stats(self) -> Dict:
+        return {
+            "transport": "in_process",
+            "endpoints": {
+                endpoint: histogram.snapshot()
+                for endpoint, histogram in self._histograms.items()
+            },
+        }
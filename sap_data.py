@@ -0,0 +1,708 @@
+"""
+SAP 請購系統 - 假 SAP 資料與查詢函式
+
+假 SAP API（app.py）的資料表與不依賴 Flask 的查詢 / 建立函式。
+API 路由與 Agent 的程序內傳輸層（InProcessTransport）共用這些函式；
+獨立成模組後，基準測試等工具不需匯入 app.py（不會建立全域 Agent）即可使用假 SAP 資料。
+"""
+
+import uuid
+from datetime import datetime
+
+from query_engine import IndexedTable
+from sap_client import InProcessTransport
+
+# 假數據 - 3C產品採購歷史
+PURCHASE_HISTORY = [
+    {
+        "purchase_id": "PH001",
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 10,
+        "unit_price": 75000,
+        "total_amount": 750000,
+        "purchase_date": "2024-12-15",
+        "status": "已完成",
+        "requester": "張小明",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH001A",
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 5,
+        "unit_price": 55000,
+        "total_amount": 275000,
+        "purchase_date": "2024-12-12",
+        "status": "已完成",
+        "requester": "王小美",
+        "department": "設計部門",
+    },
+    {
+        "purchase_id": "PH002",
+        "product_name": "iPhone 15 Pro",
+        "category": "智慧型手機",
+        "supplier": "Apple Inc.",
+        "quantity": 25,
+        "unit_price": 35000,
+        "total_amount": 875000,
+        "purchase_date": "2024-12-10",
+        "status": "已完成",
+        "requester": "李小華",
+        "department": "業務部門",
+    },
+    {
+        "purchase_id": "PH003",
+        "product_name": "Dell Monitor 27吋 4K",
+        "category": "顯示器",
+        "supplier": "Dell Technologies",
+        "quantity": 15,
+        "unit_price": 18000,
+        "total_amount": 270000,
+        "purchase_date": "2024-12-05",
+        "status": "已完成",
+        "requester": "王小芳",
+        "department": "設計部門",
+    },
+    {
+        "purchase_id": "PH004",
+        "product_name": "iPad Pro 12.9吋",
+        "category": "平板電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 8,
+        "unit_price": 35000,
+        "total_amount": 280000,
+        "purchase_date": "2024-11-28",
+        "status": "已完成",
+        "requester": "陳小強",
+        "department": "行銷部門",
+    },
+    {
+        "purchase_id": "PH005",
+        "product_name": "Surface Laptop Studio",
+        "category": "筆記型電腦",
+        "supplier": "Microsoft",
+        "quantity": 5,
+        "unit_price": 65000,
+        "total_amount": 325000,
+        "purchase_date": "2024-11-20",
+        "status": "已完成",
+        "requester": "林小美",
+        "department": "研發部門",
+    },
+    {
+        "purchase_id": "PH006",
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 1,
+        "unit_price": 55000,
+        "total_amount": 55000,
+        "purchase_date": "2024-10-15",
+        "status": "已完成",
+        "requester": "廖小魚",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH007",
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 2,
+        "unit_price": 75000,
+        "total_amount": 150000,
+        "purchase_date": "2024-12-17",
+        "status": "已完成",
+        "requester": "王奕翔",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH008",
+        "product_name": "Surface Laptop",
+        "category": "筆記型電腦",
+        "supplier": "Microsoft",
+        "quantity": 5,
+        "unit_price": 45000,
+        "total_amount": 225000,
+        "purchase_date": "2024-11-15",
+        "status": "已完成",
+        "requester": "顧王明",
+        "department": "研發部門",
+    },
+    {
+        "purchase_id": "PH009",
+        "product_name": "Surface Laptop Studio",
+        "category": "筆記型電腦",
+        "supplier": "Microsoft",
+        "quantity": 10,
+        "unit_price": 65000,
+        "total_amount": 650000,
+        "purchase_date": "2024-09-15",
+        "status": "已完成",
+        "requester": "張小龍",
+        "department": "研發部門",
+    },
+    # 新增的10筆資料
+    {
+        "purchase_id": "PH010",
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 8,
+        "unit_price": 55000,
+        "total_amount": 440000,
+        "purchase_date": "2024-12-20",
+        "status": "已完成",
+        "requester": "陳建宏",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH011",
+        "product_name": "MacBook Air 13吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 6,
+        "unit_price": 40000,
+        "total_amount": 240000,
+        "purchase_date": "2024-12-18",
+        "status": "已完成",
+        "requester": "劉志強",
+        "department": "研發部門",
+    },
+    {
+        "purchase_id": "PH012",
+        "product_name": "Surface Pro 9",
+        "category": "平板電腦",
+        "supplier": "Microsoft",
+        "quantity": 12,
+        "unit_price": 38000,
+        "total_amount": 456000,
+        "purchase_date": "2024-12-12",
+        "status": "已完成",
+        "requester": "許雅婷",
+        "department": "業務部門",
+    },
+    {
+        "purchase_id": "PH013",
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 3,
+        "unit_price": 75000,
+        "total_amount": 225000,
+        "purchase_date": "2024-12-08",
+        "status": "已完成",
+        "requester": "楊承翰",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH014",
+        "product_name": "Surface Book 3",
+        "category": "筆記型電腦",
+        "supplier": "Microsoft",
+        "quantity": 4,
+        "unit_price": 58000,
+        "total_amount": 232000,
+        "purchase_date": "2024-12-03",
+        "status": "已完成",
+        "requester": "黃敏慧",
+        "department": "研發部門",
+    },
+    {
+        "purchase_id": "PH015",
+        "product_name": "Surface Studio",
+        "category": "桌上型電腦",
+        "supplier": "Microsoft",
+        "quantity": 2,
+        "unit_price": 85000,
+        "total_amount": 170000,
+        "purchase_date": "2024-11-30",
+        "status": "已完成",
+        "requester": "鄭文傑",
+        "department": "設計部門",
+    },
+    {
+        "purchase_id": "PH016",
+        "product_name": "MacBook Air 15吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 7,
+        "unit_price": 45000,
+        "total_amount": 315000,
+        "purchase_date": "2024-11-25",
+        "status": "已完成",
+        "requester": "吳佳穎",
+        "department": "研發部門",
+    },
+    {
+        "purchase_id": "PH017",
+        "product_name": "Surface Laptop 5",
+        "category": "筆記型電腦",
+        "supplier": "Microsoft",
+        "quantity": 15,
+        "unit_price": 42000,
+        "total_amount": 630000,
+        "purchase_date": "2024-11-18",
+        "status": "已完成",
+        "requester": "謝志明",
+        "department": "業務部門",
+    },
+    {
+        "purchase_id": "PH018",
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 5,
+        "unit_price": 55000,
+        "total_amount": 275000,
+        "purchase_date": "2024-11-10",
+        "status": "已完成",
+        "requester": "李志偉",
+        "department": "IT部門",
+    },
+    {
+        "purchase_id": "PH019",
+        "product_name": "Surface Go 3",
+        "category": "平板電腦",
+        "supplier": "Microsoft",
+        "quantity": 20,
+        "unit_price": 25000,
+        "total_amount": 500000,
+        "purchase_date": "2024-11-05",
+        "status": "已完成",
+        "requester": "張雅雯",
+        "department": "行銷部門",
+    },
+]
+
+# 假數據 - 庫存資訊
+INVENTORY_DATA = [
+    {
+        "product_id": "INV001",
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "current_stock": 15,  # 根據採購歷史：10+2+3=15台
+        "reserved_stock": 3,
+        "available_stock": 12,
+        "min_stock_level": 8,
+        "max_stock_level": 40,
+        "unit_cost": 75000,
+        "location": "倉庫A-1",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV002",
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "current_stock": 14,  # 根據採購歷史：1+8+5=14台
+        "reserved_stock": 2,
+        "available_stock": 12,
+        "min_stock_level": 5,
+        "max_stock_level": 30,
+        "unit_cost": 55000,
+        "location": "倉庫A-1",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV003",
+        "product_name": "MacBook Air 13吋",
+        "category": "筆記型電腦",
+        "current_stock": 6,  # 根據採購歷史：6台
+        "reserved_stock": 1,
+        "available_stock": 5,
+        "min_stock_level": 3,
+        "max_stock_level": 20,
+        "unit_cost": 40000,
+        "location": "倉庫A-2",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV004",
+        "product_name": "MacBook Air 15吋",
+        "category": "筆記型電腦",
+        "current_stock": 7,  # 根據採購歷史：7台
+        "reserved_stock": 1,
+        "available_stock": 6,
+        "min_stock_level": 3,
+        "max_stock_level": 20,
+        "unit_cost": 45000,
+        "location": "倉庫A-2",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV005",
+        "product_name": "Surface Laptop Studio",
+        "category": "筆記型電腦",
+        "current_stock": 15,  # 根據採購歷史：5+10=15台
+        "reserved_stock": 2,
+        "available_stock": 13,
+        "min_stock_level": 5,
+        "max_stock_level": 30,
+        "unit_cost": 65000,
+        "location": "倉庫C-1",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV006",
+        "product_name": "Surface Laptop",
+        "category": "筆記型電腦",
+        "current_stock": 5,  # 根據採購歷史：5台
+        "reserved_stock": 1,
+        "available_stock": 4,
+        "min_stock_level": 3,
+        "max_stock_level": 20,
+        "unit_cost": 45000,
+        "location": "倉庫C-1",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV007",
+        "product_name": "Surface Laptop 5",
+        "category": "筆記型電腦",
+        "current_stock": 15,  # 根據採購歷史：15台
+        "reserved_stock": 3,
+        "available_stock": 12,
+        "min_stock_level": 5,
+        "max_stock_level": 30,
+        "unit_cost": 42000,
+        "location": "倉庫C-1",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV008",
+        "product_name": "Surface Book 3",
+        "category": "筆記型電腦",
+        "current_stock": 4,  # 根據採購歷史：4台
+        "reserved_stock": 1,
+        "available_stock": 3,
+        "min_stock_level": 2,
+        "max_stock_level": 15,
+        "unit_cost": 58000,
+        "location": "倉庫C-2",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV009",
+        "product_name": "Surface Studio",
+        "category": "桌上型電腦",
+        "current_stock": 2,  # 根據採購歷史：2台
+        "reserved_stock": 0,
+        "available_stock": 2,
+        "min_stock_level": 1,
+        "max_stock_level": 8,
+        "unit_cost": 85000,
+        "location": "倉庫C-3",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV010",
+        "product_name": "Surface Pro 9",
+        "category": "平板電腦",
+        "current_stock": 12,  # 根據採購歷史：12台
+        "reserved_stock": 2,
+        "available_stock": 10,
+        "min_stock_level": 5,
+        "max_stock_level": 25,
+        "unit_cost": 38000,
+        "location": "倉庫C-4",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV011",
+        "product_name": "Surface Go 3",
+        "category": "平板電腦",
+        "current_stock": 20,  # 根據採購歷史：20台
+        "reserved_stock": 5,
+        "available_stock": 15,
+        "min_stock_level": 8,
+        "max_stock_level": 40,
+        "unit_cost": 25000,
+        "location": "倉庫C-4",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV012",
+        "product_name": "iPhone 15 Pro",
+        "category": "智慧型手機",
+        "current_stock": 25,  # 根據採購歷史：25台
+        "reserved_stock": 5,
+        "available_stock": 20,
+        "min_stock_level": 10,
+        "max_stock_level": 50,
+        "unit_cost": 35000,
+        "location": "倉庫A-3",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV013",
+        "product_name": "iPad Pro 12.9吋",
+        "category": "平板電腦",
+        "current_stock": 8,  # 根據採購歷史：8台
+        "reserved_stock": 1,
+        "available_stock": 7,
+        "min_stock_level": 3,
+        "max_stock_level": 20,
+        "unit_cost": 35000,
+        "location": "倉庫A-4",
+        "last_updated": "2025-01-15",
+    },
+    {
+        "product_id": "INV014",
+        "product_name": "Dell Monitor 27吋 4K",
+        "category": "顯示器",
+        "current_stock": 15,  # 根據採購歷史：15台
+        "reserved_stock": 2,
+        "available_stock": 13,
+        "min_stock_level": 5,
+        "max_stock_level": 30,
+        "unit_cost": 18000,
+        "location": "倉庫B-1",
+        "last_updated": "2025-01-15",
+    },
+]
+
+# 假數據 - 請購單（依請購單號索引，支援申請人、部門與狀態篩選）
+PURCHASE_REQUESTS = IndexedTable(
+    "request_id", text_fields=("requester", "department", "status")
+)
+
+# 假數據 - 採購單（依採購單號索引，支援供應商與狀態篩選）
+PURCHASE_ORDERS = IndexedTable("order_id", text_fields=("supplier_id", "status"))
+
+# 假數據 - 供應商資訊
+SUPPLIERS = {
+    "Apple Inc.": {
+        "supplier_id": "SUP001",
+        "supplier_name": "Apple Inc.",
+        "contact_person": "張經理",
+        "contact_phone": "02-1234-5678",
+        "contact_email": "apple@supplier.com",
+        "address": "台北市信義區信義路五段100號",
+        "payment_terms": "30天付款",
+        "delivery_time": "5-7個工作天",
+        "rating": 4.8,
+    },
+    "Microsoft": {
+        "supplier_id": "SUP002",
+        "supplier_name": "Microsoft",
+        "contact_person": "李經理",
+        "contact_phone": "02-2345-6789",
+        "contact_email": "microsoft@supplier.com",
+        "address": "台北市中山區南京東路二段200號",
+        "payment_terms": "30天付款",
+        "delivery_time": "7-10個工作天",
+        "rating": 4.7,
+    },
+    "Dell Technologies": {
+        "supplier_id": "SUP003",
+        "supplier_name": "Dell Technologies",
+        "contact_person": "王經理",
+        "contact_phone": "02-3456-7890",
+        "contact_email": "dell@supplier.com",
+        "address": "台北市松山區敦化北路300號",
+        "payment_terms": "45天付款",
+        "delivery_time": "10-14個工作天",
+        "rating": 4.6,
+    },
+}
+
+# 查詢索引 - 採購歷史、庫存與供應商
+PURCHASE_HISTORY_TABLE = IndexedTable(
+    "purchase_id",
+    text_fields=("category", "supplier"),
+    range_fields=("purchase_date",),
+    rows=PURCHASE_HISTORY,
+)
+INVENTORY_TABLE = IndexedTable(
+    "product_id", text_fields=("category", "location"), rows=INVENTORY_DATA
+)
+SUPPLIER_TABLE = IndexedTable("supplier_id", rows=SUPPLIERS.values())
+
+
+# 列表查詢單頁筆數上限
+MAX_PAGE_SIZE = 1000
+
+
+def _page_options(params) -> dict:
+    """解析列表查詢的分頁、排序與欄位投影參數
+
+    - limit: 每頁筆數（未指定時回傳全部）
+    - cursor: 上一頁回傳的 next_cursor
+    - sort: 排序欄位，前綴 "-" 表示遞減（例如 -purchase_date）
+    - fields: 以逗號分隔的回傳欄位
+    - include_total: 設為 false 時不計算總筆數
+    """
+    limit = params.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit 必須為 1 到 {MAX_PAGE_SIZE} 之間的整數")
+
+    fields = [f.strip() for f in params.get("fields", "").split(",") if f.strip()]
+
+    return {
+        "sort": params.get("sort") or None,
+        "limit": limit,
+        "cursor": params.get("cursor") or None,
+        "fields": fields or None,
+        "with_total": params.get("include_total", "true").lower() != "false",
+    }
+
+
+def _page_payload(message: str, total_key: str, page: dict) -> dict:
+    """組合列表查詢回應（未計算總筆數時省略總數欄位）"""
+    payload = {
+        "status": "success",
+        "message": message,
+        "data": page["data"],
+        "next_cursor": page["next_cursor"],
+    }
+    if page["total"] is not None:
+        payload[total_key] = page["total"]
+    return payload
+
+
+def query_purchase_history(params) -> dict:
+    """查詢採購歷史（依類別、供應商與日期範圍篩選）"""
+    page = PURCHASE_HISTORY_TABLE.query(
+        contains={
+            "category": params.get("category"),
+            "supplier": params.get("supplier"),
+        },
+        ranges={
+            "purchase_date": (
+                params.get("start_date") or None,
+                params.get("end_date") or None,
+            )
+        },
+        **_page_options(params),
+    )
+    return _page_payload("成功取得採購歷史", "total_records", page)
+
+
+def query_inventory(params) -> dict:
+    """查詢庫存（依類別、倉庫位置篩選，並可只列出低庫存商品）"""
+    options = _page_options(params)
+    conditions = {
+        "contains": {
+            "category": params.get("category"),
+            "location": params.get("location"),
+        },
+        "where": (lambda i: i["available_stock"] <= i["min_stock_level"])
+        if params.get("low_stock", "").lower() == "true"
+        else None,
+    }
+    page = INVENTORY_TABLE.query(**conditions, **options)
+    payload = _page_payload("成功取得庫存資訊", "total_items", page)
+
+    # 計算總庫存價值（與總筆數相同，不需要時可略過）
+    if options["with_total"]:
+        payload["total_inventory_value"] = sum(
+            item["current_stock"] * item["unit_cost"]
+            for item in INVENTORY_TABLE.select(**conditions)
+        )
+    return payload
+
+
+def create_purchase_request_record(data) -> tuple:
+    """建立請購單，回傳 (回應內容, HTTP 狀態碼)"""
+    try:
+        # 驗證必要欄位
+        required_fields = [
+            "product_name",
+            "quantity",
+            "unit_price",
+            "requester",
+            "department",
+        ]
+        for field in required_fields:
+            if field not in data:
+                return {"status": "error", "message": f"缺少必要欄位: {field}"}, 400
+
+        # 生成請購單ID
+        request_id = (
+            f"PR{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:6].upper()}"
+        )
+
+        # 創建請購單
+        purchase_request = {
+            "request_id": request_id,
+            "product_name": data["product_name"],
+            "category": data.get("category", "3C產品"),
+            "quantity": data["quantity"],
+            "unit_price": data["unit_price"],
+            "total_amount": data["quantity"] * data["unit_price"],
+            "requester": data["requester"],
+            "department": data["department"],
+            "reason": data.get("reason", ""),
+            "urgent": data.get("urgent", False),
+            "expected_delivery_date": data.get("expected_delivery_date", ""),
+            "status": "待審核",
+            "created_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "approval_status": "pending",
+            "current_approver": "直屬主管",
+            "tracking_number": f"TRK-{request_id}",
+        }
+
+        # 儲存請購單
+        PURCHASE_REQUESTS.insert(purchase_request)
+
+        return {
+            "status": "success",
+            "message": "請購單創建成功",
+            "request_id": request_id,
+            "data": purchase_request,
+        }, 201
+
+    except Exception as e:
+        return {"status": "error", "message": f"創建請購單失敗: {str(e)}"}, 500
+
+
+def query_purchase_requests(params) -> dict:
+    """查詢請購單（依申請人、部門與狀態篩選）"""
+    page = PURCHASE_REQUESTS.query(
+        contains={
+            "requester": params.get("requester"),
+            "department": params.get("department"),
+            "status": params.get("status"),
+        },
+        **_page_options(params),
+    )
+    return _page_payload("成功取得所有請購單", "total_requests", page)
+
+
+def query_suppliers() -> dict:
+    """查詢所有供應商"""
+    return {
+        "status": "success",
+        "message": "成功取得供應商資訊",
+        "total_suppliers": len(SUPPLIERS),
+        "data": list(SUPPLIERS.values()),
+    }
+
+
+def query_purchase_orders(params) -> dict:
+    """查詢採購單（依供應商與狀態篩選）"""
+    page = PURCHASE_ORDERS.query(
+        contains={
+            "supplier_id": params.get("supplier"),
+            "status": params.get("status"),
+        },
+        **_page_options(params),
+    )
+    return _page_payload("成功取得所有採購單", "total_orders", page)
+
+
+def in_process_transport() -> InProcessTransport:
+    """以假 SAP 資料建立 Agent 的程序內傳輸層"""
+    return InProcessTransport(
+        query_purchase_history=query_purchase_history,
+        create_purchase_request=create_purchase_request_record,
+        query_inventory=query_inventory,
+        query_suppliers=query_suppliers,
+    )
@@ -0,0 +1,221 @@
+"""
+SAP 請購系統 AI Agent - 會話並行控制
+
+1. SessionLocks：依 session_id 雜湊分配到固定數量的鎖（lock striping），
+   同一會話的回合嚴格依序執行，不同會話可平行處理，記憶體用量不隨會話數增長
+2. FifoLock：依到達順序交出的鎖，執行緒與事件迴圈中的協程可同時等待，
+   釋放時直接交給最早等待者（不需輪詢，回合依到達順序處理）
+3. SingleFlight：相同的請求在處理中時，後到者直接等待並共用進行中的結果
+"""
+
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+
+class _Waiter:
+    """等待鎖的執行緒（event）或協程（loop + future）"""
+
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(
+        self,
+        event: Optional[threading.Event] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        future: Optional[asyncio.Future] = None,
+    ):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FifoLock:
+    """依到達順序交出的鎖
+
+    鎖被持有時，後到的執行緒與協程依序排隊；釋放時直接把鎖交給最早的等待者，
+    不會被剛到達的請求插隊。協程等待時不佔住事件迴圈。
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locked = False
+        self._waiters: Deque[_Waiter] = deque()
+
+    def locked(self) -> bool:
+        return self._locked
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """在執行緒中取得鎖（blocking=False 時鎖被佔用即回傳 False）"""
+        with self._mutex:
+            if not self._locked:
+                self._locked = True
+                return True
+            if not blocking:
+                return False
+            waiter = _Waiter(event=threading.Event())
+            self._waiters.append(waiter)
+        waiter.event.wait()
+        return True
+
+    async def acquire_async(self) -> bool:
+        """在事件迴圈中取得鎖，回傳是否曾需要等待"""
+        loop = asyncio.get_running_loop()
+        with self._mutex:
+            if not self._locked:
+                self._locked = True
+                return False
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise
+            # 取消前鎖已交給此等待者，轉交給下一位
+            self.release()
+            raise
+        return True
+
+    def release(self):
+        """釋放鎖；有等待者時直接交給最早的等待者"""
+        while True:
+            with self._mutex:
+                if not self._locked:
+                    raise RuntimeError("release() 呼叫於未持有的鎖")
+                if not self._waiters:
+                    self._locked = False
+                    return
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+            if waiter.event is not None:
+                waiter.event.set()
+                return
+            try:
+                waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+                return
+            except RuntimeError:
+                # 等待者的事件迴圈已關閉，改交給下一位
+                continue
+
+
+class SessionLocks:
+    """依會話分段的鎖（lock striping，每個分段為依到達順序交出的 FifoLock）"""
+
+    def __init__(self, stripes: int = 256):
+        if stripes < 1:
+            raise ValueError("stripes 必須大於 0")
+        self._locks = [FifoLock() for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self._stats = {"acquired": 0, "contended": 0}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def lock_for(self, session_id: str) -> FifoLock:
+        """取得會話對應的鎖"""
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    def _record(self, contended: bool):
+        with self._stats_lock:
+            self._stats["acquired"] += 1
+            if contended:
+                self._stats["contended"] += 1
+
+    @contextmanager
+    def hold(self, session_id: str):
+        """在同步程式中持有會話鎖"""
+        lock = self.lock_for(session_id)
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            lock.acquire()
+        self._record(contended)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    @asynccontextmanager
+    async def ahold(self, session_id: str):
+        """在事件迴圈中持有會話鎖（等待時不佔住事件迴圈，依到達順序取得）"""
+        lock = self.lock_for(session_id)
+        contended = await lock.acquire_async()
+        self._record(contended)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self) -> Dict:
+        """取得鎖使用統計"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["stripes"] = len(self._locks)
+        return stats
+
+
+class SingleFlight:
+    """合併處理中的重複請求
+
+    claim() 可帶入 group（例如 session_id）：相同的請求只有在處理中的那一次仍是
+    該組最後到達的請求時才會合併；中間已有其他請求到達時（例如「同意」、其他訊息、
+    再一次「同意」），後到的請求依到達順序重新執行，不會拿到較早回合的結果。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._latest: Dict[Hashable, Future] = {}
+        self._owners: Dict[Future, Tuple[Hashable, Hashable]] = {}
+        self._stats = {"leaders": 0, "shared": 0}
+
+    def claim(self, key: Hashable, group: Hashable = None) -> Tuple[Future, bool]:
+        """登記請求；回傳 (結果 Future, 是否由呼叫端負責執行)
+
+        由呼叫端執行時，完成後需以取得的 Future 呼叫 resolve()。
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None and (
+                group is None or self._latest.get(group) is future
+            ):
+                self._stats["shared"] += 1
+                return future, False
+
+            future = Future()
+            self._inflight[key] = future
+            self._owners[future] = (key, group)
+            if group is not None:
+                self._latest[group] = future
+            self._stats["leaders"] += 1
+            return future, True
+
+    def resolve(self, future: Future, result=None, error: BaseException = None):
+        """設定請求結果並移除登記，等待中的請求會取得相同結果"""
+        with self._lock:
+            key, group = self._owners.pop(future)
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if group is not None and self._latest.get(group) is future:
+                del self._latest[group]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> Dict:
+        """取得合併統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["inflight"] = len(self._owners)
+        return stats
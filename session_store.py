@@ -0,0 +1,311 @@
+"""
+SAP 請購系統 AI Agent - 會話狀態儲存
+
+提供可替換的會話儲存後端：
+1. InMemorySessionStore：記憶體 LRU，限制會話數量並淘汰閒置過久的會話
+2. SQLiteSessionStore：SQLite 持久化，適合需要重啟後保留會話的部署
+
+閒置時間以會話最後一次寫入（即最後一次對話回合）起算，讀取不會延長會話壽命。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from choose_state import ConversationState
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """會話狀態儲存介面"""
+
+    # 讀寫是否會阻塞（例如磁碟 I/O）；非同步流程據此決定是否交由執行緒池執行
+    blocking_io = False
+
+    def __init__(self, max_sessions: int, idle_ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "deletes": 0,
+            "evicted_lru": 0,
+            "evicted_idle": 0,
+        }
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """取得會話狀態，不存在或已過期時回傳 None（不會建立新會話）"""
+
+    @abstractmethod
+    def put(self, session_id: str, state: Dict):
+        """寫入會話狀態"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """刪除會話，回傳是否確實刪除"""
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        """列出目前所有未過期的會話 ID"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """目前儲存的會話數量"""
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def metrics(self) -> Dict:
+        """取得儲存統計資訊"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = len(self)
+        stats["max_sessions"] = self.max_sessions
+        stats["idle_ttl_seconds"] = self.idle_ttl_seconds
+        stats["backend"] = type(self).__name__
+        return stats
+
+
+class InMemorySessionStore(SessionStore):
+    """記憶體 LRU + 閒置 TTL 會話儲存"""
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl_seconds: float = 3600):
+        super().__init__(max_sessions, idle_ttl_seconds)
+        # session_id -> (最後寫入時間, 狀態)，依最近使用排序
+        self._sessions: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        # session_id -> 最後寫入時間，依寫入順序排序（讀取會改變 LRU 順序但不延長壽命，
+        # 閒置淘汰需以寫入順序判斷）
+        self._write_order: "OrderedDict[str, float]" = OrderedDict()
+
+    def _remove(self, session_id: str):
+        """移除會話（呼叫端需持有鎖）"""
+        del self._sessions[session_id]
+        del self._write_order[session_id]
+
+    def _evict_idle(self, now: float):
+        """淘汰閒置過久的會話（呼叫端需持有鎖）
+
+        從最早寫入的會話開始檢查，遇到第一個未過期的會話即停止，
+        每次只花費與過期會話數量成正比的時間。
+        """
+        evicted = 0
+        while self._write_order:
+            session_id, last_write = next(iter(self._write_order.items()))
+            if now - last_write <= self.idle_ttl_seconds:
+                break
+            self._remove(session_id)
+            evicted += 1
+        self._stats["evicted_idle"] += evicted
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            last_write, state = entry
+            if time.time() - last_write > self.idle_ttl_seconds:
+                self._remove(session_id)
+                self._stats["evicted_idle"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._sessions.move_to_end(session_id)
+            self._stats["hits"] += 1
+            return state
+
+    def put(self, session_id: str, state: Dict):
+        now = time.time()
+        with self._lock:
+            is_new = session_id not in self._sessions
+            self._sessions[session_id] = (now, state)
+            self._sessions.move_to_end(session_id)
+            self._write_order[session_id] = now
+            self._write_order.move_to_end(session_id)
+            self._stats["writes"] += 1
+
+            if is_new:
+                # 只有新增會話時才需要檢查容量與閒置淘汰
+                self._evict_idle(now)
+                while len(self._sessions) > self.max_sessions:
+                    session_id, _ = self._sessions.popitem(last=False)
+                    del self._write_order[session_id]
+                    self._stats["evicted_lru"] += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            self._stats["deletes"] += 1
+            return True
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            self._evict_idle(time.time())
+            return list(self._sessions.keys())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite 持久化會話儲存"""
+
+    blocking_io = True
+
+    # 每寫入多少次才執行一次淘汰檢查
+    _EVICT_INTERVAL = 64
+
+    def __init__(
+        self,
+        db_path: str = ".cache/sessions.sqlite",
+        max_sessions: int = 100000,
+        idle_ttl_seconds: float = 86400,
+    ):
+        super().__init__(max_sessions, idle_ttl_seconds)
+        self.db_path = db_path
+        self._writes_since_evict = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                last_write REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sessions_last_write ON sessions (last_write)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _dumps(state: Dict) -> str:
+        return json.dumps(state, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _loads(value: str) -> Dict:
+        state = json.loads(value)
+        if state.get("conversation_state"):
+            state["conversation_state"] = ConversationState(state["conversation_state"])
+        return state
+
+    def _evict(self, now: float):
+        """淘汰閒置過久與超出容量的會話（呼叫端需持有鎖）"""
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE last_write < ?", (now - self.idle_ttl_seconds,)
+        )
+        self._stats["evicted_idle"] += cursor.rowcount
+
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        overflow = count - self.max_sessions
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM sessions WHERE session_id IN (
+                    SELECT session_id FROM sessions ORDER BY last_write ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self._stats["evicted_lru"] += overflow
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, last_write FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            value, last_write = row
+            if time.time() - last_write > self.idle_ttl_seconds:
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+                )
+                self._conn.commit()
+                self._stats["evicted_idle"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            return self._loads(value)
+
+    def put(self, session_id: str, state: Dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, last_write) VALUES (?, ?, ?)",
+                (session_id, self._dumps(state), now),
+            )
+            self._conn.commit()
+            self._stats["writes"] += 1
+
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self._EVICT_INTERVAL:
+                self._writes_since_evict = 0
+                self._evict(now)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+            self._conn.commit()
+            if cursor.rowcount:
+                self._stats["deletes"] += 1
+            return bool(cursor.rowcount)
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id FROM sessions WHERE last_write >= ? ORDER BY last_write",
+                (time.time() - self.idle_ttl_seconds,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return count
+
+
+def create_session_store(
+    backend: str = "memory",
+    max_sessions: int = 10000,
+    idle_ttl_seconds: float = 3600,
+    db_path: str = ".cache/sessions.sqlite",
+) -> SessionStore:
+    """依設定建立會話儲存後端"""
+    if backend == "memory":
+        return InMemorySessionStore(
+            max_sessions=max_sessions, idle_ttl_seconds=idle_ttl_seconds
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            db_path=db_path,
+            max_sessions=max_sessions,
+            idle_ttl_seconds=idle_ttl_seconds,
+        )
+    raise ValueError(f"不支援的會話儲存後端: {backend}")
@@ -0,0 +1,169 @@
+"""
+SAP 請購系統 AI Agent - 推測性預先計算
+
+推薦送出後，使用者最常見的下一步是「同意」。SpeculativeExecutor 在背景以
+有上限的執行緒池預先執行下一步需要的工作（擷取確認產品、查詢供應商與庫存），
+使用者確認時直接取用結果；使用者改為調整推薦時則丟棄。
+
+1. start()：以鍵值（通常是 session_id）登記一項推測工作，同一鍵值的舊工作會被取代；
+   執行中與排隊中的工作數達上限時不再接受新的推測（不影響正常流程），
+   保留的結果超過上限時丟棄最舊的結果
+2. take()：取出結果；工作尚未完成時最多等待 timeout 秒，逾時或失敗視為未命中，
+   由呼叫端自行計算（atake() 為非同步版本，等待時不佔住事件迴圈）
+3. discard()：丟棄不再需要的推測結果
+
+stats() 提供命中率（命中 / (命中 + 未命中)）與丟棄、拒絕、失敗次數。
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeExecutor:
+    """有上限的推測工作執行緒池"""
+
+    def __init__(
+        self, max_workers: int = 4, max_pending: int = 64, max_entries: int = 1024
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers 必須大於 0")
+        self.max_pending = max_pending
+        # 保留的推測結果上限（使用者未回覆的會話不會無限累積）
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="speculative"
+        )
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, Future] = {}
+        self._running = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "started": 0,
+            "rejected": 0,
+            "hits": 0,
+            "misses": 0,
+            "discarded": 0,
+            "errors": 0,
+        }
+
+    def start(self, key: Hashable, func: Callable[[], object]) -> bool:
+        """登記推測工作；回傳是否已排入執行緒池"""
+        self.discard(key)
+        with self._lock:
+            accepted = self._running < self.max_pending
+            if accepted:
+                self._running += 1
+        self._record("started" if accepted else "rejected")
+        if not accepted:
+            return False
+
+        future = self._pool.submit(self._run, func)
+        # 完成、失敗或被取消時都釋放名額
+        future.add_done_callback(self._finished)
+        with self._lock:
+            self._futures[key] = future
+            evicted = []
+            while len(self._futures) > self.max_entries:
+                oldest = next(iter(self._futures))
+                evicted.append(self._futures.pop(oldest))
+        if evicted:
+            self._record("discarded", len(evicted))
+        for stale in evicted:
+            stale.cancel()
+        return True
+
+    def _finished(self, future: Future):
+        with self._lock:
+            self._running -= 1
+
+    def _run(self, func: Callable[[], object]):
+        try:
+            return func()
+        except Exception as e:
+            self._record("errors")
+            logger.warning(f"推測性預先計算失敗: {e}")
+            raise
+
+    def take(
+        self,
+        key: Hashable,
+        timeout: float = 0.0,
+        accept: Optional[Callable[[object], bool]] = None,
+    ) -> Optional[object]:
+        """取出推測結果；沒有可用結果或 accept 判斷結果已過時時回傳 None（計為未命中）"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        return self._resolve(future, timeout, accept)
+
+    async def atake(
+        self,
+        key: Hashable,
+        timeout: float = 0.0,
+        accept: Optional[Callable[[object], bool]] = None,
+    ) -> Optional[object]:
+        """取出推測結果（非同步版本，等待工作完成時不佔住事件迴圈）"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), timeout
+                )
+            except Exception:  # 逾時或執行失敗，由 _resolve 計為未命中
+                pass
+        return self._resolve(future, 0.0, accept)
+
+    def _resolve(
+        self,
+        future: Optional[Future],
+        timeout: float,
+        accept: Optional[Callable[[object], bool]],
+    ) -> Optional[object]:
+        if future is None:
+            self._record("misses")
+            return None
+        try:
+            result = future.result(timeout=timeout)
+        except Exception:  # 逾時、已取消或執行失敗
+            future.cancel()
+            self._record("misses")
+            return None
+        if accept is not None and not accept(result):
+            self._record("misses")
+            return None
+        self._record("hits")
+        return result
+
+    def discard(self, key: Hashable) -> bool:
+        """丟棄推測工作（尚未開始的工作不會執行）"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is None:
+            return False
+        self._record("discarded")
+        future.cancel()
+        return True
+
+    def _record(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def shutdown(self):
+        """停止執行緒池（不等待執行中的推測工作）"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        """取得推測統計"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._lock:
+            stats["pending"] = len(self._futures)
+            stats["running"] = self._running
+        used = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / used, 4) if used else 0.0
+        return stats
@@ -0,0 +1,159 @@
+"""
+非同步對話流程（achat）測試
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from benchmarks.fake_llm_server import FakeLLMConfig, start_server
+from choose_state import ConversationState
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig
+from sap_client import InProcessTransport
+from session_store import SQLiteSessionStore
+
+PURCHASE_HISTORY = [
+    {
+        "product_name": "Dell 27吋 4K 螢幕",
+        "category": "顯示器",
+        "supplier": "Dell Technologies",
+        "quantity": 2,
+        "unit_price": 12000,
+        "purchase_date": "2024-03-01",
+        "department": "IT部門",
+    }
+]
+
+
+@pytest.fixture
+def llm_url():
+    server, url = start_server(FakeLLMConfig(ttft_ms=0, tokens_per_second=0))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def _agent(url: str, transport: InProcessTransport, session_store=None, **config):
+    return ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="fake",
+            openai_base_url=url,
+            llm_cache_enabled=False,
+            speculation_enabled=False,
+            **config,
+        ),
+        sap_transport=transport,
+        session_store=session_store,
+    )
+
+
+def test_new_request_history_matches_sync_path(llm_url):
+    """預取範圍內沒有該類別的記錄時，非同步流程補查該類別，採購歷史與同步流程相同"""
+    rows = [
+        dict(PURCHASE_HISTORY[0], purchase_date=f"2024-12-{index % 28 + 1:02d}")
+        for index in range(1200)
+    ] + [
+        {
+            "product_name": "iPad Air",
+            "category": "平板",
+            "supplier": "Apple Inc.",
+            "quantity": 3,
+            "unit_price": 20000,
+            "purchase_date": "2023-01-10",
+            "department": "業務部門",
+        }
+    ]
+    queries = []
+
+    def query(params):
+        queries.append(params.get("category"))
+        category = params.get("category")
+        data = [row for row in rows if not category or category in row["category"]]
+        data.sort(key=lambda row: row["purchase_date"], reverse=True)
+        return {"data": data[: int(params["limit"])]}
+
+    def transport():
+        return InProcessTransport(
+            query_purchase_history=query,
+            create_purchase_request=lambda order: ({"status": "success"}, 201),
+        )
+
+    config = {"fast_recommend_enabled": False, "direct_order_enabled": False}
+    sync_agent = _agent(llm_url, transport(), **config)
+    async_agent = _agent(llm_url, transport(), **config)
+
+    sync_agent.chat("我想買平板", "s1")
+    asyncio.run(async_agent.achat("我想買平板", "s1"))
+
+    sync_state = sync_agent.get_session_status("s1")
+    async_state = async_agent.get_session_status("s1")
+    assert [item["product_name"] for item in async_state["purchase_history"]] == [
+        "iPad Air"
+    ]
+    assert async_state["purchase_history"] == sync_state["purchase_history"]
+    assert async_state["selected_product"] == sync_state["selected_product"]
+    assert queries == ["平板", None, "平板"]
+
+
+def test_achat_runs_confirmation_and_order_details_on_the_event_loop(llm_url, tmp_path):
+    """非同步對話的確認推薦與收集請購資訊不交由執行緒池；只有 SQLite 讀寫在執行緒池執行"""
+    sap_threads = []
+    store_threads = []
+
+    def query_inventory(params):
+        sap_threads.append(threading.current_thread())
+        return {
+            "data": [
+                {
+                    "product_name": "Dell 27吋 4K 螢幕",
+                    "available_stock": 5,
+                    "location": "台北倉",
+                }
+            ]
+        }
+
+    def query_suppliers():
+        sap_threads.append(threading.current_thread())
+        return {"data": []}
+
+    store = SQLiteSessionStore(db_path=str(tmp_path / "sessions.sqlite"))
+    put = store.put
+
+    def recording_put(session_id, state):
+        store_threads.append(threading.current_thread())
+        put(session_id, state)
+
+    store.put = recording_put
+    agent = _agent(
+        llm_url,
+        InProcessTransport(
+            query_purchase_history=lambda params: {"data": PURCHASE_HISTORY},
+            create_purchase_request=lambda order: ({"status": "success"}, 201),
+            query_inventory=query_inventory,
+            query_suppliers=query_suppliers,
+        ),
+        session_store=store,
+    )
+
+    async def conversation():
+        await agent.achat("我想買螢幕，預算2萬", "s1")
+        confirmed = await agent.achat("同意", "s1")
+        details = await agent.achat(
+            "數量：2台，請購人：王小明，交貨日期：2099-12-01", "s1"
+        )
+        return confirmed, details
+
+    confirmed, details = asyncio.run(conversation())
+
+    assert "可用 5 件" in confirmed
+    assert "資料收集完成" in details
+    assert (
+        agent.get_session_status("s1")["conversation_state"]
+        == ConversationState.CONFIRMING_ORDER
+    )
+    assert sap_threads and all(
+        thread is threading.main_thread() for thread in sap_threads
+    )
+    assert len(store_threads) == 3
+    assert not any(thread is threading.main_thread() for thread in store_threads)
@@ -0,0 +1,153 @@
+"""
+跨會話微批次測試
+"""
+
+import asyncio
+import threading
+import time
+
+from batching import MicroBatcher
+
+
+class RecordingBatch:
+    """記錄每次批次輸入的 batch 函式"""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    def __call__(self, batch_inputs):
+        self.batches.append(list(batch_inputs))
+        return [
+            ValueError("bad") if item["text"] == self.fail_on else item["text"].upper()
+            for item in batch_inputs
+        ]
+
+
+def test_concurrent_requests_share_one_batch():
+    """時間窗內的並行請求合併為一個批次，相同輸入只送出一次"""
+    batch_fn = RecordingBatch()
+    batcher = MicroBatcher(batch_fn, window_ms=50, max_batch_size=10)
+    results = {}
+
+    def worker(index, text):
+        results[index] = batcher.invoke({"text": text})
+
+    threads = [
+        threading.Thread(target=worker, args=(i, text))
+        for i, text in enumerate(["a", "b", "a", "c"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {0: "A", 1: "B", 2: "A", 3: "C"}
+    assert len(batch_fn.batches) == 1
+    assert len(batch_fn.batches[0]) == 3
+    stats = batcher.stats()
+    assert stats["requests"] == 4
+    assert stats["llm_calls"] == 3
+    assert stats["deduplicated"] == 1
+
+
+def test_full_batch_is_sent_before_window_ends():
+    """累積到批次上限時不等時間窗結束"""
+    batch_fn = RecordingBatch()
+    batcher = MicroBatcher(batch_fn, window_ms=5000, max_batch_size=2)
+
+    started = time.perf_counter()
+    first = batcher.submit({"text": "x"})
+    second = batcher.submit({"text": "y"})
+
+    assert (first.result(timeout=1), second.result(timeout=1)) == ("X", "Y")
+    assert time.perf_counter() - started < 1
+
+
+def test_single_request_waits_at_most_one_window():
+    """單獨的請求在時間窗結束時送出"""
+    batcher = MicroBatcher(RecordingBatch(), window_ms=20, max_batch_size=10)
+
+    started = time.perf_counter()
+    assert batcher.invoke({"text": "solo"}) == "SOLO"
+    assert time.perf_counter() - started < 1
+    assert batcher.stats()["max_wait_ms"] < 1000
+
+
+def test_failed_item_only_affects_its_callers():
+    """批次中個別失敗的項目只影響對應的請求"""
+    batcher = MicroBatcher(
+        RecordingBatch(fail_on="bad"), window_ms=5000, max_batch_size=2
+    )
+
+    ok = batcher.submit({"text": "ok"})
+    bad = batcher.submit({"text": "bad"})
+
+    assert ok.result(timeout=1) == "OK"
+    assert isinstance(bad.exception(timeout=1), ValueError)
+    assert batcher.stats()["errors"] == 1
+
+
+def test_async_callers_join_the_same_batch():
+    """非同步呼叫端共用批次且不阻塞事件迴圈"""
+    batch_fn = RecordingBatch()
+    batcher = MicroBatcher(batch_fn, window_ms=30, max_batch_size=10)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.ainvoke({"text": "p"}), batcher.ainvoke({"text": "q"})
+        )
+
+    assert asyncio.run(run()) == ["P", "Q"]
+    assert len(batch_fn.batches) == 1
+
+
+def test_full_batch_runs_off_the_event_loop():
+    """達上限的批次在背景執行緒送出，不佔住呼叫端的事件迴圈"""
+    threads = []
+
+    def slow_batch(batch_inputs):
+        threads.append(threading.current_thread())
+        time.sleep(0.2)
+        return [item["text"].upper() for item in batch_inputs]
+
+    batcher = MicroBatcher(slow_batch, window_ms=5000, max_batch_size=2)
+
+    async def run():
+        ticks = []
+
+        async def ticker():
+            while len(ticks) < 5:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        results = await asyncio.gather(
+            batcher.ainvoke({"text": "p"}), batcher.ainvoke({"text": "q"}), ticker()
+        )
+        return results[:2], ticks
+
+    results, ticks = asyncio.run(run())
+    assert results == ["P", "Q"]
+    assert threads and threads[0] is not threading.main_thread()
+    assert ticks[-1] - ticks[0] < 0.15
+
+
+def test_stats_stay_consistent_under_concurrent_submits():
+    """多執行緒同時送出時，統計數字不會遺失或互相矛盾"""
+    batcher = MicroBatcher(RecordingBatch(), window_ms=1, max_batch_size=4)
+
+    def worker(index):
+        for n in range(50):
+            batcher.invoke({"text": f"{index}-{n % 3}"})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = batcher.stats()
+    assert stats["requests"] == 400
+    assert stats["pending"] == 0
+    assert stats["llm_calls"] + stats["deduplicated"] == 400
+    assert stats["avg_batch_size"] == round(400 / stats["batches"], 2)
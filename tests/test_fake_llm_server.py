@@ -0,0 +1,179 @@
+"""
+本地假 LLM 伺服器測試
+"""
+
+import http.client
+import json
+from urllib.parse import urlparse
+
+from benchmarks.fake_llm_server import FakeLLMConfig, start_server
+from purchase_agent import (
+    ConversationalPurchaseAgent,
+    ConversationState,
+    PurchaseAgentConfig,
+)
+from sap_client import InProcessTransport
+
+PURCHASE_HISTORY = [
+    {
+        "product_name": "Dell 27吋 4K 螢幕",
+        "category": "顯示器",
+        "supplier": "Dell Technologies",
+        "quantity": 2,
+        "unit_price": 12000,
+        "purchase_date": "2024-03-01",
+        "department": "IT部門",
+    }
+]
+
+
+def _post(url: str, payload: dict):
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=10)
+    connection.request(
+        "POST",
+        f"{parsed.path}/chat/completions",
+        body=json.dumps(payload),
+        headers={"Content-Type": "application/json"},
+    )
+    response = connection.getresponse()
+    return response.status, response.read().decode("utf-8")
+
+
+def test_agent_runs_recommendation_flow_against_fake_server():
+    """Agent 以 openai_base_url 指向假伺服器，各鏈都取得可解析的回應"""
+    server, url = start_server(FakeLLMConfig(ttft_ms=1, tokens_per_second=0))
+    try:
+        agent = ConversationalPurchaseAgent(
+            PurchaseAgentConfig(
+                openai_api_key="fake",
+                openai_base_url=url,
+                llm_cache_enabled=False,
+                speculation_enabled=False,
+            ),
+            sap_transport=InProcessTransport(
+                query_purchase_history=lambda params: {"data": PURCHASE_HISTORY},
+                create_purchase_request=lambda order: ({"status": "success"}, 201),
+            ),
+        )
+
+        reply = agent.chat("我想買螢幕，預算2萬", "s1")
+        assert "Dell 27吋 4K 螢幕" in reply
+        assert (
+            agent.get_session_status("s1")["conversation_state"]
+            == ConversationState.WAITING_CONFIRMATION
+        )
+
+        agent.chat("同意", "s1")
+        assert (
+            agent.get_session_status("s1")["conversation_state"]
+            == ConversationState.WAITING_ORDER_DETAILS
+        )
+
+        stats = server.RequestHandlerClass.fake.stats()
+        assert stats["intent"]["requests"] >= 1
+        assert stats["structured_recommend"]["requests"] == 1
+        assert "unknown" not in stats
+        assert agent.get_usage_stats()["totals"]["input_tokens"] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_streaming_reports_usage_and_respects_script():
+    """串流回應逐段送出，要求時最後附上用量；腳本回應依序循環使用"""
+    server, url = start_server(
+        FakeLLMConfig(
+            ttft_ms=0,
+            tokens_per_second=0,
+            scripted={"guidance": ["第一則", "第二則"]},
+        )
+    )
+    guidance_prompt = ConversationalPurchaseAgent._CHAIN_SPECS["guidance"][0]()
+    messages = [
+        {"role": "system", "content": guidance_prompt.messages[0].prompt.template},
+        {"role": "user", "content": "你好"},
+    ]
+    try:
+        status, body = _post(
+            url,
+            {
+                "model": "gpt-4o-mini",
+                "messages": messages,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            },
+        )
+        events = [
+            line[len("data: ") :]
+            for line in body.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert status == 200 and events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        content = "".join(
+            choice["delta"].get("content") or ""
+            for chunk in chunks
+            for choice in chunk["choices"]
+        )
+        assert content == "第一則"
+        assert chunks[-1]["choices"] == []
+        assert chunks[-1]["usage"]["completion_tokens"] == 3
+
+        status, body = _post(url, {"model": "gpt-4o-mini", "messages": messages})
+        assert json.loads(body)["choices"][0]["message"]["content"] == "第二則"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_error_rate_injects_failures():
+    """錯誤率為 1 時每個請求都回傳設定的錯誤狀態碼"""
+    server, url = start_server(
+        FakeLLMConfig(ttft_ms=0, error_rate=1.0, error_status=429, seed=1)
+    )
+    try:
+        status, body = _post(url, {"messages": [{"role": "user", "content": "你好"}]})
+        assert status == 429
+        assert "error" in json.loads(body)
+        assert server.RequestHandlerClass.fake.stats()["unknown"] == {
+            "requests": 1,
+            "errors": 1,
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stream_uses_text_recommendation_token_by_token():
+    """串流回合預設以文字推薦逐字送出，不使用結構化推薦"""
+    server, url = start_server(FakeLLMConfig(ttft_ms=0, tokens_per_second=0))
+    try:
+        agent = ConversationalPurchaseAgent(
+            PurchaseAgentConfig(
+                openai_api_key="fake",
+                openai_base_url=url,
+                llm_cache_enabled=False,
+                speculation_enabled=False,
+            ),
+            sap_transport=InProcessTransport(
+                query_purchase_history=lambda params: {"data": PURCHASE_HISTORY},
+                create_purchase_request=lambda order: ({"status": "success"}, 201),
+            ),
+        )
+
+        chunks = list(agent.chat_stream("我想買螢幕，預算2萬", "s1"))
+
+        assert "Dell 27吋 4K 螢幕" in "".join(chunks)
+        assert len(chunks) > 10
+        stats = server.RequestHandlerClass.fake.stats()
+        assert stats["recommend"]["requests"] == 1
+        assert "structured_recommend" not in stats
+        assert (
+            agent.get_session_status("s1")["conversation_state"]
+            == ConversationState.WAITING_CONFIRMATION
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
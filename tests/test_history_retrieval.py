@@ -0,0 +1,197 @@
+"""
+採購歷史檢索測試
+"""
+
+from history_retrieval import HistoryRetriever, estimate_tokens, tokenize
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig
+from query_engine import IndexedTable
+from sap_client import InProcessTransport
+
+HISTORY = [
+    {
+        "product_name": "iPhone 15 Pro",
+        "category": "智慧型手機",
+        "supplier": "Apple Inc.",
+        "unit_price": 35000,
+        "purchase_date": "2024-12-20",
+    },
+    {
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "unit_price": 75000,
+        "purchase_date": "2024-12-15",
+    },
+    {
+        "product_name": "Dell XPS 13",
+        "category": "筆記型電腦",
+        "supplier": "Dell Technologies",
+        "unit_price": 45000,
+        "purchase_date": "2024-11-01",
+    },
+    {
+        "product_name": "Surface Pro 9",
+        "category": "平板電腦",
+        "supplier": "Microsoft",
+        "unit_price": 38000,
+        "purchase_date": "2024-10-10",
+    },
+]
+
+
+def test_tokenize_uses_cjk_bigrams():
+    """英數字取單字，中文切成相鄰雙字"""
+    assert tokenize("MacBook 筆記型電腦") == ["macbook", "筆記", "記型", "型電", "電腦"]
+    assert tokenize("16吋") == ["16", "吋"]
+
+
+def test_rank_prefers_matching_products():
+    """與需求相符的產品排在前面，不相關的記錄不會被選入"""
+    retriever = HistoryRetriever()
+
+    selected = retriever.select(HISTORY, "我需要一台筆記型電腦", top_k=2)
+
+    assert {item["product_name"] for item in selected} == {
+        "MacBook Pro 16吋",
+        "Dell XPS 13",
+    }
+
+
+def test_budget_demotes_over_budget_products():
+    """超出預算的產品降低排序"""
+    retriever = HistoryRetriever()
+
+    top = retriever.select(HISTORY, "筆記型電腦", top_k=1, budget=50000)
+
+    assert top[0]["product_name"] == "Dell XPS 13"
+
+
+def test_index_is_reused_for_same_history():
+    """同一份採購歷史只建立一次索引"""
+    retriever = HistoryRetriever()
+    retriever.select(HISTORY, "筆電")
+    retriever.select(list(HISTORY), "平板")
+
+    assert retriever.stats() == {
+        "index_builds": 1,
+        "index_hits": 1,
+        "cached_indexes": 1,
+    }
+
+
+def test_catalog_key_skips_fingerprinting_every_row(monkeypatch):
+    """標示來源時只以來源、筆數與首尾記錄辨識同一份歷史；最新記錄改變時重建索引"""
+    retriever = HistoryRetriever()
+    keyed_rows = []
+    row_key = HistoryRetriever._row_key
+    monkeypatch.setattr(
+        HistoryRetriever,
+        "_row_key",
+        staticmethod(lambda item: keyed_rows.append(item) or row_key(item)),
+    )
+
+    retriever.select(HISTORY, "筆電", catalog=("category", ""))
+    retriever.select(list(HISTORY), "平板", catalog=("category", ""))
+    assert len(keyed_rows) == 4
+
+    newer = dict(HISTORY[0], purchase_date="2025-01-05")
+    retriever.select([newer] + HISTORY[1:], "筆電", catalog=("category", ""))
+    assert retriever.stats()["index_builds"] == 2
+    assert retriever.stats()["index_hits"] == 1
+
+
+def test_estimate_tokens():
+    """中文約一字一個 token，英文約四個字元一個 token"""
+    assert estimate_tokens("筆記型電腦") == 5
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_agent_ranks_over_full_history_window():
+    """啟用檢索時查詢整段歷史範圍，較舊但相關的記錄也能排進 prompt"""
+    rows = [
+        {
+            "purchase_id": f"P{index:03d}",
+            "product_name": f"Surface Laptop {index}",
+            "category": "筆記型電腦",
+            "supplier": "Microsoft",
+            "quantity": 1,
+            "unit_price": 40000,
+            "purchase_date": f"2024-{12 - index // 28:02d}-{index % 28 + 1:02d}",
+            "department": "IT部門",
+        }
+        for index in range(80)
+    ]
+    rows.append(
+        dict(
+            rows[-1],
+            purchase_id="P999",
+            product_name="ThinkPad X1 Carbon",
+            supplier="Lenovo",
+            purchase_date="2020-01-01",
+        )
+    )
+    table = IndexedTable(
+        "purchase_id",
+        text_fields=("category", "supplier"),
+        range_fields=("purchase_date",),
+        rows=rows,
+    )
+    requested_limits = []
+
+    def query(params):
+        requested_limits.append(params.get("limit"))
+        page = table.query(sort=params.get("sort"), limit=int(params["limit"]))
+        return {"data": page["data"]}
+
+    def agent(**config):
+        return ConversationalPurchaseAgent(
+            PurchaseAgentConfig(openai_api_key="test", **config),
+            sap_transport=InProcessTransport(
+                query_purchase_history=query,
+                create_purchase_request=lambda order: ({"status": "success"}, 201),
+            ),
+        )
+
+    retrieving = agent()
+    history = retrieving._fetch_purchase_history()
+    prompt = retrieving._history_prompt("recommend", history, "ThinkPad X1")
+    assert len(history) == 81 and "ThinkPad X1 Carbon" in prompt
+
+    recent_only = agent(history_retrieval_enabled=False)
+    assert len(recent_only._fetch_purchase_history()) == 50
+    assert requested_limits == [1000, 50]
+
+
+def test_session_keeps_only_top_k_history():
+    """查詢整段範圍只用於排序，會話中只保留最相關的前 k 筆"""
+    rows = [
+        dict(
+            HISTORY[index % len(HISTORY)], purchase_date=f"2024-01-{index % 28 + 1:02d}"
+        )
+        for index in range(200)
+    ]
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="test", history_top_k=3, speculation_enabled=False
+        ),
+        sap_transport=InProcessTransport(
+            query_purchase_history=lambda params: {"data": rows},
+            create_purchase_request=lambda order: ({"status": "success"}, 201),
+        ),
+    )
+    history = agent._fetch_purchase_history("筆記型電腦")
+    requirement = {"product_name": "Dell XPS 13", "product_type": "筆記型電腦"}
+
+    agent._complete_new_request(
+        "我要買 Dell XPS 13",
+        "s1",
+        requirement,
+        history,
+        "推薦 Dell XPS 13",
+        "",
+        catalog=agent._history_catalog("筆記型電腦"),
+    )
+
+    stored = agent.get_session_status("s1")["purchase_history"]
+    assert len(history) == 200 and len(stored) == 3
+    assert stored[0]["product_name"] == "Dell XPS 13"
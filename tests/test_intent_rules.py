@@ -0,0 +1,67 @@
+"""
+意圖規則引擎測試
+"""
+
+from choose_state import ConversationState
+from intent_rules import IntentRuleEngine
+from keyword_automaton import KeywordAutomaton
+
+
+def test_automaton_longest_match():
+    """最左最長比對：「不同意」優先於「同意」"""
+    automaton = KeywordAutomaton()
+    automaton.add("同意", "yes")
+    automaton.add("不同意", "no")
+
+    matches = automaton.longest_matches("我不同意")
+    assert [m[2] for m in matches] == ["不同意"]
+    assert {m[2] for m in automaton.iter_matches("我不同意")} == {"同意", "不同意"}
+
+
+def test_confirmation_state_rules():
+    """等待確認狀態可直接判斷簡短的是/否回覆"""
+    engine = IntentRuleEngine()
+    state = ConversationState.WAITING_CONFIRMATION
+
+    assert engine.classify(state, "同意") == "confirm_recommendation"
+    assert engine.classify(state, "好的！") == "confirm_recommendation"
+    assert engine.classify(state, "不同意") == "request_adjustment"
+    assert engine.classify(state, "OK") == "confirm_recommendation"
+
+
+def test_inconclusive_falls_back():
+    """多重意圖或剩餘內容過長時交由 LLM 判斷"""
+    engine = IntentRuleEngine()
+    state = ConversationState.WAITING_CONFIRMATION
+
+    assert engine.classify(state, "好，但我想換成 iPad Pro 12.9吋") is None
+    assert engine.classify(state, "今天天氣如何") is None
+    assert engine.classify(ConversationState.INITIAL, "同意") is None
+
+
+def test_order_confirmation_rules():
+    """確認請購單狀態的提交 / 修改 / 取消"""
+    engine = IntentRuleEngine()
+    state = ConversationState.CONFIRMING_ORDER
+
+    assert engine.classify(state, "確認提交") == "submit_order"
+    assert engine.classify(state, "修改") == "modify_order"
+    assert engine.classify(state, "取消") == "cancel_order"
+    assert engine.classify(state, "不提交") == "cancel_order"
+
+
+def test_negation_questions_and_residual_are_inconclusive():
+    """否定詞、問句、多重意圖或剩下的中文內容都不是明確的是/否回覆"""
+    engine = IntentRuleEngine()
+    confirmation = ConversationState.WAITING_CONFIRMATION
+    order = ConversationState.CONFIRMING_ORDER
+
+    assert engine.classify(confirmation, "不太好") is None
+    assert engine.classify(confirmation, "可以便宜點嗎") is None
+    assert engine.classify(confirmation, "好貴") is None
+    assert engine.classify(confirmation, "好，謝謝") == "confirm_recommendation"
+
+    assert engine.classify(order, "確認一下價格") is None
+    assert engine.classify(order, "先不要送出") is None
+    assert engine.classify(order, "不要提交") == "cancel_order"
+    assert engine.classify(order, "確認了嗎？") is None
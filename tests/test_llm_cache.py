@@ -0,0 +1,60 @@
+"""
+LLM 回應快取測試
+"""
+
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from llm_cache import LLMResponseCache
+
+
+def _generation(text: str):
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def test_memory_hit_and_miss():
+    """相同 prompt 與模型參數應命中，參數不同則未命中"""
+    cache = LLMResponseCache(max_memory_entries=10)
+    cache.update("prompt", "model=gpt-4o-mini,temperature=0.3", _generation("回應"))
+
+    hit = cache.lookup("prompt", "model=gpt-4o-mini,temperature=0.3")
+    assert hit is not None and hit[0].text == "回應"
+    assert cache.lookup("prompt", "model=gpt-4o-mini,temperature=0.7") is None
+
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_lru_eviction():
+    """超過記憶體容量時淘汰最久未使用的項目"""
+    cache = LLMResponseCache(max_memory_entries=2)
+    cache.update("a", "llm", _generation("A"))
+    cache.update("b", "llm", _generation("B"))
+    cache.lookup("a", "llm")
+    cache.update("c", "llm", _generation("C"))
+
+    assert cache.lookup("b", "llm") is None
+    assert cache.lookup("a", "llm") is not None
+    assert cache.stats()["memory_evictions"] == 1
+
+
+def test_ttl_expiry():
+    """過期項目不應命中"""
+    cache = LLMResponseCache(ttl_seconds=0.01)
+    cache.update("prompt", "llm", _generation("回應"))
+    time.sleep(0.02)
+    assert cache.lookup("prompt", "llm") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """磁碟層在新的快取實例中仍可命中"""
+    db_path = str(tmp_path / "cache.sqlite")
+    LLMResponseCache(db_path=db_path).update("prompt", "llm", _generation("回應"))
+
+    cache = LLMResponseCache(db_path=db_path)
+    hit = cache.lookup("prompt", "llm")
+    assert hit is not None and hit[0].text == "回應"
+    assert cache.stats()["disk_hits"] == 1
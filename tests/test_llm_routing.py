@@ -0,0 +1,85 @@
+"""
+各鏈模型路由測試
+"""
+
+import pytest
+
+from llm_routing import (
+    CHAIN_NAMES,
+    ChainSettings,
+    LLMClientPool,
+    resolve_chain_settings,
+)
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig
+
+DEFAULT = ChainSettings(model="gpt-4o-mini", max_tokens=2000, temperature=0.7)
+
+
+def test_uniform_profile_uses_default_settings():
+    """uniform 設定檔中所有鏈都使用預設設定"""
+    resolved = resolve_chain_settings(DEFAULT)
+
+    assert set(resolved) == set(CHAIN_NAMES)
+    assert all(settings == DEFAULT for settings in resolved.values())
+
+
+def test_tiered_profile_and_overrides():
+    """tiered 設定檔把分類鏈改用小型模型，個別覆寫優先於設定檔"""
+    resolved = resolve_chain_settings(
+        DEFAULT,
+        profile="tiered",
+        overrides={"intent": ChainSettings(max_tokens=64, stop=("}",))},
+        fast_model="gpt-4.1-nano",
+    )
+
+    assert resolved["extract_requirement"] == ChainSettings(
+        model="gpt-4.1-nano", max_tokens=256, temperature=0.0
+    )
+    assert resolved["intent"].model == "gpt-4.1-nano"
+    assert resolved["intent"].max_tokens == 64
+    assert resolved["intent"].stop == ("}",)
+    # 未列入設定檔的文字鏈維持預設
+    assert resolved["recommend"] == DEFAULT
+    # 沒有指定 fast_model 時沿用預設模型
+    assert (
+        resolve_chain_settings(DEFAULT, profile="tiered")["intent"].model
+        == "gpt-4o-mini"
+    )
+
+
+def test_unknown_profile_or_chain_is_rejected():
+    """未知的路由設定檔或鏈名稱會拋出 ValueError"""
+    with pytest.raises(ValueError):
+        resolve_chain_settings(DEFAULT, profile="fastest")
+    with pytest.raises(ValueError):
+        resolve_chain_settings(DEFAULT, overrides={"nope": ChainSettings()})
+
+
+def test_client_pool_shares_clients_by_settings():
+    """設定相同（不含停止序列）的鏈共用同一個用戶端"""
+    created = []
+    pool = LLMClientPool(lambda settings: created.append(settings) or object())
+
+    first = pool.get(DEFAULT)
+    assert pool.get(ChainSettings(stop=("\n",)).over(DEFAULT)) is first
+    assert pool.get(ChainSettings(max_tokens=128).over(DEFAULT)) is not first
+    assert len(pool) == 2
+    assert len(created) == 2
+
+
+def test_agent_builds_one_client_per_distinct_setting():
+    """Agent 依解析後的設定建立用戶端，預設設定的鏈使用 self.llm"""
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="test",
+            llm_cache_enabled=False,
+            routing_profile="tiered",
+            fast_model="gpt-4.1-nano",
+        )
+    )
+    routing = agent.get_chain_routing()
+
+    distinct = {settings.client_key() for settings in agent.chain_settings.values()}
+    assert routing["clients"] == len(distinct)
+    assert routing["chains"]["intent"]["model"] == "gpt-4.1-nano"
+    assert routing["chains"]["recommend"]["model"] == agent.config.model
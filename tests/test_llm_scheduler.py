@@ -0,0 +1,141 @@
+"""
+LLM 呼叫排程測試
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import LLMScheduler, lane_for_chain
+
+
+def test_concurrency_is_capped():
+    """同時執行的呼叫數不超過並行上限"""
+    scheduler = LLMScheduler(max_concurrency=2)
+    active, peak = [], []
+    lock = threading.Lock()
+
+    def call():
+        with scheduler.slot("recommend"):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+    stats = scheduler.stats()
+    assert stats["lanes"]["recommend"]["completed"] == 6
+    assert stats["in_flight"] == 0
+    assert stats["lanes"]["recommend"]["max_queued"] >= 4
+
+
+def test_higher_priority_lane_is_served_first():
+    """名額釋出時優先分配給送出請購單的通道，離題引導最後"""
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+    holding = threading.Event()
+    release = threading.Event()
+
+    def blocker():
+        with scheduler.slot("recommend"):
+            holding.set()
+            release.wait()
+
+    def call(lane):
+        with scheduler.slot(lane):
+            order.append(lane)
+
+    first = threading.Thread(target=blocker)
+    first.start()
+    holding.wait()
+    threads = []
+    for lane in ("guidance", "recommend", "order"):
+        thread = threading.Thread(target=call, args=(lane,))
+        thread.start()
+        threads.append(thread)
+        while scheduler.stats()["queue_depth"] < len(threads):
+            time.sleep(0.001)
+
+    release.set()
+    for thread in [first, *threads]:
+        thread.join()
+
+    assert order == ["order", "recommend", "guidance"]
+
+
+def test_token_budget_delays_calls():
+    """每分鐘 token 預算用完時，後續呼叫等待 token 補充"""
+    scheduler = LLMScheduler(max_concurrency=4, tokens_per_minute=6000)
+
+    with scheduler.slot("order", tokens=6000):
+        pass
+    started = time.perf_counter()
+    with scheduler.slot("order", tokens=10):  # 每秒補充 100 tokens，約需 0.1 秒
+        pass
+
+    assert time.perf_counter() - started >= 0.05
+    assert scheduler.stats()["lanes"]["order"]["max_wait_ms"] >= 50
+
+
+def test_async_slots_share_the_queue():
+    """非同步呼叫端與同步呼叫端使用同一個並行上限"""
+    scheduler = LLMScheduler(max_concurrency=1)
+    active, peak = [0], [0]
+
+    async def call():
+        async with scheduler.aslot("recommend"):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            active[0] -= 1
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(4)))
+
+    asyncio.run(run())
+    assert peak[0] == 1
+    assert scheduler.stats()["lanes"]["recommend"]["completed"] == 4
+
+
+def test_batch_holds_one_slot_per_call():
+    """批次依同時送出的請求數佔用名額，超過上限時以上限計算"""
+    scheduler = LLMScheduler(max_concurrency=3)
+    granted = threading.Event()
+
+    with scheduler.slot("recommend"):
+
+        def batch():
+            with scheduler.slot("recommend", calls=3):
+                granted.set()
+
+        thread = threading.Thread(target=batch)
+        thread.start()
+        # 一個名額已被佔用，三個請求的批次必須等待
+        assert not granted.wait(0.05)
+        assert scheduler.stats()["queue_depth"] == 1
+    thread.join(timeout=1)
+
+    assert granted.is_set()
+    with scheduler.slot("recommend", calls=10):
+        assert scheduler.stats()["in_flight"] == 3
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_lane_mapping_and_unknown_lane():
+    """鏈對應到優先通道，未知通道會拋出 ValueError"""
+    assert lane_for_chain("create_order") == "order"
+    assert lane_for_chain("recommend") == "recommend"
+    assert lane_for_chain("guidance") == "guidance"
+    with pytest.raises(ValueError):
+        with LLMScheduler().slot("urgent"):
+            pass
@@ -0,0 +1,91 @@
+"""
+Prometheus 格式指標測試
+"""
+
+import gc
+import threading
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_counter_sums_all_threads():
+    """各執行緒各自累加，抓取時加總（包含已結束的執行緒）"""
+    registry = MetricsRegistry()
+    counter = registry.counter("test_calls_total", "呼叫次數", ("chain",))
+    child = counter.labels("intent")
+
+    def work():
+        for _ in range(1000):
+            child.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert child.value() == 8000
+    assert 'test_calls_total{chain="intent"} 8000' in registry.render()
+
+
+def test_histogram_renders_cumulative_buckets():
+    """直方圖輸出累積區間、總和與次數"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "test_seconds", "延遲", ("route",), buckets=(0.1, 1.0)
+    )
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.labels("new_request").observe(value)
+
+    text = registry.render()
+
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{route="new_request",le="0.1"} 2' in text
+    assert 'test_seconds_bucket{route="new_request",le="1"} 3' in text
+    assert 'test_seconds_bucket{route="new_request",le="+Inf"} 4' in text
+    assert 'test_seconds_sum{route="new_request"} 3.65' in text
+    assert 'test_seconds_count{route="new_request"} 4' in text
+
+
+def test_gauges_and_registration():
+    """量測值可增減或於抓取時計算；同名指標重複登錄取得同一個物件"""
+    registry = MetricsRegistry()
+    gauge = registry.gauge("test_in_progress", "處理中")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    sessions = registry.callback_gauge("test_sessions", "會話數")
+    sessions.callback = lambda: 3
+
+    text = registry.render()
+
+    assert "test_in_progress 1" in text
+    assert "test_sessions 3" in text
+    assert registry.gauge("test_in_progress", "處理中") is gauge
+    with pytest.raises(ValueError):
+        registry.counter("test_in_progress", "處理中")
+    with pytest.raises(ValueError):
+        registry.counter("test_labeled_total", "x", ("a",)).labels("1", "2")
+
+
+def test_callback_gauge_sums_tracked_owners():
+    """每個擁有者各自登錄回呼，抓取時加總；後建立的擁有者不會取代先前的，被回收後即移除"""
+
+    class Owner:
+        def __init__(self, sessions: int):
+            self.sessions = sessions
+
+    registry = MetricsRegistry()
+    sessions = registry.callback_gauge("test_tracked_sessions", "會話數")
+    first, second = Owner(2), Owner(5)
+    sessions.track(first, lambda owner: owner.sessions)
+    sessions.track(second, lambda owner: owner.sessions)
+
+    assert "test_tracked_sessions 7" in registry.render()
+
+    del second
+    gc.collect()
+
+    assert "test_tracked_sessions 2" in registry.render()
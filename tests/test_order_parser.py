@@ -0,0 +1,109 @@
+"""
+請購單資料解析測試
+"""
+
+from datetime import date
+
+from order_parser import OrderDetailsParser, parse_number
+
+# 2026-10-17 為星期六
+TODAY = date(2026, 10, 17)
+
+
+def test_parse_number():
+    """阿拉伯數字與中文數字"""
+    assert parse_number("12") == 12
+    assert parse_number("兩") == 2
+    assert parse_number("十二") == 12
+    assert parse_number("二十五") == 25
+    assert parse_number("一百零五") == 105
+    assert parse_number("abc") is None
+
+
+def test_well_formed_input_is_fully_parsed():
+    """格式完整的輸入不需要 LLM"""
+    result = OrderDetailsParser().parse(
+        "數量：2台，請購人：張三，交貨日期：2026-11-15", TODAY
+    )
+
+    assert result.fields == {
+        "quantity": 2,
+        "requester": "張三",
+        "expected_delivery_date": "2026-11-15",
+    }
+    assert result.residual == ""
+    assert result.missing() == []
+
+
+def test_chinese_numerals_and_relative_dates():
+    """中文數字量詞與相對日期"""
+    parser = OrderDetailsParser()
+
+    assert parser.parse("我要兩台，請購人是李小明，下週五交貨", TODAY).fields == {
+        "quantity": 2,
+        "requester": "李小明",
+        "expected_delivery_date": "2026-10-23",
+    }
+    assert parser.parse("三支，月底前", TODAY).fields == {
+        "quantity": 3,
+        "expected_delivery_date": "2026-10-31",
+    }
+    assert parser.parse("後天", TODAY).fields == {
+        "expected_delivery_date": "2026-10-19"
+    }
+    assert parser.parse("3天後", TODAY).fields == {
+        "expected_delivery_date": "2026-10-20"
+    }
+
+
+def test_dates_without_year_roll_forward():
+    """沒有年份的日期不會落在過去"""
+    parser = OrderDetailsParser()
+
+    assert parser.parse("7/15", TODAY).fields == {
+        "expected_delivery_date": "2027-07-15"
+    }
+    assert parser.parse("12月1日", TODAY).fields == {
+        "expected_delivery_date": "2026-12-01"
+    }
+    assert parser.parse("交貨日期：2025-07-15", TODAY).fields == {
+        "expected_delivery_date": "2027-07-15"
+    }
+    assert parser.normalize_date("2023-07-15", TODAY) == "2027-07-15"
+    assert parser.normalize_date("儘快", TODAY) is None
+
+
+def test_name_without_label_is_left_for_llm():
+    """規則無法判斷的內容留在 residual，交給 LLM"""
+    result = OrderDetailsParser().parse("張三", TODAY)
+
+    assert result.fields == {}
+    assert result.residual == "張三"
+    assert result.missing({"quantity": 2}) == ["requester", "expected_delivery_date"]
+
+
+def test_name_stops_before_next_field():
+    """中文姓名不會吃掉後面的欄位標籤"""
+    result = OrderDetailsParser().parse("請購人王大明交貨日期7月20日", TODAY)
+
+    assert result.fields["requester"] == "王大明"
+    assert result.fields["expected_delivery_date"] == "2027-07-20"
+
+
+def test_requester_is_trimmed_before_overlap_check():
+    """姓名緊接日期時先截斷再檢查重疊，請購人與日期都保留"""
+    result = OrderDetailsParser().parse("請購人：張三豐交貨日期明天", TODAY)
+
+    assert result.fields == {
+        "requester": "張三豐",
+        "expected_delivery_date": "2026-10-18",
+    }
+
+
+def test_department_is_not_requester():
+    """「我是IT部門的」、「我是業務部的」是部門，不是請購人"""
+    parser = OrderDetailsParser()
+
+    assert "requester" not in parser.parse("我是IT部門的", TODAY).fields
+    assert "requester" not in parser.parse("我是業務部的，要兩台", TODAY).fields
+    assert parser.parse("我是 Alice，IT部門", TODAY).fields["requester"] == "Alice"
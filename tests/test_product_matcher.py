@@ -0,0 +1,110 @@
+"""
+產品比對器測試
+"""
+
+import random
+
+from product_matcher import ProductMatcher
+
+HISTORY = [
+    {
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "unit_price": 75000,
+    },
+    {
+        "product_name": "MacBook Pro 14吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "unit_price": 55000,
+    },
+    {
+        "product_name": "Dell XPS 13",
+        "category": "筆記型電腦",
+        "supplier": "Dell Technologies",
+        "unit_price": 45000,
+    },
+]
+
+
+def _linear_best_match(recommendation, purchase_history):
+    """原本逐筆比對的參考實作"""
+    recommendation_lower = recommendation.lower()
+    best_match, max_matches = None, 0
+    for product in purchase_history:
+        matches = 0
+        for keyword in product["product_name"].lower().split():
+            if len(keyword) > 2 and keyword in recommendation_lower:
+                matches += 2
+        if product["supplier"].lower() in recommendation_lower:
+            matches += 1
+        if product["category"].lower() in recommendation_lower:
+            matches += 1
+        if str(product["unit_price"]) in recommendation:
+            matches += 3
+        if matches > max_matches and matches >= 3:
+            best_match, max_matches = product, matches
+    return best_match
+
+
+def test_best_match_uses_price_and_name():
+    """價格（含千分位寫法）與產品名稱共同決定最佳產品"""
+    matcher = ProductMatcher()
+    text = "推薦 MacBook Pro 14吋，建議價格 NT$ 55,000，供應商 Apple Inc."
+
+    assert matcher.best_match(text, HISTORY) is HISTORY[1]
+    ranked = matcher.rank(text, HISTORY)
+    assert [product["product_name"] for _, product in ranked][:2] == [
+        "MacBook Pro 14吋",
+        "MacBook Pro 16吋",
+    ]
+
+
+def test_below_threshold_returns_none():
+    """分數未達門檻時不回傳產品"""
+    matcher = ProductMatcher()
+    assert matcher.best_match("建議採購筆記型電腦", HISTORY) is None
+
+
+def test_matches_linear_reference_on_random_texts():
+    """沒有千分位價格時，結果與原本逐筆比對相同"""
+    rng = random.Random(3)
+    words = ["MacBook", "Pro", "16吋", "Dell", "XPS", "Apple Inc.", "75000", "45000"]
+    matcher = ProductMatcher()
+    for _ in range(200):
+        text = " ".join(rng.sample(words, rng.randint(1, 5)))
+        assert matcher.best_match(text, HISTORY) is _linear_best_match(text, HISTORY)
+
+
+def test_catalog_grows_incrementally():
+    """只有出現新產品時才更新目錄版本"""
+    matcher = ProductMatcher()
+    matcher.add_products(HISTORY)
+    version = matcher.catalog_version
+
+    assert matcher.add_products([dict(p) for p in HISTORY]) == 0
+    assert matcher.catalog_version == version
+
+    surface = {
+        "product_name": "Surface Pro 9",
+        "category": "平板電腦",
+        "supplier": "Microsoft",
+        "unit_price": 38000,
+    }
+    assert matcher.add_products([surface]) == 1
+    assert matcher.catalog_version == version + 1
+    assert matcher.best_match("Surface Pro 9 平板", HISTORY + [surface]) is surface
+
+
+def test_mentioned_products_prefers_longest_name():
+    """以完整名稱找出使用者指名的產品，較長（較明確）的名稱優先"""
+    matcher = ProductMatcher()
+    matcher.add_products(HISTORY)
+
+    mentioned = matcher.mentioned_products("請幫我再買兩台 macbook pro 16吋")
+
+    assert mentioned == [HISTORY[0]]
+    assert matcher.mentioned_products("我需要一台筆電") == []
+    # 完整名稱不影響計分
+    assert matcher.rank("Dell XPS 13", HISTORY)[0][0] == 4
@@ -0,0 +1,334 @@
+"""
+請購 Agent 推薦範本、直接下單與推測性預先計算測試
+"""
+
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+from pydantic import ValidationError
+
+from choose_state import ConversationState
+from purchase_agent import (
+    ConversationalPurchaseAgent,
+    PurchaseAgentConfig,
+    _turn_intent,
+)
+from sap_client import InProcessTransport
+
+HISTORY = [
+    {
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 5,
+        "unit_price": 75000,
+        "purchase_date": "2024-12-15",
+        "department": "IT部門",
+    },
+    {
+        "product_name": "MacBook Pro 16吋",
+        "category": "筆記型電腦",
+        "supplier": "Apple Inc.",
+        "quantity": 2,
+        "unit_price": 72000,
+        "purchase_date": "2024-10-01",
+        "department": "設計部門",
+    },
+]
+
+
+@pytest.fixture
+def agent():
+    return ConversationalPurchaseAgent(
+        PurchaseAgentConfig(openai_api_key="test", llm_cache_enabled=False)
+    )
+
+
+def test_render_structured_recommendation():
+    """結構化推薦以與推薦鏈相同的格式呈現"""
+    recommendation = ConversationalPurchaseAgent._validate_recommendation(
+        {
+            "product_name": "MacBook Pro 16吋",
+            "category": "筆記型電腦",
+            "supplier": "Apple Inc.",
+            "quantity": 2,
+            "unit_price": 75000,
+            "total_amount": 0,
+            "reason": "- 過去採購表現良好\n- 符合預算",
+        }
+    )
+
+    text = ConversationalPurchaseAgent._render_recommendation(recommendation)
+
+    assert recommendation["total_amount"] == 150000
+    assert text.splitlines() == [
+        "🎯 **推薦產品**：MacBook Pro 16吋",
+        "💰 **建議價格**：NT$ 75,000 (基於歷史價格分析)",
+        "🏢 **推薦供應商**：Apple Inc.",
+        "📦 **建議數量**：2，總金額 NT$ 150,000",
+        "📊 **推薦理由**：",
+        "- 過去採購表現良好",
+        "- 符合預算",
+    ]
+
+
+def test_invalid_structured_recommendation_is_rejected():
+    """缺少必要欄位的結構化推薦無法通過驗證"""
+    with pytest.raises(ValidationError):
+        ConversationalPurchaseAgent._validate_recommendation(
+            {"product_name": "MacBook Pro 16吋"}
+        )
+
+
+def test_render_history_recommendation_uses_statistics():
+    """快速推薦以同一產品的採購歷史統計產生推薦理由"""
+    text = ConversationalPurchaseAgent._render_history_recommendation(
+        HISTORY[0], HISTORY, {"budget": 80000}
+    )
+
+    assert "🎯 **推薦產品**：MacBook Pro 16吋" in text
+    assert "過去已採購 2 次，累計 7 件，最近一次為 2024-12-15" in text
+    assert "平均 NT$ 73,500" in text
+    assert "單價在您的預算 NT$ 80,000 以內" in text
+    assert "曾採購部門：IT部門、設計部門" in text
+
+
+def test_direct_order_needs_order_fields_and_confident_product(agent):
+    """一句話包含請購欄位且產品比對達門檻時才直接下單"""
+    requirement = {"product_name": "MacBook Pro 16吋", "product_type": "筆記型電腦"}
+
+    candidate = agent._direct_order_candidate(
+        "請購 2 台 MacBook Pro 16吋，請購人張三，下週五到貨", requirement, HISTORY
+    )
+    assert candidate is not None
+    assert candidate[0] is HISTORY[0]
+
+    # 只提到產品，沒有請購欄位
+    assert (
+        agent._direct_order_candidate("MacBook Pro 16吋", requirement, HISTORY) is None
+    )
+    # 產品不明確
+    assert (
+        agent._direct_order_candidate(
+            "請購 2 台筆電，請購人張三", {"product_type": "筆記型電腦"}, HISTORY
+        )
+        is None
+    )
+
+
+def test_direct_order_jumps_to_order_confirmation(agent):
+    """直接下單建立請購單並進入確認請購單狀態"""
+    user_input = "請購 2 台 MacBook Pro 16吋，請購人張三，2026-12-01 到貨"
+    requirement = {"product_name": "MacBook Pro 16吋", "product_type": "筆記型電腦"}
+    product, parsed = agent._direct_order_candidate(user_input, requirement, HISTORY)
+
+    response = agent._complete_direct_order(
+        user_input,
+        "s1",
+        requirement,
+        HISTORY,
+        product,
+        parsed,
+        None,
+        time.perf_counter(),
+    )
+
+    state = agent.get_session_status("s1")
+    assert "請購單" in response
+    assert state["conversation_state"] == ConversationState.CONFIRMING_ORDER
+    assert state["confirmed_order"]["quantity"] == 2
+    assert state["confirmed_order"]["requester"] == "張三"
+    assert state["confirmed_order"]["unit_price"] == 75000
+    assert agent.get_direct_order_stats()["turns_saved"] == 2
+
+
+def test_direct_order_asks_for_missing_requester(agent):
+    """LLM 也補不齊欄位（或只填入預設請購人）時記下已取得的欄位並詢問請購人"""
+    user_input = "請購 2 台 MacBook Pro 16吋，下週五到貨"
+    requirement = {"product_name": "MacBook Pro 16吋", "product_type": "筆記型電腦"}
+    product, parsed = agent._direct_order_candidate(user_input, requirement, HISTORY)
+
+    inputs = agent._direct_order_inputs(user_input, product, "s2")
+    assert "系統使用者" not in inputs["user_info"]
+
+    response = agent._complete_direct_order(
+        user_input,
+        "s2",
+        requirement,
+        HISTORY,
+        product,
+        parsed,
+        {"requester": "系統使用者"},
+        time.perf_counter(),
+    )
+
+    state = agent.get_session_status("s2")
+    assert "請購人姓名" in response and "需要的數量" not in response
+    assert state["conversation_state"] == ConversationState.WAITING_ORDER_DETAILS
+    assert state["selected_product"] is HISTORY[0]
+    assert state["collected_order_info"]["quantity"] == 2
+    assert state["collected_order_info"]["requester"] is None
+    assert agent.get_direct_order_stats()["orders"] == 0
+
+    agent._handle_order_details("請購人：張三", "s2")
+    state = agent.get_session_status("s2")
+    assert state["conversation_state"] == ConversationState.CONFIRMING_ORDER
+    assert state["confirmed_order"]["requester"] == "張三"
+
+
+def test_confirmation_uses_speculative_availability():
+    """推薦送出後預先查詢庫存與供應商，使用者同意時直接取用"""
+    transport = InProcessTransport(
+        lambda params: {"data": HISTORY},
+        lambda order_data: ({}, 201),
+        query_inventory=lambda params: {
+            "data": [
+                {
+                    "product_name": "MacBook Pro 16吋",
+                    "available_stock": 7,
+                    "location": "倉庫A-1",
+                }
+            ]
+        },
+        query_suppliers=lambda: {
+            "data": [
+                {
+                    "supplier_name": "Apple Inc.",
+                    "delivery_time": "5-7個工作天",
+                    "contact_person": "張經理",
+                }
+            ]
+        },
+    )
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(openai_api_key="test", llm_cache_enabled=False),
+        sap_transport=transport,
+    )
+    agent._complete_new_request(
+        "我要 MacBook Pro 16吋", "s3", {}, HISTORY, "推薦內容", "", HISTORY[0]
+    )
+
+    response = agent._handle_confirmation("同意", "s3")
+
+    assert "✅ 產品確認：MacBook Pro 16吋" in response
+    assert "可用 7 件（倉庫A-1）" in response
+    assert "交期 5-7個工作天，聯絡人 張經理" in response
+    # 範例交貨日期以今天推算，不會是過去的日期
+    assert f"交貨日期：{date.today() + timedelta(days=14)}」" in response
+    assert agent.get_speculation_stats()["hits"] == 1
+    state = agent.get_session_status("s3")
+    assert state["conversation_state"] == ConversationState.WAITING_ORDER_DETAILS
+    assert state["selected_product"] == HISTORY[0]
+
+
+def test_fast_recommendation_carries_requested_quantity():
+    """需求提到數量時，快速推薦列出總金額，確認後不再詢問數量"""
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="test", llm_cache_enabled=False, speculation_enabled=False
+        ),
+        sap_transport=InProcessTransport(
+            lambda params: {"data": HISTORY}, lambda order_data: ({}, 201)
+        ),
+    )
+
+    response = agent._handle_new_request("我要兩台 MacBook Pro 16吋", "s4")
+
+    assert "📦 **建議數量**：2，總金額 NT$ 150,000" in response
+    assert agent.get_recommend_stats()["fast"]["count"] == 1
+    assert agent.get_session_status("s4")["collected_order_info"]["quantity"] == 2
+
+    response = agent._handle_confirmation("同意", "s4")
+    assert "已依您的需求記錄為 2" in response
+
+    agent._handle_order_details("請購人：張三，交貨日期：2026-12-01", "s4")
+    state = agent.get_session_status("s4")
+    assert state["conversation_state"] == ConversationState.CONFIRMING_ORDER
+    assert state["confirmed_order"]["quantity"] == 2
+
+
+def test_ambiguous_order_confirmation_never_submits(agent):
+    """確認請購單時，否定或模稜兩可的回覆不會提交，而是再次詢問"""
+    user_input = "請購 2 台 MacBook Pro 16吋，請購人張三，2026-12-01 到貨"
+    requirement = {"product_name": "MacBook Pro 16吋", "product_type": "筆記型電腦"}
+    product, parsed = agent._direct_order_candidate(user_input, requirement, HISTORY)
+    agent._complete_direct_order(
+        user_input,
+        "s5",
+        requirement,
+        HISTORY,
+        product,
+        parsed,
+        None,
+        time.perf_counter(),
+    )
+    submitted = []
+    agent._submit_order = submitted.append
+
+    for reply in ("確認一下價格", "先不要送出", "送出？"):
+        response = agent._handle_order_confirmation(reply, "s5")
+        assert response.startswith("請明確回答")
+    assert submitted == []
+    state = agent.get_session_status("s5")
+    assert state["conversation_state"] == ConversationState.CONFIRMING_ORDER
+
+    agent._handle_order_confirmation("不要提交", "s5")
+    state = agent.get_session_status("s5")
+    assert state["conversation_state"] == ConversationState.INITIAL
+
+
+def test_order_confirmation_falls_back_to_turn_intent(agent):
+    """規則無法判斷的確認回覆改用本回合 LLM 判斷的意圖提交，不會一直再次詢問"""
+    agent._update_session_state(
+        "s6",
+        {
+            "conversation_state": ConversationState.CONFIRMING_ORDER,
+            "confirmed_order": {"product_name": "MacBook Pro 16吋", "quantity": 1},
+        },
+    )
+    submitted = []
+    agent._submit_order = submitted.append
+
+    replies = ("我確認", "確認提交請購單", "好的，送出", "沒問題，提交", "確認無誤")
+    for reply in replies:
+        assert (
+            agent.intent_rules.classify(ConversationState.CONFIRMING_ORDER, reply)
+            is None
+        )
+        token = _turn_intent.set("submit_order")
+        try:
+            agent._handle_order_confirmation(reply, "s6")
+        finally:
+            _turn_intent.reset(token)
+    assert submitted == ["s6"] * len(replies)
+
+    # 規則與 LLM 都無法判斷時才再次詢問
+    assert agent._handle_order_confirmation("我確認", "s6").startswith("請明確回答")
+
+    token = _turn_intent.set("cancel_order")
+    try:
+        agent._handle_order_confirmation("算了吧", "s6")
+    finally:
+        _turn_intent.reset(token)
+    state = agent.get_session_status("s6")
+    assert state["conversation_state"] == ConversationState.INITIAL
+
+
+def test_intent_stats_count_every_turn_across_threads(agent):
+    """多個會話並行判斷意圖時，統計不會遺失任何回合"""
+
+    def worker(index):
+        for _ in range(200):
+            agent._rule_intent("同意", f"s{index}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = agent.get_intent_stats()
+    assert stats["turns"] == 1600
+    assert stats["rule_resolved"] + stats["llm_classified"] == 1600
@@ -0,0 +1,134 @@
+"""
+記憶體查詢引擎測試
+"""
+
+import random
+
+from query_engine import IndexedTable
+
+CATEGORIES = ["筆記型電腦", "智慧型手機", "平板電腦", "Monitor"]
+SUPPLIERS = ["Apple Inc.", "Dell Technologies", "Microsoft"]
+
+
+def _rows(count: int):
+    rng = random.Random(7)
+    return [
+        {
+            "purchase_id": f"PH{i:05d}",
+            "category": rng.choice(CATEGORIES),
+            "supplier": rng.choice(SUPPLIERS),
+            "purchase_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "quantity": rng.randint(1, 30),
+        }
+        for i in range(count)
+    ]
+
+
+def _table(rows):
+    return IndexedTable(
+        "purchase_id",
+        text_fields=("category", "supplier"),
+        range_fields=("purchase_date",),
+        rows=rows,
+    )
+
+
+def test_select_matches_linear_filters():
+    """索引查詢結果與原本逐條子字串 / 日期篩選一致（含順序）"""
+    rows = _rows(2000)
+    table = _table(rows)
+
+    cases = [
+        ("電腦", None, None, None),
+        (None, "apple", "2024-03-01", "2024-06-30"),
+        ("monitor", "DELL", None, "2024-02-15"),
+        (None, None, "2024-11-01", None),
+        (None, None, None, None),
+    ]
+    for category, supplier, start_date, end_date in cases:
+        expected = [
+            h
+            for h in rows
+            if (not category or category.lower() in h["category"].lower())
+            and (not supplier or supplier.lower() in h["supplier"].lower())
+            and (not start_date or h["purchase_date"] >= start_date)
+            and (not end_date or h["purchase_date"] <= end_date)
+        ]
+        result = table.select(
+            contains={"category": category, "supplier": supplier},
+            ranges={"purchase_date": (start_date, end_date)},
+        )
+        assert result == expected
+
+
+def test_where_predicate_and_primary_key():
+    """主鍵查詢與自訂條件"""
+    rows = _rows(100)
+    table = _table(rows)
+
+    assert table.get("PH00042") is rows[42]
+    assert table.get("missing") is None
+    assert "PH00001" in table
+
+    bulk = table.select(where=lambda h: h["quantity"] >= 25)
+    assert bulk == [h for h in rows if h["quantity"] >= 25]
+
+
+def test_update_keeps_indexes_in_sync():
+    """更新欄位後，索引查詢反映新值"""
+    table = IndexedTable("request_id", text_fields=("status",))
+    table.insert({"request_id": "PR1", "status": "待審核"})
+    table.insert({"request_id": "PR2", "status": "待審核"})
+
+    table.update("PR1", {"status": "已完成", "related_order_id": "PO1"})
+
+    assert [r["request_id"] for r in table.select(contains={"status": "待審核"})] == [
+        "PR2"
+    ]
+    completed = table.select(contains={"status": "完成"})
+    assert completed == [table["PR1"]]
+    assert completed[0]["related_order_id"] == "PO1"
+
+
+def _all_pages(table, **kwargs):
+    rows, cursor = [], None
+    while True:
+        page = table.query(cursor=cursor, **kwargs)
+        rows.extend(page["data"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return rows
+
+
+def test_cursor_pagination_is_stable_and_complete():
+    """游標分頁逐頁取回的結果與完整排序結果相同，且不重複、不遺漏"""
+    rows = _rows(500)
+    table = _table(rows)
+
+    pages = _all_pages(
+        table, contains={"category": "電腦"}, sort="-purchase_date", limit=37
+    )
+    expected = sorted(
+        (h for h in rows if "電腦" in h["category"]),
+        key=lambda h: h["purchase_date"],
+        reverse=True,
+    )
+    assert [h["purchase_date"] for h in pages] == [h["purchase_date"] for h in expected]
+    assert len({h["purchase_id"] for h in pages}) == len(expected)
+
+    unsorted = _all_pages(table, limit=64, with_total=False)
+    assert unsorted == rows
+
+
+def test_projection_and_optional_total():
+    """欄位投影只回傳指定欄位；不需要總數時回傳 None"""
+    table = _table(_rows(50))
+
+    page = table.query(sort="quantity", limit=3, fields=["purchase_id", "quantity"])
+    assert page["total"] == 50
+    assert all(set(row) == {"purchase_id", "quantity"} for row in page["data"])
+    assert [row["quantity"] for row in page["data"]] == sorted(
+        row["quantity"] for row in page["data"]
+    )
+
+    assert table.query(limit=3, with_total=False)["total"] is None
@@ -0,0 +1,85 @@
+"""
+對話重播基準測試
+"""
+
+import json
+
+import pytest
+
+from benchmarks.replay import (
+    DEFAULT_CONVERSATIONS,
+    compare_results,
+    load_conversations,
+    main,
+    percentiles,
+)
+
+
+def test_load_conversations_and_percentiles(tmp_path):
+    """目錄中的 JSONL 腳本逐行讀入，字串回合轉為物件；缺少回合時指出檔案與行號"""
+    (tmp_path / "a.jsonl").write_text(
+        '{"id": "c1", "turns": ["我想買筆電", {"user": "同意", "expect_state": "x"}]}\n\n',
+        encoding="utf-8",
+    )
+    (tmp_path / "notes.txt").write_text("不是腳本", encoding="utf-8")
+
+    conversations = load_conversations([str(tmp_path)])
+    assert conversations == [
+        {
+            "id": "c1",
+            "source": "a.jsonl",
+            "turns": [{"user": "我想買筆電"}, {"user": "同意", "expect_state": "x"}],
+        }
+    ]
+    assert len(load_conversations([DEFAULT_CONVERSATIONS])) >= 5
+
+    (tmp_path / "b.jsonl").write_text(
+        '{"id": "empty", "turns": []}\n', encoding="utf-8"
+    )
+    with pytest.raises(ValueError, match="b.jsonl:1"):
+        load_conversations([str(tmp_path)])
+
+    stats = percentiles([float(value) for value in range(1, 101)])
+    assert (stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]) == (50.0, 95.0, 99.0)
+    assert percentiles([]) == {"count": 0}
+
+
+def test_replay_against_fake_llm_writes_comparable_results(tmp_path, capsys):
+    """以假 LLM 伺服器重播內建腳本：每段對話走到預期狀態，結果可與前一次比較"""
+    output = str(tmp_path / "result.json")
+    args = [
+        DEFAULT_CONVERSATIONS,
+        "--fake-llm",
+        "--ttft-ms",
+        "0",
+        "--tokens-per-second",
+        "0",
+        "--no-cache",
+        "--sessions",
+        "9",
+        "--concurrency",
+        "3",
+        "--output",
+        output,
+    ]
+    assert main(args) == 0
+    with open(output, encoding="utf-8") as f:
+        report = json.load(f)
+
+    results = report["results"]
+    assert results["turns"] > results["sessions"] and results["errors"] == 0
+    assert results["state_mismatches"] == []
+    assert results["completed_orders"] >= 7
+    assert results["llm_calls_per_order"] > 0
+    assert {"initial", "waiting_confirmation", "waiting_order_details"} <= set(
+        results["by_state"]
+    )
+    assert results["by_chain"]["intent"]["count"] > 0
+    assert results["turn_latency"]["p99_ms"] >= results["turn_latency"]["p50_ms"]
+
+    rows = {row["metric"]: row for row in compare_results(report, report)}
+    assert rows["turn.p95_ms"]["change_pct"] == 0.0
+    assert not any(row["regression"] for row in rows.values())
+
+    assert main(args[:-2] + ["--compare", output]) == 0
+    assert "turn.p95_ms" in capsys.readouterr().out
@@ -0,0 +1,210 @@
+"""
+SAP API 用戶端測試（以本機 HTTP 伺服器模擬 SAP 端）
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from sap_client import CircuitBreaker, CircuitOpenError, InProcessTransport, SAPClient
+
+
+class _FakeSAP:
+    """依序回傳預先設定狀態碼的假 SAP 伺服器"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                fake.requests.append((self.command, self.path))
+                status = fake.statuses.pop(0) if fake.statuses else 200
+                body = json.dumps({"status": status, "data": []}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _reply
+            do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+@pytest.fixture
+def fake_sap():
+    servers = []
+
+    def start(statuses=()):
+        server = _FakeSAP(statuses)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_get_retries_transient_errors(fake_sap):
+    """GET 遇到 5xx 時重試，並記錄各端點延遲"""
+    server = fake_sap([503, 502])
+    client = SAPClient(server.url, max_retries=2, backoff_seconds=0.001)
+
+    response = client.get_purchase_history({"category": "筆記型電腦"})
+
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+    stats = client.stats()["endpoints"]["purchase_history"]
+    assert stats["count"] == 3 and stats["errors"] == 2
+
+
+def test_post_is_not_retried(fake_sap):
+    """建立請購單（非冪等）不重試"""
+    server = fake_sap([503])
+    client = SAPClient(server.url, max_retries=2, backoff_seconds=0.001)
+
+    response = client.create_purchase_request({"product_name": "MacBook"})
+
+    assert response.status_code == 503
+    assert len(server.requests) == 1
+
+
+def test_circuit_opens_and_fails_fast(fake_sap):
+    """連續失敗達門檻後直接失敗，不再送出請求"""
+    server = fake_sap([503] * 10)
+    client = SAPClient(server.url, max_retries=0, failure_threshold=3, reset_timeout=60)
+
+    for _ in range(3):
+        client.get_purchase_history({})
+    with pytest.raises(CircuitOpenError):
+        client.get_purchase_history({})
+
+    assert len(server.requests) == 3
+    assert client.stats()["circuit"]["state"] == "open"
+
+
+def test_half_open_probe_closes_circuit():
+    """熔斷逾時後放行一個試探請求，成功即恢復"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_async_requests_share_retry_rules(fake_sap):
+    """非同步請求同樣會重試並記錄統計"""
+    server = fake_sap([504])
+    client = SAPClient(server.url, max_retries=1, backoff_seconds=0.001)
+
+    response = asyncio.run(client.aget_purchase_history({}))
+
+    assert response.status_code == 200
+    assert client.stats()["endpoints"]["purchase_history"]["count"] == 2
+
+
+def test_unexpected_errors_settle_half_open_probe(fake_sap):
+    """試探請求發生非連線類錯誤或被取消時仍會結束試探，熔斷器不會永久拒絕請求"""
+    server = fake_sap()
+    client = SAPClient(server.url, max_retries=0, failure_threshold=1, reset_timeout=0)
+    client.breaker.record_failure()
+
+    def broken_request(*args, **kwargs):
+        raise requests.TooManyRedirects("redirect loop")
+
+    client.session.request = broken_request
+    with pytest.raises(requests.TooManyRedirects):
+        client.get_purchase_history({})
+    assert client.breaker.state == "open"
+
+    async def cancelled_probe():
+        task = asyncio.create_task(client.aget_purchase_history({}))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await client.aget_purchase_history({})
+
+    assert asyncio.run(cancelled_probe()).status_code == 200
+    assert client.breaker.state == "closed"
+
+
+def test_async_http_client_closes_with_its_event_loop(fake_sap):
+    """每個事件迴圈使用自己的用戶端，事件迴圈結束時一併關閉"""
+    server = fake_sap()
+    client = SAPClient(server.url)
+    clients = []
+
+    async def request():
+        await client.aget_purchase_history({})
+        clients.append(client._async_clients[asyncio.get_running_loop()][0])
+
+    asyncio.run(request())
+    asyncio.run(request())
+
+    assert clients[0] is not clients[1]
+    assert all(http_client.is_closed for http_client in clients)
+    assert client._async_clients == {}
+
+
+def test_in_process_transport_isolates_payload():
+    """程序內傳輸直接呼叫查詢函式，回傳內容為複本且參數錯誤時回傳 400"""
+    rows = [{"product_name": "MacBook Pro 16吋", "category": "筆記型電腦"}]
+
+    def query(params):
+        if params.get("limit") == 0:
+            raise ValueError("limit 必須為 1 到 1000 之間的整數")
+        return {"status": "success", "data": rows}
+
+    def create(order_data):
+        return {"status": "success", "request_id": "PR1", "data": order_data}, 201
+
+    transport = InProcessTransport(query, create)
+
+    response = transport.get_purchase_history({"category": "筆記"})
+    response.json()["data"][0]["category"] = "已修改"
+    assert response.status_code == 200
+    assert rows[0]["category"] == "筆記型電腦"
+
+    assert transport.get_purchase_history({"limit": 0}).status_code == 400
+    created = asyncio.run(transport.acreate_purchase_request({"quantity": 1}))
+    assert created.status_code == 201 and created.json()["request_id"] == "PR1"
+    assert transport.stats()["endpoints"]["purchase_history"]["count"] == 2
+
+
+def test_in_process_transport_inventory_and_suppliers():
+    """程序內傳輸層的庫存與供應商查詢；未提供查詢函式時回傳 404"""
+    transport = InProcessTransport(
+        lambda params: {"data": []},
+        lambda order_data: ({}, 201),
+        query_inventory=lambda params: {
+            "data": [{"product_name": "iPad", "category": params["category"]}]
+        },
+        query_suppliers=lambda: {"data": [{"supplier_name": "Apple Inc."}]},
+    )
+
+    inventory = transport.get_inventory({"category": "平板電腦"})
+    assert inventory.json()["data"][0]["category"] == "平板電腦"
+    assert transport.get_suppliers().json()["data"][0]["supplier_name"] == "Apple Inc."
+    assert transport.stats()["endpoints"]["suppliers"]["count"] == 1
+
+    bare = InProcessTransport(lambda params: {}, lambda order_data: ({}, 201))
+    assert bare.get_inventory({}).status_code == 404
+    assert bare.get_suppliers().status_code == 404
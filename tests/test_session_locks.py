@@ -0,0 +1,136 @@
+"""
+會話並行控制測試
+"""
+
+import asyncio
+import threading
+import time
+
+from session_locks import SessionLocks, SingleFlight
+
+
+def test_same_session_turns_run_in_order():
+    """同一會話的回合不會重疊執行"""
+    locks = SessionLocks(stripes=8)
+    active = []
+    overlaps = []
+
+    def turn():
+        with locks.hold("s1"):
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(True)
+            time.sleep(0.01)
+            active.pop()
+
+    threads = [threading.Thread(target=turn) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == []
+    assert locks.stats()["acquired"] == 5
+
+
+def test_different_sessions_run_in_parallel():
+    """不同會話（不同分段）可同時持有鎖"""
+    locks = SessionLocks(stripes=1024)
+    session_a, session_b = "a", "b"
+    while locks.lock_for(session_a) is locks.lock_for(session_b):
+        session_b += "b"
+
+    with locks.hold(session_a):
+        assert locks.lock_for(session_b).acquire(blocking=False)
+        locks.lock_for(session_b).release()
+
+
+def test_async_hold_waits_without_blocking_loop():
+    """非同步等待鎖時不阻塞事件迴圈"""
+    locks = SessionLocks(stripes=4)
+    order = []
+
+    async def turn(name):
+        async with locks.ahold("s1"):
+            order.append(f"{name}-start")
+            await asyncio.sleep(0.02)
+            order.append(f"{name}-end")
+
+    async def main():
+        await asyncio.gather(turn("first"), turn("second"))
+
+    asyncio.run(main())
+    assert order == ["first-start", "first-end", "second-start", "second-end"]
+
+
+def test_waiters_are_served_in_arrival_order():
+    """等待中的協程與執行緒依到達順序取得鎖，取消等待的協程不會卡住後面的等待者"""
+    locks = SessionLocks(stripes=4)
+    lock = locks.lock_for("s1")
+    order = []
+
+    async def turn(name):
+        async with locks.ahold("s1"):
+            order.append(name)
+
+    def thread_turn():
+        with locks.hold("s1"):
+            order.append("thread")
+
+    async def main():
+        lock.acquire()
+        tasks = [asyncio.create_task(turn(f"t{index}")) for index in range(3)]
+        await asyncio.sleep(0.01)
+        thread = threading.Thread(target=thread_turn)
+        thread.start()
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(turn("t3")))
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        lock.release()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(main())
+    assert order == ["t0", "t2", "thread", "t3"]
+    assert not lock.locked()
+    assert locks.stats()["contended"] == 4
+
+
+def test_single_flight_shares_inflight_result():
+    """處理中的相同請求共用結果，完成後的新請求重新執行"""
+    flight = SingleFlight()
+    future, is_leader = flight.claim(("s1", "同意"))
+    shared, shared_is_leader = flight.claim(("s1", "同意"))
+    assert is_leader and not shared_is_leader
+
+    flight.resolve(future, result="已確認")
+    assert shared.result() == "已確認"
+
+    _, is_leader_again = flight.claim(("s1", "同意"))
+    assert is_leader_again
+    assert flight.stats()["shared"] == 1
+
+
+def test_single_flight_does_not_merge_across_a_later_message():
+    """同一會話在相同訊息之間已有其他訊息到達時，後到的相同訊息依序重新執行"""
+    flight = SingleFlight()
+    first, _ = flight.claim(("s1", "同意"), group="s1")
+    other, other_is_leader = flight.claim(("s1", "不同意"), group="s1")
+    again, again_is_leader = flight.claim(("s1", "同意"), group="s1")
+    assert other_is_leader and again_is_leader
+    assert again is not first
+
+    # 緊接在後的重複訊息仍合併到最後到達的那一次
+    shared, shared_is_leader = flight.claim(("s1", "同意"), group="s1")
+    assert shared is again and not shared_is_leader
+    # 其他會話不影響合併
+    _, s2_is_leader = flight.claim(("s2", "同意"), group="s2")
+    assert s2_is_leader
+
+    flight.resolve(first, result="第一次")
+    flight.resolve(other, result="調整")
+    assert not again.done()
+    flight.resolve(again, result="第二次")
+    assert shared.result() == "第二次"
+    assert flight.stats()["inflight"] == 1
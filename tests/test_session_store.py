@@ -0,0 +1,78 @@
+"""
+會話狀態儲存測試
+"""
+
+import time
+
+from choose_state import ConversationState
+from session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+def test_get_does_not_create_session():
+    """讀取不存在的會話只回傳 None，不會建立新會話"""
+    store = InMemorySessionStore(max_sessions=10)
+    assert store.get("unknown") is None
+    assert len(store) == 0
+    assert store.metrics()["misses"] == 1
+
+
+def test_lru_eviction():
+    """超過會話上限時淘汰最久未使用的會話"""
+    store = InMemorySessionStore(max_sessions=2)
+    store.put("a", {"n": 1})
+    store.put("b", {"n": 2})
+    store.get("a")
+    store.put("c", {"n": 3})
+
+    assert store.get("b") is None
+    assert store.get("a") == {"n": 1}
+    assert store.metrics()["evicted_lru"] == 1
+
+
+def test_idle_ttl_eviction():
+    """閒置超過 TTL 的會話會被淘汰"""
+    store = InMemorySessionStore(max_sessions=10, idle_ttl_seconds=0.05)
+    store.put("a", {"n": 1})
+    time.sleep(0.1)
+
+    assert store.session_ids() == []
+    assert store.get("a") is None
+    assert store.metrics()["evicted_idle"] == 1
+
+
+def test_idle_eviction_follows_write_order():
+    """閒置淘汰依寫入時間判斷：讀取過的舊會話仍會淘汰，近期寫入的會話保留"""
+    store = InMemorySessionStore(max_sessions=10, idle_ttl_seconds=0.05)
+    store.put("old", {"n": 1})
+    store.put("rewritten", {"n": 2})
+    store.get("old")
+    time.sleep(0.06)
+    store.put("rewritten", {"n": 3})
+    store.put("new", {"n": 4})
+
+    assert store.session_ids() == ["rewritten", "new"]
+    assert store.metrics()["evicted_idle"] == 1
+    assert store.delete("new") and not store.delete("new")
+    assert store.session_ids() == ["rewritten"]
+
+
+def test_sqlite_roundtrip_restores_state_enum(tmp_path):
+    """SQLite 後端重新開啟後仍可讀回會話，並還原對話狀態列舉"""
+    db_path = str(tmp_path / "sessions.sqlite")
+    store = SQLiteSessionStore(db_path=db_path)
+    store.put(
+        "s1",
+        {
+            "conversation_state": ConversationState.WAITING_CONFIRMATION,
+            "chat_history": [{"role": "user", "content": "我需要筆電"}],
+        },
+    )
+
+    reopened = SQLiteSessionStore(db_path=db_path)
+    state = reopened.get("s1")
+    assert state["conversation_state"] is ConversationState.WAITING_CONFIRMATION
+    assert state["chat_history"][0]["content"] == "我需要筆電"
+    assert reopened.session_ids() == ["s1"]
+
+    assert reopened.delete("s1") is True
+    assert reopened.get("s1") is None
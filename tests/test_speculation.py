@@ -0,0 +1,114 @@
+"""
+推測性預先計算測試
+"""
+
+import asyncio
+import threading
+import time
+
+from speculation import SpeculativeExecutor
+
+
+def test_finished_work_is_a_hit():
+    """已完成的推測結果直接取用並計為命中"""
+    executor = SpeculativeExecutor(max_workers=2)
+    executor.start("s1", lambda: {"product": "MacBook"})
+
+    assert executor.take("s1", timeout=1) == {"product": "MacBook"}
+    assert executor.take("s1") is None  # 結果只能取用一次
+    stats = executor.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_take_waits_for_running_work():
+    """推測工作執行中時最多等待 timeout 秒"""
+    executor = SpeculativeExecutor(max_workers=1)
+    executor.start("s1", lambda: time.sleep(0.05) or "done")
+
+    assert executor.take("s1", timeout=1) == "done"
+
+
+def test_atake_awaits_running_work_without_blocking_the_loop():
+    """非同步取用時以 await 等待執行中的推測工作，等待期間事件迴圈仍可處理其他工作"""
+    executor = SpeculativeExecutor(max_workers=1)
+    executor.start("s1", lambda: time.sleep(0.05) or "done")
+    ticks = []
+
+    async def tick():
+        for _ in range(3):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        taken, _ = await asyncio.gather(executor.atake("s1", timeout=1), tick())
+        return taken
+
+    assert asyncio.run(run()) == "done"
+    assert len(ticks) == 3
+    assert asyncio.run(executor.atake("s1")) is None
+    assert executor.stats()["hits"] == 1
+
+
+def test_discarded_and_stale_results_are_not_used():
+    """調整推薦時丟棄結果；accept 判斷結果已過時則視為未命中"""
+    executor = SpeculativeExecutor(max_workers=1)
+    executor.start("s1", lambda: {"recommendation": "A"})
+    assert executor.discard("s1") is True
+    assert executor.take("s1") is None
+
+    executor.start("s2", lambda: {"recommendation": "A"})
+    assert (
+        executor.take("s2", timeout=1, accept=lambda r: r["recommendation"] == "B")
+        is None
+    )
+    stats = executor.stats()
+    assert stats["discarded"] == 1
+    assert stats["hits"] == 0 and stats["misses"] == 2
+
+
+def test_pending_work_is_bounded():
+    """執行中與排隊中的推測工作達上限時拒絕新的推測"""
+    release = threading.Event()
+    executor = SpeculativeExecutor(max_workers=1, max_pending=2)
+
+    assert executor.start("a", release.wait)
+    assert executor.start("b", release.wait)
+    assert executor.start("c", release.wait) is False
+    release.set()
+    assert executor.take("a", timeout=1) is True
+    assert executor.stats()["rejected"] == 1
+
+
+def test_failed_work_is_a_miss():
+    """推測工作失敗時計為未命中，由呼叫端自行計算"""
+    executor = SpeculativeExecutor(max_workers=1)
+
+    def fail():
+        raise RuntimeError("LLM 無回應")
+
+    executor.start("s1", fail)
+    assert executor.take("s1", timeout=1) is None
+    assert executor.stats()["errors"] == 1
+
+
+def test_stats_stay_consistent_under_concurrent_sessions():
+    """多個會話同時啟動與取用推測工作時，每次取用都計入命中或未命中"""
+    executor = SpeculativeExecutor(max_workers=4, max_pending=1000)
+
+    def worker(index):
+        for n in range(50):
+            key = f"s{index}-{n}"
+            executor.start(key, lambda: "done")
+            executor.take(key, timeout=1)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = executor.stats()
+    assert stats["started"] == 400
+    assert stats["hits"] + stats["misses"] == 400
+    assert stats["pending"] == 0
+    executor.shutdown()
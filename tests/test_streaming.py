@@ -0,0 +1,143 @@
+"""
+串流對話（chat_stream 與 SSE 路由）測試
+"""
+
+import importlib
+import json
+import time
+
+import pytest
+
+from benchmarks.fake_llm_server import FakeLLMConfig, start_server
+from choose_state import ConversationState
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig
+from sap_client import InProcessTransport
+
+PURCHASE_HISTORY = [
+    {
+        "product_name": "Dell 27吋 4K 螢幕",
+        "category": "顯示器",
+        "supplier": "Dell Technologies",
+        "quantity": 2,
+        "unit_price": 12000,
+        "purchase_date": "2024-03-01",
+        "department": "IT部門",
+    }
+]
+
+
+def _agent(url: str, **config) -> ConversationalPurchaseAgent:
+    return ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="fake",
+            openai_base_url=url,
+            llm_cache_enabled=False,
+            speculation_enabled=False,
+            **config,
+        ),
+        sap_transport=InProcessTransport(
+            query_purchase_history=lambda params: {"data": PURCHASE_HISTORY},
+            create_purchase_request=lambda order: ({"status": "success"}, 201),
+        ),
+    )
+
+
+def _sse_events(body: str):
+    """解析 Server-Sent Events 回應為 (事件名稱, 資料) 列表"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def llm_url():
+    server, url = start_server(FakeLLMConfig(ttft_ms=0, tokens_per_second=0))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_sse_tokens_arrive_in_order_and_done_matches_chat(llm_url, monkeypatch):
+    """SSE 逐段送出 token，串接後與 done 事件的回應相同，也與 chat() 的回傳值相同
+
+    串流回合預設改用文字推薦，因此兩邊都關閉結構化推薦以比較同一條產生路徑。
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setenv("OPENAI_BASE_URL", llm_url)
+    app_module = importlib.import_module("app")
+    monkeypatch.setattr(
+        app_module, "ai_agent", _agent(llm_url, structured_recommend_enabled=False)
+    )
+    client = app_module.app.test_client()
+
+    response = client.post(
+        "/api/chat/stream", json={"message": "我想買螢幕，預算2萬", "session_id": "s1"}
+    )
+    events = _sse_events(response.get_data(as_text=True))
+
+    assert response.mimetype == "text/event-stream"
+    names = [name for name, _ in events]
+    assert names[-1] == "done" and set(names[:-1]) == {"token"}
+    tokens = [data["text"] for _, data in events[:-1]]
+    assert len(tokens) > 10
+    done = events[-1][1]
+    assert "".join(tokens) == done["response"]
+    assert done["conversation_state"] == ConversationState.WAITING_CONFIRMATION
+
+    agent = _agent(llm_url, structured_recommend_enabled=False)
+    assert agent.chat("我想買螢幕，預算2萬", "s1") == done["response"]
+
+
+def test_stream_error_mid_turn_commits_state_once(llm_url):
+    """串流途中處理失敗：回傳錯誤訊息，本回合的狀態只寫回一次且不含處理到一半的變更"""
+    agent = _agent(llm_url)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("推薦寫入失敗")
+
+    agent._complete_new_request = fail
+    writes = agent.session_store.metrics()["writes"]
+
+    chunks = list(agent.chat_stream("我想買螢幕，預算2萬", "s1"))
+
+    assert "推薦寫入失敗" in chunks[-1]
+    assert agent.session_store.metrics()["writes"] == writes + 1
+    state = agent.get_session_status("s1")
+    assert state["conversation_state"] == ConversationState.INITIAL
+    assert state["current_recommendation"] is None
+    assert [message["role"] for message in state["chat_history"]] == [
+        "user",
+        "assistant",
+    ]
+    assert state["chat_history"][-1]["content"].endswith(chunks[-1].lstrip("\n"))
+
+
+def test_stream_disconnect_commits_the_whole_turn_once():
+    """串流中途停止讀取：回合中不會寫入一半的狀態，回合結束後一次寫回完整狀態"""
+    server, url = start_server(FakeLLMConfig(ttft_ms=0, tokens_per_second=200))
+    try:
+        agent = _agent(url)
+        writes = agent.session_store.metrics()["writes"]
+
+        stream = agent.chat_stream("我想買螢幕，預算2萬", "s1")
+        next(stream)
+        # 推薦仍在串流中：會話儲存還沒有任何本回合的變更
+        assert agent.get_session_status("s1") is None
+        stream.close()
+
+        deadline = time.monotonic() + 10
+        while agent.get_session_status("s1") is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        state = agent.get_session_status("s1")
+        assert state["conversation_state"] == ConversationState.WAITING_CONFIRMATION
+        assert "Dell 27吋 4K 螢幕" in state["current_recommendation"]
+        assert [message["role"] for message in state["chat_history"]] == [
+            "user",
+            "assistant",
+        ]
+        assert agent.session_store.metrics()["writes"] == writes + 1
+    finally:
+        server.shutdown()
+        server.server_close()
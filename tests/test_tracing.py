@@ -0,0 +1,125 @@
+"""
+對話回合追蹤測試
+"""
+
+import asyncio
+import json
+
+from sap_client import InProcessTransport
+from tracing import (
+    TRACE_HEADER,
+    JSONLTraceExporter,
+    load_traces,
+    main,
+    render_waterfall,
+    slowest_spans,
+    span,
+    start_trace,
+    trace_headers,
+)
+
+
+def test_spans_nest_and_summarize_server_timing():
+    """span 記錄上層關係，Server-Timing 依類別彙總；沒有 trace 時不記錄"""
+    with span("llm.intent") as attributes:
+        assert attributes is None
+    assert trace_headers() == {}
+
+    with start_trace("turn-1", session_id="s1") as trace:
+        assert trace_headers() == {TRACE_HEADER: "turn-1"}
+        with span("intent", source="llm"):
+            with span("llm.intent"):
+                pass
+        with span("llm.recommend"):
+            pass
+        with span("state.update"):
+            pass
+
+    spans = {s["name"]: s for s in trace.to_dict()["spans"]}
+    assert spans["llm.intent"]["parent_id"] == spans["intent"]["id"]
+    assert spans["intent"]["parent_id"] is None
+    assert spans["intent"]["attributes"] == {"source": "llm"}
+
+    timing = trace.server_timing()
+    assert timing.startswith("intent;dur=")
+    assert "llm;dur=" in timing and 'desc="2 calls"' in timing
+    assert "state;dur=" in timing and "total;dur=" in timing
+    assert "sap" not in timing
+
+
+def test_trace_id_validation_and_async_propagation():
+    """不合法的 trace id 改為新產生的 id；非同步工作與執行緒沿用目前的 trace"""
+    with start_trace("bad id\r\nX-Injected: 1") as trace:
+        pass
+    assert trace.trace_id != "bad id\r\nX-Injected: 1"
+    assert len(trace.trace_id) == 32
+
+    async def turn():
+        with start_trace("async-turn") as trace:
+
+            async def lookup(name):
+                with span(name):
+                    await asyncio.sleep(0.01)
+
+            def update_state():
+                with span("state.update"):
+                    pass
+
+            await asyncio.gather(lookup("sap.inventory"), lookup("sap.suppliers"))
+            await asyncio.to_thread(update_state)
+            return trace
+
+    trace = asyncio.run(turn())
+    names = sorted(s["name"] for s in trace.spans)
+    assert names == ["sap.inventory", "sap.suppliers", "state.update"]
+
+
+def test_in_process_sap_calls_are_recorded():
+    """程序內 SAP 呼叫記錄為 span（含狀態碼）"""
+    transport = InProcessTransport(
+        query_purchase_history=lambda params: {"data": []},
+        create_purchase_request=lambda order: ({"status": "success"}, 201),
+    )
+    with start_trace() as trace:
+        transport.get_purchase_history({})
+        transport.create_purchase_request({})
+
+    assert [(s["name"], s["attributes"]["status"]) for s in trace.spans] == [
+        ("sap.purchase_history", 200),
+        ("sap.purchase_request", 201),
+    ]
+
+
+def test_exporter_and_cli(tmp_path, capsys):
+    """exporter 以 JSONL 寫出 trace，CLI 可顯示瀑布圖與最慢的 span"""
+    path = str(tmp_path / "traces" / "turns.jsonl")
+    exporter = JSONLTraceExporter(path)
+    for index in range(3):
+        with start_trace(f"t{index}", name="/api/chat", exporter=exporter):
+            with span("intent"):
+                with span("llm.intent"):
+                    pass
+            with span("sap.purchase_history"):
+                pass
+    exporter.close()
+
+    traces = load_traces(path)
+    assert [t["trace_id"] for t in traces] == ["t0", "t1", "t2"]
+    assert exporter.stats()["exported"] == 3
+
+    waterfall = render_waterfall(traces[0], width=20)
+    lines = waterfall.splitlines()
+    assert lines[0].startswith("trace t0  /api/chat")
+    assert lines[2].lstrip().startswith("llm.intent")
+    assert lines[2].index("llm.intent") > lines[1].index("intent")
+
+    rows = slowest_spans(traces, top=2)
+    assert len(rows) == 2
+    assert all(row["count"] == 3 for row in rows)
+
+    assert main(["waterfall", path, "--trace-id", "t1"]) == 0
+    assert "trace t1" in capsys.readouterr().out
+    assert main(["slowest", path, "--top", "5"]) == 0
+    output = capsys.readouterr().out
+    assert "3 筆 trace" in output and "llm.intent" in output
+    assert json.loads(open(path, encoding="utf-8").readline())["spans"]
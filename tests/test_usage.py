@@ -0,0 +1,159 @@
+"""
+LLM token 用量與成本統計測試
+"""
+
+import json
+import time
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult, LLMResult
+
+from purchase_agent import ConversationalPurchaseAgent, PurchaseAgentConfig
+from sap_client import InProcessTransport
+from usage import UsageCollector, UsageTracker
+
+
+class UsageReportingModel(BaseChatModel):
+    """回傳固定 token 用量的假模型（記錄每次呼叫使用的模型名稱）"""
+
+    model_name: str = "gpt-4o-mini"
+    # 各用戶端共用的呼叫記錄（Any 避免 pydantic 複製 list）
+    calls: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "usage-reporting-fake"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, **kwargs):
+        self.calls.append(self.model_name)
+        if "分析使用者的輸入並判斷其意圖" in messages[0].content:
+            content = json.dumps({"intent": "unclear", "is_purchase_related": False})
+        else:
+            content = "請告訴我您想採購的產品。"
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": 100,
+                "output_tokens": 20,
+                "total_tokens": 120,
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _agent(**config) -> ConversationalPurchaseAgent:
+    agent = ConversationalPurchaseAgent(
+        PurchaseAgentConfig(
+            openai_api_key="test",
+            llm_cache_enabled=False,
+            speculation_enabled=False,
+            **config,
+        ),
+        sap_transport=InProcessTransport(
+            query_purchase_history=lambda params: {"data": []},
+            create_purchase_request=lambda order: ({"status": "success"}, 201),
+        ),
+    )
+    calls: List[str] = []
+    agent._create_llm = lambda settings: UsageReportingModel(
+        model_name=settings.model, calls=calls
+    )
+    agent.llm = agent._create_llm(agent._default_chain_settings)
+    agent._setup_chains()
+    return agent, calls
+
+
+def test_tracker_aggregates_and_prices_usage():
+    """用量依鏈、會話、部門與狀態彙總，成本以模型名稱最長前綴的價格計算"""
+    tracker = UsageTracker(pricing={"gpt-4o": (2.5, 10.0), "gpt-4o-mini": (0.15, 0.6)})
+    usage = {
+        "llm_calls": 1,
+        "cached_calls": 0,
+        "input_tokens": 1000,
+        "output_tokens": 100,
+        "model": "gpt-4o-mini-2024-07-18",
+    }
+    tracker.record(
+        "intent", usage, session_id="s1", department="IT部門", state="initial"
+    )
+    tracker.record("recommend", usage, model="gpt-4o", session_id="s2")
+
+    snapshot = tracker.snapshot()
+
+    assert snapshot["totals"]["total_tokens"] == 2200
+    assert snapshot["by_chain"]["intent"]["cost_usd"] == round(
+        (1000 * 0.15 + 100 * 0.6) / 1e6, 6
+    )
+    assert snapshot["by_department"] == {
+        "IT部門": snapshot["by_chain"]["intent"],
+        "unknown": snapshot["by_chain"]["recommend"],
+    }
+    assert tracker.session_tokens("s1") == 1100
+    assert list(snapshot["top_sessions"]) == ["s1", "s2"]
+
+
+def test_rollup_closes_finished_windows():
+    """時段結束後結算為一筆 rollup，新的時段從零開始"""
+    tracker = UsageTracker(rollup_seconds=0.05)
+    usage = {"llm_calls": 1, "cached_calls": 0, "input_tokens": 10, "output_tokens": 5}
+    tracker.record("intent", usage)
+    time.sleep(0.06)
+
+    rollups = tracker.rollups()
+
+    assert len(rollups) == 1
+    assert rollups[0]["total_tokens"] == 15
+    assert rollups[0]["by_chain"]["intent"]["calls"] == 1
+    assert tracker.snapshot()["current_window"]["calls"] == 0
+
+
+def test_collector_counts_cache_hits_and_claims_once():
+    """快取命中的回應只計次數；重複請求共用的收集器只交出一次用量"""
+    collector = UsageCollector()
+    fresh = AIMessage(
+        content="x",
+        usage_metadata={"input_tokens": 7, "output_tokens": 3, "total_tokens": 10},
+    )
+    # 與 langchain 快取命中時的處理相同：在 usage_metadata 加上 total_cost=0
+    cached = AIMessage(content="x").model_copy(
+        update={"usage_metadata": {"total_cost": 0}}
+    )
+    collector.on_llm_end(
+        LLMResult(
+            generations=[
+                [ChatGeneration(message=fresh)],
+                [ChatGeneration(message=cached)],
+            ]
+        )
+    )
+
+    usage = collector.claim()
+
+    assert usage["llm_calls"] == 1 and usage["cached_calls"] == 1
+    assert usage["input_tokens"] == 7 and usage["output_tokens"] == 3
+    assert collector.claim() is None
+
+
+def test_agent_records_usage_and_downgrades_over_budget_sessions():
+    """每次鏈呼叫的用量歸屬到會話；超出預算後的回合改用較省的模型"""
+    agent, calls = _agent(session_token_budget=200, budget_model="gpt-4.1-nano")
+
+    agent.chat("今天天氣如何", "s1")
+    first = agent.get_usage_stats("s1")
+    assert first["usage"]["total_tokens"] >= 120
+    assert calls and set(calls) == {"gpt-4o-mini"}
+
+    calls.clear()
+    agent.chat("你好", "s1")
+    agent.chat("你好", "s1")
+
+    assert calls and set(calls) == {"gpt-4.1-nano"}
+    stats = agent.get_usage_stats()
+    assert stats["budget"]["downgraded_turns"] >= 1
+    assert stats["by_department"]["IT部門"]["calls"] >= 3
+    assert "initial" in stats["by_state"]
+    assert agent.get_usage_stats("s1")["over_budget"] is True
+    assert agent.get_usage_stats("other")["usage"] is None
@@ -0,0 +1,426 @@
+"""
+SAP 請購系統 AI Agent - 對話回合追蹤
+
+每個 /api/chat 請求是一個 trace（以 trace id 識別），回合中的各階段
+（意圖判斷、每次 LLM 鏈呼叫、每次 SAP 呼叫、會話狀態更新、回應序列化）
+各記錄為一個 span（開始時間、耗時與上層 span）：
+1. start_trace()：在請求處理期間啟用 trace（以 ContextVar 保存，同步與
+   非同步呼叫端皆可用；asyncio.to_thread 會帶入目前的 trace）
+2. span()：記錄一個階段；沒有啟用 trace 時不做任何事
+3. trace_headers()：SAP 呼叫時帶上 X-Trace-Id，讓 SAP 端的記錄能對應回同一回合
+4. Trace.server_timing()：依類別彙總各階段耗時，作為 Server-Timing 回應標頭
+5. JSONLTraceExporter：背景執行緒把結束的 trace 逐行寫入 JSONL 檔，
+   佇列滿時丟棄（不拖慢請求）
+
+命令列工具：
+    python tracing.py waterfall traces.jsonl [--trace-id ID | --last N]
+    python tracing.py slowest traces.jsonl [--top N]
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+
+# 接受呼叫端傳入的 trace id 格式（其他格式改為產生新的 id，避免標頭注入）
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Server-Timing 依序輸出的類別（span 名稱第一段，例如 llm.intent 屬於 llm）
+SERVER_TIMING_CATEGORIES = ("intent", "llm", "sap", "state", "serialize")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar(
+    "current_trace", default=None
+)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+
+def resolve_trace_id(trace_id: Optional[str] = None) -> str:
+    """沿用呼叫端傳入的 trace id；未提供或格式不符時產生新的 id"""
+    if trace_id and _TRACE_ID_PATTERN.match(trace_id):
+        return trace_id
+    return uuid.uuid4().hex
+
+
+class Trace:
+    """單一請求的 span 集合（時間以相對於 trace 開始的毫秒表示）"""
+
+    # 單一 trace 保留的 span 上限（避免異常迴圈讓記錄無限增加）
+    MAX_SPANS = 1000
+
+    def __init__(
+        self,
+        trace_id: Optional[str] = None,
+        name: str = "turn",
+        attributes: Optional[Dict] = None,
+    ):
+        self.trace_id = resolve_trace_id(trace_id)
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.started_at = time.time()
+        self.duration_ms: Optional[float] = None
+        self.spans: List[Dict] = []
+        self.dropped_spans = 0
+        self._started = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _offset_ms(self, moment: float) -> float:
+        return round((moment - self._started) * 1000, 3)
+
+    def record(
+        self,
+        name: str,
+        started: float,
+        ended: float,
+        parent_id: Optional[int] = None,
+        attributes: Optional[Dict] = None,
+        error: Optional[str] = None,
+        span_id: Optional[int] = None,
+    ):
+        """加入一個已結束的 span（started / ended 為 time.perf_counter() 值）"""
+        span = {
+            "id": span_id if span_id is not None else next(self._ids),
+            "parent_id": parent_id,
+            "name": name,
+            "start_ms": self._offset_ms(started),
+            "duration_ms": round((ended - started) * 1000, 3),
+        }
+        if attributes:
+            span["attributes"] = attributes
+        if error:
+            span["error"] = error
+        with self._lock:
+            if len(self.spans) >= self.MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            self.spans.append(span)
+
+    def finish(self):
+        """結束 trace（重複呼叫不會改變已記錄的總耗時）"""
+        if self.duration_ms is None:
+            self.duration_ms = self._offset_ms(time.perf_counter())
+
+    def breakdown(self) -> Dict[str, Dict]:
+        """依類別彙總 span 的耗時與次數"""
+        totals: Dict[str, Dict] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            category = span["name"].split(".", 1)[0]
+            entry = totals.setdefault(category, {"duration_ms": 0.0, "count": 0})
+            entry["duration_ms"] += span["duration_ms"]
+            entry["count"] += 1
+        return totals
+
+    def server_timing(self) -> str:
+        """產生 Server-Timing 標頭值，例如 llm;dur=812.4;desc="2 calls"
+
+        並行的 span（例如非同步同時查詢）會分別計入，類別耗時可能大於總耗時。
+        """
+        breakdown = self.breakdown()
+        entries = []
+        for category in SERVER_TIMING_CATEGORIES:
+            entry = breakdown.get(category)
+            if entry is None:
+                continue
+            text = f"{category};dur={entry['duration_ms']:.1f}"
+            if entry["count"] > 1:
+                text += f';desc="{entry["count"]} calls"'
+            entries.append(text)
+        self.finish()
+        entries.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def response_headers(self) -> Dict[str, str]:
+        """回應標頭：trace id 與 Server-Timing 耗時摘要"""
+        return {TRACE_HEADER: self.trace_id, "Server-Timing": self.server_timing()}
+
+    def to_dict(self) -> Dict:
+        """轉為可寫入 JSONL 的記錄"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: (span["start_ms"], span["id"]))
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "spans": spans,
+        }
+        if self.dropped_spans:
+            record["dropped_spans"] = self.dropped_spans
+        return record
+
+
+@contextmanager
+def start_trace(
+    trace_id: Optional[str] = None,
+    name: str = "turn",
+    exporter: Optional["JSONLTraceExporter"] = None,
+    **attributes,
+) -> Iterator[Trace]:
+    """在區塊內啟用 trace；離開時結束 trace 並交給 exporter"""
+    trace = Trace(trace_id, name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.finish()
+        if exporter is not None:
+            exporter.export(trace.to_dict())
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Dict]]:
+    """記錄一個 span；產出的 dict 可在區塊內補上屬性（沒有 trace 時為 None）"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    span_id = next(trace._ids)
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    error = None
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ended = time.perf_counter()
+        _current_span.reset(token)
+        trace.record(name, started, ended, parent_id, attributes, error, span_id)
+
+
+def current_trace() -> Optional[Trace]:
+    """取得目前啟用的 trace"""
+    return _current_trace.get()
+
+
+def trace_headers() -> Dict[str, str]:
+    """目前 trace 需傳給下游服務的標頭（沒有 trace 時為空）"""
+    trace = _current_trace.get()
+    return {TRACE_HEADER: trace.trace_id} if trace is not None else {}
+
+
+class JSONLTraceExporter:
+    """以背景執行緒把 trace 寫入 JSONL 檔
+
+    export() 只把記錄放入佇列，不做檔案 I/O；佇列滿時丟棄並計數。
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="trace-exporter"
+        )
+        self._thread.start()
+
+    def export(self, record: Dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                records = [self._queue.get()]
+                # 一次寫出佇列中已累積的記錄，減少 flush 次數
+                while True:
+                    try:
+                        records.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = False
+                for record in records:
+                    if record is self._STOP:
+                        stop = True
+                        continue
+                    try:
+                        f.write(
+                            json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                        )
+                        self.exported += 1
+                    except (TypeError, ValueError) as e:
+                        logger.warning(f"trace 寫入失敗: {e}")
+                f.flush()
+                for _ in records:
+                    self._queue.task_done()
+                if stop:
+                    return
+
+    def flush(self):
+        """等待佇列中的記錄全部寫入檔案"""
+        self._queue.join()
+
+    def close(self, timeout: float = 5.0):
+        """寫完佇列中的記錄後停止背景執行緒"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+        }
+
+
+# ---- 命令列工具 ----
+
+
+def load_traces(path: str) -> List[Dict]:
+    """讀取 JSONL trace 檔（略過無法解析的行）"""
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                traces.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return traces
+
+
+def render_waterfall(trace: Dict, width: int = 40) -> str:
+    """以文字瀑布圖呈現單一 trace 的 span 時間軸"""
+    total = trace.get("duration_ms") or max(
+        (s["start_ms"] + s["duration_ms"] for s in trace["spans"]), default=0.0
+    )
+    started_at = datetime.fromtimestamp(trace["started_at"]).isoformat(
+        timespec="seconds"
+    )
+    attributes = " ".join(f"{k}={v}" for k, v in trace.get("attributes", {}).items())
+    lines = [
+        f"trace {trace['trace_id']}  {trace.get('name', '')}  "
+        f"{total:.1f} ms  {started_at}  {attributes}".rstrip()
+    ]
+
+    depths: Dict[int, int] = {}
+    for span in trace["spans"]:
+        parent = span.get("parent_id")
+        depths[span["id"]] = depths.get(parent, -1) + 1 if parent else 0
+
+    label_width = max(
+        (len(s["name"]) + 2 * depths[s["id"]] for s in trace["spans"]), default=0
+    )
+    for span in trace["spans"]:
+        scale = width / total if total else 0
+        offset = min(int(span["start_ms"] * scale), width - 1)
+        length = max(1, round(span["duration_ms"] * scale))
+        bar = (" " * offset + "█" * length)[:width].ljust(width)
+        label = ("  " * depths[span["id"]] + span["name"]).ljust(label_width)
+        suffix = f"  !{span['error']}" if span.get("error") else ""
+        lines.append(
+            f"  {label} |{bar}| {span['start_ms']:8.1f} +{span['duration_ms']:8.1f} ms"
+            f"{suffix}"
+        )
+    return "\n".join(lines)
+
+
+def slowest_spans(traces: List[Dict], top: int = 10) -> List[Dict]:
+    """依 span 名稱彙總所有 trace，依總耗時由大到小排序"""
+    durations: Dict[str, List[float]] = {}
+    for trace in traces:
+        for span in trace.get("spans", []):
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        p95 = values[max(0, math.ceil(len(values) * 0.95) - 1)]
+        rows.append(
+            {
+                "name": name,
+                "count": len(values),
+                "total_ms": round(sum(values), 1),
+                "avg_ms": round(sum(values) / len(values), 1),
+                "p95_ms": round(p95, 1),
+                "max_ms": round(values[-1], 1),
+            }
+        )
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows[:top]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="SAP 請購 Agent trace 檢視工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    waterfall = subparsers.add_parser("waterfall", help="顯示單一回合的瀑布圖")
+    waterfall.add_argument("path", help="JSONL trace 檔")
+    waterfall.add_argument("--trace-id", help="指定 trace id（預設為最後幾筆）")
+    waterfall.add_argument("--last", type=int, default=1, help="顯示最後 N 筆")
+    waterfall.add_argument("--width", type=int, default=40, help="時間軸寬度")
+
+    slowest = subparsers.add_parser("slowest", help="彙總最慢的 span")
+    slowest.add_argument("path", help="JSONL trace 檔")
+    slowest.add_argument("--top", type=int, default=10, help="顯示前 N 名")
+
+    args = parser.parse_args(argv)
+    traces = load_traces(args.path)
+    if not traces:
+        print(f"{args.path} 沒有 trace 記錄", file=sys.stderr)
+        return 1
+
+    if args.command == "waterfall":
+        if args.trace_id:
+            selected = [t for t in traces if t["trace_id"] == args.trace_id]
+            if not selected:
+                print(f"找不到 trace {args.trace_id}", file=sys.stderr)
+                return 1
+        else:
+            selected = traces[-max(args.last, 1) :]
+        print("\n\n".join(render_waterfall(t, args.width) for t in selected))
+        return 0
+
+    rows = slowest_spans(traces, args.top)
+    print(f"{len(traces)} 筆 trace")
+    print(
+        f"{'span':<40} {'count':>7} {'total_ms':>11} {'avg_ms':>9} "
+        f"{'p95_ms':>9} {'max_ms':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['name']:<40} {row['count']:>7} {row['total_ms']:>11.1f} "
+            f"{row['avg_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['max_ms']:>9.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+SAP 請購系統 AI Agent - LLM token 用量與成本統計
+
+鏈的輸出只保留解析後的結果，LLM 回應中的 token 用量（usage_metadata）由
+UsageCollector 在每次呼叫時以回呼收集，再交給 UsageTracker 彙總：
+1. 依鏈、會話、部門與回合開始時的對話狀態累計呼叫次數、輸入 / 輸出 token 與成本
+2. 每 rollup_seconds 把該時段的用量結算為一筆 rollup（保留最近 max_rollups 筆），
+   用來比較優化前後每個時段的消耗
+3. 會話用量以 LRU 保留最近 max_sessions 個會話，供每會話 token 預算判斷
+
+成本依 pricing（每百萬 token 的美元價格：輸入, 輸出）以模型名稱的最長前綴比對計算；
+命中回應快取的呼叫不消耗 token，只計入 cached_calls。
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 預設價格（美元 / 每百萬 token：輸入, 輸出）
+DEFAULT_PRICING: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+class UsageCollector(BaseCallbackHandler):
+    """收集單次鏈呼叫中 LLM 回應的 token 用量
+
+    微批次中輸入相同的請求共用同一次呼叫的結果，claim() 只會交出一次用量，
+    避免同一次呼叫被重複計算。
+    """
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.cached_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.model: Optional[str] = None
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                metadata = getattr(message, "response_metadata", None) or {}
+                with self._lock:
+                    # langchain 在快取命中時把 total_cost 設為 0
+                    if "total_cost" in usage:
+                        self.cached_calls += 1
+                        continue
+                    self.llm_calls += 1
+                    self.input_tokens += usage.get("input_tokens", 0)
+                    self.output_tokens += usage.get("output_tokens", 0)
+                    self.model = metadata.get("model_name") or self.model
+
+    def claim(self) -> Optional[Dict]:
+        """取出收集到的用量（只有第一次呼叫會取得，之後回傳 None）"""
+        with self._lock:
+            if self._claimed:
+                return None
+            self._claimed = True
+            return {
+                "llm_calls": self.llm_calls,
+                "cached_calls": self.cached_calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "model": self.model,
+            }
+
+
+def _new_totals() -> Dict:
+    return {
+        "calls": 0,
+        "llm_calls": 0,
+        "cached_calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+        "cost_usd": 0.0,
+    }
+
+
+def _add(totals: Dict, usage: Dict, cost: float):
+    totals["calls"] += 1
+    totals["llm_calls"] += usage["llm_calls"]
+    totals["cached_calls"] += usage["cached_calls"]
+    totals["input_tokens"] += usage["input_tokens"]
+    totals["output_tokens"] += usage["output_tokens"]
+    totals["total_tokens"] += usage["input_tokens"] + usage["output_tokens"]
+    totals["cost_usd"] += cost
+
+
+def _rounded(totals: Dict) -> Dict:
+    return {**totals, "cost_usd": round(totals["cost_usd"], 6)}
+
+
+class UsageTracker:
+    """依鏈、會話、部門與對話狀態彙總 token 用量"""
+
+    def __init__(
+        self,
+        pricing: Optional[Dict[str, Tuple[float, float]]] = None,
+        rollup_seconds: float = 60.0,
+        max_rollups: int = 60,
+        max_sessions: int = 10000,
+    ):
+        self.pricing = dict(DEFAULT_PRICING if pricing is None else pricing)
+        self.rollup_seconds = rollup_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._totals = _new_totals()
+        self._by_chain: Dict[str, Dict] = {}
+        self._by_department: Dict[str, Dict] = {}
+        self._by_state: Dict[str, Dict] = {}
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._rollups: deque = deque(maxlen=max_rollups)
+        self._window_started = time.time()
+        self._window = _new_totals()
+        self._window_by_chain: Dict[str, Dict] = {}
+
+    def cost(
+        self, model: Optional[str], input_tokens: int, output_tokens: int
+    ) -> float:
+        """依模型價格計算成本（未知的模型以 0 計算）"""
+        if not model:
+            return 0.0
+        matches = [name for name in self.pricing if model.startswith(name)]
+        if not matches:
+            return 0.0
+        input_price, output_price = self.pricing[max(matches, key=len)]
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def record(
+        self,
+        chain: str,
+        usage: Dict,
+        model: Optional[str] = None,
+        session_id: Optional[str] = None,
+        department: Optional[str] = None,
+        state: Optional[str] = None,
+    ):
+        """記錄一次鏈呼叫的用量（model 為回應未提供模型名稱時使用的設定值）"""
+        cost = self.cost(
+            usage.get("model") or model, usage["input_tokens"], usage["output_tokens"]
+        )
+        with self._lock:
+            self._rollup_locked(time.time())
+            _add(self._totals, usage, cost)
+            _add(self._window, usage, cost)
+            for table, key in (
+                (self._by_chain, chain),
+                (self._window_by_chain, chain),
+                (self._by_department, department or "unknown"),
+                (self._by_state, state or "unknown"),
+            ):
+                _add(table.setdefault(key, _new_totals()), usage, cost)
+            if session_id is not None:
+                totals = self._sessions.pop(session_id, None) or _new_totals()
+                _add(totals, usage, cost)
+                self._sessions[session_id] = totals
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+    def _rollup_locked(self, now: float):
+        """目前時段已結束時結算為一筆 rollup（需持有 self._lock）"""
+        if now - self._window_started < self.rollup_seconds:
+            return
+        if self._window["calls"]:
+            self._rollups.append(self._window_record(now))
+        # 沒有流量的時段不產生 rollup，新時段從目前時間開始
+        self._window_started = now
+        self._window = _new_totals()
+        self._window_by_chain = {}
+
+    def _window_record(self, ended: float) -> Dict:
+        return {
+            "start": datetime.fromtimestamp(self._window_started).isoformat(
+                timespec="seconds"
+            ),
+            "end": datetime.fromtimestamp(ended).isoformat(timespec="seconds"),
+            **_rounded(self._window),
+            "by_chain": {
+                name: _rounded(totals)
+                for name, totals in sorted(self._window_by_chain.items())
+            },
+        }
+
+    def session_tokens(self, session_id: str) -> int:
+        """會話累計的 token 數（輸入 + 輸出）"""
+        with self._lock:
+            totals = self._sessions.get(session_id)
+            return totals["total_tokens"] if totals else 0
+
+    def session_usage(self, session_id: str) -> Optional[Dict]:
+        """會話的用量明細（沒有記錄時回傳 None）"""
+        with self._lock:
+            totals = self._sessions.get(session_id)
+            return _rounded(totals) if totals else None
+
+    def rollups(self) -> List[Dict]:
+        """已結算的各時段用量（由舊到新）"""
+        with self._lock:
+            self._rollup_locked(time.time())
+            return list(self._rollups)
+
+    def snapshot(self, top_sessions: int = 20) -> Dict:
+        """取得用量統計（各維度依 token 數由多到少排序）"""
+
+        def ranked(table: Dict[str, Dict], limit: Optional[int] = None) -> Dict:
+            items = sorted(
+                table.items(), key=lambda item: item[1]["total_tokens"], reverse=True
+            )
+            return {key: _rounded(totals) for key, totals in items[:limit]}
+
+        with self._lock:
+            now = time.time()
+            self._rollup_locked(now)
+            return {
+                "totals": _rounded(self._totals),
+                "by_chain": ranked(self._by_chain),
+                "by_department": ranked(self._by_department),
+                "by_state": ranked(self._by_state),
+                "top_sessions": ranked(self._sessions, top_sessions),
+                "sessions_tracked": len(self._sessions),
+                "rollup_seconds": self.rollup_seconds,
+                "current_window": self._window_record(now),
+                "rollups": list(self._rollups),
+            }